@@ -3,7 +3,11 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
+import os
+import runpy
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 try:
     from commands import getstatusoutput
@@ -21,6 +25,20 @@ def bash_completion_dir():
     return output.strip()
 
 
+class build_py_with_command_index(build_py):
+    """
+    Regenerates the static index of bkr subcommands (see
+    bkr.client.command_index) before building, so that it is always in sync
+    with the command modules being installed.
+    """
+
+    def run(self):
+        command_index = runpy.run_path(os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), 'src', 'bkr', 'client', 'command_index.py'))
+        command_index['write_index']()
+        build_py.run(self)
+
+
 setup(
     name='beaker-client',
     version='29.1',
@@ -64,6 +82,10 @@ def bash_completion_dir():
         'License :: OSI Approved :: GNU General Public License v2 or later (GPLv2+)',
     ],
 
+    cmdclass={
+        'build_py': build_py_with_command_index,
+    },
+
     entry_points={
         'console_scripts': (
             'bkr = bkr.client.main:main',
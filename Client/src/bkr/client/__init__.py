@@ -14,10 +14,10 @@
 import xml.dom.minidom
 from optparse import OptionGroup
 
-import pkg_resources
 from six.moves.urllib_parse import urljoin
 
 from bkr.client.command import Command
+from bkr.client.metadata_cache import MetadataCache, DEFAULT_TTL
 from bkr.common.pyconfig import PyConfigParser
 
 user_config_file = os.environ.get("BEAKER_CLIENT_CONF", None)
@@ -51,6 +51,7 @@ def host_filter_presets():
     if _host_filter_presets is not None:
         return _host_filter_presets
 
+    import pkg_resources
     _host_filter_presets = {}
     config_files = (
             sorted(glob.glob(pkg_resources.resource_filename('bkr.client', 'host-filters/*.conf')))
@@ -188,6 +189,7 @@ def __init__(self, *args, **kwargs):
         """ Initialize Workflow """
         super(BeakerWorkflow, self).__init__(*args, **kwargs)
         self.multi_host = False
+        self._metadata_cache = None
 
     def options(self):
         """ Default options that all Workflows use """
@@ -485,6 +487,17 @@ def options(self):
         )
         self.parser.add_option_group(multihost_options)
 
+    def metadata_cache(self):
+        """
+        Returns the cache of server metadata used for looking up distros and
+        tasks, see bkr.client.metadata_cache.
+        """
+        if self._metadata_cache is None:
+            self._metadata_cache = MetadataCache(self.hub, self.conf['HUB_URL'],
+                                                 ttl=int(self.conf.get('METADATA_CACHE_TTL',
+                                                                       DEFAULT_TTL)))
+        return self._metadata_cache
+
     def get_arches(self, *args, **kwargs):
         """
         Get all arches that apply to either this distro, or the distro which
@@ -501,9 +514,11 @@ def get_arches(self, *args, **kwargs):
             self.set_hub(**kwargs)
 
         if distro:
-            return self.hub.distros.get_arch(dict(distro=distro, variant=variant))
+            return self.metadata_cache().call('distros', 'get_arch',
+                                              dict(distro=distro, variant=variant))
         else:
-            return self.hub.distros.get_arch(dict(osmajor=family, tags=tags, variant=variant))
+            return self.metadata_cache().call('distros', 'get_arch',
+                                              dict(osmajor=family, tags=tags, variant=variant))
 
     getArches = get_arches
 
@@ -515,7 +530,7 @@ def get_os_majors(self, *args, **kwargs):
         tags = kwargs.get("tag", [])
         if not hasattr(self, 'hub'):
             self.set_hub(**kwargs)
-        return self.hub.distros.get_osmajors(tags)
+        return self.metadata_cache().call('distros', 'get_osmajors', tags)
 
     getOsMajors = get_os_majors
 
@@ -544,7 +559,7 @@ def get_family(self, *args, **kwargs):
 
         if not hasattr(self, 'hub'):
             self.set_hub(**kwargs)
-        return self.hub.distros.get_osmajor(distro)
+        return self.metadata_cache().call('distros', 'get_osmajor', distro)
 
     getFamily = get_family
 
@@ -593,8 +608,9 @@ def get_tasks(self, *args, **kwargs):
         task_names = list(kwargs['task'])
         task_names.extend(self.getTaskNamesFromFile(kwargs))
         if task_names:
-            for task in self.hub.tasks.filter(dict(names=task_names,
-                                                   osmajor=filter['osmajor'])):
+            for task in self.metadata_cache().call('tasks', 'filter',
+                                                   dict(names=task_names,
+                                                        osmajor=filter['osmajor'])):
                 valid_tasks[task['name']] = task
             for name in task_names:
                 task = valid_tasks.get(name, None)
@@ -612,21 +628,16 @@ def get_tasks(self, *args, **kwargs):
             filter['packages'] = packages
 
         if types or packages:
-            ntasks = self.hub.tasks.filter(filter)
+            ntasks = self.metadata_cache().call('tasks', 'filter', filter)
 
-            multihost_tasks = self.hub.tasks.filter(dict(types=['Multihost']))
+            multihost_task_names = set(task['name'] for task in
+                                       self.metadata_cache().call('tasks', 'filter',
+                                                                  dict(types=['Multihost'])))
 
-            if self.multi_host:
-                for t in ntasks[:]:
-                    if t not in multihost_tasks:
-                        # FIXME add debug print here
-                        ntasks.remove(t)
-            else:
-                for t in ntasks[:]:
-                    if t in multihost_tasks:
-                        # FIXME add debug print here
-                        ntasks.remove(t)
-            tasks.extend(ntasks)
+            # Multi-host workflows only want Multihost tasks, single host
+            # workflows only want the others
+            tasks.extend(t for t in ntasks
+                         if (t['name'] in multihost_task_names) == self.multi_host)
         return tasks
 
     getTasks = get_tasks
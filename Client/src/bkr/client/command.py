@@ -276,11 +276,20 @@ def register_module(cls, module, prefix=None, skip_broken=False):
             __import__(module.__name__, {}, {}, module_list)
 
         for mn in module_list:
-            mod = getattr(module, mn)
-            for pn in dir(mod):
-                plugin = getattr(mod, pn)
-                if type(plugin) is type and issubclass(plugin, Plugin) and plugin is not Plugin:
-                    cls.register_plugin(plugin)
+            cls.register_module_plugins(getattr(module, mn))
+
+    @classmethod
+    def register_module_plugins(cls, mod):
+        """
+        Register all plugins defined in (or imported into) a single module.
+
+        @param mod: a python module that contains plugin classes
+        @type  mod: module
+        """
+        for pn in dir(mod):
+            plugin = getattr(mod, pn)
+            if type(plugin) is type and issubclass(plugin, Plugin) and plugin is not Plugin:
+                cls.register_plugin(plugin)
 
 
 class BeakerClientConfigurationError(ValueError):
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Static index of the built-in bkr subcommands.
+
+Importing every module in the bkr.client.commands package just to find out
+which one provides the requested subcommand makes each bkr invocation slow to
+start. Instead, the index maps each command name to the module defining it,
+so that only that module needs to be imported. The index is generated at
+build time (and by the tests) by parsing the command modules, without
+importing them, and written to bkr/client/commands/_index.py.
+
+This module must only depend on the standard library, since it is run by
+setup.py before the client's dependencies are available.
+"""
+
+import ast
+import os
+import pprint
+import sys
+
+INDEX_MODULE = '_index'
+
+INDEX_TEMPLATE = '''\
+# This file is generated by bkr.client.command_index. Do not edit it by hand,
+# run "python src/bkr/client/command_index.py" in the Client directory instead.
+
+# Maps normalized command names to the module in bkr.client.commands which
+# defines them.
+COMMANDS = %s
+'''
+
+
+def normalize_name(name):
+    # Must match bkr.client.command.CommandContainer.normalize_name
+    return name.lower().replace('_', '-').replace(' ', '-')
+
+
+def _literal_bool(node):
+    if isinstance(node, ast.Name) and node.id in ('True', 'False'):
+        return node.id == 'True'
+    value = getattr(node, 'value', None)
+    if isinstance(value, bool):
+        return value
+    return None
+
+
+def _module_commands(source):
+    """
+    Returns the names of the enabled command classes defined in the given
+    module source. A class is enabled if it sets enabled = True, or inherits
+    it from another class defined in the same module.
+    """
+    tree = ast.parse(source)
+    enabled = {}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        class_enabled = None
+        for stmt in node.body:
+            if (isinstance(stmt, ast.Assign)
+                    and any(isinstance(target, ast.Name) and target.id == 'enabled'
+                            for target in stmt.targets)):
+                class_enabled = _literal_bool(stmt.value)
+        if class_enabled is None:
+            class_enabled = any(isinstance(base, ast.Name) and enabled.get(base.id)
+                                for base in node.bases)
+        enabled[node.name] = class_enabled
+    return [name for name, is_enabled in enabled.items() if is_enabled]
+
+
+def build_index(commands_dir):
+    """
+    Returns a dict mapping normalized command names to module names, for all
+    the cmd_*.py modules in the given directory.
+    """
+    index = {}
+    for filename in sorted(os.listdir(commands_dir)):
+        if not filename.startswith('cmd_') or not filename.endswith('.py'):
+            continue
+        with open(os.path.join(commands_dir, filename)) as f:
+            source = f.read()
+        for class_name in _module_commands(source):
+            index[normalize_name(class_name)] = filename[:-3]
+    return index
+
+
+def format_index(index):
+    return INDEX_TEMPLATE % pprint.pformat(index)
+
+
+def default_commands_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'commands')
+
+
+def write_index(commands_dir=None):
+    """
+    Regenerates bkr/client/commands/_index.py. Returns the path written.
+    """
+    if commands_dir is None:
+        commands_dir = default_commands_dir()
+    path = os.path.join(commands_dir, INDEX_MODULE + '.py')
+    with open(path, 'w') as f:
+        f.write(format_index(build_index(commands_dir)))
+    return path
+
+
+if __name__ == '__main__':
+    sys.stdout.write('Wrote %s\n' % write_index(*sys.argv[1:]))
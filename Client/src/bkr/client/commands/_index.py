@@ -0,0 +1,71 @@
+# This file is generated by bkr.client.command_index. Do not edit it by hand,
+# run "python src/bkr/client/command_index.py" in the Client directory instead.
+
+# Maps normalized command names to the module in bkr.client.commands which
+# defines them.
+COMMANDS = {'distro-trees-list': 'cmd_distro_trees_list',
+ 'distro-trees-verify': 'cmd_distro_trees_verify',
+ 'distros-edit-version': 'cmd_distros_edit_version',
+ 'distros-list': 'cmd_distros_list',
+ 'distros-tag': 'cmd_distros_tag',
+ 'distros-untag': 'cmd_distros_untag',
+ 'group-create': 'cmd_group_create',
+ 'group-list': 'cmd_group_list',
+ 'group-members': 'cmd_group_members',
+ 'group-modify': 'cmd_group_modify',
+ 'harness-test': 'cmd_harness_test',
+ 'job-cancel': 'cmd_job_cancel',
+ 'job-clone': 'cmd_job_clone',
+ 'job-comment': 'cmd_job_comment',
+ 'job-delete': 'cmd_job_delete',
+ 'job-list': 'cmd_job_list',
+ 'job-logs': 'cmd_job_logs',
+ 'job-modify': 'cmd_job_modify',
+ 'job-results': 'cmd_job_results',
+ 'job-submit': 'cmd_job_submit',
+ 'job-watch': 'cmd_job_watch',
+ 'labcontroller-create': 'cmd_labcontroller_create',
+ 'labcontroller-list': 'cmd_labcontroller_list',
+ 'labcontroller-modify': 'cmd_labcontroller_modify',
+ 'list-labcontrollers': 'cmd_labcontroller_list',
+ 'list-systems': 'cmd_system_list',
+ 'loan-grant': 'cmd_loan_grant',
+ 'loan-return': 'cmd_loan_return',
+ 'machine-test': 'cmd_machine_test',
+ 'policy-grant': 'cmd_policy_grant',
+ 'policy-list': 'cmd_policy_list',
+ 'policy-revoke': 'cmd_policy_revoke',
+ 'pool-add': 'cmd_pool_add',
+ 'pool-create': 'cmd_pool_create',
+ 'pool-delete': 'cmd_pool_delete',
+ 'pool-list': 'cmd_pool_list',
+ 'pool-modify': 'cmd_pool_modify',
+ 'pool-remove': 'cmd_pool_remove',
+ 'pool-systems': 'cmd_pool_systems',
+ 'remove-account': 'cmd_remove_account',
+ 'system-create': 'cmd_system_create',
+ 'system-delete': 'cmd_system_delete',
+ 'system-details': 'cmd_system_details',
+ 'system-history-list': 'cmd_system_history_list',
+ 'system-list': 'cmd_system_list',
+ 'system-modify': 'cmd_system_modify',
+ 'system-power': 'cmd_system_power',
+ 'system-provision': 'cmd_system_provision',
+ 'system-release': 'cmd_system_release',
+ 'system-reserve': 'cmd_system_reserve',
+ 'system-status': 'cmd_system_status',
+ 'task-add': 'cmd_task_add',
+ 'task-delete': 'cmd_task_delete',
+ 'task-details': 'cmd_task_details',
+ 'task-list': 'cmd_task_list',
+ 'update-inventory': 'cmd_update_inventory',
+ 'update-openstack-trust': 'cmd_update_openstack_trust',
+ 'update-prefs': 'cmd_update_prefs',
+ 'user-modify': 'cmd_user_modify',
+ 'watchdog-extend': 'cmd_watchdog_extend',
+ 'watchdog-show': 'cmd_watchdog_show',
+ 'watchdogs-extend': 'cmd_watchdogs_extend',
+ 'whoami': 'cmd_whoami',
+ 'workflow-installer-test': 'cmd_workflow_installer_test',
+ 'workflow-simple': 'cmd_workflow_simple',
+ 'workflow-xslt': 'cmd_workflow_xslt'}
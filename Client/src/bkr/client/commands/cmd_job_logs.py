@@ -28,6 +28,12 @@
 subcommands (for example, ``J:1234``). See :ref:`Specifying tasks <taskspec>` 
 in :manpage:`bkr(1)`.
 
+With :option:`--download`, the log files are downloaded instead, using
+several connections at once. The files are saved in a directory tree mirroring
+the one on the lab controller or archive server. Files which have already been
+downloaded are skipped, and partially downloaded files are resumed, so the
+command can safely be repeated (for example while a job is still running).
+
 Options
 -------
 
@@ -35,6 +41,16 @@
 
    Print the file size (in bytes) alongside each log file URL.
 
+.. option:: --download <dir>
+
+   Download the log files into <dir> instead of printing their URLs. The path
+   of each downloaded file is printed instead.
+
+.. option:: --connections <number>
+
+   Use at most <number> concurrent connections when checking sizes or
+   downloading (default: 8).
+
 Common :program:`bkr` options are described in the :ref:`Options 
 <common-options>` section of :manpage:`bkr(1)`.
 
@@ -50,6 +66,10 @@
 
     bkr job-logs J:12345
 
+Download all logs for job 12345 into the current directory::
+
+    bkr job-logs --download . J:12345
+
 See also
 --------
 
@@ -58,8 +78,16 @@
 
 from __future__ import print_function
 
+import errno
+import os
+import sys
+from multiprocessing.pool import ThreadPool
+
 from bkr.client import BeakerCommand
 
+# Size of the chunks written to disk while downloading
+CHUNK_SIZE = 64 * 1024
+
 
 class Job_Logs(BeakerCommand):
     """
@@ -71,6 +99,11 @@ class Job_Logs(BeakerCommand):
     def options(self):
         self.parser.add_option('--size', action='store_true',
                                help='Print file size alongside each log file')
+        self.parser.add_option('--download', metavar='DIR',
+                               help='Download log files into DIR')
+        self.parser.add_option('--connections', metavar='NUMBER', type='int', default=8,
+                               help='Use at most NUMBER concurrent connections '
+                                    '[default: %default]')
         self.parser.usage = "%%prog %s [options] <taskspec>..." % self.normalized_name
 
     def _log_size(self, url):
@@ -84,15 +117,99 @@ def _log_size(self, url):
         except ValueError:
             return '<invalid>'
 
+    def _local_path(self, log):
+        # Mirror the directory structure of the lab controller or archive
+        # server, refusing anything which would escape the download directory
+        relative_path = os.path.normpath(os.path.join(
+            log['filepath'], (log['path'] or '').lstrip('/'), log['filename']))
+        if relative_path.startswith(os.pardir) or os.path.isabs(relative_path):
+            raise ValueError('Invalid log file path %s' % relative_path)
+        return os.path.join(self.download_dir, relative_path)
+
+    def _download(self, log):
+        """
+        Downloads the log file unless it has already been downloaded, resuming
+        a partial download if possible. Returns an error message on failure.
+        """
+        import requests
+        try:
+            dest = self._local_path(log)
+            try:
+                os.makedirs(os.path.dirname(dest))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            return self._fetch(log['url'], dest)
+        except (ValueError, IOError, OSError, requests.RequestException) as e:
+            return str(e)
+
+    def _fetch(self, url, dest):
+        size = os.path.getsize(dest) if os.path.exists(dest) else 0
+        headers = {'Range': 'bytes=%d-' % size} if size else {}
+        response = self.session.get(url, headers=headers, stream=True)
+        resume = (response.status_code == 206 and response.headers.get(
+            'Content-Range', '').startswith('bytes %d-' % size))
+        if response.status_code == 416 or (response.status_code == 206 and not resume):
+            response.close()
+            # Our copy is at least as large as the file on the server
+            if response.headers.get('Content-Range') == 'bytes */%d' % size:
+                return None
+            # Otherwise our copy does not match, start again
+            response = self.session.get(url, stream=True)
+        try:
+            if response.status_code in (404, 410):
+                return 'missing'
+            elif response.status_code >= 400:
+                return 'error:%s' % response.status_code
+            # If the server ignored the Range header it sends the whole file
+            with open(dest, 'ab' if resume else 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+        finally:
+            response.close()
+        return None
+
+    def _mount_connection_pool(self, connections):
+        import requests.adapters
+        adapter = requests.adapters.HTTPAdapter(pool_connections=connections,
+                                                pool_maxsize=connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
     def run(self, *args, **kwargs):
         self.check_taskspec_args(args)
+        if kwargs['connections'] < 1:
+            self.parser.error('--connections must be at least 1')
 
         self.set_hub(**kwargs)
         self.session = self.requests_session()
+        logs = []
         for task in args:
-            logfiles = self.hub.taskactions.files(task)
-            for log in logfiles:
-                if kwargs.get('size'):
-                    print(self._log_size(log['url']), log['url'])
-                else:
-                    print(log['url'])
+            logs.extend(self.hub.taskactions.files(task))
+        if not kwargs.get('size') and not kwargs.get('download'):
+            for log in logs:
+                print(log['url'])
+            return
+
+        self._mount_connection_pool(kwargs['connections'])
+        pool = ThreadPool(kwargs['connections'])
+        try:
+            if kwargs.get('download'):
+                self.download_dir = kwargs['download']
+                failed = False
+                # imap returns the results in order, so the output is stable
+                for log, error in zip(logs, pool.imap(self._download, logs)):
+                    if error:
+                        sys.stderr.write('Failed to download %s: %s\n' % (log['url'], error))
+                        failed = True
+                    else:
+                        print(self._local_path(log))
+                if failed:
+                    sys.exit(1)
+            else:
+                urls = [log['url'] for log in logs]
+                for url, size in zip(urls, pool.imap(self._log_size, urls)):
+                    print(size, url)
+        finally:
+            pool.close()
+            pool.join()
@@ -17,6 +17,7 @@
 | :program:`bkr system-history-list` [*options*] <fqdn>
 |       [:option:`--pretty`]
 |       [:option:`--since` <date>]
+|       [:option:`--include-archived`]
 
 
 
@@ -37,6 +38,14 @@
     from the past 24 hours are returned. Date has to be defined in
     UTC format YYYY-MM-DD.
 
+.. option:: --include-archived
+
+    Also return history entries which have been moved to the activity
+    archive on the server. By default only entries which are still in the
+    activity tables are returned.
+
+    .. versionadded:: 29.2
+
 .. option:: --pretty
 
    Pretty-print results in JSON (with indentation and line breaks,
@@ -61,6 +70,10 @@
 
     bkr system-history-list system1.example.invalid --since 2019-06-25
 
+Display history of a system since 2015-01-01, including archived entries:
+
+    bkr system-history-list system1.example.invalid --since 2015-01-01 --include-archived
+
 See also
 --------
 
@@ -109,6 +122,11 @@ def options(self):
                                action="store_true",
                                help="Pretty print the JSON output",
                                )
+        self.parser.add_option("--include-archived",
+                               default=False,
+                               action="store_true",
+                               help="Include entries from the activity archive",
+                               )
 
     def run(self, *args, **kwargs):
         if len(args) != 1:
@@ -116,12 +134,16 @@ def run(self, *args, **kwargs):
         fqdn = args[0]
         since = kwargs.pop('since', None)
         pretty = kwargs.pop('pretty')
+        include_archived = kwargs.pop('include_archived')
         since = since and self.check_valid_date(since)
 
         # This will log us in using XML-RPC
         self.set_hub(**kwargs)
 
-        action_list = self.hub.systems.history(fqdn, since)
+        if include_archived:
+            action_list = self.hub.systems.history(fqdn, since, True)
+        else:
+            action_list = self.hub.systems.history(fqdn, since)
         print(json.dumps({i: action for i, action in enumerate(action_list)},
                          default=json_serial,
                          sort_keys=True,
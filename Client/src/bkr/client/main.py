@@ -6,6 +6,7 @@
 # (at your option) any later version.
 
 import errno
+import importlib
 import logging
 import signal
 import sys
@@ -13,8 +14,6 @@
 from optparse import Option
 from optparse import SUPPRESS_HELP
 
-import gssapi
-import pkg_resources
 from six.moves.xmlrpc_client import Fault
 
 from bkr.client.command import BeakerClientConfigurationError
@@ -41,9 +40,31 @@ def register_all(cls):
         # Load subcommands from setuptools entry points in the bkr.client.commands
         # group. This is the new, preferred way for other packages to provide their
         # own bkr subcommands.
+        import pkg_resources
         for entrypoint in pkg_resources.iter_entry_points('bkr.client.commands'):
             cls.register_plugin(entrypoint.load(), name=entrypoint.name)
 
+    @classmethod
+    def register_for_args(cls, args):
+        """
+        Registers the commands needed to handle the given command line. If it
+        names a built-in command, only the module defining that command is
+        imported. Otherwise (for help, unknown commands, and commands provided
+        by entry points or dropped-in modules) all commands are registered.
+        """
+        if args and not args[0].startswith('-'):
+            try:
+                from bkr.client.commands._index import COMMANDS
+            except ImportError:
+                COMMANDS = {}
+            module_name = COMMANDS.get(args[0])
+            if module_name:
+                module = importlib.import_module('bkr.client.commands.%s' % module_name)
+                cls.register_module_plugins(module)
+                if args[0] in cls._get_plugins():
+                    return
+        cls.register_all()
+
 
 class BeakerOptionParser(CommandOptionParser):
     standard_option_list = [
@@ -60,7 +81,6 @@ class BeakerOptionParser(CommandOptionParser):
     ]
 
 
-BeakerCommandContainer.register_all()
 from bkr.client import BeakerJobTemplateError
 from bkr.client import conf
 
@@ -80,9 +100,23 @@ def warn_on_version_mismatch(response):
                              % (__version__, server_version))
 
 
+class _NoGSSError(Exception):
+    pass
+
+
+def _gss_error():
+    # gssapi is only imported when logging in with Kerberos, so if it has not
+    # been imported then no GSSError can have been raised.
+    gssapi = sys.modules.get('gssapi')
+    if gssapi is None:
+        return _NoGSSError
+    return gssapi.raw.GSSError
+
+
 def main():
     log_to_stream(sys.stderr, level=logging.WARNING)
 
+    BeakerCommandContainer.register_for_args(sys.argv[1:])
     command_container = BeakerCommandContainer(conf=conf)
     formatter = IndentedHelpFormatter(max_help_position=60, width=120)
     parser = BeakerOptionParser(version=__version__,
@@ -111,7 +145,7 @@ def main():
 
     try:
         return cmd.run(*cmd_args, **cmd_opts.__dict__)
-    except gssapi.raw.GSSError as e:
+    except _gss_error() as e:
         if e.min_code == krb5krb_ap_err_tkt_expired:  # pylint: disable=no-member
             sys.stderr.write('Kerberos ticket expired (run kinit to obtain a new ticket)\n')
             return 1
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+On-disk cache of server metadata used by the workflow commands.
+
+Workflow commands look up distro families, arches and task lists on every
+invocation, even though this metadata rarely changes. The results of those
+XML-RPC calls are cached in a JSON file per Beaker server under the user's
+cache directory.
+
+A cached result is used without contacting the server for METADATA_CACHE_TTL
+seconds. After that it is revalidated against the server's version stamp for
+that kind of metadata (for example distros.metadata_version): if the stamp
+has not changed since the result was cached, the result is still current and
+is used again, otherwise the call is repeated. Servers which do not provide
+version stamps are simply asked again once the TTL has expired.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from six.moves import xmlrpc_client
+
+# Default lifetime (in seconds) of cached results before they are revalidated
+DEFAULT_TTL = 300
+
+# Results which have not been revalidated for this long (in seconds) are
+# dropped from the cache file, so that it does not grow without bound.
+PRUNE_AGE = 7 * 24 * 60 * 60
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'bkr', 'metadata')
+
+
+class MetadataCache(object):
+    """
+    Caches the results of XML-RPC calls on *hub*, which is connected to the
+    Beaker server at *hub_url*. Each call belongs to a namespace (such as
+    ``'distros'`` or ``'tasks'``) whose version stamp is fetched by calling
+    the ``metadata_version`` method in that namespace.
+    """
+
+    def __init__(self, hub, hub_url, ttl=DEFAULT_TTL, cache_dir=None):
+        self.hub = hub
+        self.ttl = ttl
+        self.path = os.path.join(cache_dir or default_cache_dir(),
+                                 '%s.json' % hashlib.sha1(hub_url.encode('utf8')).hexdigest())
+        self._data = None
+        # namespace -> version stamp, fetched at most once per invocation
+        self._versions = {}
+
+    def call(self, namespace, method, *args):
+        """
+        Returns the result of calling hub.<namespace>.<method>(*args), from
+        the cache if possible.
+        """
+        if self.ttl <= 0:
+            return self._call(namespace, method, args)
+        entries = self._load().setdefault(namespace, {})
+        key = json.dumps([method, args], sort_keys=True)
+        entry = entries.get(key)
+        now = time.time()
+        if entry is not None and now - entry['stored'] <= self.ttl:
+            return entry['value']
+        version = self._version(namespace)
+        if entry is not None and version is not None and version == entry['version']:
+            entry['stored'] = now
+        else:
+            entry = {'value': self._call(namespace, method, args),
+                     'version': version, 'stored': now}
+            entries[key] = entry
+        self._save()
+        return entry['value']
+
+    def _call(self, namespace, method, args):
+        return getattr(getattr(self.hub, namespace), method)(*args)
+
+    def _version(self, namespace):
+        if namespace not in self._versions:
+            try:
+                self._versions[namespace] = self._call(namespace, 'metadata_version', ())
+            except xmlrpc_client.Fault:
+                # Older servers have no version stamps
+                self._versions[namespace] = None
+        return self._versions[namespace]
+
+    def _load(self):
+        if self._data is None:
+            try:
+                with open(self.path) as f:
+                    self._data = json.load(f)
+                if not isinstance(self._data, dict):
+                    self._data = {}
+            except (IOError, OSError, ValueError):
+                # Missing or corrupted, start again
+                self._data = {}
+        return self._data
+
+    def _save(self):
+        now = time.time()
+        for entries in self._data.values():
+            for key, entry in list(entries.items()):
+                if now - entry['stored'] > PRUNE_AGE:
+                    del entries[key]
+        cache_dir = os.path.dirname(self.path)
+        try:
+            try:
+                os.makedirs(cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            # Write to a temporary file and rename it into place, so that
+            # concurrent invocations never see a partially written file.
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.tmp')
+        except (IOError, OSError):
+            # The cache is only an optimisation, never fail the command
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._data, f)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
@@ -11,12 +11,18 @@
 
 import six
 import time
+from six.moves import xmlrpc_client
 
 __all__ = (
     "TaskWatcher",
     "watch_tasks"
 )
 
+# When a poll finds no changes, the time until the next poll is multiplied by
+# this factor (up to max_sleep_time). It drops back to sleep_time as soon as
+# something changes.
+BACKOFF_FACTOR = 1.5
+
 
 def display_tasklist_status(task_list):
     state_dict = {}
@@ -29,12 +35,19 @@ def display_tasklist_status(task_list):
           + " [total: %s]" % sum(state_dict.values()))
 
 
-def watch_tasks(hub, task_id_list, indentation_level=0, sleep_time=30, task_url=None):
+def watch_tasks(hub, task_id_list, indentation_level=0, sleep_time=30, task_url=None,
+                max_sleep_time=None):
     """
     Watch the task statuses until they finish.
+
+    All the tasks are polled together, and the polling interval backs off from
+    sleep_time up to max_sleep_time (default four times sleep_time) while
+    nothing is changing.
     """
     if not task_id_list:
         return
+    if max_sleep_time is None:
+        max_sleep_time = sleep_time * 4
     watcher = TaskWatcher()
     is_failed = False
     try:
@@ -45,18 +58,22 @@ def watch_tasks(hub, task_id_list, indentation_level=0, sleep_time=30, task_url=
             task_url = task_url or hub._conf.get("TASK_URL", None)
             if task_url is not None:
                 print("Task url: %s" % (task_url % task_id))
+        interval = sleep_time
         while True:
             all_done = True
-            changed = False
+            changed = watcher.update_all()
             for task in watcher.task_list:
-                changed |= watcher.update(task)
                 is_failed |= watcher.is_failed(task)
                 all_done &= watcher.is_finished(task)
             if changed:
                 display_tasklist_status(watcher.task_list)
             if all_done:
                 break
-            time.sleep(sleep_time)
+            if changed:
+                interval = sleep_time
+            else:
+                interval = min(interval * BACKOFF_FACTOR, max(max_sleep_time, sleep_time))
+            time.sleep(interval)
     except KeyboardInterrupt:
         running_task_list = [t.task_id for t in watcher.task_list if not watcher.is_finished(t)]
         if running_task_list:
@@ -72,6 +89,10 @@ class TaskWatcher(object):
     def __init__(self):
         self.subtask_dict = {}
         self.task_list = []
+        # Whether the server supports taskactions.task_info_many
+        self.batch = True
+        # Token returned by the last task_info_many call
+        self.token = None
 
     def is_finished(self, task):
         """Is the task finished?"""
@@ -93,13 +114,46 @@ def is_failed(self, task):
             result |= subtask.is_failed()
         return result
 
+    def update_all(self):
+        """
+        Update info for all unfinished tasks and log if needed, using a single
+        call to the server. Returns True on any state change.
+        """
+        tasks = [task for task in self.task_list if not self.is_finished(task)]
+        if not tasks:
+            return False
+        if self.batch:
+            try:
+                result = tasks[0].hub.taskactions.task_info_many(
+                    [task.task_id for task in tasks], self.token)
+            except xmlrpc_client.Fault as e:
+                # Older servers only support task_info
+                if 'task_info_many' not in e.faultString:
+                    raise
+                self.batch = False
+        if not self.batch:
+            changed = False
+            for task in tasks:
+                changed |= self.update(task)
+            return changed
+        self.token = result['token']
+        changed = False
+        for task in tasks:
+            # Tasks whose state has not changed since the last call are omitted
+            if task.task_id in result['tasks']:
+                changed |= self.set_task_info(task, result['tasks'][task.task_id])
+        return changed
+
     def update(self, task):
         """Update info and log if needed. Returns True on state change."""
         if self.is_finished(task):
             return False
+        return self.set_task_info(task, task.hub.taskactions.task_info(task.task_id, False))
 
+    def set_task_info(self, task, task_info):
+        """Record new info for the task and log if needed. Returns True on state change."""
         last = task.task_info
-        task.task_info = task.hub.taskactions.task_info(task.task_id, False)
+        task.task_info = task_info
 
         if task.task_info is None:
             print("No such task id: %s" % task.task_id)
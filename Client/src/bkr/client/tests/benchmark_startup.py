@@ -0,0 +1,54 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Benchmark for bkr client startup time. Not collected as part of the normal test
+run, invoke it explicitly from the Client directory:
+
+    PYTHONPATH=src:../Common nosetests -v -s bkr.client.tests.benchmark_startup
+
+The startup budget (in seconds, on top of the bare interpreter startup time)
+can be adjusted for slow machines with the BKR_STARTUP_BUDGET environment
+variable.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+RUNS = 10
+
+
+def _median_duration(args):
+    durations = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(RUNS):
+            start = time.time()
+            subprocess.call([sys.executable] + args, stdout=devnull, stderr=devnull)
+            durations.append(time.time() - start)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+class ClientStartupBenchmark(unittest.TestCase):
+
+    budget = float(os.environ.get('BKR_STARTUP_BUDGET', '0.3'))
+
+    def test_startup(self):
+        interpreter = _median_duration(['-c', 'pass'])
+        lazy = _median_duration(['-m', 'bkr.client.main', 'whoami', '--help'])
+        eager = _median_duration(['-c', 'from bkr.client.main import '
+                                  'BeakerCommandContainer as c; c.register_all()'])
+        print('\nInterpreter startup: %.3fs' % interpreter)
+        print('bkr whoami --help: %.3fs' % lazy)
+        print('Registering all commands: %.3fs' % eager)
+        self.assertLess(lazy, eager,
+                        'Running a single command should not cost as much as '
+                        'registering every command')
+        self.assertLess(lazy - interpreter, self.budget,
+                        'bkr startup took %.3fs over the interpreter startup time, '
+                        'budget is %.3fs' % (lazy - interpreter, self.budget))
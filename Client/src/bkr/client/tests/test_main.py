@@ -0,0 +1,89 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from bkr.client import command_index
+
+# Registers the commands for the given arguments in a fresh interpreter, and
+# reports what was registered and which modules had to be imported to do it.
+REGISTER_SCRIPT = '''
+import json, sys
+from bkr.client.main import BeakerCommandContainer
+BeakerCommandContainer.register_for_args(sys.argv[1:])
+json.dump({
+    'commands': sorted(BeakerCommandContainer({}).plugins),
+    'command_modules': sorted(name for name in sys.modules
+            if name.startswith('bkr.client.commands.cmd_')),
+    'gssapi_imported': 'gssapi' in sys.modules,
+}, sys.stdout)
+'''
+
+
+def register_for_args(*args):
+    p = subprocess.Popen([sys.executable, '-c', REGISTER_SCRIPT] + list(args),
+                         stdout=subprocess.PIPE, env=dict(os.environ))
+    out, _ = p.communicate()
+    if p.returncode != 0:
+        raise AssertionError('Registering commands failed with status %s'
+                             % p.returncode)
+    return json.loads(out.decode('utf8'))
+
+
+class CommandIndexTest(unittest.TestCase):
+
+    def test_index_is_up_to_date(self):
+        commands_dir = command_index.default_commands_dir()
+        with open(os.path.join(commands_dir, '_index.py')) as f:
+            committed = f.read()
+        self.assertEqual(committed, command_index.format_index(
+            command_index.build_index(commands_dir)),
+            'bkr/client/commands/_index.py is out of date, '
+            'run "python src/bkr/client/command_index.py" to regenerate it')
+
+    def test_includes_aliases(self):
+        from bkr.client.commands._index import COMMANDS
+        self.assertEqual(COMMANDS['system-list'], 'cmd_system_list')
+        self.assertEqual(COMMANDS['list-systems'], 'cmd_system_list')
+
+    def test_inherited_enabled(self):
+        source = '''
+class Base(BeakerCommand):
+    enabled = True
+class Alias(Base):
+    hidden = True
+class Disabled(Base):
+    enabled = False
+class Helper(object):
+    pass
+'''
+        self.assertEqual(sorted(command_index._module_commands(source)),
+                         ['Alias', 'Base'])
+
+
+class LazyRegistrationTest(unittest.TestCase):
+
+    def test_builtin_command_imports_only_its_module(self):
+        result = register_for_args('whoami', '--help')
+        self.assertIn('whoami', result['commands'])
+        self.assertEqual(result['command_modules'],
+                         ['bkr.client.commands.cmd_whoami'])
+        self.assertFalse(result['gssapi_imported'])
+
+    def test_help_registers_all_commands(self):
+        result = register_for_args('help')
+        self.assertIn('whoami', result['commands'])
+        self.assertIn('job-submit', result['commands'])
+        self.assertIn('bkr.client.commands.cmd_job_submit',
+                      result['command_modules'])
+
+    def test_unknown_command_registers_all_commands(self):
+        result = register_for_args('no-such-command')
+        self.assertIn('whoami', result['commands'])
+        self.assertIn('job-submit', result['commands'])
@@ -0,0 +1,115 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import shutil
+import tempfile
+import unittest
+
+from six.moves import xmlrpc_client
+
+from bkr.client.metadata_cache import MetadataCache
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+class FakeNamespace(object):
+
+    def __init__(self, hub, name):
+        self.hub = hub
+        self.name = name
+
+    def __getattr__(self, method):
+        def call(*args):
+            self.hub.calls.append('%s.%s' % (self.name, method))
+            if method == 'metadata_version':
+                if self.hub.version is None:
+                    raise xmlrpc_client.Fault(1, 'XML-RPC method %s.%s not '
+                                              'implemented by this server' % (self.name, method))
+                return self.hub.version
+            return self.hub.results[method]
+        return call
+
+
+class FakeHub(object):
+
+    def __init__(self):
+        self.calls = []
+        self.version = '1'
+        self.results = {'get_osmajor': 'RedHatEnterpriseLinux7'}
+
+    def __getattr__(self, name):
+        return FakeNamespace(self, name)
+
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='bkr-client-metadata-cache-test')
+        self.hub = FakeHub()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def cache(self, ttl=300):
+        return MetadataCache(self.hub, 'https://beaker.example.com/bkr',
+                             ttl=ttl, cache_dir=self.cache_dir)
+
+    def test_result_is_reused_by_later_invocations(self):
+        self.assertEqual(self.cache().call('distros', 'get_osmajor', 'RHEL-7.9'),
+                         'RedHatEnterpriseLinux7')
+        self.assertEqual(self.hub.calls, ['distros.metadata_version', 'distros.get_osmajor'])
+        del self.hub.calls[:]
+        self.assertEqual(self.cache().call('distros', 'get_osmajor', 'RHEL-7.9'),
+                         'RedHatEnterpriseLinux7')
+        self.assertEqual(self.hub.calls, [])
+
+    def test_different_arguments_are_cached_separately(self):
+        self.cache().call('distros', 'get_osmajor', 'RHEL-7.9')
+        del self.hub.calls[:]
+        self.cache().call('distros', 'get_osmajor', 'RHEL-8.4')
+        self.assertIn('distros.get_osmajor', self.hub.calls)
+
+    def test_expired_result_is_revalidated(self):
+        with patch('time.time', return_value=1000):
+            self.cache().call('distros', 'get_osmajor', 'RHEL-7.9')
+        del self.hub.calls[:]
+        with patch('time.time', return_value=2000):
+            self.cache().call('distros', 'get_osmajor', 'RHEL-7.9')
+        # version has not changed, so the cached result is still good
+        self.assertEqual(self.hub.calls, ['distros.metadata_version'])
+        del self.hub.calls[:]
+        self.hub.version = '2'
+        self.hub.results['get_osmajor'] = 'RedHatEnterpriseLinux8'
+        with patch('time.time', return_value=3000):
+            result = self.cache().call('distros', 'get_osmajor', 'RHEL-7.9')
+        self.assertEqual(result, 'RedHatEnterpriseLinux8')
+        self.assertEqual(self.hub.calls, ['distros.metadata_version', 'distros.get_osmajor'])
+
+    def test_server_without_version_stamps(self):
+        self.hub.version = None
+        with patch('time.time', return_value=1000):
+            self.cache().call('distros', 'get_osmajor', 'RHEL-7.9')
+        del self.hub.calls[:]
+        with patch('time.time', return_value=1100):
+            self.cache().call('distros', 'get_osmajor', 'RHEL-7.9')
+        self.assertEqual(self.hub.calls, [])
+        with patch('time.time', return_value=2000):
+            self.cache().call('distros', 'get_osmajor', 'RHEL-7.9')
+        self.assertEqual(self.hub.calls, ['distros.metadata_version', 'distros.get_osmajor'])
+
+    def test_zero_ttl_disables_cache(self):
+        self.cache(ttl=0).call('distros', 'get_osmajor', 'RHEL-7.9')
+        self.cache(ttl=0).call('distros', 'get_osmajor', 'RHEL-7.9')
+        self.assertEqual(self.hub.calls, ['distros.get_osmajor', 'distros.get_osmajor'])
+
+    def test_corrupted_cache_file_is_ignored(self):
+        cache = self.cache()
+        with open(cache.path, 'w') as f:
+            f.write('garbage')
+        self.assertEqual(cache.call('distros', 'get_osmajor', 'RHEL-7.9'),
+                         'RedHatEnterpriseLinux7')
@@ -0,0 +1,98 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import unittest
+
+from six.moves import StringIO
+from six.moves import xmlrpc_client
+
+from bkr.client.task_watcher import watch_tasks
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def task_info(taskid, state):
+    return {'id': taskid, 'worker': None, 'state': state, 'state_label': state,
+            'method': None, 'result': 'New', 'is_finished': state == 'Completed',
+            'is_failed': False}
+
+
+class FakeTaskActions(object):
+    """
+    Serves a scripted sequence of states for each task. Each poll advances
+    every task to its next state, until its last state is reached.
+    """
+
+    def __init__(self, states, batch=True):
+        self.states = states
+        self.polls = dict((taskid, 0) for taskid in states)
+        self.batch = batch
+        self.calls = []
+
+    def _next_info(self, taskid):
+        states = self.states[taskid]
+        state = states[min(self.polls[taskid], len(states) - 1)]
+        self.polls[taskid] += 1
+        return task_info(taskid, state)
+
+    def task_info(self, taskid, flat=True):
+        self.calls.append('task_info')
+        return self._next_info(taskid)
+
+    def task_info_many(self, taskids, since=None):
+        self.calls.append('task_info_many')
+        if not self.batch:
+            raise xmlrpc_client.Fault(1, 'XML-RPC method taskactions.task_info_many '
+                                         'not implemented by this server')
+        previous = dict(item.split('=') for item in since.split(',')) if since else {}
+        infos = dict((taskid, self._next_info(taskid)) for taskid in taskids)
+        tasks = dict((taskid, info) for taskid, info in infos.items()
+                     if previous.get(taskid) != info['state'])
+        token = ','.join('%s=%s' % (taskid, info['state'])
+                         for taskid, info in infos.items())
+        return {'tasks': tasks, 'token': token}
+
+
+class FakeHub(object):
+
+    def __init__(self, taskactions):
+        self.taskactions = taskactions
+        self._conf = {}
+
+
+class WatchTasksTest(unittest.TestCase):
+
+    def watch(self, taskactions, **kwargs):
+        with patch('sys.stdout', new_callable=StringIO), \
+                patch('time.sleep') as sleep:
+            watch_tasks(FakeHub(taskactions), list(taskactions.states), **kwargs)
+        return [call[0][0] for call in sleep.call_args_list]
+
+    def test_all_tasks_are_polled_together(self):
+        taskactions = FakeTaskActions({
+            'J:1': ['Queued', 'Running', 'Completed'],
+            'J:2': ['Queued', 'Running', 'Running', 'Completed'],
+        })
+        self.watch(taskactions)
+        self.assertEqual(taskactions.calls, ['task_info_many'] * 4)
+
+    def test_backs_off_while_nothing_changes(self):
+        taskactions = FakeTaskActions({
+            'J:1': ['Running'] * 6 + ['Completed'],
+        })
+        sleeps = self.watch(taskactions, sleep_time=10, max_sleep_time=30)
+        self.assertEqual(sleeps, [10, 15, 22.5, 30, 30, 30])
+
+    def test_falls_back_to_task_info_on_older_servers(self):
+        taskactions = FakeTaskActions({
+            'J:1': ['Queued', 'Completed'],
+            'J:2': ['Queued', 'Completed'],
+        }, batch=False)
+        self.watch(taskactions)
+        self.assertEqual(taskactions.calls,
+                         ['task_info_many'] + ['task_info'] * 4)
@@ -147,6 +147,13 @@ def temp_file(self):
             raise RuntimeError(msg)
         return self._temp_info[0]
 
+    @property
+    def temp_path(self):
+        if not self._temp_info:
+            msg = "Replacement for %r not yet created" % self.dest_path
+            raise RuntimeError(msg)
+        return self._temp_info[2]
+
     def create_temp(self):
         """Create the temporary file that may later be renamed"""
         dirname, basename = os.path.split(self.dest_path)
@@ -9,7 +9,6 @@
 import os
 import tempfile
 
-import gssapi
 import six
 import ssl
 from six.moves import urllib_parse as urlparse
@@ -145,6 +144,9 @@ def _login_krbv(self):
         """
         Login using kerberos credentials (uses python-gssapi).
         """
+        # Imported here rather than at module scope because loading the GSSAPI
+        # libraries is slow, and most logins do not use Kerberos.
+        import gssapi
 
         def get_server_principal(service=None, realm=None):
             """
@@ -4,9 +4,12 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
+import re
 import difflib
 import time
 import datetime
+import contextlib
+from bkr.server import sqlprofile
 
 def assert_sorted(things, key=None):
     """
@@ -85,3 +88,27 @@ def character_diff_message(expected, actual):
     message for a test assertion."""
     diffed = ''.join(difflib.unified_diff(list(expected), list(actual), n=10))
     return 'Diff:\n %s\nExpected:\n %s\nActual:\n %s' % (diffed, expected, actual)
+
+# Matches the query issued by User.groups to find a user's group memberships
+GROUP_MEMBERSHIP_QUERY = r'FROM tg_group WHERE .*excluded_user_group'
+
+@contextlib.contextmanager
+def assert_max_sql_statements(pattern, max_count):
+    """
+    Asserts that no more than max_count SQL statements matching the given
+    regular expression (after normalisation by
+    :func:`bkr.server.sqlprofile.fingerprint`) are issued inside the
+    with-block.
+    """
+    sqlprofile.install_hooks()
+    profile = sqlprofile.start('assert_max_sql_statements')
+    try:
+        yield profile
+    finally:
+        sqlprofile.finish()
+    matching = [(fp, count) for fp, (count, total)
+            in profile.by_fingerprint.iteritems() if re.search(pattern, fp)]
+    if sum(count for fp, count in matching) > max_count:
+        raise AssertionError('Expected at most %d statements matching %r, '
+                'found: %s' % (max_count, pattern, '; '.join('%d x %s'
+                % (count, fp) for fp, count in matching)))
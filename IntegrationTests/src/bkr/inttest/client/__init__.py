@@ -36,6 +36,9 @@ def create_client_config(username=data_setup.ADMIN_USER,
                 'PASSWORD = "%s"' % password,
                 # Kobo wigs out if HUB_URL ends with a trailing slash, not sure why..
                 'HUB_URL = "%s"' % hub_url.rstrip('/'),
+                # Tests change distros and tasks constantly, so the workflow
+                # commands must not reuse cached server metadata
+                'METADATA_CACHE_TTL = 0',
                 cacert_conf
         ]))
 
@@ -126,3 +126,53 @@ def test_size_handles_http_errors(self):
         lines = out.splitlines()
         self.assertEquals(lines[0], '<error:500> %srecipes/%s/logs/error/500' %
                 (get_server_base(), self.recipe.id))
+
+    def recipe_log_path(self, download_dir):
+        return os.path.join(download_dir, self.recipe.filepath, 'R', 'dummy.txt')
+
+    def test_download(self):
+        download_dir = tempfile.mkdtemp(prefix='beaker-client-test-job-logs-download')
+        self.addCleanup(shutil.rmtree, download_dir, ignore_errors=True)
+        out = run_client(['bkr', 'job-logs', '--download', download_dir, self.job.t_id])
+        recipe_log = self.recipe_log_path(download_dir)
+        task_log = os.path.join(download_dir, self.recipe.tasks[0].filepath,
+                'T', 'dummy.txt')
+        result_log = os.path.join(download_dir,
+                self.recipe.tasks[0].results[0].filepath, 'TR', 'dummy.txt')
+        self.assertEquals(out.splitlines(), [recipe_log, task_log, result_log])
+        self.assertEquals(open(recipe_log).read(), 'recipe\n')
+        self.assertEquals(open(task_log).read(), 'task\n')
+        self.assertEquals(open(result_log).read(), 'result\n')
+
+    def test_download_resumes_partial_files(self):
+        download_dir = tempfile.mkdtemp(prefix='beaker-client-test-job-logs-download')
+        self.addCleanup(shutil.rmtree, download_dir, ignore_errors=True)
+        recipe_log = self.recipe_log_path(download_dir)
+        os.makedirs(os.path.dirname(recipe_log))
+        open(recipe_log, 'w').write('rec')
+        run_client(['bkr', 'job-logs', '--download', download_dir, self.job.t_id])
+        self.assertEquals(open(recipe_log).read(), 'recipe\n')
+        # a second run leaves the complete files alone
+        run_client(['bkr', 'job-logs', '--download', download_dir, self.job.t_id])
+        self.assertEquals(open(recipe_log).read(), 'recipe\n')
+
+    def test_download_replaces_mismatched_files(self):
+        download_dir = tempfile.mkdtemp(prefix='beaker-client-test-job-logs-download')
+        self.addCleanup(shutil.rmtree, download_dir, ignore_errors=True)
+        recipe_log = self.recipe_log_path(download_dir)
+        os.makedirs(os.path.dirname(recipe_log))
+        open(recipe_log, 'w').write('something much longer\n')
+        run_client(['bkr', 'job-logs', '--download', download_dir, self.job.t_id])
+        self.assertEquals(open(recipe_log).read(), 'recipe\n')
+
+    def test_download_reports_missing_files(self):
+        download_dir = tempfile.mkdtemp(prefix='beaker-client-test-job-logs-download')
+        self.addCleanup(shutil.rmtree, download_dir, ignore_errors=True)
+        with session.begin():
+            self.job.recipesets[0].recipes[0].logs[0].filename = u'idontexist.txt'
+        try:
+            run_client(['bkr', 'job-logs', '--download', download_dir, self.job.t_id])
+            self.fail('should raise')
+        except ClientError as e:
+            self.assertEquals(e.status, 1)
+            self.assertIn('idontexist.txt: missing', e.stderr_output)
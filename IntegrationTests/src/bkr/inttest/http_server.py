@@ -19,6 +19,8 @@
 /slow/<delay>[/...]
     Waits <delay> seconds and then responds with a dummy response body. Extra 
     path information is ignored.
+
+GET requests for files support simple "bytes=<start>-" Range headers.
 """
 
 import os, os.path
@@ -74,9 +76,24 @@ def __call__(self, environ, start_response):
                 start_response('200 OK', response_headers)
                 return [listing]
             else:
-                response_headers.append(('Content-Length', str(os.path.getsize(localpath))))
+                size = os.path.getsize(localpath)
                 mimetype, encoding = mimetypes.guess_type(localpath)
                 response_headers.append(('Content-Type', mimetype or 'application/octet-stream'))
+                m = re.match(r'bytes=(\d+)-$', environ.get('HTTP_RANGE', ''))
+                if m:
+                    start = int(m.group(1))
+                    if start >= size:
+                        response_headers.append(('Content-Range', 'bytes */%d' % size))
+                        start_response('416 Range Not Satisfiable', response_headers)
+                        return []
+                    f = open(localpath, 'r')
+                    f.seek(start)
+                    response_headers.append(('Content-Length', str(size - start)))
+                    response_headers.append(('Content-Range',
+                            'bytes %d-%d/%d' % (start, size - 1, size)))
+                    start_response('206 Partial Content', response_headers)
+                    return wsgiref.util.FileWrapper(f)
+                response_headers.append(('Content-Length', str(size)))
                 start_response('200 OK', response_headers)
                 return wsgiref.util.FileWrapper(open(localpath, 'r'))
         elif environ['REQUEST_METHOD'] == 'DELETE' and self.writable:
@@ -6,6 +6,7 @@
 
 import os, os.path
 import re
+import json
 import posixpath
 import datetime
 import tempfile
@@ -232,6 +233,41 @@ def test_POST_skip(self):
         self.check_result(result_id, TaskResult.skip, u'/', None,
                 u'Did not run')
 
+    def post_results(self, results):
+        results_url = '%srecipes/%s/tasks/%s/results/' % (self.get_proxy_url(),
+                self.recipe.id, self.recipe.tasks[0].id)
+        return requests.post(results_url, data=json.dumps(results),
+                headers={'Content-Type': 'application/json'})
+
+    def test_POST_several_results(self):
+        response = self.post_results([
+                dict(result='Pass', path='/random/junk', score=123,
+                     message='The thing worked'),
+                dict(result='Fail', path='/random/junk/2', score='456',
+                     message='The thing failed'),
+                dict(result='None', path='/random/junk/3')])
+        self.assertEquals(response.status_code, 201)
+        result_ids = response.json()['ids']
+        with session.begin():
+            session.expire_all()
+            results = self.recipe.tasks[0].results
+            self.assertEquals([r.id for r in results], result_ids)
+            self.assertEquals([r.result for r in results],
+                    [TaskResult.pass_, TaskResult.fail, TaskResult.none])
+            self.assertEquals([r.path for r in results],
+                    [u'/random/junk', u'/random/junk/2', u'/random/junk/3'])
+            self.assertEquals([r.score for r in results], [123, 456, None])
+            self.assertEquals([r.log for r in results],
+                    [u'The thing worked', u'The thing failed', None])
+
+    def test_POST_several_results_with_unknown_result(self):
+        response = self.post_results([dict(result='Pass'),
+                dict(result='Eggplant')])
+        self.assertEquals(response.status_code, 400)
+        with session.begin():
+            session.expire_all()
+            self.assertEquals(self.recipe.tasks[0].results, [])
+
     def test_POST_missing_result(self):
         results_url = '%srecipes/%s/tasks/%s/results/' % (self.get_proxy_url(),
                 self.recipe.id, self.recipe.tasks[0].id)
@@ -276,6 +312,7 @@ def test_max_results_per_recipe_limit_is_enforced(self):
         response = requests.post(results_url, data=dict(result='Pass'))
         self.assertEqual(response.status_code, 403)
         self.assertIn('Too many results in recipe', response.text)
+        self.assertEqual(self.post_results([dict(result='Pass')]).status_code, 403)
         # Warning result should have been recorded, but only once
         with session.begin():
             session.expire_all()
@@ -0,0 +1,71 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Benchmark for recording activity through the ORM compared with the
+activity buffer. Not collected as part of the normal test run, invoke it
+explicitly:
+
+    nosetests -v -s bkr.inttest.server.benchmark_activity
+
+The number of activity records can be adjusted with the
+BKR_ACTIVITY_BENCHMARK_RECORDS environment variable.
+"""
+
+import os
+import time
+from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.server.model import session, System, SystemActivity
+
+class ActivityBenchmark(DatabaseTestCase):
+
+    records = int(os.environ.get('BKR_ACTIVITY_BENCHMARK_RECORDS', '10000'))
+    systems = 100
+
+    def setUp(self):
+        session.begin()
+        self.user = data_setup.create_user()
+        self.system_list = [data_setup.create_system()
+                for _ in range(self.systems)]
+        session.flush()
+
+    def tearDown(self):
+        session.rollback()
+
+    def _record(self, method_name, service):
+        start = time.time()
+        for i in range(self.records):
+            system = self.system_list[i % self.systems]
+            getattr(system, method_name)(user=self.user, service=service,
+                    field=u'Key/Value', action=u'Added', new=u'BENCHMARK/%s' % i)
+        session.flush()
+        duration = time.time() - start
+        count = SystemActivity.query.filter(SystemActivity.service == service).count()
+        return duration, count
+
+    def test_record_activity(self):
+        orm_duration, orm_count = self._record('record_activity', u'orm')
+        buffered_duration, buffered_count = self._record(
+                'record_buffered_activity', u'buffered')
+        print ('%d activity records: %.2fs through the ORM, %.2fs buffered'
+               % (self.records, orm_duration, buffered_duration))
+        self.assertEquals(orm_count, self.records)
+        self.assertEquals(buffered_count, self.records)
+        self.assertLess(buffered_duration, orm_duration)
+
+    def test_record_bulk_activity(self):
+        query = System.query.filter(System.id.in_(
+                [system.id for system in self.system_list]))
+        start = time.time()
+        for _ in range(self.records // self.systems):
+            System.record_bulk_activity(query, user=self.user,
+                    service=u'bulk', field=u'Pool', action=u'Removed',
+                    old=u'benchmark')
+        session.flush()
+        duration = time.time() - start
+        print ('%d bulk activity records: %.2fs' % (self.records, duration))
+        self.assertEquals(SystemActivity.query
+                .filter(SystemActivity.service == u'bulk').count(),
+                self.records // self.systems * self.systems)
@@ -0,0 +1,101 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Benchmark for CSV export on a large synthetic inventory. Not collected as
+part of the normal test run, invoke it explicitly:
+
+    nosetests -v -s bkr.inttest.server.benchmark_csv_export
+
+The size of the inventory can be adjusted with the BKR_CSV_BENCHMARK_SYSTEMS
+environment variable.
+"""
+
+import os
+import time
+from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.server.CSV_import_export import CSV_KeyValue, CSV_System
+from bkr.server.model import session, System, User, Key, Key_Value_Int, \
+        Key_Value_String
+
+class CSVExportBenchmark(DatabaseTestCase):
+
+    systems = int(os.environ.get('BKR_CSV_BENCHMARK_SYSTEMS', '2000'))
+    key_values_per_system = 20
+
+    def setUp(self):
+        session.begin()
+        self.admin_id = data_setup.create_admin().user_id
+        owner = data_setup.create_user()
+        self.system_ids = [data_setup.create_system(owner=owner).id
+                for _ in range(self.systems)]
+        session.flush()
+        int_keys = Key.query.filter(Key.numeric == True).limit(10).all()
+        string_keys = Key.query.filter(Key.numeric == False).limit(10).all()
+        conn = session.connection(System)
+        conn.execute(Key_Value_Int.__table__.insert(), [
+                {'system_id': system_id, 'key_id': key.id, 'key_value': i}
+                for system_id in self.system_ids
+                for i, key in enumerate(int_keys)])
+        conn.execute(Key_Value_String.__table__.insert(), [
+                {'system_id': system_id, 'key_id': key.id,
+                 'key_value': u'value %s' % i}
+                for system_id in self.system_ids
+                for i, key in enumerate(string_keys)])
+        self.key_values_per_system = len(int_keys) + len(string_keys)
+        session.expunge_all()
+
+    def tearDown(self):
+        session.rollback()
+
+    def _export(self, csv_class):
+        session.expunge_all()
+        admin = User.query.get(self.admin_id)
+        start = time.time()
+        size = 0
+        rows = 0
+        largest_chunk = 0
+        for chunk in csv_class.iter_csv(admin):
+            size += len(chunk)
+            rows += chunk.count('\n')
+            largest_chunk = max(largest_chunk, len(chunk))
+        return time.time() - start, size, rows, largest_chunk
+
+    def _orm_export_keyvalue(self):
+        # The object-at-a-time approach used before export was streamed, for
+        # comparison: one query per system and per relationship.
+        session.expunge_all()
+        admin = User.query.get(self.admin_id)
+        start = time.time()
+        rows = 0
+        for system in System.all(admin):
+            for kv in system.key_values_int + system.key_values_string:
+                u'%s,%s,%s' % (system.fqdn, kv.key.key_name, kv.key_value)
+                rows += 1
+        return time.time() - start, rows
+
+    def test_export_keyvalue(self):
+        orm_duration, orm_rows = self._orm_export_keyvalue()
+        orm_identity_map = len(session.identity_map)
+        duration, size, rows, largest_chunk = self._export(CSV_KeyValue)
+        print ('Key/value export of %d systems: %.2fs streamed (%d bytes, '
+               'largest chunk %d bytes), %.2fs object-at-a-time (%d objects '
+               'left in session)' % (self.systems, duration, size,
+               largest_chunk, orm_duration, orm_identity_map))
+        self.assertGreaterEqual(rows - 1,
+                self.systems * self.key_values_per_system)
+        self.assertGreaterEqual(rows - 1, orm_rows)
+        # Streaming must not accumulate objects in the session
+        self.assertLess(len(session.identity_map), 20)
+        # Chunks are bounded by the window size, not the inventory size
+        if self.systems > CSV_KeyValue.export_window:
+            self.assertLess(largest_chunk, size)
+
+    def test_export_systems(self):
+        duration, size, rows, largest_chunk = self._export(CSV_System)
+        print ('System export of %d systems: %.2fs (%d bytes, largest chunk '
+               '%d bytes)' % (self.systems, duration, size, largest_chunk))
+        self.assertGreaterEqual(rows - 1, self.systems)
+        self.assertLess(len(session.identity_map), 20)
@@ -0,0 +1,66 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Benchmark for kickstart rendering. Not collected as part of the normal test
+run, invoke it explicitly:
+
+    nosetests -v -s bkr.inttest.server.benchmark_kickstart
+"""
+
+import time
+from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.server.kickstart import generate_kickstart, snippet_cache
+from bkr.server.model import session
+from bkr.server.tools.create_kickstart import FakeInstallation
+
+class KickstartRenderBenchmark(DatabaseTestCase):
+
+    renders = 200
+
+    def setUp(self):
+        session.begin()
+        self.lab_controller = data_setup.create_labcontroller()
+        self.distro_tree = data_setup.create_distro_tree(
+                osmajor=u'RedHatEnterpriseLinux7', arch=u'x86_64',
+                lab_controllers=[self.lab_controller])
+        self.systems = [data_setup.create_system(arch=u'x86_64',
+                lab_controller=self.lab_controller) for _ in range(10)]
+        self.user = data_setup.create_user()
+        session.flush()
+
+    def tearDown(self):
+        session.rollback()
+
+    def _render(self, system):
+        installation = FakeInstallation(
+                self.distro_tree.distro.osversion.osmajor.osmajor,
+                self.distro_tree.distro.osversion.osminor,
+                self.distro_tree.distro.name, self.distro_tree.variant,
+                self.distro_tree.arch,
+                self.distro_tree.url_in_lab(lab_controller=self.lab_controller))
+        install_options = system.manual_provision_install_options(self.distro_tree)
+        return generate_kickstart(install_options=install_options,
+                distro_tree=self.distro_tree, installation=installation,
+                system=system, user=self.user).kickstart
+
+    def _renders_per_second(self, clear_cache):
+        start = time.time()
+        for i in range(self.renders):
+            if clear_cache:
+                snippet_cache.clear()
+            self._render(self.systems[i % len(self.systems)])
+        return self.renders / (time.time() - start)
+
+    def test_renders_per_second(self):
+        # make sure both paths produce the same kickstart before timing them
+        snippet_cache.clear()
+        uncached = self._render(self.systems[0])
+        cached = self._render(self.systems[0])
+        self.assertEquals(cached, uncached)
+        without_cache = self._renders_per_second(clear_cache=True)
+        with_cache = self._renders_per_second(clear_cache=False)
+        print ('Kickstart renders per second: %.1f without snippet cache, '
+               '%.1f with snippet cache' % (without_cache, with_cache))
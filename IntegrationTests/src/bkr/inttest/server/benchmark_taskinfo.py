@@ -0,0 +1,80 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Benchmark for reading task details out of task RPMs. Not collected as part
+of the normal test run, invoke it explicitly with a directory of real task
+RPMs (for example a copy of /var/www/beaker/rpms) in the
+BKR_TASKINFO_BENCHMARK_RPMS environment variable:
+
+    BKR_TASKINFO_BENCHMARK_RPMS=/var/www/beaker/rpms \\
+        nosetests -v -s bkr.inttest.server.benchmark_taskinfo
+"""
+
+import os
+import time
+import unittest
+import multiprocessing
+from bkr.server import rpmpayload
+from bkr.server.model import TaskLibrary
+from bkr.server.model.tasklibrary import _read_taskinfo_from_path
+
+class TaskInfoBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        rpms_dir = os.environ.get('BKR_TASKINFO_BENCHMARK_RPMS')
+        if not rpms_dir:
+            raise unittest.SkipTest('BKR_TASKINFO_BENCHMARK_RPMS is not set')
+        self.rpm_paths = [os.path.join(rpms_dir, name)
+                for name in sorted(os.listdir(rpms_dir))
+                if name.endswith('.rpm')]
+        if not self.rpm_paths:
+            raise unittest.SkipTest('No RPMs found in %s' % rpms_dir)
+        self.tasklib = TaskLibrary()
+
+    def _testinfo_paths(self):
+        paths = []
+        for rpm_path in self.rpm_paths:
+            with open(rpm_path, 'rb') as f:
+                files = self.tasklib.get_rpm_info(f)['files']
+            testinfo = [name for name in files if name.endswith('testinfo.desc')]
+            if testinfo:
+                paths.append((rpm_path, testinfo[-1]))
+        return paths
+
+    def test_extract_testinfo(self):
+        paths = self._testinfo_paths()
+        start = time.time()
+        cpio_results = []
+        for rpm_path, testinfo in paths:
+            with open(rpm_path, 'rb') as f:
+                cpio_results.append(self.tasklib._extract_with_cpio(f, testinfo))
+        cpio_duration = time.time() - start
+        start = time.time()
+        payload_results = []
+        for rpm_path, testinfo in paths:
+            with open(rpm_path, 'rb') as f:
+                payload_results.append(rpmpayload.read_payload_file(f, testinfo))
+        payload_duration = time.time() - start
+        print ('testinfo.desc from %d RPMs: %.2fs with rpm2cpio, %.2fs in-process'
+               % (len(paths), cpio_duration, payload_duration))
+        self.assertEquals(payload_results, cpio_results)
+
+    def test_read_taskinfo(self):
+        start = time.time()
+        serial = map(_read_taskinfo_from_path, self.rpm_paths)
+        serial_duration = time.time() - start
+        pool = multiprocessing.Pool()
+        try:
+            start = time.time()
+            parallel = pool.map(_read_taskinfo_from_path, self.rpm_paths)
+            parallel_duration = time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+        print ('Task details from %d RPMs: %.2fs serially, %.2fs with %d processes'
+               % (len(self.rpm_paths), serial_duration, parallel_duration,
+                  multiprocessing.cpu_count()))
+        self.assertEquals(parallel, serial)
@@ -11,7 +11,8 @@
 from bkr.inttest.server.selenium import WebDriverTestCase
 from bkr.inttest.server.webdriver_utils import login, logout
 from bkr.server.model import Provision, ProvisionFamily, ProvisionFamilyUpdate, \
-    ExcludeOSMajor, SystemPermission
+    ExcludeOSMajor, ExcludeOSVersion, SystemPermission, Key, Key_Value_Int, \
+    Key_Value_String, GroupMembershipType
 import csv
 import requests
 
@@ -233,3 +234,63 @@ def test_export_system_pool(self):
                     if row['pool'] == pool.name]
         self.assertEquals([csv_row['fqdn'] for csv_row in csv_rows],
                           [s.fqdn for s in pool.systems])
+
+    def test_export_keyvalue(self):
+        with session.begin():
+            system = data_setup.create_system()
+            system.key_values_int.append(
+                    Key_Value_Int(Key.by_name(u'NR_DISKS'), 2))
+            system.key_values_string.append(
+                    Key_Value_String(Key.by_name(u'CPUMODEL'), u'Möbius'))
+        login(self.browser)
+        csv_request = self.get_csv('keyvalue')
+        csv_rows = [row for row in csv.DictReader(csv_request)
+                    if row['fqdn'] == system.fqdn]
+        self.assertEquals(csv_rows, [
+            {'csv_type': 'keyvalue', 'fqdn': system.fqdn, 'key': 'NR_DISKS',
+             'key_value': '2', 'deleted': 'False'},
+            {'csv_type': 'keyvalue', 'fqdn': system.fqdn, 'key': 'CPUMODEL',
+             'key_value': u'Möbius'.encode('utf8'), 'deleted': 'False'},
+        ])
+
+    def test_export_exclude_osversion(self):
+        with session.begin():
+            system = data_setup.create_system(arch=u'i386')
+            distro_tree = data_setup.create_distro_tree(arch=u'i386')
+            system.excluded_osversion.append(ExcludeOSVersion(
+                    osversion=distro_tree.distro.osversion, arch=distro_tree.arch))
+        login(self.browser)
+        csv_request = self.get_csv('exclude')
+        row, = [row for row in csv.DictReader(csv_request)
+                if row['fqdn'] == system.fqdn]
+        self.assertEquals(row['arch'], 'i386')
+        self.assertEquals(row['family'],
+                unicode(distro_tree.distro.osversion.osmajor))
+        self.assertEquals(row['update'], distro_tree.distro.osversion.osminor)
+        self.assertEquals(row['excluded'], 'True')
+
+    def test_export_user_group(self):
+        with session.begin():
+            user = data_setup.create_user()
+            other_user = data_setup.create_user()
+            group = data_setup.create_group()
+            group.add_member(user)
+            inverted_group = data_setup.create_group(
+                    membership_type=GroupMembershipType.inverted)
+            inverted_group.exclude_user(other_user)
+        login(self.browser)
+        rows = list(csv.DictReader(self.get_csv('user_group')))
+        self.assertIn(group.group_name,
+                [row['group'] for row in rows if row['user'] == user.user_name])
+        self.assertIn(inverted_group.group_name,
+                [row['group'] for row in rows if row['user'] == user.user_name])
+        self.assertNotIn(inverted_group.group_name,
+                [row['group'] for row in rows if row['user'] == other_user.user_name])
+
+    def test_invalid_csv_type(self):
+        login(self.browser)
+        url = get_server_base() + 'csv/action_export?csv_type=bogus'
+        cookies = dict((cookie['name'].encode('ascii', 'replace'), cookie['value'])
+                for cookie in self.browser.get_cookies())
+        response = requests.get(url, cookies=cookies)
+        self.assertEquals(response.status_code, 400)
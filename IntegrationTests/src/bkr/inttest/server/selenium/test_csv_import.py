@@ -16,7 +16,7 @@
 from bkr.inttest.server.selenium import WebDriverTestCase
 from bkr.inttest.server.webdriver_utils import login, is_text_present
 from bkr.server.model import Arch, System, OSMajor, SystemPermission, \
-    SystemStatus
+    SystemStatus, Group
 
 
 class CSVImportTest(WebDriverTestCase):
@@ -345,6 +345,55 @@ def test_rolls_back_on_error(self):
             self.assertEquals(len(self.system.status_durations), 1)
             self.assertEquals(self.system.status_durations[0].finish_time, None)
 
+    def test_bad_rows_are_skipped_across_chunks(self):
+        # The test server imports in chunks of two rows. The bad rows force
+        # their chunks to be retried row by row, other rows must still be
+        # imported and the log must be in line order.
+        with session.begin():
+            other = data_setup.create_system()
+        fqdn = data_setup.unique_name(u'system%s.idonot.exist')
+        login(self.browser)
+        self.import_csv((u'csv_type,fqdn,key,key_value,deleted\n'
+                         u'keyvalue,%s,COMMENT,first,False\n'
+                         u'keyvalue,%s,NOTAKEY,oops,False\n'
+                         u'keyvalue,%s,COMMENT,second,False\n'
+                         u'keyvalue,%s,COMMENT,another,False\n'
+                         u'keyvalue,--%s,COMMENT,bad,False\n'
+                         u'keyvalue,%s,COMMENT,first,True'
+                         % (fqdn, self.system.fqdn, fqdn, other.fqdn, fqdn, fqdn))
+                        .encode('utf8'))
+        log = [td.text for td in self.browser.find_elements_by_xpath(
+            '//table[@id="csv-import-log"]//td')]
+        self.assertEquals(log, [
+            '%s: Invalid Key NOTAKEY' % self.system.fqdn,
+            'Error importing line 6: Invalid FQDN for system: --%s' % fqdn])
+        with session.begin():
+            system = System.query.filter(System.fqdn == fqdn).one()
+            self.assertEquals(
+                [kv.key_value for kv in system.key_values_string
+                 if kv.key.key_name == u'COMMENT'], [u'second'])
+            session.refresh(other)
+            assert_has_key_with_value(other, 'COMMENT', u'another')
+
+    def test_new_group_referenced_by_several_rows(self):
+        with session.begin():
+            user1 = data_setup.create_user()
+            user2 = data_setup.create_user()
+        group_name = data_setup.unique_name(u'group%s')
+        login(self.browser)
+        self.import_csv((u'csv_type,user,group,deleted\n'
+                         u'user_group,%s,%s,False\n'
+                         u'user_group,%s,%s,False\n'
+                         u'user_group,%s,%s,False'
+                         % (user1.user_name, group_name, user2.user_name,
+                            group_name, user1.user_name, group_name))
+                        .encode('utf8'))
+        self.failUnless(is_text_present(self.browser, 'No Errors'))
+        with session.begin():
+            group = Group.by_name(group_name)
+            self.assertItemsEqual([u.user_name for u in group.users],
+                                  [user1.user_name, user2.user_name])
+
     # https://bugzilla.redhat.com/show_bug.cgi?id=1085238
     def test_error_on_empty_csv(self):
         login(self.browser)
@@ -190,6 +190,14 @@ def test_non_admin_user_cannot_remove_tag(self):
         except xmlrpclib.Fault, e:
             self.assert_('IdentityFailure' in e.faultString)
 
+    def test_tagging_changes_metadata_version(self):
+        before = self.server.distros.metadata_version()
+        self.assertEquals(self.server.distros.metadata_version(), before)
+        self.server.auth.login_password(
+                data_setup.ADMIN_USER, data_setup.ADMIN_PASSWORD)
+        self.server.distros.tag(self.distro.name, 'HAPPY')
+        self.assertNotEquals(self.server.distros.metadata_version(), before)
+
     def test_adding_tag_is_recorded_in_distro_activity(self):
         self.server.auth.login_password(
                 data_setup.ADMIN_USER, data_setup.ADMIN_PASSWORD)
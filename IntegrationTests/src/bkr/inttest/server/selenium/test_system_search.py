@@ -680,6 +680,13 @@ def test_search_size_greater_than(self):
         check_system_search_results(b, present=[self.big_disk, self.two_disks],
                 absent=[self.small_disk, self.no_disks])
 
+    def test_search_size_is_not(self):
+        b = self.browser
+        perform_search(b, [('Disk/Size', 'is not', '8000000000')],
+                search_url='mine')
+        check_system_search_results(b, present=[self.big_disk, self.no_disks],
+                absent=[self.small_disk, self.two_disks])
+
     def test_sector_size_is_not_for_multiple_disks(self):
         # The search bar special-cases "is not" searches on one-to-many 
         # relationships. "Disk/Size is not 1000" does not mean "systems with 
@@ -12,15 +12,17 @@
 import datetime
 import xmlrpclib
 import crypt
+import requests
 from turbogears.database import session
 
 from bkr.inttest.server.selenium import XmlRpcTestCase
 from bkr.inttest.assertions import assert_datetime_within, \
         assert_durations_not_overlapping
-from bkr.inttest import data_setup, with_transaction
+from bkr.inttest import data_setup, with_transaction, get_server_base
+from bkr.inttest.server.requests_utils import login as requests_login, patch_json
 from bkr.server.model import User, Cpu, Key, Key_Value_String, Key_Value_Int, \
         System, SystemActivity, Provision, Hypervisor, SSHPubKey, ConfigItem, \
-        RenderedKickstart, SystemStatus, ReleaseAction, Arch
+        RenderedKickstart, SystemStatus, ReleaseAction, Arch, ArchivedActivity
 
 class ReserveSystemXmlRpcTest(XmlRpcTestCase):
 
@@ -838,6 +840,113 @@ def test_long_bios_version(self):
             session.refresh(system)
             self.assertEquals(system.devices[0].fw_version, 'Hisilicon D06 UEFI RC0 - B051 (V0.51)')
 
+    def test_unchanged_sections_are_not_reapplied(self):
+        with session.begin():
+            system = data_setup.create_system()
+        device = {
+            'type': 'IDE', 'bus': u'pci', 'driver': u'PIIX_IDE',
+            'vendorID': '8086', 'deviceID': '7111',
+            'description': u'82371AB/EB/MB PIIX4 IDE',
+            'subsysVendorID': '0000', 'subsysDeviceID': '0000', 'fw_version': None
+        }
+        disk = {'model': 'foo', 'phys_sector_size': 512, 'sector_size': 512,
+                'size': str(8589934592)}
+        self.server.push(system.fqdn, {'memory': '1024', 'Devices': [device],
+                'Disk': {'Disks': [disk]}})
+        with session.begin():
+            session.refresh(system)
+            activity_count = len(system.activity)
+        self.server.push(system.fqdn, {'memory': '2048', 'Devices': [device],
+                'Disk': {'Disks': [disk]}})
+        with session.begin():
+            session.refresh(system)
+            self.assertEquals(system.memory, 2048)
+            self.assertEquals(len(system.devices), 1)
+            self.assertEquals(len(system.disks), 1)
+            new_fields = set(a.field_name for a in
+                    system.activity[:len(system.activity) - activity_count])
+            self.assertEquals(new_fields, set([u'checksum', u'memory']))
+
+    def test_repushing_inventory_restores_edited_values(self):
+        with session.begin():
+            system = data_setup.create_system()
+        inventory = {'memory': '1024', 'Numa': {'nodes': 2}}
+        self.server.push(system.fqdn, inventory)
+        s = requests.Session()
+        requests_login(s)
+        response = patch_json(get_server_base() + 'systems/%s/' % system.fqdn,
+                session=s, data={'memory': 2048, 'numa_nodes': 4})
+        response.raise_for_status()
+        with session.begin():
+            session.refresh(system)
+            self.assertEquals(system.memory, 2048)
+            self.assertEquals(system.numa.nodes, 4)
+        self.server.push(system.fqdn, inventory)
+        with session.begin():
+            session.refresh(system)
+            self.assertEquals(system.memory, 1024)
+            self.assertEquals(system.numa.nodes, 2)
+
+    def test_devices_are_diffed(self):
+        with session.begin():
+            system = data_setup.create_system()
+        ide = {
+            'type': 'IDE', 'bus': u'pci', 'driver': u'PIIX_IDE',
+            'vendorID': '8086', 'deviceID': '7111',
+            'description': u'82371AB/EB/MB PIIX4 IDE',
+            'subsysVendorID': '0000', 'subsysDeviceID': '0000', 'fw_version': None
+        }
+        usb = dict(ide, type='USB', driver=u'uhci_hcd', deviceID='7112',
+                description=u'82371AB/EB/MB PIIX4 USB')
+        self.server.push(system.fqdn, {'Devices': [ide]})
+        with session.begin():
+            session.refresh(system)
+            ide_id = system.devices[0].id
+        self.server.push(system.fqdn, {'Devices': [usb, ide, ide]})
+        with session.begin():
+            session.refresh(system)
+            self.assertEquals(len(system.devices), 2)
+            self.assertIn(ide_id, [d.id for d in system.devices])
+            usb_id = [d.id for d in system.devices if d.id != ide_id][0]
+            self.assertEquals(system.activity[0].action, u'Added')
+            self.assertEquals(system.activity[0].field_name, u'Device')
+            self.assertEquals(system.activity[0].new_value, unicode(usb_id))
+            self.assertEquals(system.activity[1].field_name, u'checksum')
+        self.server.push(system.fqdn, {'Devices': [usb]})
+        with session.begin():
+            session.refresh(system)
+            self.assertEquals([d.id for d in system.devices], [usb_id])
+            self.assertEquals(system.activity[0].action, u'Removed')
+            self.assertEquals(system.activity[0].field_name, u'Device')
+            self.assertEquals(system.activity[0].old_value, unicode(ide_id))
+
+    def test_cpu_flags_are_updated(self):
+        with session.begin():
+            system = data_setup.create_system()
+        cpuinfo = {
+            'modelName': 'Intel(R) Core(TM) i7 CPU       M 620  @ 2.67GHz',
+            'vendor': 'GenuineIntel', 'family': 6, 'stepping': 5, 'model': 37,
+            'processors': 4, 'cores': 4, 'sockets': 1, 'speed': 2659.708,
+            'CpuFlags': ['fpu', 'mmx', 'syscall', 'ssse3'],
+        }
+        self.server.push(system.fqdn, {'Cpu': cpuinfo})
+        with session.begin():
+            session.refresh(system)
+            cpu_id = system.cpu.id
+        cpuinfo['CpuFlags'] = ['fpu', 'mmx', 'sse4_2']
+        cpuinfo['processors'] = 8
+        self.server.push(system.fqdn, {'Cpu': cpuinfo})
+        with session.begin():
+            session.refresh(system)
+            self.assertEquals(system.cpu.id, cpu_id)
+            self.assertEquals(system.cpu.processors, 8)
+            self.assertEquals(system.cpu.hyper, True)
+            self.assertEquals(sorted(f.flag for f in system.cpu.flags),
+                    ['fpu', 'mmx', 'sse4_2'])
+            self.assertEquals(system.activity[0].field_name, u'CPU')
+            self.assertEquals(Cpu.query.filter(Cpu.system == system)
+                    .filter(Cpu.flags.any(flag=u'sse4_2')).count(), 1)
+
     # https://bugzilla.redhat.com/show_bug.cgi?id=1253111
     def test_unrecognised_arches_are_not_automatically_created(self):
         with session.begin():
@@ -889,3 +998,23 @@ def test_fetches_history_since_timestamp(self):
                 xmlrpclib.DateTime('20060101T00:00:00'))
         self.assertEquals(len(result), 1)
         self.assertEquals(result[0]['old_value'], u'oldname.example.com')
+
+    def test_fetches_archived_history(self):
+        with session.begin():
+            owner = data_setup.create_user()
+            system = data_setup.create_system(owner=owner)
+            system.activity.append(SystemActivity(user=owner, service=u'WEBUI',
+                    action=u'Changed', field_name=u'fqdn',
+                    old_value=u'oldname.example.com', new_value=system.fqdn))
+            system.activity[-1].created = datetime.datetime(1990, 8, 16, 12, 23, 34)
+        with session.begin():
+            ArchivedActivity.archive(datetime.datetime(1991, 1, 1))
+        since = xmlrpclib.DateTime('19900101T00:00:00')
+        self.assertEquals(self.server.systems.history(system.fqdn, since), [])
+        result = self.server.systems.history(system.fqdn, since, True)
+        self.assertEquals(len(result), 1)
+        self.assertEquals(result[0]['user'], owner.user_name)
+        self.assertEquals(result[0]['old_value'], u'oldname.example.com')
+        # archived entries before the given timestamp are not returned
+        self.assertEquals(self.server.systems.history(system.fqdn,
+                xmlrpclib.DateTime('19910101T00:00:00'), True), [])
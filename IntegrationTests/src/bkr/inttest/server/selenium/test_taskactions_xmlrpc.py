@@ -56,3 +56,35 @@ def test_worker_info_for_recipe_without_resource(self):
                 recipe.t_id)['worker'], None)
         self.assertEquals(self.server.taskactions.task_info(
                 recipe.tasks[0].t_id)['worker'], None)
+
+    def test_task_info_many(self):
+        with session.begin():
+            job = data_setup.create_job(owner=self.user)
+            data_setup.mark_job_running(job)
+            recipe = job.recipesets[0].recipes[0]
+            system = recipe.resource.system
+        taskids = [job.t_id, job.recipesets[0].t_id, recipe.t_id,
+                   recipe.tasks[0].t_id, 'R:0']
+        result = self.server.taskactions.task_info_many(taskids)
+        self.assertEquals(sorted(result['tasks'].keys()), sorted(taskids))
+        for taskid in taskids[:4]:
+            self.assertEquals(result['tasks'][taskid],
+                    self.server.taskactions.task_info(taskid))
+        self.assertEquals(result['tasks'][recipe.t_id]['worker'],
+                {'name': system.fqdn})
+        self.assertEquals(result['tasks']['R:0'], None)
+
+    def test_task_info_many_returns_only_changed_since_token(self):
+        with session.begin():
+            job = data_setup.create_job(owner=self.user)
+            data_setup.mark_job_running(job)
+            recipe = job.recipesets[0].recipes[0]
+        taskids = [job.t_id, recipe.t_id]
+        token = self.server.taskactions.task_info_many(taskids)['token']
+        result = self.server.taskactions.task_info_many(taskids, token)
+        self.assertEquals(result['tasks'], {})
+        with session.begin():
+            data_setup.mark_job_complete(job)
+        result = self.server.taskactions.task_info_many(taskids, result['token'])
+        self.assertEquals(sorted(result['tasks'].keys()), sorted(taskids))
+        self.assertEquals(result['tasks'][job.t_id]['state'], 'Completed')
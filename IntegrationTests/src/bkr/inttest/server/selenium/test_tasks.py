@@ -387,6 +387,15 @@ def test_filter_by_distro(self):
         self.assertIn(included.name, task_names)
         self.assertNotIn(excluded.name, task_names)
 
+    def test_metadata_version_changes_when_task_is_invalidated(self):
+        with session.begin():
+            task = data_setup.create_task()
+        before = self.server.tasks.metadata_version()
+        self.assertEquals(self.server.tasks.metadata_version(), before)
+        with session.begin():
+            Task.query.get(task.id).valid = False
+        self.assertNotEquals(self.server.tasks.metadata_version(), before)
+
     def test_exclusive_arches(self):
         with session.begin():
             task = data_setup.create_task(runfor=[u'httpd'],
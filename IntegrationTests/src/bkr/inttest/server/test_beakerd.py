@@ -18,7 +18,7 @@
         Provision, TaskPriority, RecipeSet, RecipeTaskResult, Task, SystemPermission,\
         MachineRecipe, GuestRecipe, LabControllerDistroTree, DistroTree, \
         TaskResult, Command, CommandStatus, GroupMembershipType, \
-        RecipeVirtStatus, Arch
+        RecipeVirtStatus, Arch, GaugeDelta
 from bkr.server.installopts import InstallOptions
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import not_
@@ -27,7 +27,8 @@
 import lxml.etree
 from bkr.inttest import data_setup, fix_beakerd_repodata_perms, DatabaseTestCase
 from bkr.inttest.assertions import assert_datetime_within, \
-        assert_durations_not_overlapping, wait_for_condition
+        assert_durations_not_overlapping, wait_for_condition, \
+        assert_max_sql_statements, GROUP_MEMBERSHIP_QUERY
 from bkr.server.tools import beakerd
 from bkr.server.jobs import Jobs
 from bkr.server import dynamic_virt
@@ -584,6 +585,24 @@ def test_or_lab_controller(self):
             self.assert_(system2 in candidate_systems)
             self.assert_(system3 not in candidate_systems)
 
+    def test_process_new_recipe_checks_group_membership_once(self):
+        with session.begin():
+            user = data_setup.create_user()
+            group = data_setup.create_group()
+            group.add_member(user)
+            for _ in range(5):
+                system = data_setup.create_system(shared=False,
+                        lab_controller=self.lab_controller)
+                system.custom_access_policy.add_rule(SystemPermission.view, group=group)
+                system.custom_access_policy.add_rule(SystemPermission.reserve, group=group)
+            distro_tree = data_setup.create_distro_tree(
+                    lab_controllers=[self.lab_controller])
+            job = data_setup.create_job(owner=user, distro_tree=distro_tree)
+            recipe_id = job.recipesets[0].recipes[0].id
+        with session.begin():
+            with assert_max_sql_statements(GROUP_MEMBERSHIP_QUERY, 1):
+                beakerd.process_new_recipe(recipe_id)
+
     def check_user_cannot_run_job_on_system(self, user, system):
         """
         Asserts that the given user is not allowed to run a job against the
@@ -2253,6 +2272,23 @@ def test_recipe_count_metrics(self, mock_metrics):
         for name, value in expected.iteritems():
             mock_metrics.measure.assert_any_call(name, value)
 
+    def test_gauge_deltas_follow_command_status(self, mock_metrics):
+        with patch('bkr.server.model.gauges.config') as mock_config:
+            mock_config.get.return_value = ('graphite.example.invalid', 2023)
+            lc = data_setup.create_labcontroller(fqdn=u'testgaugedeltas.invalid')
+            system = data_setup.create_system(lab_controller=lc, arch=u'x86_64')
+            command = system.enqueue_command(u'on', service=u'testdata')
+            session.flush()
+            command.change_status(CommandStatus.running)
+            session.flush()
+        deltas = GaugeDelta.drain(session.connection(GaugeDelta))
+        self.assertEquals(deltas.get(
+                'system_commands_queued.by_lab.testgaugedeltas_invalid', 0), 0)
+        self.assertEquals(deltas[
+                'system_commands_running.by_lab.testgaugedeltas_invalid'], 1)
+        self.assertEquals(deltas[
+                'systems_idle_automated.by_lab.testgaugedeltas_invalid'], 1)
+
     def test_dirty_job_metrics(self, mock_metrics):
         # Ensure that any dirty jobs left behind by
         # an unrelated test are marked clean to avoid
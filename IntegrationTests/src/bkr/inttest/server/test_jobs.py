@@ -12,7 +12,7 @@
 from turbogears.database import session
 from bkr.server.bexceptions import BX
 from bkr.inttest import data_setup, with_transaction, DatabaseTestCase, get_server_base
-from bkr.server.model import TaskPackage
+from bkr.server.model import TaskPackage, DistroLibraryVersion
 
 
 class TestJobsController(DatabaseTestCase):
@@ -227,6 +227,32 @@ def test_creates_taskpackages_successfully(self):
         job = self.controller.process_xmljob(xmljob, self.user)
         self.assertListEqual(['libbeer'], [x.package for x in job.recipesets[0].recipes[0].custom_packages])
 
+    def test_submitting_job_leaves_distro_library_version_unchanged(self):
+        # Recipes are appended to DistroTree.recipes, which must not count as
+        # a change to the distro library, otherwise every job submission would
+        # invalidate the distro filter cache in every process.
+        def distro_library_version():
+            return session.query(DistroLibraryVersion.version)\
+                    .filter(DistroLibraryVersion.id == 1).scalar()
+        version = distro_library_version()
+        xmljob = lxml.etree.fromstring("""
+            <job>
+                <recipeSet>
+                    <recipe>
+                        <distroRequires>
+                            <distro_name op="=" value="BlueShoeLinux5-5"/>
+                        </distroRequires>
+                        <hostRequires/>
+                        <task name="/distribution/check-install" role="STANDALONE"/>
+                    </recipe>
+                </recipeSet>
+            </job>
+            """)
+        job = self.controller.process_xmljob(xmljob, self.user)
+        session.flush()
+        self.assertIsNotNone(job.recipesets[0].recipes[0].distro_tree)
+        self.assertEquals(distro_library_version(), version)
+
     def test_upload_xml_catches_invalid_xml(self):
         """We want that invalid Job XML is caught in the validation step."""
         xmljob = lxml.etree.fromstring('''
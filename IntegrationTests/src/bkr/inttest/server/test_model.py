@@ -21,10 +21,11 @@
 from turbogears.database import session
 from bkr.server.installopts import InstallOptions
 from bkr.server import model, identity
+from bkr.server.model import distrolibrary
 from bkr.server.app import app
 from bkr.server.model import System, SystemStatus, SystemActivity, TaskStatus, \
         SystemType, Job, JobCc, Key, Key_Value_Int, Key_Value_String, \
-        Cpu, Numa, Provision, Arch, DistroTree, \
+        Cpu, Numa, Provision, Arch, DistroTree, DistroFilterCache, \
         LabControllerDistroTree, TaskType, TaskPackage, Device, DeviceClass, \
         GuestRecipe, GuestResource, Recipe, LogRecipe, RecipeResource, \
         VirtResource, OSMajor, OSMajorInstallOptions, Watchdog, RecipeSet, \
@@ -33,14 +34,16 @@
         RecipeTask, RecipeTaskResult, DeclarativeMappedObject, OSVersion, \
         RecipeReservationRequest, ReleaseAction, SystemPool, CommandStatus, \
         GroupMembershipType, RecipeSetComment, Power, LogRecipeTask, \
-        LogRecipeTaskResult
+        LogRecipeTaskResult, UserGroup, SystemAccess, SystemFacet, \
+        SystemFacetType, Activity, ArchivedActivity, ActivityArchiveSummary
 
 from bkr.server.bexceptions import BeakerException
 from sqlalchemy.sql import not_
 from sqlalchemy.exc import OperationalError, IntegrityError
 import netaddr
 from bkr.inttest import data_setup, DatabaseTestCase, get_server_base
-from bkr.inttest.assertions import assert_datetime_within
+from bkr.inttest.assertions import assert_datetime_within, \
+        assert_max_sql_statements, GROUP_MEMBERSHIP_QUERY
 import turbogears
 import os
 import dnf
@@ -100,6 +103,133 @@ def test_log_formatting(self):
             self.assert_(('%s=%r' % (name, value)) in text, text)
 
 
+class ActivityBufferTest(DatabaseTestCase):
+
+    def setUp(self):
+        session.begin()
+        self.user = data_setup.create_user()
+        self.system = data_setup.create_system()
+        session.flush()
+
+    def tearDown(self):
+        session.rollback()
+
+    def activity_fields(self, system):
+        return [a.field_name for a in SystemActivity.query
+                .filter(SystemActivity.object_id == system.id)
+                .filter(SystemActivity.service == u'testdata')
+                .order_by(SystemActivity.id)]
+
+    def test_buffered_records_are_written_on_flush(self):
+        self.system.record_buffered_activity(user=self.user, service=u'testdata',
+                field=u'Memory', old=u'1', new=u'2')
+        self.system.record_buffered_activity(user=self.user, service=u'testdata',
+                field=u'Vendor', new=u'x' * 100)
+        session.flush()
+        activity = SystemActivity.query.filter(
+                SystemActivity.object_id == self.system.id)\
+                .filter(SystemActivity.service == u'testdata')\
+                .order_by(SystemActivity.id).all()
+        self.assertEquals([a.field_name for a in activity], [u'Memory', u'Vendor'])
+        self.assertEquals(activity[0].user, self.user)
+        self.assertEquals(activity[0].action, u'Changed')
+        self.assertEquals(activity[0].old_value, u'1')
+        self.assertEquals(activity[0].new_value, u'2')
+        # values are truncated like in record_activity
+        self.assertEquals(activity[1].new_value, u'x' * 60)
+
+    def test_pending_object(self):
+        system = System(fqdn=data_setup.unique_name(u'system%s.example.invalid'),
+                owner=self.user)
+        session.add(system)
+        system.record_buffered_activity(user=self.user, service=u'testdata',
+                field=u'Memory', new=u'2')
+        session.flush()
+        self.assertEquals(self.activity_fields(system), [u'Memory'])
+
+    def test_savepoint_rollback_discards_records(self):
+        self.system.record_buffered_activity(user=self.user, service=u'testdata',
+                field=u'Memory', new=u'2')
+        try:
+            with session.begin_nested():
+                self.system.record_buffered_activity(user=self.user,
+                        service=u'testdata', field=u'Vendor', new=u'x')
+                raise ValueError('oops')
+        except ValueError:
+            pass
+        session.flush()
+        self.assertEquals(self.activity_fields(self.system), [u'Memory'])
+
+    def test_bulk_activity(self):
+        other = data_setup.create_system()
+        session.flush()
+        System.record_bulk_activity(
+                System.query.filter(System.id.in_([self.system.id, other.id])),
+                user=self.user, service=u'testdata', field=u'Pool',
+                action=u'Removed', old=u'mypool')
+        session.flush()
+        self.assertEquals(self.activity_fields(self.system), [u'Pool'])
+        self.assertEquals(self.activity_fields(other), [u'Pool'])
+
+
+class ActivityArchiveTest(DatabaseTestCase):
+
+    def setUp(self):
+        session.begin()
+        self.user = data_setup.create_user()
+        self.system = data_setup.create_system()
+
+    def tearDown(self):
+        session.rollback()
+
+    def add_activity(self, created, field=u'Memory'):
+        self.system.record_activity(user=self.user, service=u'testdata',
+                field=field, old=u'1', new=u'2')
+        self.system.activity[-1].created = created
+        session.flush()
+        return self.system.activity[-1].id
+
+    def test_old_records_are_moved_to_archive(self):
+        old_id = self.add_activity(datetime.datetime(1990, 1, 2))
+        recent_id = self.add_activity(datetime.datetime.utcnow())
+        session.expunge_all()
+        ArchivedActivity.archive(datetime.datetime(1991, 1, 1))
+        self.assertIsNone(Activity.query.get(old_id))
+        self.assertEquals(SystemActivity.query
+                .filter(SystemActivity.id == old_id).count(), 0)
+        self.assertIsNotNone(Activity.query.get(recent_id))
+        archived = ArchivedActivity.query.get(old_id)
+        self.assertEquals(archived.type, u'system_activity')
+        self.assertEquals(archived.object_id, self.system.id)
+        self.assertEquals(archived.user_id, self.user.user_id)
+        self.assertEquals(archived.field_name, u'Memory')
+        self.assertEquals(archived.old_value, u'1')
+        self.assertEquals(archived.new_value, u'2')
+        self.assertEquals(archived.created, datetime.datetime(1990, 1, 2))
+        self.assertEquals(ArchivedActivity.for_object(SystemActivity,
+                self.system.id).all(), [archived])
+
+    def test_summary_counts_records_per_month(self):
+        self.add_activity(datetime.datetime(1990, 1, 2))
+        self.add_activity(datetime.datetime(1990, 1, 20))
+        ArchivedActivity.archive(datetime.datetime(1991, 1, 1), limit=1)
+        self.add_activity(datetime.datetime(1990, 2, 3))
+        ArchivedActivity.archive(datetime.datetime(1991, 1, 1))
+        summary = ActivityArchiveSummary.query.filter(
+                ActivityArchiveSummary.object_id == self.system.id)\
+                .order_by(ActivityArchiveSummary.month).all()
+        self.assertEquals([(s.month, s.count) for s in summary],
+                [(datetime.date(1990, 1, 1), 2), (datetime.date(1990, 2, 1), 1)])
+        self.assertEquals(summary[0].first_created, datetime.datetime(1990, 1, 2))
+        self.assertEquals(summary[0].last_created, datetime.datetime(1990, 1, 20))
+        self.assertTrue(ActivityArchiveSummary.has_archived(SystemActivity,
+                self.system.id))
+        self.assertTrue(ActivityArchiveSummary.has_archived(SystemActivity,
+                self.system.id, since=datetime.datetime(1990, 2, 1)))
+        self.assertFalse(ActivityArchiveSummary.has_archived(SystemActivity,
+                self.system.id, since=datetime.datetime(1990, 3, 1)))
+
+
 class TestSystem(DatabaseTestCase):
 
     def setUp(self):
@@ -530,6 +660,27 @@ def setUp(self):
     def tearDown(self):
         session.rollback()
 
+    def test_system_list_checks_group_membership_once(self):
+        # Listing systems evaluates visibility and permissions for every row,
+        # which should not repeat the user's group membership query.
+        group = data_setup.create_group()
+        group.add_member(self.unprivileged)
+        systems = []
+        for _ in range(10):
+            system = data_setup.create_system(shared=False)
+            system.custom_access_policy.add_rule(SystemPermission.view, group=group)
+            system.custom_access_policy.add_rule(SystemPermission.reserve, group=group)
+            systems.append(system)
+        session.flush()
+        with assert_max_sql_statements(GROUP_MEMBERSHIP_QUERY, 1):
+            visible = System.all(self.unprivileged)\
+                    .filter(System.id.in_([s.id for s in systems])).all()
+            self.assertItemsEqual(visible, systems)
+            for system in visible:
+                self.assertTrue(system.visible_to_user(self.unprivileged))
+                self.assertTrue(system.can_reserve(self.unprivileged))
+                self.assertFalse(system.can_edit(self.unprivileged))
+
     # This ensures we "fail secure" if any code erroneously checks
     # permissions without ensure the user is authenticated first
     # For example, https://bugzilla.redhat.com/show_bug.cgi?id=1039514
@@ -939,6 +1090,182 @@ def test_add_rule_for_everybody(self):
                 .filter(SystemAccessPolicy.grants(user, perm)).count())
 
 
+class SystemAccessTest(DatabaseTestCase):
+
+    def setUp(self):
+        session.begin()
+        self.system = data_setup.create_system(shared=False)
+        self.policy = self.system.custom_access_policy
+        self.user = data_setup.create_user()
+
+    def tearDown(self):
+        session.rollback()
+
+    def can_reserve(self, user):
+        return System.query.filter(System.id == self.system.id)\
+                .filter(System.can_reserve(user)).count() == 1
+
+    def assert_consistent(self):
+        session.flush()
+        missing, unexpected = SystemAccess.check_consistency()
+        self.assertEquals([row for row in missing if row[0] == self.system.id], [])
+        self.assertEquals([row for row in unexpected if row[0] == self.system.id], [])
+
+    def test_user_rule(self):
+        self.assertFalse(self.can_reserve(self.user))
+        rule = self.policy.add_rule(SystemPermission.reserve, user=self.user)
+        self.assertTrue(self.can_reserve(self.user))
+        self.assert_consistent()
+        self.policy.rules.remove(rule)
+        self.assertFalse(self.can_reserve(self.user))
+        self.assert_consistent()
+
+    def test_group_membership_changes(self):
+        group = data_setup.create_group()
+        self.policy.add_rule(SystemPermission.reserve, group=group)
+        self.assertFalse(self.can_reserve(self.user))
+        group.add_member(self.user)
+        self.assertTrue(self.can_reserve(self.user))
+        self.assert_consistent()
+        group.remove_member(self.user)
+        self.assertFalse(self.can_reserve(self.user))
+        self.assert_consistent()
+
+    def test_inverted_group(self):
+        group = data_setup.create_group(membership_type=GroupMembershipType.inverted)
+        self.policy.add_rule(SystemPermission.reserve, group=group)
+        self.assertTrue(self.can_reserve(self.user))
+        group.exclude_user(self.user)
+        self.assertFalse(self.can_reserve(self.user))
+        self.assert_consistent()
+
+    def test_group_membership_type_changes(self):
+        group = data_setup.create_group()
+        self.policy.add_rule(SystemPermission.reserve, group=group)
+        self.assertFalse(self.can_reserve(self.user))
+        group.membership_type = GroupMembershipType.inverted
+        self.assertTrue(self.can_reserve(self.user))
+        self.assert_consistent()
+
+    def test_everybody_rule(self):
+        self.policy.add_rule(SystemPermission.reserve, everybody=True)
+        self.assertTrue(self.can_reserve(self.user))
+        self.assertTrue(self.can_reserve(data_setup.create_user()))
+        self.assert_consistent()
+
+    def test_active_policy_changes(self):
+        pool = data_setup.create_system_pool(systems=[self.system])
+        pool.access_policy.add_rule(SystemPermission.reserve, user=self.user)
+        self.assertFalse(self.can_reserve(self.user))
+        self.system.active_access_policy = pool.access_policy
+        self.assertTrue(self.can_reserve(self.user))
+        self.assert_consistent()
+        self.system.active_access_policy = self.policy
+        self.assertFalse(self.can_reserve(self.user))
+        self.assert_consistent()
+
+    def test_ownership_and_loans(self):
+        self.assertTrue(self.can_reserve(self.system.owner))
+        self.system.loaned = self.user
+        self.assertTrue(self.can_reserve(self.user))
+        self.system.loaned = None
+        self.assertFalse(self.can_reserve(self.user))
+
+    def test_rebuild(self):
+        self.policy.add_rule(SystemPermission.reserve, user=self.user)
+        session.flush()
+        session.execute(SystemAccess.__table__.delete()
+                .where(SystemAccess.system_id == self.system.id))
+        self.assertFalse(self.can_reserve(self.user))
+        missing, unexpected = SystemAccess.check_consistency()
+        self.assertIn((self.system.id, self.user.user_id, None,
+                SystemPermission.reserve), missing)
+        SystemAccess.rebuild()
+        self.assertTrue(self.can_reserve(self.user))
+        self.assert_consistent()
+
+
+class SystemFacetTest(DatabaseTestCase):
+
+    def setUp(self):
+        session.begin()
+        self.system = data_setup.create_system()
+
+    def tearDown(self):
+        session.rollback()
+
+    def matching(self, facet, clause=None, key=None):
+        return System.query.filter(System.id == self.system.id)\
+                .filter(SystemFacet.matches(facet, clause, key=key)).count() == 1
+
+    def assert_consistent(self):
+        session.flush()
+        missing, unexpected = SystemFacet.check_consistency()
+        self.assertEquals([row for row in missing if row[0] == self.system.id], [])
+        self.assertEquals([row for row in unexpected if row[0] == self.system.id], [])
+
+    def test_cpu_flags(self):
+        self.system.cpu = Cpu(processors=1, cores=1, flags=[u'lm', u'vmx'])
+        session.flush()
+        self.assertTrue(self.matching(SystemFacetType.cpu_flag, SystemFacet.value == u'vmx'))
+        self.assert_consistent()
+        self.system.cpu.flags[:] = [flag for flag in self.system.cpu.flags
+                if flag.flag != u'vmx']
+        session.flush()
+        self.assertFalse(self.matching(SystemFacetType.cpu_flag, SystemFacet.value == u'vmx'))
+        self.assertTrue(self.matching(SystemFacetType.cpu_flag, SystemFacet.value == u'lm'))
+        self.assert_consistent()
+        self.system.cpu = Cpu(processors=1, cores=1, flags=[u'svm'])
+        session.flush()
+        self.assertFalse(self.matching(SystemFacetType.cpu_flag, SystemFacet.value == u'lm'))
+        self.assertTrue(self.matching(SystemFacetType.cpu_flag, SystemFacet.value == u'svm'))
+        self.assert_consistent()
+
+    def test_disks(self):
+        self.system.disks[:] = [
+                Disk(size=2000000000000, sector_size=512, phys_sector_size=512)]
+        session.flush()
+        self.assertTrue(self.matching(SystemFacetType.disk_size,
+                SystemFacet.int_value > 1000000000000))
+        self.assert_consistent()
+        self.system.disks[:] = [
+                Disk(size=8000000000, sector_size=512, phys_sector_size=512)]
+        session.flush()
+        self.assertFalse(self.matching(SystemFacetType.disk_size,
+                SystemFacet.int_value > 1000000000000))
+        self.assert_consistent()
+
+    def test_key_values(self):
+        string_key = Key(u'FACETSTRING', numeric=False)
+        int_key = Key(u'FACETINT', numeric=True)
+        self.system.key_values_string.append(Key_Value_String(string_key, u'e1000'))
+        self.system.key_values_int.append(Key_Value_Int(int_key, 4))
+        session.flush()
+        self.assertTrue(self.matching(SystemFacetType.key_value,
+                SystemFacet.value == u'e1000', key=string_key))
+        self.assertFalse(self.matching(SystemFacetType.key_value,
+                SystemFacet.value == u'e1000', key=int_key))
+        self.assertTrue(self.matching(SystemFacetType.key_value,
+                SystemFacet.int_value > 2, key=int_key))
+        self.assert_consistent()
+        self.system.key_values_string[:] = []
+        session.flush()
+        self.assertFalse(self.matching(SystemFacetType.key_value, key=string_key))
+        self.assert_consistent()
+
+    def test_rebuild(self):
+        self.system.cpu = Cpu(processors=1, cores=1, flags=[u'vmx'])
+        session.flush()
+        session.execute(SystemFacet.__table__.delete()
+                .where(SystemFacet.system_id == self.system.id))
+        missing, unexpected = SystemFacet.check_consistency()
+        self.assertIn((self.system.id, SystemFacetType.cpu_flag, None, u'vmx', None),
+                missing)
+        SystemFacet.rebuild()
+        self.assertTrue(self.matching(SystemFacetType.cpu_flag, SystemFacet.value == u'vmx'))
+        self.assert_consistent()
+
+
 class SystemReleaseAction(DatabaseTestCase):
 
     def setUp(self):
@@ -1288,6 +1615,105 @@ def test_distrolabcontroller_notequal(self):
         self.assert_(excluded not in distro_trees)
         self.assert_(included in distro_trees)
 
+class DistroTreeLatestByFilterTest(DatabaseTestCase):
+
+    def setUp(self):
+        session.begin()
+        self.osmajor = data_setup.unique_name(u'PurpleBeardLinux%s')
+
+    def tearDown(self):
+        session.commit()
+
+    def create_distro_tree(self, arch, date_created):
+        return data_setup.create_distro_tree(osmajor=self.osmajor,
+                arch=arch, date_created=date_created)
+
+    def family_filter(self):
+        return """
+            <distroRequires>
+                <!-- latest nightly -->
+                <distro_family value="%s"  op="=="/>
+            </distroRequires>
+            """ % self.osmajor
+
+    def test_latest_tree_per_arch(self):
+        self.create_distro_tree(u'x86_64', datetime.datetime(2020, 1, 1))
+        latest_x86_64 = self.create_distro_tree(u'x86_64', datetime.datetime(2020, 2, 1))
+        latest_i386 = self.create_distro_tree(u'i386', datetime.datetime(2020, 3, 1))
+        session.flush()
+        trees = DistroTree.latest_by_filter_per_arch(self.family_filter())
+        self.assertEquals(trees, {latest_x86_64.arch: latest_x86_64,
+                latest_i386.arch: latest_i386})
+        self.assertEquals(DistroTree.latest_by_filter(self.family_filter()),
+                latest_i386)
+
+    def test_no_match(self):
+        self.assertEquals(DistroTree.latest_by_filter(self.family_filter()), None)
+
+    def test_equivalent_filters_share_cache_entry(self):
+        self.create_distro_tree(u'x86_64', datetime.datetime(2020, 1, 1))
+        session.flush()
+        cache = DistroFilterCache(ttl=300)
+        with patch('bkr.server.model.distrolibrary._resolve_distro_filter',
+                wraps=distrolibrary._resolve_distro_filter) as resolve:
+            first = cache.lookup(self.family_filter())
+            second = cache.lookup('<distroRequires><distro_family op="==" '
+                    'value="%s"/></distroRequires>' % self.osmajor)
+        self.assertEquals(first, second)
+        self.assertEquals(resolve.call_count, 1)
+
+    def test_cache_is_invalidated_when_tags_change(self):
+        distro_tree = self.create_distro_tree(u'x86_64', datetime.datetime(2020, 1, 1))
+        session.flush()
+        tag_filter = """
+            <distroRequires>
+                <distro_family op="==" value="%s" />
+                <distro_tag op="==" value="RELEASED" />
+            </distroRequires>
+            """ % self.osmajor
+        self.assertEquals(DistroTree.latest_by_filter(tag_filter), None)
+        distro_tree.distro.tags.append(u'RELEASED')
+        session.flush()
+        self.assertEquals(DistroTree.latest_by_filter(tag_filter), distro_tree)
+
+    def test_cache_is_invalidated_when_tree_is_added(self):
+        self.create_distro_tree(u'x86_64', datetime.datetime(2020, 1, 1))
+        session.flush()
+        cache = DistroFilterCache(ttl=300)
+        cache.lookup(self.family_filter())
+        newer = self.create_distro_tree(u'x86_64', datetime.datetime(2020, 2, 1))
+        session.flush()
+        self.assertEquals(cache.lookup(self.family_filter()),
+                {newer.arch_id: newer.id})
+
+    def test_other_caches_notice_tag_removal(self):
+        # A separate cache stands in for one in another process, which does
+        # not see this session's flushes and relies on the version stamp.
+        distro_tree = self.create_distro_tree(u'x86_64', datetime.datetime(2020, 1, 1))
+        distro_tree.distro.tags.append(u'RELEASED')
+        session.flush()
+        tag_filter = """
+            <distroRequires>
+                <distro_family op="==" value="%s" />
+                <distro_tag op="==" value="RELEASED" />
+            </distroRequires>
+            """ % self.osmajor
+        cache = DistroFilterCache(ttl=300)
+        self.assertEquals(cache.lookup(tag_filter),
+                {distro_tree.arch_id: distro_tree.id})
+        distro_tree.distro.tags.remove(u'RELEASED')
+        session.flush()
+        self.assertEquals(cache.lookup(tag_filter), {})
+
+    def test_cache_is_invalidated_when_tree_leaves_lab(self):
+        older = self.create_distro_tree(u'x86_64', datetime.datetime(2020, 1, 1))
+        newer = self.create_distro_tree(u'x86_64', datetime.datetime(2020, 2, 1))
+        session.flush()
+        self.assertEquals(DistroTree.latest_by_filter(self.family_filter()), newer)
+        del newer.lab_controller_assocs[:]
+        session.flush()
+        self.assertEquals(DistroTree.latest_by_filter(self.family_filter()), older)
+
 class WatchdogTest(DatabaseTestCase):
 
     def setUp(self):
@@ -1585,6 +2011,60 @@ def test_check_user_groups(self):
         self.assertIn(inverted_group, user1.groups)
         self.assertIn(group, user2.groups)
 
+    def test_group_membership_is_cached_within_transaction(self):
+        group = data_setup.create_group(permissions=[u'secret_visible'])
+        group.add_member(self.user)
+        session.flush()
+        with assert_max_sql_statements(GROUP_MEMBERSHIP_QUERY, 1):
+            for _ in range(10):
+                self.assertIn(group, self.user.groups)
+                self.assertFalse(self.user.is_admin())
+                self.assertTrue(self.user.in_group([group.group_name]))
+                self.assertTrue(self.user.has_permission(u'secret_visible'))
+                self.assertFalse(self.user.has_permission(u'tag_distro'))
+        with assert_max_sql_statements(r'FROM permission WHERE', 0):
+            self.user.has_permission(u'secret_visible')
+
+    def test_group_membership_cache_is_invalidated(self):
+        group = data_setup.create_group()
+        inverted_group = data_setup.create_group(
+                membership_type=GroupMembershipType.inverted)
+        session.flush()
+        self.assertNotIn(group, self.user.groups)
+        self.assertIn(inverted_group, self.user.groups)
+        group.add_member(self.user)
+        self.assertTrue(self.user.in_group([group.group_name]))
+        group.remove_member(self.user)
+        self.assertFalse(self.user.in_group([group.group_name]))
+        inverted_group.exclude_user(self.user)
+        self.assertNotIn(inverted_group, self.user.groups)
+        admin_group = Group.by_name(u'admin')
+        admin_group.add_member(self.user)
+        self.assertTrue(self.user.is_admin())
+
+    def test_permission_cache_is_invalidated(self):
+        group = data_setup.create_group()
+        group.add_member(self.user)
+        permission = data_setup.create_permission()
+        session.flush()
+        self.assertFalse(self.user.has_permission(permission.permission_name))
+        group.permissions.append(permission)
+        self.assertTrue(self.user.has_permission(permission.permission_name))
+        group.permissions.remove(permission)
+        self.assertFalse(self.user.has_permission(permission.permission_name))
+
+    def test_group_membership_cache_is_discarded_at_end_of_transaction(self):
+        group = data_setup.create_group()
+        session.flush()
+        self.assertFalse(self.user.in_group([group.group_name]))
+        session.commit()
+        session.begin()
+        # change membership behind the ORM's back
+        session.execute(UserGroup.__table__.insert(),
+                {'user_id': self.user.user_id, 'group_id': group.group_id,
+                 'is_owner': False})
+        self.assertTrue(self.user.in_group([group.group_name]))
+
 
 class GroupTest(DatabaseTestCase):
 
@@ -2716,6 +3196,47 @@ def test_caps_very_large_score(self):
         session.refresh(self.recipe_task)
         self.assertEquals(self.recipe_task.results[0].score, 9999999999)
 
+    def test_record_results(self):
+        ids = self.recipe_task.record_results([
+                (TaskResult.pass_, u'/a', 1, u'first'),
+                (TaskResult.fail, u'/b', '8.88', None),
+                (TaskResult.warn, u'/c', '12345678900', u'third')])
+        self.assertEquals([r.id for r in self.recipe_task.results], ids)
+        self.assertEquals([(r.result, r.path, r.score, r.log)
+                for r in self.recipe_task.results],
+                [(TaskResult.pass_, u'/a', 1, u'first'),
+                 (TaskResult.fail, u'/b', 9, None),
+                 (TaskResult.warn, u'/c', 9999999999, u'third')])
+
+    def test_record_results_ids_match_inserted_rows(self):
+        # The ids are derived from the first id of a multi-row INSERT, so they
+        # must also be correct when MySQL is configured to skip ids.
+        connection = session.connection(RecipeTaskResult)
+        for increment in [1, 3]:
+            connection.execute('SET SESSION auto_increment_increment = %s', increment)
+            try:
+                with patch('bkr.server.model.sql._autoinc_settings', None):
+                    ids = self.recipe_task.record_results([
+                            (TaskResult.pass_, u'/increment-%s/%s' % (increment, i),
+                             None, None) for i in range(5)])
+            finally:
+                connection.execute('SET SESSION auto_increment_increment = 1')
+            self.assertEquals(len(set(ids)), 5)
+            for i, result_id in enumerate(ids):
+                result = RecipeTaskResult.query.get(result_id)
+                self.assertEquals(result.path, u'/increment-%s/%s' % (increment, i))
+                self.assertEquals(result.recipe_task_id, self.recipe_task.id)
+
+    def test_result_count_is_cached(self):
+        self.recipe_task.pass_(path=u'/a', score=None, summary=None)
+        # not counted until it is first needed
+        self.assertEquals(Recipe.get_result_count(self.recipe.id), 1)
+        self.recipe_task.record_results([(TaskResult.pass_, u'/b', None, None)] * 2)
+        self.recipe_task.warn(path=u'/c', score=None, summary=None)
+        session.expire(self.recipe, ['result_count'])
+        self.assertEquals(self.recipe.result_count, 4)
+        self.assertEquals(Recipe.get_result_count(self.recipe.id), 4)
+
     # https://bugzilla.redhat.com/show_bug.cgi?id=915319
     def test_logs_appear_in_results_xml(self):
         rtr_id = self.recipe_task.pass_(path=u'.', score=None, summary=None)
@@ -5,11 +5,13 @@
 # (at your option) any later version.
 
 import datetime
+import requests
 from collections import namedtuple
 from bkr.server.model import session, System, SystemType, SystemStatus, Cpu, \
         Arch, Numa, Key, Key_Value_String, Key_Value_Int, Disk
-from bkr.server.needpropertyxml import XmlHost
-from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.server.needpropertyxml import XmlHost, HostFilterCache
+from bkr.inttest import data_setup, get_server_base, DatabaseTestCase
+from bkr.inttest.server.requests_utils import patch_json, login as requests_login
 
 class SystemFilteringTest(DatabaseTestCase):
 
@@ -21,13 +23,17 @@ def tearDown(self):
 
     def check_filter(self, filterxml, present=[], absent=[]):
         session.flush()
-        query = XmlHost.from_string(filterxml).apply_filter(System.query)
-        if present:
-            self.assertItemsEqual(present,
-                    query.filter(System.id.in_([s.id for s in present])).all())
-        if absent:
-            self.assertItemsEqual([],
-                    query.filter(System.id.in_([s.id for s in absent])).all())
+        host_filter = XmlHost.from_string(filterxml)
+        # The bitset evaluation must always agree with the SQL filter
+        for query in [host_filter.apply_filter(System.query),
+                      host_filter.apply_cached_filter(System.query,
+                                                      HostFilterCache(ttl=60))]:
+            if present:
+                self.assertItemsEqual(present,
+                        query.filter(System.id.in_([s.id for s in present])).all())
+            if absent:
+                self.assertItemsEqual([],
+                        query.filter(System.id.in_([s.id for s in absent])).all())
 
     def test_autoprov(self):
         no_power = data_setup.create_system()
@@ -1138,6 +1144,99 @@ def test_compatible_with_distro(self):
 
 FakeFlavor = namedtuple('FakeFlavor', ['disk', 'ram', 'vcpus'])
 
+class HostFilterCacheTest(DatabaseTestCase):
+
+    def setUp(self):
+        session.begin()
+        self.cache = HostFilterCache(ttl=60)
+        self.key = Key(u'HOSTFILTERCACHE', numeric=False)
+        session.add(self.key)
+        self.system = data_setup.create_system(arch=u'x86_64')
+        session.flush()
+
+    def tearDown(self):
+        session.rollback()
+
+    def matches(self, filterxml):
+        query = System.query.filter(System.id == self.system.id)
+        return XmlHost.from_string(filterxml).apply_cached_filter(
+                query, self.cache).count() == 1
+
+    def test_leaf_results_are_shared(self):
+        self.assertTrue(self.matches("""
+            <hostRequires><arch value="x86_64" /></hostRequires>
+            """))
+        self.assertTrue(self.matches("""
+            <hostRequires>
+                <and>
+                    <arch value="x86_64" />
+                    <not><key_value key="HOSTFILTERCACHE" value="yes" /></not>
+                </and>
+            </hostRequires>
+            """))
+        self.assertEquals(len(self.cache._entries), 2)
+
+    def test_inventory_change_invalidates_system(self):
+        filterxml = """
+            <hostRequires>
+                <key_value key="HOSTFILTERCACHE" value="yes" />
+            </hostRequires>
+            """
+        self.assertFalse(self.matches(filterxml))
+        self.system.key_values_string.append(Key_Value_String(self.key, u'yes'))
+        session.flush()
+        self.assertTrue(self.matches(filterxml))
+        del self.system.key_values_string[:]
+        session.flush()
+        self.assertFalse(self.matches(filterxml))
+
+    def test_null_values_match_neither_filter_nor_negation(self):
+        self.system.memory = None
+        session.flush()
+        self.assertFalse(self.matches("""
+            <hostRequires><memory op="&gt;" value="1024" /></hostRequires>
+            """))
+        self.assertFalse(self.matches("""
+            <hostRequires>
+                <not><memory op="&gt;" value="1024" /></not>
+            </hostRequires>
+            """))
+
+
+class HostFilterCacheOtherProcessTest(DatabaseTestCase):
+
+    # The cache here stands in for beakerd's. The web application runs in a
+    # separate process, so its changes never reach this process's flush hooks.
+
+    def setUp(self):
+        with session.begin():
+            self.owner = data_setup.create_user(password=u'theowner')
+            self.system = data_setup.create_system(owner=self.owner, memory=1024)
+        self.cache = HostFilterCache(ttl=300)
+
+    def matches(self, filterxml):
+        with session.begin():
+            query = System.query.filter(System.id == self.system.id)
+            return XmlHost.from_string(filterxml).apply_cached_filter(
+                    query, self.cache).count() == 1
+
+    def test_inventory_change_through_web_api_is_noticed(self):
+        filterxml = """
+            <hostRequires><memory op="&gt;" value="2048" /></hostRequires>
+            """
+        self.assertFalse(self.matches(filterxml))
+        s = requests.Session()
+        requests_login(s, user=self.owner.user_name, password=u'theowner')
+        response = patch_json(get_server_base() + 'systems/%s/' % self.system.fqdn,
+                session=s, data={'memory': 4096})
+        response.raise_for_status()
+        self.assertTrue(self.matches(filterxml))
+        response = patch_json(get_server_base() + 'systems/%s/' % self.system.fqdn,
+                session=s, data={'memory': 1024})
+        response.raise_for_status()
+        self.assertFalse(self.matches(filterxml))
+
+
 class OpenstackFlavorFilteringTest(DatabaseTestCase):
 
     def setUp(self):
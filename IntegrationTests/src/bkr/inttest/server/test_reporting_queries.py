@@ -12,7 +12,7 @@
 from bkr.server import dynamic_virt
 from bkr.server.model import System, RecipeTask, Cpu, SystemStatus, \
     SystemActivity, TaskPriority, RecipeSetActivity, VirtResource, \
-    GuestResource
+    GuestResource, ReportingFactDay
 from bkr.inttest import data_setup, DatabaseTestCase
 
 class ReportingQueryTest(DatabaseTestCase):
@@ -39,6 +39,12 @@ def execute_reporting_query(self, name):
         sql = pkg_resources.resource_string('bkr.server', 'reporting-queries/%s.sql' % name)
         return session.connection(System).execute(text(sql))
 
+    def load_reporting_facts(self, first_day, last_day):
+        day = first_day
+        while day <= last_day:
+            ReportingFactDay.load(day)
+            day += datetime.timedelta(days=1)
+
     def test_wait_duration_by_resource(self):
         system_recipe = data_setup.create_recipe()
         data_setup.create_job_for_recipes([system_recipe])
@@ -65,21 +71,24 @@ def test_wait_duration_by_resource(self):
         system_recipe.resource.recipe.start_time = system_recipe.resource.recipe.recipeset.queue_time + one_hour
         system_recipe2.resource.recipe.start_time = system_recipe2.resource.recipe.recipeset.queue_time + three_hours
         session.flush()
+        today = datetime.datetime.utcnow().date()
+        self.load_reporting_facts(today, today + datetime.timedelta(days=1))
 
-        rows = self.execute_reporting_query('wait-duration-by-resource')
-        all_rows = rows.fetchall()
-        virt_rows = [row for row in all_rows if row.fqdn == 'All OpenStack']
-        system_rows = [row for row in all_rows if row.fqdn in (system_recipe.resource.fqdn, system_recipe2.resource.fqdn)]
+        for query in ['wait-duration-by-resource', 'facts/wait-duration-by-resource']:
+            rows = self.execute_reporting_query(query)
+            all_rows = rows.fetchall()
+            virt_rows = [row for row in all_rows if row.fqdn == 'All OpenStack']
+            system_rows = [row for row in all_rows if row.fqdn in (system_recipe.resource.fqdn, system_recipe2.resource.fqdn)]
 
-        self.assertEquals(len(virt_rows), 1, virt_rows)
-        self.assertEquals(virt_rows[0].min_wait_hours, 1)
-        self.assertEquals(virt_rows[0].max_wait_hours, 2)
-        self.assertEquals(virt_rows[0].avg_wait_hours, Decimal('1.5'))
+            self.assertEquals(len(virt_rows), 1, virt_rows)
+            self.assertEquals(virt_rows[0].min_wait_hours, 1)
+            self.assertEquals(virt_rows[0].max_wait_hours, 2)
+            self.assertEquals(virt_rows[0].avg_wait_hours, Decimal('1.5'))
 
-        self.assertEquals(len(system_rows), 1, system_rows)
-        self.assertEquals(system_rows[0].min_wait_hours, 1)
-        self.assertEquals(system_rows[0].max_wait_hours, 3)
-        self.assertEquals(system_rows[0].avg_wait_hours, 2)
+            self.assertEquals(len(system_rows), 1, system_rows)
+            self.assertEquals(system_rows[0].min_wait_hours, 1)
+            self.assertEquals(system_rows[0].max_wait_hours, 3)
+            self.assertEquals(system_rows[0].avg_wait_hours, 2)
 
     def test_install_duration_by_resource(self):
         system_recipe = data_setup.create_recipe()
@@ -112,26 +121,30 @@ def test_install_duration_by_resource(self):
         system_recipe2.installation.install_finished = system_recipe2.installation.install_started + three_hours
         session.flush()
 
-        rows = self.execute_reporting_query('install-duration-by-resource')
-        all_rows = rows.fetchall()
-        guest_rows = [row for row in all_rows if row.fqdn == 'All Guest']
-        virt_rows = [row for row in all_rows if row.fqdn == 'All OpenStack']
-        system_rows = [row for row in all_rows if row.fqdn == system_recipe.resource.fqdn]
+        today = datetime.datetime.utcnow().date()
+        self.load_reporting_facts(today, today + datetime.timedelta(days=1))
 
-        self.assertEquals(len(virt_rows), 1, virt_rows)
-        self.assertEquals(virt_rows[0].min_install_hours, 1)
-        self.assertEquals(virt_rows[0].max_install_hours, 2)
-        self.assertEquals(virt_rows[0].avg_install_hours, Decimal('1.5'))
+        for query in ['install-duration-by-resource', 'facts/install-duration-by-resource']:
+            rows = self.execute_reporting_query(query)
+            all_rows = rows.fetchall()
+            guest_rows = [row for row in all_rows if row.fqdn == 'All Guest']
+            virt_rows = [row for row in all_rows if row.fqdn == 'All OpenStack']
+            system_rows = [row for row in all_rows if row.fqdn == system_recipe.resource.fqdn]
 
-        self.assertEquals(len(guest_rows), 1, guest_rows)
-        self.assertEquals(guest_rows[0].min_install_hours, 2)
-        self.assertEquals(guest_rows[0].max_install_hours, 3)
-        self.assertEquals(guest_rows[0].avg_install_hours, Decimal('2.5'))
+            self.assertEquals(len(virt_rows), 1, virt_rows)
+            self.assertEquals(virt_rows[0].min_install_hours, 1)
+            self.assertEquals(virt_rows[0].max_install_hours, 2)
+            self.assertEquals(virt_rows[0].avg_install_hours, Decimal('1.5'))
 
-        self.assertEquals(len(system_rows), 1, system_rows)
-        self.assertEquals(system_rows[0].min_install_hours, 1)
-        self.assertEquals(system_rows[0].max_install_hours, 3)
-        self.assertEquals(system_rows[0].avg_install_hours, Decimal('2.0'))
+            self.assertEquals(len(guest_rows), 1, guest_rows)
+            self.assertEquals(guest_rows[0].min_install_hours, 2)
+            self.assertEquals(guest_rows[0].max_install_hours, 3)
+            self.assertEquals(guest_rows[0].avg_install_hours, Decimal('2.5'))
+
+            self.assertEquals(len(system_rows), 1, system_rows)
+            self.assertEquals(system_rows[0].min_install_hours, 1)
+            self.assertEquals(system_rows[0].max_install_hours, 3)
+            self.assertEquals(system_rows[0].avg_install_hours, Decimal('2.0'))
 
     def test_resource_install_failures(self):
 
@@ -200,13 +213,15 @@ def test_recipe_hours(self):
                 start_time=datetime.datetime(2012, 10, 31, 22, 0, 0),
                 finish_time=datetime.datetime(2012, 11, 1, 10, 0, 0))
         session.flush()
-        rows = self.execute_reporting_query('recipe-hours-by-user-arch')
-        user_rows = [row for row in rows if row.username == user.user_name]
-        self.assertEquals(len(user_rows), 2, user_rows)
-        self.assertEquals(user_rows[0].arch, 'ia64')
-        self.assertEquals(user_rows[0].recipe_hours, Decimal('1.5'))
-        self.assertEquals(user_rows[1].arch, 'ppc64')
-        self.assertEquals(user_rows[1].recipe_hours, Decimal('2.0'))
+        self.load_reporting_facts(datetime.date(2012, 9, 30), datetime.date(2012, 11, 1))
+        for query in ['recipe-hours-by-user-arch', 'facts/recipe-hours-by-user-arch']:
+            rows = self.execute_reporting_query(query)
+            user_rows = [row for row in rows if row.username == user.user_name]
+            self.assertEquals(len(user_rows), 2, user_rows)
+            self.assertEquals(user_rows[0].arch, 'ia64')
+            self.assertEquals(user_rows[0].recipe_hours, Decimal('1.5'))
+            self.assertEquals(user_rows[1].arch, 'ppc64')
+            self.assertEquals(user_rows[1].recipe_hours, Decimal('2.0'))
 
     # https://bugzilla.redhat.com/show_bug.cgi?id=877264
     def test_machine_hours(self):
@@ -230,13 +245,15 @@ def test_machine_hours(self):
                 start=datetime.datetime(2012, 10, 31, 23, 0, 0),
                 finish=datetime.datetime(2012, 11, 1, 10, 0, 0))
         session.flush()
-        rows = self.execute_reporting_query('machine-hours-by-user-arch')
-        user_rows = [row for row in rows if row.username == user.user_name]
-        self.assertEquals(len(user_rows), 2, user_rows)
-        self.assertEquals(user_rows[0].arch, 'ia64')
-        self.assertEquals(user_rows[0].machine_hours, Decimal('2.5'))
-        self.assertEquals(user_rows[1].arch, 'ppc64')
-        self.assertEquals(user_rows[1].machine_hours, Decimal('3.0'))
+        self.load_reporting_facts(datetime.date(2012, 9, 30), datetime.date(2012, 11, 1))
+        for query in ['machine-hours-by-user-arch', 'facts/machine-hours-by-user-arch']:
+            rows = self.execute_reporting_query(query)
+            user_rows = [row for row in rows if row.username == user.user_name]
+            self.assertEquals(len(user_rows), 2, user_rows)
+            self.assertEquals(user_rows[0].arch, 'ia64')
+            self.assertEquals(user_rows[0].machine_hours, Decimal('2.5'))
+            self.assertEquals(user_rows[1].arch, 'ppc64')
+            self.assertEquals(user_rows[1].machine_hours, Decimal('3.0'))
 
     #https://bugzilla.redhat.com/show_bug.cgi?id=1117681
     def test_machine_utilization(self):
@@ -275,13 +292,15 @@ def test_task_durations(self):
         r.tasks[1].start_time = datetime.datetime(2012, 10, 15, 11, 0, 0)
         r.tasks[1].finish_time = datetime.datetime(2012, 10, 15, 21, 0, 0)
         session.flush()
-        rows = list(self.execute_reporting_query('task-durations-by-arch'))
-        short_task_row, = [row for row in rows if row.task == short_task.name]
-        self.assertEquals(short_task_row.executions, 1)
-        self.assertEquals(short_task_row.avg_duration, Decimal('0.1'))
-        long_task_row, = [row for row in rows if row.task == long_task.name]
-        self.assertEquals(long_task_row.executions, 1)
-        self.assertEquals(long_task_row.avg_duration, Decimal('10.0'))
+        self.load_reporting_facts(datetime.date(2012, 10, 15), datetime.date(2012, 10, 15))
+        for query in ['task-durations-by-arch', 'facts/task-durations-by-arch']:
+            rows = list(self.execute_reporting_query(query))
+            short_task_row, = [row for row in rows if row.task == short_task.name]
+            self.assertEquals(short_task_row.executions, 1)
+            self.assertEquals(short_task_row.avg_duration, Decimal('0.1'))
+            long_task_row, = [row for row in rows if row.task == long_task.name]
+            self.assertEquals(long_task_row.executions, 1)
+            self.assertEquals(long_task_row.avg_duration, Decimal('10.0'))
 
     def test_job_priority_changes(self):
         user1 = data_setup.create_user()
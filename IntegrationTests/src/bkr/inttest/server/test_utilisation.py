@@ -8,7 +8,8 @@
 from turbogears.database import session
 from bkr.server.model import SystemStatus, SystemStatusDuration, System, Arch
 from bkr.server.utilisation import system_utilisation, \
-        system_utilisation_counts, system_utilisation_counts_by_group
+        system_utilisation_counts, system_utilisation_counts_by_group, \
+        fleet_utilisation, rollup_utilisation_day, daily_utilisation
 from bkr.inttest import data_setup, DatabaseTestCase
 
 class SystemUtilisationTest(DatabaseTestCase):
@@ -102,6 +103,64 @@ def test_system_removed_during_period(self):
         self.assertEqual(sum((v for k, v in u.iteritems()), datetime.timedelta(0)),
                 datetime.timedelta(days=4))
 
+    def _create_systems_with_history(self):
+        # One system with the history from test_durations, and one added
+        # partway through the period
+        system = data_setup.create_system()
+        system.date_added = datetime.datetime(2009, 1, 1, 0, 0, 0)
+        system.status_durations.append(SystemStatusDuration(
+                status=SystemStatus.broken,
+                start_time=datetime.datetime(2009, 12, 31, 0, 0, 0),
+                finish_time=datetime.datetime(2010, 1, 2, 0, 0, 0)))
+        system.status_durations.append(SystemStatusDuration(
+                status=SystemStatus.automated,
+                start_time=datetime.datetime(2010, 1, 2, 0, 0, 0)))
+        data_setup.create_manual_reservation(system,
+                start=datetime.datetime(2010, 1, 3, 0, 0, 0),
+                finish=datetime.datetime(2010, 1, 3, 12, 0, 0))
+        data_setup.create_completed_job(system=system,
+                start_time=datetime.datetime(2010, 1, 4, 12, 0, 0),
+                finish_time=datetime.datetime(2010, 1, 5, 0, 0, 0))
+        new_system = data_setup.create_system()
+        new_system.date_added = datetime.datetime(2010, 1, 2, 6, 0, 0)
+        new_system.status_durations.append(SystemStatusDuration(
+                status=SystemStatus.manual,
+                start_time=datetime.datetime(2010, 1, 2, 6, 0, 0)))
+        data_setup.create_manual_reservation(new_system,
+                start=datetime.datetime(2010, 1, 3, 18, 0, 0))
+        session.flush()
+        return [system, new_system]
+
+    def test_fleet_utilisation(self):
+        systems = self._create_systems_with_history()
+        start = datetime.datetime(2010, 1, 1, 0, 0, 0)
+        end = datetime.datetime(2010, 1, 5, 0, 0, 0)
+        u = fleet_utilisation(start, end, System.query.filter(
+                System.id.in_([system.id for system in systems])))
+        self.assertEqual(sorted(u.keys()), sorted(system.id for system in systems))
+        for system in systems:
+            self.assertEqual(u[system.id], system_utilisation(system, start, end))
+        self.assertEqual(u[systems[1].id]['manual'],
+                datetime.timedelta(days=1, hours=6))
+
+    def test_daily_rollup(self):
+        systems = self._create_systems_with_history()
+        query = System.query.filter(System.id.in_([system.id for system in systems]))
+        for day in range(1, 5):
+            rollup_utilisation_day(datetime.date(2010, 1, day), query)
+        u = daily_utilisation(datetime.date(2010, 1, 1),
+                datetime.date(2010, 1, 5), query)
+        for system in systems:
+            self.assertEqual(u[system.id], system_utilisation(system,
+                    datetime.datetime(2010, 1, 1, 0, 0, 0),
+                    datetime.datetime(2010, 1, 5, 0, 0, 0)))
+        # only the requested days are summed
+        u = daily_utilisation(datetime.date(2010, 1, 3),
+                datetime.date(2010, 1, 4), query)
+        self.assertEqual(u[systems[0].id]['manual'], datetime.timedelta(hours=12))
+        self.assertEqual(u[systems[0].id]['idle_automated'],
+                datetime.timedelta(hours=12))
+
     def test_counts(self):
         lc = data_setup.create_labcontroller()
         manual_system = data_setup.create_system(lab_controller=lc)
@@ -0,0 +1,46 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import datetime
+from turbogears.database import session
+from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.inttest.server.tools import run_command
+from bkr.common import __version__
+from bkr.server.model import Activity, ArchivedActivity, SystemActivity
+
+class ArchiveActivityTest(DatabaseTestCase):
+
+    def test_version(self):
+        out = run_command('archive_activity.py', 'beaker-archive-activity',
+                ['--version'])
+        self.assertEquals(out.strip(), __version__)
+
+    def create_activity(self, created):
+        with session.begin():
+            system = data_setup.create_system()
+            system.record_activity(service=u'testdata', field=u'Memory',
+                    old=u'1', new=u'2')
+            session.flush()
+            activity = system.activity[-1]
+            activity.created = created
+            return activity.id
+
+    def test_archives_old_activity(self):
+        old_id = self.create_activity(datetime.datetime.utcnow()
+                - datetime.timedelta(days=400))
+        recent_id = self.create_activity(datetime.datetime.utcnow())
+        out = run_command('archive_activity.py', 'beaker-archive-activity',
+                ['--age', '365', '--dry-run'])
+        self.assertIn('activity records would be archived', out)
+        with session.begin():
+            self.assertIsNotNone(Activity.query.get(old_id))
+        run_command('archive_activity.py', 'beaker-archive-activity',
+                ['--age', '365', '--batch-size', '2'])
+        with session.begin():
+            self.assertIsNone(Activity.query.get(old_id))
+            self.assertIsNotNone(Activity.query.get(recent_id))
+            archived = ArchivedActivity.query.get(old_id)
+            self.assertEquals(archived.type, SystemActivity.__mapper__.polymorphic_identity)
+            self.assertEquals(archived.field_name, u'Memory')
@@ -144,3 +144,29 @@ def test_replaces_bad_packages(self):
         self.assertEquals(
                 open(os.path.join(self.harness_repo_dir, osmajor, package), 'rb').read(),
                 open(os.path.join(local_harness_dir, osmajor, package), 'rb').read())
+
+    def test_identical_packages_are_hardlinked(self):
+        package = 'tmp-distribution-beaker-task_test-2.0-5.noarch.rpm'
+        osmajors = [u'PeachFedoraLinux8', u'PeachFedoraLinux9']
+        with session.begin():
+            lab_controller = data_setup.create_labcontroller()
+            for osmajor in osmajors:
+                data_setup.create_distro_tree(
+                        osmajor=OSMajor.lazy_create(osmajor=osmajor),
+                        harness_dir=False, lab_controllers=[lab_controller])
+                self._create_remote_harness(osmajor)
+        # Make the repo metadata differ, so that the repos are synced
+        # separately and only the package is shared between them
+        with open(os.path.join(self.harness_repo_dir, osmajors[1],
+                'repodata', 'repomd.xml'), 'ab') as f:
+            f.write(b'<!-- %s -->\n' % osmajors[1])
+        local_harness_dir = tempfile.mkdtemp(suffix='local')
+        self.addCleanup(shutil.rmtree, local_harness_dir)
+        run_command('repo_update.py', 'beaker-repo-update',
+                ['-j', '2', '-b', self.harness_repo_url, '-d', local_harness_dir],
+                ignore_stderr=True)
+        first, second = [os.path.join(local_harness_dir, osmajor, package)
+                for osmajor in osmajors]
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertTrue(os.path.exists(os.path.join(local_harness_dir, osmajors[1], 'repodata')))
+        self.assertTrue(os.path.exists(os.path.join(local_harness_dir, '.checksums.json')))
@@ -0,0 +1,67 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import datetime
+from turbogears.database import session
+from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.inttest.server.tools import run_command
+from bkr.common import __version__
+from bkr.server.model import ReportingFactDay, MachineHoursFact, \
+        SystemUtilisationDay
+
+class UpdateReportingFactsTest(DatabaseTestCase):
+
+    def test_version(self):
+        out = run_command('reporting_facts.py', 'beaker-update-reporting-facts',
+                ['--version'])
+        self.assertEquals(out.strip(), __version__)
+
+    def test_loads_finished_days(self):
+        today = datetime.datetime.utcnow().date()
+        yesterday = today - datetime.timedelta(days=1)
+        midnight = datetime.datetime.combine(yesterday, datetime.time())
+        with session.begin():
+            user = data_setup.create_user()
+            system = data_setup.create_system()
+            data_setup.create_manual_reservation(system, user=user,
+                    start=midnight + datetime.timedelta(hours=10),
+                    finish=midnight + datetime.timedelta(hours=13))
+        run_command('reporting_facts.py', 'beaker-update-reporting-facts',
+                ['--since', yesterday.isoformat()])
+        with session.begin():
+            self.assertIsNotNone(ReportingFactDay.query.get(yesterday))
+            # today has not finished yet
+            self.assertIsNone(ReportingFactDay.query.get(today))
+            fact = MachineHoursFact.query.get((yesterday, user.user_id, system.id))
+            self.assertEquals(fact.seconds, 3 * 60 * 60)
+        # running again does not load anything more
+        run_command('reporting_facts.py', 'beaker-update-reporting-facts')
+        with session.begin():
+            self.assertEquals(MachineHoursFact.query
+                    .filter(MachineHoursFact.system_id == system.id).count(), 1)
+
+    def test_rolls_up_system_utilisation(self):
+        today = datetime.datetime.utcnow().date()
+        yesterday = today - datetime.timedelta(days=1)
+        midnight = datetime.datetime.combine(yesterday, datetime.time())
+        with session.begin():
+            # other tests may have rolled up yesterday already
+            SystemUtilisationDay.query.filter(SystemUtilisationDay.day >= yesterday)\
+                    .delete(synchronize_session=False)
+            system = data_setup.create_system(
+                    date_added=midnight - datetime.timedelta(days=1))
+            session.flush()
+            system.status_durations[0].start_time = \
+                    midnight - datetime.timedelta(days=1)
+            data_setup.create_manual_reservation(system,
+                    start=midnight + datetime.timedelta(hours=10),
+                    finish=midnight + datetime.timedelta(hours=13))
+        run_command('reporting_facts.py', 'beaker-update-reporting-facts',
+                ['--since', yesterday.isoformat()])
+        with session.begin():
+            row = SystemUtilisationDay.query.get((system.id, yesterday))
+            self.assertEquals(row.manual, 3 * 60 * 60)
+            # today has not finished yet
+            self.assertIsNone(SystemUtilisationDay.query.get((system.id, today)))
@@ -143,6 +143,47 @@ def test_sync_two_tasks_one_fails(self):
 
         self.assertTrue(os.path.exists(task_rpm_disk))
 
+    def test_rpm_which_fails_integrity_check_is_skipped(self):
+        task_sync = TaskLibrarySync()
+        task_sync.download_attempts = 1
+        good_task = 'task4.rpm'
+        bad_task = 'empty.rpm'
+        task_sync.sync_tasks(['%s%s' % (self.task_url, good_task),
+                '%s%s' % (self.task_url, bad_task)])
+        with session.begin():
+            self.assertEqual(Task.query.filter(Task.rpm == good_task).count(), 1)
+            self.assertEqual(Task.query.filter(Task.rpm == bad_task).count(), 0)
+        self.assertTrue(os.path.exists(
+                os.path.join(task_sync.tasklib.rpmspath, good_task)))
+        self.assertFalse(os.path.exists(
+                os.path.join(task_sync.tasklib.rpmspath, bad_task)))
+
+    def test_downloads_stay_one_batch_ahead(self):
+        task_sync = TaskLibrarySync()
+        task_sync.batch_size = 1
+        staging_dirs = set()
+        staged_counts = []
+        download_rpm = task_sync._download_rpm
+        def _download_rpm(task_url, staging_dir):
+            staging_dirs.add(staging_dir)
+            return download_rpm(task_url, staging_dir)
+        task_sync._download_rpm = _download_rpm
+        update_tasks = task_sync.tasklib.update_tasks
+        def _update_tasks(tasks_and_writes, **kwargs):
+            staged_counts.append(len(os.listdir(list(staging_dirs)[0])))
+            return update_tasks(tasks_and_writes, **kwargs)
+        task_sync.tasklib.update_tasks = _update_tasks
+        task_filenames = ['task1.rpm', 'task2.rpm', 'task3.rpm', 'task4.rpm']
+        task_sync.sync_tasks(['%s%s' % (self.task_url, task_filename)
+                for task_filename in task_filenames])
+        with session.begin():
+            for task_filename in task_filenames:
+                self.assertEqual(Task.query.filter(Task.rpm == task_filename).count(), 1)
+        # only the batch being synced and the next one are ever staged
+        self.assertEqual(len(staged_counts), 4)
+        self.assertLessEqual(max(staged_counts), 2)
+        self.assertFalse(os.path.exists(list(staging_dirs)[0]))
+
     def test_script_run_log(self):
 
         remote = get_server_base()
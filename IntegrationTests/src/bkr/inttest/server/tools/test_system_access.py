@@ -0,0 +1,38 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+from turbogears.database import session
+from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.inttest.server.tools import run_command, CommandError
+from bkr.common import __version__
+from bkr.server.model import System, SystemAccess, SystemPermission
+
+class RebuildSystemAccessTest(DatabaseTestCase):
+
+    def test_version(self):
+        out = run_command('system_access.py', 'beaker-rebuild-system-access',
+                ['--version'])
+        self.assertEquals(out.strip(), __version__)
+
+    def test_check_and_rebuild(self):
+        with session.begin():
+            system = data_setup.create_system(shared=False)
+            user = data_setup.create_user()
+            system.custom_access_policy.add_rule(SystemPermission.reserve, user=user)
+        with session.begin():
+            session.execute(SystemAccess.__table__.delete()
+                    .where(SystemAccess.system_id == system.id))
+        try:
+            run_command('system_access.py', 'beaker-rebuild-system-access',
+                    ['--check'])
+            self.fail('should raise')
+        except CommandError as e:
+            self.assertEquals(e.status, 1)
+        run_command('system_access.py', 'beaker-rebuild-system-access')
+        with session.begin():
+            self.assertEquals(System.query.filter(System.id == system.id)
+                    .filter(System.can_reserve(user)).count(), 1)
+        run_command('system_access.py', 'beaker-rebuild-system-access',
+                ['--check'])
@@ -0,0 +1,38 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+from turbogears.database import session
+from bkr.inttest import data_setup, DatabaseTestCase
+from bkr.inttest.server.tools import run_command, CommandError
+from bkr.common import __version__
+from bkr.server.model import System, SystemFacet, SystemFacetType, Cpu
+
+class RebuildSystemFacetsTest(DatabaseTestCase):
+
+    def test_version(self):
+        out = run_command('system_facets.py', 'beaker-rebuild-system-facets',
+                ['--version'])
+        self.assertEquals(out.strip(), __version__)
+
+    def test_check_and_rebuild(self):
+        with session.begin():
+            system = data_setup.create_system()
+            system.cpu = Cpu(processors=1, cores=1, flags=[u'vmx'])
+        with session.begin():
+            session.execute(SystemFacet.__table__.delete()
+                    .where(SystemFacet.system_id == system.id))
+        try:
+            run_command('system_facets.py', 'beaker-rebuild-system-facets',
+                    ['--check'])
+            self.fail('should raise')
+        except CommandError as e:
+            self.assertEquals(e.status, 1)
+        run_command('system_facets.py', 'beaker-rebuild-system-facets')
+        with session.begin():
+            self.assertEquals(System.query.filter(System.id == system.id)
+                    .filter(SystemFacet.matches(SystemFacetType.cpu_flag,
+                        SystemFacet.value == u'vmx')).count(), 1)
+        run_command('system_facets.py', 'beaker-rebuild-system-facets',
+                ['--check'])
@@ -116,6 +116,11 @@ def task_result(self,
                                              result_score,
                                              result_summary)
 
+    def task_results(self, task_id, results):
+        """ report several results to the scheduler at once """
+        logger.debug("task_results %s (%d results)", task_id, len(results))
+        return self.hub.recipes.tasks.results(task_id, results)
+
     def task_info(self,
                   qtask_id):
         """ accepts qualified task_id J:213 RS:1234 R:312 T:1234 etc.. Returns dict with status """
@@ -788,30 +793,58 @@ def get_recipe(self, req, recipe_id):
         'none': 'result_none',
         'skip': 'skip',
     }
-    def post_result(self, req, recipe_id, task_id):
-        if 'result' not in req.form:
+    def _result_type(self, result):
+        if not result:
             raise BadRequest('Missing "result" parameter')
-        result = req.form['result'].lower()
-        if result not in self._result_types:
-            raise BadRequest('Unknown result type %r' % req.form['result'])
+        if result.lower() not in self._result_types:
+            raise BadRequest('Unknown result type %r' % result)
+        return self._result_types[result.lower()]
+
+    def _result_fault_response(self, fault):
+        # XXX need to find a less fragile way to do this
+        if 'Cannot record result for finished task' in fault.faultString:
+            return Response(status=409, response=fault.faultString,
+                    content_type='text/plain')
+        elif 'Too many results in recipe' in fault.faultString:
+            return Response(status=403, response=fault.faultString,
+                    content_type='text/plain')
+        raise fault
+
+    def post_result(self, req, recipe_id, task_id):
+        if req.mimetype == 'application/json':
+            return self._post_results(req, recipe_id, task_id)
+        result_type = self._result_type(req.form.get('result'))
         try:
-            result_id = self.hub.recipes.tasks.result(task_id,
-                    self._result_types[result],
+            result_id = self.hub.recipes.tasks.result(task_id, result_type,
                     req.form.get('path'), req.form.get('score'),
                     req.form.get('message'))
         except xmlrpc_client.Fault as fault:
-            # XXX need to find a less fragile way to do this
-            if 'Cannot record result for finished task' in fault.faultString:
-                return Response(status=409, response=fault.faultString,
-                        content_type='text/plain')
-            elif 'Too many results in recipe' in fault.faultString:
-                return Response(status=403, response=fault.faultString,
-                        content_type='text/plain')
-            else:
-                raise
+            return self._result_fault_response(fault)
         return redirect('/recipes/%s/tasks/%s/results/%s' % (
                 recipe_id, task_id, result_id), code=201)
 
+    def _post_results(self, req, recipe_id, task_id):
+        # Several results at once, as a JSON array of objects with the same
+        # keys as the form parameters for a single result.
+        try:
+            data = json.loads(req.data)
+        except ValueError:
+            raise BadRequest('Invalid JSON')
+        if not isinstance(data, list) or \
+                not all(isinstance(item, dict) for item in data):
+            raise BadRequest('Request body must be a JSON array of results')
+        results = [{'result_type': self._result_type(item.get('result')),
+                    'path': item.get('path'),
+                    'score': item.get('score'),
+                    'summary': item.get('message')}
+                   for item in data]
+        try:
+            result_ids = self.hub.recipes.tasks.results(task_id, results)
+        except xmlrpc_client.Fault as fault:
+            return self._result_fault_response(fault)
+        return Response(status=201, response=json.dumps({'ids': result_ids}),
+                content_type='application/json')
+
     def post_recipe_status(self, req, recipe_id):
         if 'status' not in req.form:
             raise BadRequest('Missing "status" parameter')
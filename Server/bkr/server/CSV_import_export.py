@@ -5,12 +5,17 @@
 # (at your option) any later version.
 
 from turbogears.database import session
-from turbogears import expose, widgets
+from turbogears import expose, widgets, config
+from flask import request, Response, stream_with_context
+from sqlalchemy import inspect
+from sqlalchemy.sql import select, exists, and_, or_, not_
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import InvalidRequestError
 from bkr.server import identity
+from bkr.server.app import app
+from bkr.server.flask_util import auth_required, BadRequest400
 from bkr.server.xmlrpccontroller import RPCRoot
-from tempfile import NamedTemporaryFile
-from cherrypy.lib.cptools import serve_file
 from bkr.server.model import (System, SystemType, Activity, SystemActivity,
                               User, Group, LabController, LabInfo,
                               OSMajor, OSVersion,
@@ -19,13 +24,19 @@
                               Provision, ProvisionFamily,
                               ProvisionFamilyUpdate,
                               Key, Key_Value_Int, Key_Value_String,
-                              SystemAccessPolicy, SystemPermission, SystemPool)
+                              SystemAccessPolicy, SystemPermission, SystemPool,
+                              SystemCc, UserGroup, ExcludedUserGroup,
+                              GroupMembershipType)
+from bkr.server.model.inventory import system_arch_map, system_pool_map
 from bkr.server.widgets import HorizontalForm, RadioButtonList
 from kid import XML
 
 import csv
 import datetime
 import logging
+from collections import defaultdict
+from itertools import chain
+from cStringIO import StringIO
 logger = logging.getLogger(__name__)
 
 def smart_bool(s):
@@ -38,6 +49,208 @@ def smart_bool(s):
         return False
     return s
 
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    # XXX remove encoding in Python 3...
+    return unicode(value).encode('utf8')
+
+def _grouped(pairs):
+    """
+    Collects (key, value) pairs into a dict of key -> list of values,
+    preserving the order of the values.
+    """
+    result = {}
+    for key, value in pairs:
+        result.setdefault(key, []).append(value)
+    return result
+
+def _windows(query, column, size):
+    """
+    Yields successive lists of up to *size* values of *column* matched by
+    *query*, in ascending order. Each window is fetched with a separate
+    query starting after the last value of the previous window, so nothing
+    is held in the session between windows.
+    """
+    last = None
+    while True:
+        window_query = query.with_entities(column)
+        if last is not None:
+            window_query = window_query.filter(column > last)
+        ids = [row[0] for row in window_query.order_by(column).limit(size)]
+        if not ids:
+            return
+        yield ids
+        if len(ids) < size:
+            return
+        last = ids[-1]
+
+def _chunks(values, size):
+    values = list(values)
+    for start in xrange(0, len(values), size):
+        yield values[start:start + size]
+
+def _find_key_value(key_values, key, value):
+    for key_value in key_values:
+        if key_value.key == key and unicode(key_value.key_value) == value:
+            return key_value
+    return None
+
+# Relationships needed by each csv_type, loaded together with the systems
+# for a chunk of rows
+_system_import_options = {
+    'system': [subqueryload(System.arch), subqueryload(System._system_ccs),
+               joinedload(System.lab_controller)],
+    'system_id': [subqueryload(System.arch), subqueryload(System._system_ccs),
+                  joinedload(System.lab_controller)],
+    'power': [joinedload(System.power)],
+    'labinfo': [joinedload(System.labinfo)],
+    'exclude': [subqueryload(System.excluded_osmajor),
+                subqueryload(System.excluded_osversion)],
+    'install': [subqueryload(System.provisions)],
+    'keyvalue': [subqueryload(System.key_values_int),
+                 subqueryload(System.key_values_string)],
+    'system_pool': [subqueryload(System.pools)],
+}
+
+class _ImportLookups(object):
+    """
+    Objects referenced by the rows of a CSV import, keyed by lower-cased
+    name to match the database's case-insensitive comparisons.
+
+    Reference data (arches, keys, users, etc) is loaded for the whole file
+    up front. Systems are loaded for each chunk of rows by load_systems().
+    The accessors fail in the same way as the by_name() lookups which they
+    replace.
+    """
+
+    def __init__(self, rows):
+        names = defaultdict(set)
+        for line_num, data in rows:
+            for field in ['arch', 'family', 'key', 'owner', 'lab_controller',
+                    'power_type', 'pool', 'group', 'user']:
+                if data.get(field):
+                    names[field].update(data[field].split(',')
+                            if field == 'arch' else [data[field]])
+        self.arches = self._load(Arch, Arch.arch, names['arch'])
+        self.osmajors = self._load(OSMajor, OSMajor.osmajor, names['family'])
+        self.osversions = {}
+        for osmajor_ids in _chunks(set(osmajor.id for osmajor in self.osmajors.values()), 1000):
+            for osversion in OSVersion.query.filter(OSVersion.osmajor_id.in_(osmajor_ids)):
+                self.osversions[osversion.osmajor_id, osversion.osminor.lower()] = osversion
+        self.keys = self._load(Key, Key.key_name, names['key'])
+        self.users = self._load(User, User.user_name, names['owner'] | names['user'])
+        self.lab_controllers = self._load(LabController, LabController.fqdn,
+                names['lab_controller'])
+        self.power_types = self._load(PowerType, PowerType.name, names['power_type'])
+        self.pools = self._load(SystemPool, SystemPool.name, names['pool'])
+        self.groups = self._load(Group, Group.group_name, names['group'])
+        self.systems = {}
+        self.systems_by_id = {}
+
+    @staticmethod
+    def _load(cls, column, names, options=()):
+        objects = {}
+        for chunk in _chunks(names, 1000):
+            for obj in cls.query.filter(column.in_(chunk)).options(*options):
+                objects[getattr(obj, column.key).lower()] = obj
+        return objects
+
+    @staticmethod
+    def _get(objects, name):
+        try:
+            return objects[name.lower()]
+        except KeyError:
+            raise NoResultFound('No row was found for one()')
+
+    def load_systems(self, rows):
+        fqdns = set()
+        ids = set()
+        csv_types = set()
+        for line_num, data in rows:
+            csv_types.add(data['csv_type'])
+            if data.get('id'):
+                try:
+                    ids.add(int(data['id']))
+                except ValueError:
+                    pass
+            elif data.get('fqdn'):
+                fqdns.add(data['fqdn'])
+        options = [joinedload(System.owner)]
+        for csv_type in csv_types:
+            options.extend(_system_import_options.get(csv_type, []))
+        self.systems = self._load(System, System.fqdn, fqdns, options)
+        self.systems_by_id = {}
+        for chunk in _chunks(ids, 1000):
+            for system in System.query.filter(System.id.in_(chunk)).options(*options):
+                self.systems_by_id[system.id] = system
+
+    def forget_new(self):
+        """
+        Forgets any objects created during the import which are no longer
+        pending, because their transaction or savepoint was rolled back.
+        """
+        for objects in [self.users, self.groups, self.systems, self.systems_by_id]:
+            for name, obj in objects.items():
+                if inspect(obj).transient:
+                    del objects[name]
+
+    def system(self, fqdn):
+        return self.systems.get(fqdn.lower())
+
+    def system_by_id(self, system_id):
+        try:
+            return self.systems_by_id[int(system_id)]
+        except (KeyError, ValueError):
+            raise ValueError('Non-existent system id')
+
+    def add_system(self, system):
+        self.systems[system.fqdn.lower()] = system
+
+    def arch(self, arch):
+        try:
+            return self.arches[arch.lower()]
+        except KeyError:
+            raise ValueError('No such arch %r' % arch)
+
+    def osmajor(self, osmajor):
+        return self._get(self.osmajors, osmajor)
+
+    def osversion(self, osmajor, osminor):
+        try:
+            return self.osversions[osmajor.id, osminor.lower()]
+        except KeyError:
+            raise NoResultFound('No row was found for one()')
+
+    def key(self, key_name):
+        return self._get(self.keys, key_name)
+
+    def user(self, user_name):
+        user = self.users.get(user_name.lower())
+        if user is None:
+            # may be created on demand from LDAP
+            user = User.by_user_name(user_name)
+            if user is not None:
+                self.users[user_name.lower()] = user
+        return user
+
+    def lab_controller(self, fqdn):
+        return self._get(self.lab_controllers, fqdn)
+
+    def power_type(self, name):
+        return self._get(self.power_types, name)
+
+    def pool(self, name):
+        return self._get(self.pools, name)
+
+    def group(self, group_name):
+        return self._get(self.groups, group_name)
+
+    def add_group(self, group):
+        self.groups[group.group_name.lower()] = group
+
 # Adapted from the recipe at 
 # https://docs.python.org/2/library/csv.html#csv-examples
 class UnicodeDictReader():
@@ -132,28 +345,13 @@ def csv_import(self, **kw):
             value = kw,
         )
 
-    @expose()
-    @identity.require(identity.not_anonymous())
-    def action_export(self, csv_type, *args, **kw):
-        file = NamedTemporaryFile()
-        log = self.to_csv(file, csv_type)
-        file.seek(0)
-
-        return serve_file(file.name, contentType="text/csv",
-                                     disposition="attachment",
-                                     name="%s.csv" % csv_type)
-
-    def _import_row(self, data, log):
+    def _import_row(self, data, log, lookups):
         if data['csv_type'] in system_types and ('fqdn' in data or 'id' in data):
             if data.get('id', None):
-                try:
-                    system = System.query.filter(System.id == data['id']).one()
-                except InvalidRequestError as e:
-                    raise ValueError('Non-existent system id')
+                system = lookups.system_by_id(data['id'])
             else:
-                try:
-                    system = System.query.filter(System.fqdn == data['fqdn']).one()
-                except InvalidRequestError:
+                system = lookups.system(data['fqdn'])
+                if system is None:
                     # Create new system with some defaults
                     # Assume the system is broken until proven otherwise.
                     # Also assumes its a machine.  we have to pick something
@@ -171,24 +369,57 @@ def _import_row(self, data, log):
             # we change the FQDN only when a valid system id is supplied
             if not data.get('id', None):
                 data.pop('fqdn')
-            self.from_csv(system, data, log)
+            self.from_csv(system, data, log, lookups)
+            # later rows may refer to a new or renamed system by its FQDN
+            lookups.add_system(system)
         elif data['csv_type'] == 'user_group' and 'user' in data:
-            user = User.by_user_name(data['user'])
+            user = lookups.user(data['user'])
             if user is None:
                 raise ValueError('%s is not a valid user' % data['user'])
-            CSV_GroupUser.from_csv(user, data, log)
+            CSV_GroupUser.from_csv(user, data, log, lookups)
         else:
             raise ValueError('Invalid csv_type %s or missing required fields'
                     % data['csv_type'])
 
+    def _import_chunk(self, rows, lookups, savepoints):
+        """
+        Imports the given (line number, data) rows, returning a list of
+        (line number, message) log entries. Without savepoints, the first
+        error propagates and the caller is expected to roll back the chunk.
+        """
+        lookups.load_systems(rows)
+        messages = []
+        for line_num, data in rows:
+            # handlers consume the row, keep the original for a retry
+            data = dict(data)
+            row_log = []
+            if savepoints:
+                try:
+                    with session.begin_nested():
+                        self._import_row(data, row_log, lookups)
+                except Exception, e:
+                    # log and continue processing more rows
+                    row_log.append('Error importing line %s: %s' % (line_num, e))
+                    lookups.forget_new()
+            else:
+                self._import_row(data, row_log, lookups)
+            messages.extend((line_num, message) for message in row_log)
+        return messages
+
     @expose(template='bkr.server.templates.csv_import')
     @identity.require(identity.in_group('admin'))
     def action_import(self, csv_file, *args, **kw):
         """
         TurboGears method to import data from csv
-        """
 
-        log = []
+        The whole file is parsed and checked before anything is imported.
+        Rows are then imported in chunks of beaker.csv_import_chunk_size,
+        each committed separately. A chunk is first applied without
+        savepoints, if any row in it fails the chunk is rolled back and
+        retried one row at a time, so that only the bad rows are skipped.
+        """
+        messages = []
+        rows = []
         try:
             # ... process CSV file contents here ...
             missing = object()
@@ -200,32 +431,50 @@ def action_import(self, csv_file, *args, **kw):
                 is_empty = False
 
                 if missing in data:
-                    log.append('Too many fields on line %s (expecting %s)'
-                            % (reader.line_num, len(reader.fieldnames)))
+                    messages.append((reader.line_num, 'Too many fields on line %s (expecting %s)'
+                            % (reader.line_num, len(reader.fieldnames))))
                     continue
                 if any(value is missing for value in data.itervalues()):
                     missing_fields = [field for field, value in data.iteritems()
                             if value is missing]
-                    log.append('Missing fields on line %s: %s' % (reader.line_num,
-                            ', '.join(missing_fields)))
+                    messages.append((reader.line_num, 'Missing fields on line %s: %s'
+                            % (reader.line_num, ', '.join(missing_fields))))
                     continue
                 if 'csv_type' not in data:
-                    log.append('Missing csv_type on line %s' % reader.line_num)
+                    messages.append((reader.line_num,
+                            'Missing csv_type on line %s' % reader.line_num))
                     continue
-                try:
-                    with session.begin_nested():
-                        self._import_row(data, log)
-                except Exception, e:
-                    # log and continue processing more rows
-                    log.append('Error importing line %s: %s' % (reader.line_num, e))
+                rows.append((reader.line_num, data))
 
             if is_empty:
-                log.append('Empty CSV file supplied')
+                messages.append((0, 'Empty CSV file supplied'))
 
         except csv.Error, e:
-            session.rollback()
+            # nothing has been imported yet
+            log = [message for line_num, message in messages]
             log.append('Error parsing CSV file: %s' % e)
+            logger.debug('CSV import failed with errors: %r', log)
+            return dict(log = log)
 
+        if rows:
+            lookups = _ImportLookups(rows)
+            chunk_size = config.get('beaker.csv_import_chunk_size', 500)
+            for chunk in _chunks(rows, chunk_size):
+                try:
+                    chunk_messages = self._import_chunk(chunk, lookups, savepoints=False)
+                    session.flush()
+                except Exception:
+                    session.rollback()
+                    session.begin()
+                    lookups.forget_new()
+                    chunk_messages = self._import_chunk(chunk, lookups, savepoints=True)
+                session.commit()
+                session.begin()
+                messages.extend(chunk_messages)
+
+        # messages from the checks and from the import are interleaved by line
+        messages.sort(key=lambda message: message[0])
+        log = [message for line_num, message in messages]
         if log:
             logger.debug('CSV import failed with errors: %r', log)
         return dict(log = log)
@@ -234,7 +483,8 @@ def action_import(self, csv_file, *args, **kw):
     def to_csv(cls, file, csv_type):
         log = []
         if csv_type in csv_types:
-            csv_types[csv_type]._to_csv(file)
+            for chunk in csv_types[csv_type].iter_csv(identity.current.user):
+                file.write(chunk)
         else:
             log.append("Invalid csv_type %s" % csv_type)
         return log
@@ -243,26 +493,48 @@ def to_csv(cls, file, csv_type):
     csv_type = None
     csv_keys = []
 
+    # Exported rows are produced in windows of this many systems (or users),
+    # so that memory use stays flat regardless of the size of the inventory.
+    export_window = 1000
+    export_id_column = System.id
+
     @classmethod
-    def query(cls):
+    def export_ids(cls, user):
+        """
+        Returns a query for the ids (export_id_column) of the objects which
+        the given user may export.
+        """
+        return System.all(user)
+
+    @classmethod
+    def export_rows(cls, ids):
+        """
+        Returns an iterable of rows, each a list of values in csv_keys order,
+        for the objects with the given ids.
+        """
         raise NotImplementedError()
 
     @classmethod
-    def _to_csv(cls, file):
+    def iter_csv(cls, user):
         """
-        Export objects into a csv file.
+        Generates the export for the given user as chunks of UTF-8 encoded
+        CSV, one chunk per window of rows.
         """
-        header = csv.writer(file)
-        header.writerow(['csv_type'] + cls.csv_keys)
-        writer = csv.DictWriter(file, ['csv_type'] + cls.csv_keys)
-        for item in cls.query():
-            for data in cls.to_datastruct(item):
-                data['csv_type'] = cls.csv_type
-                # XXX remove encoding in Python 3...
-                writer.writerow(dict((k, unicode(v).encode('utf8')) for k, v in data.iteritems()))
+        buf = StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(['csv_type'] + cls.csv_keys)
+        for ids in _windows(cls.export_ids(user), cls.export_id_column,
+                cls.export_window):
+            for row in cls.export_rows(ids):
+                writer.writerow([cls.csv_type] + [_csv_value(v) for v in row])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
 
     @classmethod
-    def from_csv(cls, system, data, log):
+    def from_csv(cls, system, data, log, lookups):
         """
         Process data file
         """
@@ -270,13 +542,13 @@ def from_csv(cls, system, data, log):
             csv_type = data['csv_type']
             # Remove csv_type now that we know what we want to do.
             data.pop('csv_type')
-            csv_types[csv_type]._from_csv(system, data, csv_type, log)
+            csv_types[csv_type]._from_csv(system, data, csv_type, log, lookups)
             system.date_modified = datetime.datetime.utcnow()
         else:
             raise ValueError("Invalid csv_type %s" % data['csv_type'])
 
     @classmethod
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         """
         Import data from CSV file into Objects
         """ 
@@ -294,15 +566,6 @@ def _from_csv(cls,system,data,csv_type,log):
                             old=u'%s' % current_data, new=u'%s' % newdata)
                     setattr(csv_object,key,newdata)
 
-    def to_datastruct(self):
-        datastruct = dict()
-        for csv_key in self.csv_keys:
-            val = getattr(self, csv_key, None)
-            if val is None:
-                val = ''
-            datastruct[csv_key] = unicode(val)
-        yield datastruct
-
 class CSV_System(CSV):
     csv_type = 'system'
     reg_keys = ['fqdn', 'lender', 'location',
@@ -315,12 +578,41 @@ class CSV_System(CSV):
     csv_keys = reg_keys + spec_keys
 
     @classmethod
-    def query(cls):
-        for system in System.all(identity.current.user):
-            yield CSV_System(system)
+    def export_rows(cls, system_ids):
+        conn = session.connection(System)
+        arches = _grouped(conn.execute(
+                select([system_arch_map.c.system_id, Arch.arch])
+                .select_from(system_arch_map.join(Arch.__table__))
+                .where(system_arch_map.c.system_id.in_(system_ids))
+                .order_by(Arch.arch)))
+        ccs = _grouped(conn.execute(
+                select([SystemCc.system_id, SystemCc.email_address])
+                .where(SystemCc.system_id.in_(system_ids))
+                .order_by(SystemCc.email_address)))
+        owner = User.__table__.alias('owner')
+        rows = conn.execute(select([System.id, System.fqdn, System.lender,
+                    System.location, System.mac_address, System.memory,
+                    System.model, System.serial, System.vendor,
+                    LabController.fqdn, owner.c.user_name, System.status,
+                    System.type])
+                .select_from(System.__table__
+                    .join(owner, System.owner_id == owner.c.user_id)
+                    .outerjoin(LabController.__table__,
+                        System.lab_controller_id == LabController.id))
+                .where(System.id.in_(system_ids))
+                .order_by(System.id))
+        for (system_id, fqdn, lender, location, mac_address, memory, model,
+                serial, vendor, lab_controller, owner_name, status, type) in rows:
+            row = [fqdn, lender, location, mac_address, memory, model,
+                    serial, vendor, ','.join(arches.get(system_id, [])),
+                    lab_controller, owner_name, status, type,
+                    ','.join(ccs.get(system_id, []))]
+            if 'id' in cls.reg_keys:
+                row.insert(0, system_id)
+            yield row
 
     @classmethod
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         """
         Import data from CSV file into System Objects
         """
@@ -343,7 +635,7 @@ def _from_csv(cls,system,data,csv_type,log):
                 arches = data['arch'].split(',')
                 for arch in arches:
                     try:
-                        arch_obj = Arch.by_name(arch)
+                        arch_obj = lookups.arch(arch)
                     except ValueError:
                         raise ValueError("%s: Invalid arch %s" %
                                          (system.fqdn, arch))
@@ -369,7 +661,7 @@ def _from_csv(cls,system,data,csv_type,log):
         if 'lab_controller' in data:
             if data['lab_controller']:
                 try:
-                    lab_controller = LabController.by_name(data['lab_controller'])
+                    lab_controller = lookups.lab_controller(data['lab_controller'])
                 except InvalidRequestError:
                     raise ValueError("%s: Invalid lab controller %s" %
                                      (system.fqdn, data['lab_controller']))
@@ -384,7 +676,7 @@ def _from_csv(cls,system,data,csv_type,log):
         # import owner
         if 'owner' in data:
             if data['owner']:
-                owner = User.by_user_name(data['owner'])
+                owner = lookups.user(data['owner'])
                 if not owner:
                     raise ValueError("%s: Invalid User %s" %
                                               (system.fqdn, data['owner']))
@@ -453,38 +745,11 @@ def _from_csv(cls,system,data,csv_type,log):
                         field=u'Access Policy Rule', action=u'Added',
                         new=repr(new_rule))
 
-    def __init__(self, system):
-        self.system = system
-        self.fqdn = system.fqdn
-        self.arch = ','.join([arch.arch for arch in system.arch])
-        self.lab_controller = system.lab_controller
-        self.lender = system.lender
-        self.location = system.location
-        self.mac_address = system.mac_address
-        self.memory = system.memory
-        self.model = system.model
-        self.owner = system.owner
-        self.serial = system.serial
-        self.status = system.status
-        self.type = system.type
-        self.vendor = system.vendor
-        self.cc = ','.join([cc for cc in system.cc])
-
 class CSV_System_id(CSV_System):
 
     reg_keys = ['id'] + CSV_System.reg_keys
     csv_keys = reg_keys + CSV_System.spec_keys
 
-    def __init__(self, system):
-        self.id = system.id
-        super(CSV_System_id, self).__init__(system)
-
-    @classmethod
-    def query(cls):
-        for system in System.all(identity.current.user):
-            yield CSV_System_id(system)
-
-
 class CSV_Power(CSV):
     csv_type = 'power'
     reg_keys = ['fqdn', 'power_address', 'power_user', 'power_passwd', 
@@ -493,7 +758,7 @@ class CSV_Power(CSV):
     csv_keys = reg_keys + spec_keys
 
     @classmethod
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         """
         Import data from CSV file into Power Objects
         """
@@ -519,7 +784,7 @@ def _from_csv(cls,system,data,csv_type,log):
                 log.append("%s: Invalid power_type None" % system.fqdn)
                 return False
             try:
-                power_type = PowerType.by_name(data['power_type'])
+                power_type = lookups.power_type(data['power_type'])
             except InvalidRequestError:
                 log.append("%s: Invalid Power Type %s" % (system.fqdn,
                                                          data['power_type']))
@@ -533,43 +798,35 @@ def _from_csv(cls,system,data,csv_type,log):
         return True
 
     @classmethod
-    def query(cls):
-        query = System.all(identity.current.user)\
-            .filter(System.can_view_power(identity.current.user))\
-            .join(System.power)
-        for system in query:
-            yield CSV_Power(system.power)
-
-    def __init__(self, power):
-        self.power = power
-        self.fqdn = power.system.fqdn
-        self.power_address = power.power_address
-        self.power_user = power.power_user
-        self.power_passwd = power.power_passwd
-        self.power_type = power.power_type.name
-        self.power_id = power.power_id
+    def export_ids(cls, user):
+        return System.all(user).filter(System.can_view_power(user))
+
+    @classmethod
+    def export_rows(cls, system_ids):
+        return session.connection(System).execute(
+                select([System.fqdn, Power.power_address, Power.power_user,
+                    Power.power_passwd, Power.power_id, PowerType.name])
+                .select_from(System.__table__.join(Power.__table__)
+                    .join(PowerType.__table__))
+                .where(System.id.in_(system_ids))
+                .order_by(System.id))
 
 class CSV_LabInfo(CSV):
     csv_type = 'labinfo'
     csv_keys = ['fqdn', 'orig_cost', 'curr_cost', 'dimensions', 'weight', 'wattage', 'cooling']
 
     @classmethod
-    def query(cls):
-        for system in System.all(identity.current.user).join(System.labinfo):
-            yield CSV_LabInfo(system.labinfo)
-
-    def __init__(self, labinfo):
-        self.labinfo = labinfo
-        self.fqdn = labinfo.system.fqdn
-        self.orig_cost = labinfo.orig_cost
-        self.curr_cost = labinfo.curr_cost
-        self.dimensions = labinfo.dimensions
-        self.weight = labinfo.weight
-        self.wattage = labinfo.wattage
-        self.cooling = labinfo.cooling
+    def export_rows(cls, system_ids):
+        return session.connection(System).execute(
+                select([System.fqdn, LabInfo.orig_cost, LabInfo.curr_cost,
+                    LabInfo.dimensions, LabInfo.weight, LabInfo.wattage,
+                    LabInfo.cooling])
+                .select_from(System.__table__.join(LabInfo.__table__))
+                .where(System.id.in_(system_ids))
+                .order_by(System.id))
 
     @classmethod 
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         new_data = dict()
         for c_type in cls.csv_keys:
             if c_type in data:
@@ -583,38 +840,55 @@ class CSV_Exclude(CSV):
     csv_keys = ['fqdn', 'arch', 'family', 'update', 'excluded']
 
     @classmethod
-    def query(cls):
-        for system in System.all(identity.current.user):
-            for exclude in (ExcludeOSMajor.query.join('system')
-                                                .yield_per(10000)
-                                                .filter(System.id == system.id)):
-                yield CSV_Exclude(exclude)
-            for exclude in (ExcludeOSVersion.query.join('system')
-                                                  .yield_per(10000)
-                                                  .filter(System.id == system.id)):
-                yield CSV_Exclude(exclude)
+    def export_rows(cls, system_ids):
+        conn = session.connection(System)
+        osmajor_rows = conn.execute(
+                select([System.fqdn, Arch.arch, OSMajor.osmajor,
+                    ExcludeOSMajor.system_id])
+                .select_from(ExcludeOSMajor.__table__.join(System.__table__)
+                    .join(Arch.__table__).join(OSMajor.__table__))
+                .where(ExcludeOSMajor.system_id.in_(system_ids))
+                .order_by(ExcludeOSMajor.system_id, ExcludeOSMajor.id))
+        osversion_rows = conn.execute(
+                select([System.fqdn, Arch.arch, OSMajor.osmajor,
+                    OSVersion.osminor, ExcludeOSVersion.system_id])
+                .select_from(ExcludeOSVersion.__table__.join(System.__table__)
+                    .join(Arch.__table__).join(OSVersion.__table__)
+                    .join(OSMajor.__table__))
+                .where(ExcludeOSVersion.system_id.in_(system_ids))
+                .order_by(ExcludeOSVersion.system_id, ExcludeOSVersion.id))
+        excludes = _grouped(chain(
+                ((system_id, [fqdn, arch, osmajor, None, True])
+                 for fqdn, arch, osmajor, system_id in osmajor_rows),
+                ((system_id, [fqdn, arch, osmajor, osminor, True])
+                 for fqdn, arch, osmajor, osminor, system_id in osversion_rows)))
+        for system_id in system_ids:
+            for row in excludes.get(system_id, []):
+                yield row
 
     @classmethod
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         """
         Import data from CSV file into System Objects
         """
         try:
-            arch = Arch.by_name(data['arch'])
+            arch = lookups.arch(data['arch'])
         except ValueError:
             log.append("%s: Invalid Arch %s" % (system.fqdn, data['arch']))
             return False
 
         if data['update'] and data['family']:
             try:
-                osversion = OSVersion.by_name(OSMajor.by_name(unicode(data['family'])),
-                                                            unicode(data['update']))
+                osversion = lookups.osversion(lookups.osmajor(unicode(data['family'])),
+                                              unicode(data['update']))
             except InvalidRequestError:
                 log.append("%s: Invalid Family %s Update %s" % (system.fqdn,
                                                         data['family'],
                                                         data['update']))
                 return False
-            if osversion not in [oldosversion.osversion for oldosversion in system.excluded_osversion_byarch(arch)]:
+            excluded_osversions = [excluded for excluded in system.excluded_osversion
+                                   if excluded.arch == arch]
+            if osversion not in [oldosversion.osversion for oldosversion in excluded_osversions]:
                 if data['excluded'] == 'True':
                     exclude_osversion = ExcludeOSVersion(osversion=osversion,
                                                          arch=arch)
@@ -624,22 +898,24 @@ def _from_csv(cls,system,data,csv_type,log):
                             old=u'', new=u'%s/%s' % (osversion, arch))
             else:
                 if data['excluded'] == 'False':
-                    for old_osversion in system.excluded_osversion_byarch(arch):
+                    for old_osversion in excluded_osversions:
                         if old_osversion.osversion == osversion:
                             system.record_activity(user=identity.current.user,
                                     service=u'CSV', action=u'Removed',
                                     field=u'Excluded_families',
                                     old=u'%s/%s' % (old_osversion.osversion, arch),
                                     new=u'')
-                            session.delete(old_osversion)
+                            system.excluded_osversion.remove(old_osversion)
         if not data['update'] and data['family']:
             try:
-                osmajor = OSMajor.by_name(data['family'])
+                osmajor = lookups.osmajor(data['family'])
             except InvalidRequestError:
                 log.append("%s: Invalid family %s " % (system.fqdn,
                                                        data['family']))
                 return False
-            if osmajor not in [oldosmajor.osmajor for oldosmajor in system.excluded_osmajor_byarch(arch)]:
+            excluded_osmajors = [excluded for excluded in system.excluded_osmajor
+                                 if excluded.arch == arch]
+            if osmajor not in [oldosmajor.osmajor for oldosmajor in excluded_osmajors]:
                 if data['excluded'].lower() == 'true':
                     exclude_osmajor = ExcludeOSMajor(osmajor=osmajor, arch=arch)
                     system.excluded_osmajor.append(exclude_osmajor)
@@ -648,37 +924,65 @@ def _from_csv(cls,system,data,csv_type,log):
                             old=u'', new=u'%s/%s' % (osmajor, arch))
             else:
                 if data['excluded'].lower() == 'false':
-                    for old_osmajor in system.excluded_osmajor_byarch(arch):
+                    for old_osmajor in excluded_osmajors:
                         if old_osmajor.osmajor == osmajor:
                             system.record_activity(user=identity.current.user, service=u'CSV',
                                     action=u'Removed', field=u'Excluded_families',
                                     old=u'%s/%s' % (old_osmajor.osmajor, arch), new=u'')
-                            session.delete(old_osmajor)
+                            system.excluded_osmajor.remove(old_osmajor)
         return True
 
-    def __init__(self, exclude):
-        self.fqdn = exclude.system.fqdn
-        self.arch = exclude.arch
-        self.excluded = True
-        if type(exclude) == ExcludeOSMajor:
-            self.family = exclude.osmajor
-            self.update = None
-        if type(exclude) == ExcludeOSVersion:
-            self.family = exclude.osversion.osmajor
-            self.update = exclude.osversion.osminor
-
 class CSV_Install(CSV):
     csv_type = 'install'
     csv_keys = ['fqdn', 'arch', 'family', 'update', 'ks_meta', 'kernel_options', 'kernel_options_post' ]
 
     @classmethod
-    def query(cls):
-        for system in System.all(identity.current.user):
-            for install in system.provisions.itervalues():
-                yield CSV_Install(install)
+    def export_rows(cls, system_ids):
+        conn = session.connection(System)
+        provisions = conn.execute(
+                select([Provision.id, Provision.system_id, System.fqdn,
+                    Arch.arch, Provision.ks_meta, Provision.kernel_options,
+                    Provision.kernel_options_post])
+                .select_from(Provision.__table__.join(System.__table__)
+                    .join(Arch.__table__))
+                .where(Provision.system_id.in_(system_ids))
+                .order_by(Provision.system_id, Provision.id)).fetchall()
+        provision_ids = [row.id for row in provisions]
+        if not provision_ids:
+            return
+        families = _grouped((row[0], row[1:]) for row in conn.execute(
+                select([ProvisionFamily.provision_id, ProvisionFamily.id,
+                    OSMajor.osmajor, ProvisionFamily.ks_meta,
+                    ProvisionFamily.kernel_options,
+                    ProvisionFamily.kernel_options_post])
+                .select_from(ProvisionFamily.__table__.join(OSMajor.__table__))
+                .where(ProvisionFamily.provision_id.in_(provision_ids))
+                .order_by(ProvisionFamily.id)))
+        updates = _grouped((row[0], row[1:]) for row in conn.execute(
+                select([ProvisionFamilyUpdate.provision_family_id,
+                    OSVersion.osminor, ProvisionFamilyUpdate.ks_meta,
+                    ProvisionFamilyUpdate.kernel_options,
+                    ProvisionFamilyUpdate.kernel_options_post])
+                .select_from(ProvisionFamilyUpdate.__table__
+                    .join(ProvisionFamily.__table__)
+                    .join(OSVersion.__table__))
+                .where(ProvisionFamily.provision_id.in_(provision_ids))
+                .order_by(ProvisionFamilyUpdate.id)))
+        for provision in provisions:
+            fqdn, arch = provision.fqdn, provision.arch
+            yield [fqdn, arch, None, None, provision.ks_meta,
+                    provision.kernel_options, provision.kernel_options_post]
+            for family_id, osmajor, ks_meta, kernel_options, kernel_options_post \
+                    in families.get(provision.id, []):
+                yield [fqdn, arch, osmajor, None, ks_meta, kernel_options,
+                        kernel_options_post]
+                for osminor, ks_meta, kernel_options, kernel_options_post \
+                        in updates.get(family_id, []):
+                    yield [fqdn, arch, osmajor, osminor, ks_meta,
+                            kernel_options, kernel_options_post]
 
     @classmethod
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         """
         Import data from CSV file into System Objects
         """
@@ -688,7 +992,7 @@ def _from_csv(cls,system,data,csv_type,log):
         # Arch is required
         if 'arch' in data:
             try:
-                arch = Arch.by_name(data['arch'])
+                arch = lookups.arch(data['arch'])
             except ValueError:
                 log.append("%s: Invalid arch %s" % (system.fqdn, data['arch']))
                 return False
@@ -701,7 +1005,7 @@ def _from_csv(cls,system,data,csv_type,log):
             family = data['family']
             if family:
                 try:
-                    family = OSMajor.by_name(family)
+                    family = lookups.osmajor(family)
                 except InvalidRequestError:
                     log.append("%s: Error! Invalid family %s" % (system.fqdn,
                                                               data['family']))
@@ -713,7 +1017,7 @@ def _from_csv(cls,system,data,csv_type,log):
                     log.append("%s: Error! You must specify Family along with Update" % system.fqdn)
                     return False
                 try:
-                    update = OSVersion.by_name(family, unicode(update))
+                    update = lookups.osversion(family, unicode(update))
                 except InvalidRequestError:
                     log.append("%s: Error! Invalid update %s" % (system.fqdn,
                                                              data['update']))
@@ -782,62 +1086,36 @@ def _from_csv(cls,system,data,csv_type,log):
 
         return True
 
-    def __init__(self, install):
-        self.install = install
-        self.fqdn = install.system.fqdn
-        self.arch = install.arch
-
-    def to_datastruct(self):
-        datastruct = dict(fqdn = self.fqdn,
-                          arch = self.arch,
-                          family = '',
-                          update = '',
-                          ks_meta = self.install.ks_meta or '',
-                          kernel_options = self.install.kernel_options or '',
-                          kernel_options_post = self.install.kernel_options_post or '')
-        yield datastruct
-        if self.install.provision_families:
-            for family in self.install.provision_families.keys():
-                prov_family = self.install.provision_families[family]
-                datastruct['family'] = family
-                datastruct['ks_meta'] = prov_family.ks_meta or ''
-                datastruct['kernel_options'] = prov_family.kernel_options or ''
-                datastruct['kernel_options_post'] = prov_family.kernel_options_post or ''
-                yield datastruct
-                if prov_family.provision_family_updates:
-                    for update in prov_family.provision_family_updates.keys():
-                        prov_update = prov_family.provision_family_updates[update]
-                        datastruct['update'] = update.osminor
-                        datastruct['ks_meta'] = prov_update.ks_meta or ''
-                        datastruct['kernel_options'] = prov_update.kernel_options or ''
-                        datastruct['kernel_options_post'] = prov_update.kernel_options_post or ''
-                        yield datastruct
-                    datastruct['update'] = ''
-        
 class CSV_KeyValue(CSV):
     csv_type = 'keyvalue'
     csv_keys = ['fqdn', 'key', 'key_value', 'deleted' ]
 
     @classmethod
-    def query(cls):
-        for system in System.all(identity.current.user):
-            for key_int in (Key_Value_Int.query.join('system')
-                                               .yield_per(10000)
-                                               .filter(System.id == system.id)):
-                yield CSV_KeyValue(key_int)
-            for key_string in (Key_Value_String.query.join('system')
-                                               .yield_per(10000)
-                                               .filter(System.id == system.id)):
-                yield CSV_KeyValue(key_string)
+    def export_rows(cls, system_ids):
+        conn = session.connection(System)
+        key_values = {}
+        for kv in [Key_Value_Int, Key_Value_String]:
+            rows = conn.execute(
+                    select([kv.system_id, System.fqdn, Key.key_name, kv.key_value])
+                    .select_from(kv.__table__.join(System.__table__)
+                        .join(Key.__table__))
+                    .where(kv.system_id.in_(system_ids))
+                    .order_by(kv.id))
+            for system_id, fqdn, key_name, key_value in rows:
+                key_values.setdefault(system_id, []).append(
+                        [fqdn, key_name, key_value, False])
+        for system_id in system_ids:
+            for row in key_values.get(system_id, []):
+                yield row
 
     @classmethod
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         """
         Import data from CSV file into System Objects
         """
         if 'key' in data and data['key']:
             try:
-                key = Key.by_name(data['key'])
+                key = lookups.key(data['key'])
             except InvalidRequestError:
                 log.append('%s: Invalid Key %s ' % (system.fqdn, data['key']))
                 return False
@@ -847,20 +1125,14 @@ def _from_csv(cls,system,data,csv_type,log):
         if 'key_value' in data and data['key_value']:
             if key.numeric:
                 system_key_values = system.key_values_int
-                try:
-                    key_value = Key_Value_Int.by_key_value(system,
-                                                           key,
-                                                           data['key_value'])
-                except InvalidRequestError:
+                key_value = _find_key_value(system_key_values, key, data['key_value'])
+                if key_value is None:
                     key_value = Key_Value_Int(key=key,
                                               key_value=data['key_value'])
             else:
                 system_key_values = system.key_values_string
-                try:
-                    key_value = Key_Value_String.by_key_value(system,
-                                                           key,
-                                                           data['key_value'])
-                except InvalidRequestError:
+                key_value = _find_key_value(system_key_values, key, data['key_value'])
+                if key_value is None:
                     key_value = Key_Value_String(key=key,
                                                  key_value=data['key_value'])
         else:
@@ -887,34 +1159,48 @@ def _from_csv(cls,system,data,csv_type,log):
         session.add(key_value)
         return True
 
-    def __init__(self, key):
-        self.fqdn = key.system.fqdn
-        self.key = key.key
-        self.key_value = key.key_value
-        self.deleted = False
-
 class CSV_GroupUser(CSV):
     csv_type = 'user_group'
     csv_keys = ['user', 'group', 'deleted']
 
+    export_id_column = User.user_id
+
+    @classmethod
+    def export_ids(cls, user):
+        return User.query
+
     @classmethod
-    def query(cls):
-        for user in User.query:
-            for group in user.groups:
-                yield CSV_GroupUser(user, group)
+    def export_rows(cls, user_ids):
+        # Equivalent to Group.has_member, for many users at once
+        is_member = or_(
+                and_(Group.membership_type != GroupMembershipType.inverted,
+                     exists([1]).where(and_(UserGroup.user_id == User.user_id,
+                                            UserGroup.group_id == Group.group_id))),
+                and_(Group.membership_type == GroupMembershipType.inverted,
+                     not_(exists([1]).where(and_(
+                        ExcludedUserGroup.user_id == User.user_id,
+                        ExcludedUserGroup.group_id == Group.group_id)))))
+        rows = session.connection(User).execute(
+                select([User.user_name, Group.group_name])
+                .where(User.user_id.in_(user_ids))
+                .where(is_member)
+                .order_by(User.user_id, Group.group_id))
+        for user_name, group_name in rows:
+            yield [user_name, group_name, False]
 
     @classmethod
-    def from_csv(cls,user,data,log):
+    def from_csv(cls,user,data,log,lookups):
         """
         Import data from CSV file into user.groups
         """
         if 'group' in data and data['group']:
             try:
-                group = Group.by_name(data['group'])
+                group = lookups.group(data['group'])
             except InvalidRequestError:
                 group = Group(group_name=data['group'],
                               display_name=data['group'])
                 session.add(group)
+                lookups.add_group(group)
             deleted = False
             if 'deleted' in data:
                 deleted = smart_bool(data['deleted'])
@@ -931,29 +1217,29 @@ def from_csv(cls,user,data,log):
             return False
         return True
 
-    def __init__(self, user, group):
-        self.group = group.group_name
-        self.user = user.user_name
-        self.deleted = False
-
 class CSV_SystemPool(CSV):
     csv_type = 'system_pool'
     csv_keys = ['fqdn', 'pool', 'deleted']
 
     @classmethod
-    def query(cls):
-        for system in System.all(identity.current.user):
-            for pool in system.pools:
-                yield CSV_SystemPool(system, pool)
+    def export_rows(cls, system_ids):
+        rows = session.connection(System).execute(
+                select([System.fqdn, SystemPool.name])
+                .select_from(System.__table__.join(system_pool_map)
+                    .join(SystemPool.__table__))
+                .where(System.id.in_(system_ids))
+                .order_by(System.id, SystemPool.name))
+        for fqdn, pool in rows:
+            yield [fqdn, pool, False]
 
     @classmethod
-    def _from_csv(cls,system,data,csv_type,log):
+    def _from_csv(cls,system,data,csv_type,log,lookups):
         """
         Import data from CSV file into system.pool
         """
         if 'pool' in data and data['pool']:
             try:
-                pool = SystemPool.by_name(data['pool'])
+                pool = lookups.pool(data['pool'])
             except InvalidRequestError:
                 log.append('%s: pool does not exist' % data['pool'])
                 return False
@@ -976,11 +1262,6 @@ def _from_csv(cls,system,data,csv_type,log):
             return False
         return True
 
-    def __init__(self, system, pool):
-        self.pool = pool.name
-        self.fqdn = system.fqdn
-        self.deleted = False
-
 system_types = ['system', 'labinfo', 'exclude','install','keyvalue',
                 'system_pool', 'power']
 user_types   = ['user_group']
@@ -993,3 +1274,18 @@ def __init__(self, system, pool):
                   system_pool = CSV_SystemPool,
                   user_group = CSV_GroupUser,
                   power      = CSV_Power)
+
+
+@app.route('/csv/action_export', methods=['GET', 'POST'])
+@auth_required
+def export_csv():
+    """
+    Streams the requested CSV export. Rows are written to the response as
+    they are produced, window by window.
+    """
+    csv_type = request.values.get('csv_type')
+    if csv_type not in csv_types:
+        raise BadRequest400('Invalid csv_type %s' % csv_type)
+    chunks = csv_types[csv_type].iter_csv(identity.current.user)
+    return Response(stream_with_context(chunks), mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=%s.csv' % csv_type})
@@ -9,7 +9,7 @@
 from bkr.server.app import app
 from bkr.server.flask_util import json_collection, request_wants_json, \
         render_tg_template
-from bkr.server.model import (Activity, User, Distro, DistroTree,
+from bkr.server.model import (Activity, ArchivedActivity, User, Distro, DistroTree,
         LabController, System, Group, Arch, DistroActivity, DistroTreeActivity,
                               LabControllerActivity, SystemActivity, GroupActivity,
                               SystemPool, SystemPoolActivity)
@@ -26,6 +26,19 @@
     'new_value': Activity.new_value,
 }
 
+# Search field mapping for records in the activity archive.
+archived_activity_search_columns = {
+    'id': ArchivedActivity.id,
+    'type': ArchivedActivity.type,
+    'object_id': ArchivedActivity.object_id,
+    'service': ArchivedActivity.service,
+    'created': ArchivedActivity.created,
+    'field_name': ArchivedActivity.field_name,
+    'action': ArchivedActivity.action,
+    'old_value': ArchivedActivity.old_value,
+    'new_value': ArchivedActivity.new_value,
+}
+
 @app.route('/activity/', methods=['GET'])
 def get_activity():
     """
@@ -54,11 +67,20 @@ def get_activity():
         Previous value of the field before the action was performed (if applicable).
     ``new_value``
         New value of the field after the action was performed (if applicable).
+
+    If the ``archived`` query parameter is set to ``1``, records which have
+    been moved to the activity archive (see
+    :manpage:`beaker-archive-activity(8)`) are returned instead. Archived
+    records also support filtering and sorting by ``object_id``, the ID of
+    the affected object.
     """
-    query = Activity.query.order_by(Activity.id.desc())
-    json_result = json_collection(query,
-            columns=common_activity_search_columns,
-            skip_count=True)
+    if request.args.get('archived') == '1':
+        query = ArchivedActivity.query.order_by(ArchivedActivity.id.desc())
+        columns = archived_activity_search_columns
+    else:
+        query = Activity.query.order_by(Activity.id.desc())
+        columns = common_activity_search_columns
+    json_result = json_collection(query, columns=columns, skip_count=True)
     if request_wants_json():
         return jsonify(json_result)
     return render_tg_template('bkr.server.templates.backgrid', {
@@ -0,0 +1,31 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Index system.date_modified
+
+Revision ID: 1d7e5a3c9f84
+Revises: 6b8d1e4f2a93
+Create Date: 2026-10-20 00:21:37.640158
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '1d7e5a3c9f84'
+down_revision = '6b8d1e4f2a93'
+
+
+def upgrade():
+    indexes = sa.inspect(op.get_bind()).get_indexes('system')
+    if not any(index['column_names'] == ['date_modified'] for index in indexes):
+        op.create_index('ix_system_date_modified', 'system', ['date_modified'])
+
+
+def downgrade():
+    indexes = sa.inspect(op.get_bind()).get_indexes('system')
+    if any(index['name'] == 'ix_system_date_modified' for index in indexes):
+        op.drop_index('ix_system_date_modified', 'system')
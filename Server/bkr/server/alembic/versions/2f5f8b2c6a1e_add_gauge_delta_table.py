@@ -0,0 +1,31 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add gauge_delta table
+
+Revision ID: 2f5f8b2c6a1e
+Revises: 140c5eea2836
+Create Date: 2026-10-19 09:12:40.118206
+"""
+
+from alembic import op
+from sqlalchemy import Column, Integer, Unicode
+
+# revision identifiers, used by Alembic.
+revision = '2f5f8b2c6a1e'
+down_revision = '140c5eea2836'
+
+
+def upgrade():
+    op.create_table('gauge_delta',
+            Column('id', Integer, primary_key=True),
+            Column('name', Unicode(255), nullable=False),
+            Column('delta', Integer, nullable=False),
+            mysql_engine='InnoDB')
+
+
+def downgrade():
+    op.drop_table('gauge_delta')
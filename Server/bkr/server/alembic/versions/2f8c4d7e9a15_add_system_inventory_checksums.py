@@ -0,0 +1,27 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add system.inventory_checksums column
+
+Revision ID: 2f8c4d7e9a15
+Revises: 6c1f0a7b3d52
+Create Date: 2026-10-19 18:04:37.512306
+"""
+
+from alembic import op
+from sqlalchemy import Column, UnicodeText
+
+# revision identifiers, used by Alembic.
+revision = '2f8c4d7e9a15'
+down_revision = '6c1f0a7b3d52'
+
+
+def upgrade():
+    op.add_column('system', Column('inventory_checksums', UnicodeText(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('system', 'inventory_checksums')
@@ -0,0 +1,92 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add reporting fact tables
+
+Revision ID: 3e6a2d9c4b18
+Revises: 7c1f9b3e8d42
+Create Date: 2026-10-19 23:05:47.381920
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import (Column, Integer, BigInteger, ForeignKey, DateTime,
+        Date, Unicode)
+
+# revision identifiers, used by Alembic.
+revision = '3e6a2d9c4b18'
+down_revision = '7c1f9b3e8d42'
+
+
+def upgrade():
+    op.create_table('reporting_fact_day',
+        Column('day', Date, primary_key=True),
+        Column('loaded', DateTime, nullable=False),
+        mysql_engine='InnoDB'
+    )
+    op.create_table('reporting_machine_hours',
+        Column('day', Date, primary_key=True),
+        Column('user_id', Integer, ForeignKey('tg_user.user_id',
+                name='reporting_machine_hours_user_id_fk', ondelete='CASCADE'),
+                primary_key=True),
+        Column('system_id', Integer, ForeignKey('system.id',
+                name='reporting_machine_hours_system_id_fk', ondelete='CASCADE'),
+                primary_key=True),
+        Column('seconds', Integer, nullable=False),
+        mysql_engine='InnoDB'
+    )
+    op.create_table('reporting_recipe_hours',
+        Column('id', Integer, autoincrement=True, primary_key=True),
+        Column('day', Date, nullable=False, index=True),
+        Column('user_id', Integer, ForeignKey('tg_user.user_id',
+                name='reporting_recipe_hours_user_id_fk', ondelete='CASCADE'),
+                nullable=False),
+        Column('arch_id', Integer, ForeignKey('arch.id',
+                name='reporting_recipe_hours_arch_id_fk'), nullable=False),
+        Column('system_id', Integer, ForeignKey('system.id',
+                name='reporting_recipe_hours_system_id_fk', ondelete='CASCADE')),
+        Column('seconds', Integer, nullable=False),
+        mysql_engine='InnoDB'
+    )
+    op.create_table('reporting_task_duration',
+        Column('day', Date, primary_key=True),
+        Column('task_id', Integer, ForeignKey('task.id',
+                name='reporting_task_duration_task_id_fk', ondelete='CASCADE'),
+                primary_key=True),
+        Column('arch_id', Integer, ForeignKey('arch.id',
+                name='reporting_task_duration_arch_id_fk'), primary_key=True),
+        Column('executions', Integer, nullable=False),
+        Column('total_seconds', BigInteger, nullable=False),
+        Column('min_seconds', Integer, nullable=False),
+        Column('max_seconds', Integer, nullable=False),
+        mysql_engine='InnoDB'
+    )
+    op.create_table('reporting_resource_duration',
+        Column('id', Integer, autoincrement=True, primary_key=True),
+        Column('day', Date, nullable=False, index=True),
+        Column('measure', Unicode(16), nullable=False),
+        Column('fqdn', Unicode(255), nullable=False),
+        Column('recipes', Integer, nullable=False),
+        Column('total_seconds', BigInteger, nullable=False),
+        Column('min_seconds', Integer, nullable=False),
+        Column('max_seconds', Integer, nullable=False),
+        mysql_engine='InnoDB'
+    )
+    # for loading the recipes which overlap each day
+    indexes = sa.inspect(op.get_bind()).get_indexes('recipe')
+    if not any(index['column_names'] == ['finish_time'] for index in indexes):
+        op.create_index('ix_recipe_finish_time', 'recipe', ['finish_time'])
+
+
+def downgrade():
+    indexes = sa.inspect(op.get_bind()).get_indexes('recipe')
+    if any(index['name'] == 'ix_recipe_finish_time' for index in indexes):
+        op.drop_index('ix_recipe_finish_time', 'recipe')
+    op.drop_table('reporting_resource_duration')
+    op.drop_table('reporting_task_duration')
+    op.drop_table('reporting_recipe_hours')
+    op.drop_table('reporting_machine_hours')
+    op.drop_table('reporting_fact_day')
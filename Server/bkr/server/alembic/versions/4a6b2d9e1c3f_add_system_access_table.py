@@ -0,0 +1,81 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add system_access table
+
+Revision ID: 4a6b2d9e1c3f
+Revises: 2f5f8b2c6a1e
+Create Date: 2026-10-19 14:03:27.502118
+"""
+
+from alembic import op
+from sqlalchemy import Column, Integer, Enum, ForeignKey
+
+# revision identifiers, used by Alembic.
+revision = '4a6b2d9e1c3f'
+down_revision = '2f5f8b2c6a1e'
+
+
+def upgrade():
+    op.create_table('system_access',
+            Column('id', Integer, primary_key=True),
+            Column('system_id', Integer, ForeignKey('system.id',
+                name='system_access_system_id_fk', ondelete='CASCADE'),
+                nullable=False),
+            Column('user_id', Integer, ForeignKey('tg_user.user_id',
+                name='system_access_user_id_fk', ondelete='CASCADE')),
+            Column('inverted_group_id', Integer, ForeignKey('tg_group.group_id',
+                name='system_access_inverted_group_id_fk', ondelete='CASCADE')),
+            Column('permission', Enum(u'view', u'view_power', u'edit_policy',
+                u'edit_system', u'loan_any', u'loan_self', u'control_system',
+                u'reserve'), nullable=False),
+            mysql_engine='InnoDB')
+    op.create_index('ix_system_access_system_id_permission', 'system_access',
+            ['system_id', 'permission'])
+    op.create_index('ix_system_access_user_id_permission', 'system_access',
+            ['user_id', 'permission'])
+    # Populate it from the existing policies, the same way as
+    # SystemAccess.rebuild() does
+    op.execute("""
+        INSERT INTO system_access (system_id, user_id, inverted_group_id, permission)
+        SELECT system.id, system_access_policy_rule.user_id, NULL,
+            system_access_policy_rule.permission
+        FROM system
+        INNER JOIN system_access_policy_rule
+            ON system_access_policy_rule.policy_id = system.active_access_policy_id
+        WHERE system_access_policy_rule.user_id IS NOT NULL
+        UNION
+        SELECT system.id, user_group.user_id, NULL,
+            system_access_policy_rule.permission
+        FROM system
+        INNER JOIN system_access_policy_rule
+            ON system_access_policy_rule.policy_id = system.active_access_policy_id
+        INNER JOIN tg_group
+            ON system_access_policy_rule.group_id = tg_group.group_id
+        INNER JOIN user_group
+            ON user_group.group_id = tg_group.group_id
+        WHERE tg_group.membership_type != 'inverted'
+        UNION
+        SELECT system.id, NULL, NULL, system_access_policy_rule.permission
+        FROM system
+        INNER JOIN system_access_policy_rule
+            ON system_access_policy_rule.policy_id = system.active_access_policy_id
+        WHERE system_access_policy_rule.user_id IS NULL
+            AND system_access_policy_rule.group_id IS NULL
+        UNION
+        SELECT system.id, NULL, tg_group.group_id,
+            system_access_policy_rule.permission
+        FROM system
+        INNER JOIN system_access_policy_rule
+            ON system_access_policy_rule.policy_id = system.active_access_policy_id
+        INNER JOIN tg_group
+            ON system_access_policy_rule.group_id = tg_group.group_id
+        WHERE tg_group.membership_type = 'inverted'
+        """)
+
+
+def downgrade():
+    op.drop_table('system_access')
@@ -0,0 +1,55 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add activity_archive and activity_archive_summary tables
+
+Revision ID: 4a9e3c1d7b26
+Revises: 2f8c4d7e9a15
+Create Date: 2026-10-19 19:12:08.240117
+"""
+
+from alembic import op
+from sqlalchemy import (Column, Integer, ForeignKey, DateTime, Date, Unicode,
+        Index, UniqueConstraint)
+
+# revision identifiers, used by Alembic.
+revision = '4a9e3c1d7b26'
+down_revision = '2f8c4d7e9a15'
+
+
+def upgrade():
+    op.create_table('activity_archive',
+        Column('id', Integer, autoincrement=False, primary_key=True),
+        Column('user_id', Integer, ForeignKey('tg_user.user_id'), index=True),
+        Column('created', DateTime, nullable=False, index=True),
+        Column('type', Unicode(40), nullable=False),
+        Column('object_id', Integer),
+        Column('field_name', Unicode(40), nullable=False),
+        Column('service', Unicode(100), nullable=False),
+        Column('action', Unicode(40), nullable=False),
+        Column('old_value', Unicode(60)),
+        Column('new_value', Unicode(60)),
+        Index('ix_activity_archive_type_object_id', 'type', 'object_id', 'created'),
+        mysql_engine='InnoDB'
+    )
+    op.create_table('activity_archive_summary',
+        Column('id', Integer, autoincrement=True, primary_key=True),
+        Column('type', Unicode(40), nullable=False),
+        Column('object_id', Integer),
+        Column('field_name', Unicode(40), nullable=False),
+        Column('month', Date, nullable=False),
+        Column('count', Integer, nullable=False),
+        Column('first_created', DateTime, nullable=False),
+        Column('last_created', DateTime, nullable=False),
+        UniqueConstraint('type', 'object_id', 'field_name', 'month',
+                name='activity_archive_summary_uix_1'),
+        mysql_engine='InnoDB'
+    )
+
+
+def downgrade():
+    op.drop_table('activity_archive_summary')
+    op.drop_table('activity_archive')
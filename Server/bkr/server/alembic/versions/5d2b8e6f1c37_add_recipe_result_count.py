@@ -0,0 +1,28 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add recipe.result_count column
+
+Revision ID: 5d2b8e6f1c37
+Revises: 4a9e3c1d7b26
+Create Date: 2026-10-19 20:31:55.904127
+"""
+
+from alembic import op
+from sqlalchemy import Column, Integer
+
+# revision identifiers, used by Alembic.
+revision = '5d2b8e6f1c37'
+down_revision = '4a9e3c1d7b26'
+
+
+def upgrade():
+    # The count is filled in the first time it is needed for each recipe
+    op.add_column('recipe', Column('result_count', Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('recipe', 'result_count')
@@ -0,0 +1,32 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add distro_library_version table
+
+Revision ID: 6b8d1e4f2a93
+Revises: 3e6a2d9c4b18
+Create Date: 2026-10-19 23:48:12.905317
+"""
+
+from alembic import op
+from sqlalchemy import Column, Integer, BigInteger
+
+# revision identifiers, used by Alembic.
+revision = '6b8d1e4f2a93'
+down_revision = '3e6a2d9c4b18'
+
+
+def upgrade():
+    op.create_table('distro_library_version',
+        Column('id', Integer, primary_key=True),
+        Column('version', BigInteger, nullable=False),
+        mysql_engine='InnoDB'
+    )
+    op.execute("INSERT INTO distro_library_version (id, version) VALUES (1, 0)")
+
+
+def downgrade():
+    op.drop_table('distro_library_version')
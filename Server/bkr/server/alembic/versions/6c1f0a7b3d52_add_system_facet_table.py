@@ -0,0 +1,64 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add system_facet table
+
+Revision ID: 6c1f0a7b3d52
+Revises: 4a6b2d9e1c3f
+Create Date: 2026-10-19 16:21:05.218934
+"""
+
+from alembic import op
+from sqlalchemy import Column, Integer, BigInteger, Enum, ForeignKey, TEXT
+
+# revision identifiers, used by Alembic.
+revision = '6c1f0a7b3d52'
+down_revision = '4a6b2d9e1c3f'
+
+
+def upgrade():
+    op.create_table('system_facet',
+            Column('id', Integer, primary_key=True),
+            Column('system_id', Integer, ForeignKey('system.id',
+                name='system_facet_system_id_fk', ondelete='CASCADE'),
+                nullable=False),
+            Column('facet', Enum(u'cpu_flag', u'disk_size', u'key_value'),
+                nullable=False),
+            Column('key_id', Integer, ForeignKey('key_.id',
+                name='system_facet_key_id_fk', ondelete='CASCADE')),
+            Column('value', TEXT),
+            Column('int_value', BigInteger),
+            mysql_engine='InnoDB')
+    op.create_index('ix_system_facet_system_id', 'system_facet', ['system_id'])
+    op.create_index('ix_system_facet_facet_key_id_value', 'system_facet',
+            ['facet', 'key_id', 'value'], mysql_length={'value': 255})
+    op.create_index('ix_system_facet_facet_key_id_int_value', 'system_facet',
+            ['facet', 'key_id', 'int_value'])
+    # Populate it from the existing inventory, the same way as
+    # SystemFacet.rebuild() does
+    op.execute("""
+        INSERT INTO system_facet (system_id, facet, key_id, value, int_value)
+        SELECT cpu.system_id, 'cpu_flag', NULL, cpu_flag.flag, NULL
+        FROM cpu
+        INNER JOIN cpu_flag ON cpu_flag.cpu_id = cpu.id
+        WHERE cpu_flag.flag IS NOT NULL
+        UNION
+        SELECT disk.system_id, 'disk_size', NULL, NULL, disk.size
+        FROM disk
+        WHERE disk.size IS NOT NULL
+        UNION
+        SELECT key_value_string.system_id, 'key_value', key_value_string.key_id,
+            key_value_string.key_value, NULL
+        FROM key_value_string
+        UNION
+        SELECT key_value_int.system_id, 'key_value', key_value_int.key_id,
+            NULL, key_value_int.key_value
+        FROM key_value_int
+        """)
+
+
+def downgrade():
+    op.drop_table('system_facet')
@@ -0,0 +1,39 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Add system_utilisation_day table
+
+Revision ID: 7c1f9b3e8d42
+Revises: 5d2b8e6f1c37
+Create Date: 2026-10-19 21:40:31.518204
+"""
+
+from alembic import op
+from sqlalchemy import Column, Integer, ForeignKey, Date
+
+# revision identifiers, used by Alembic.
+revision = '7c1f9b3e8d42'
+down_revision = '5d2b8e6f1c37'
+
+
+def upgrade():
+    op.create_table('system_utilisation_day',
+        Column('system_id', Integer, ForeignKey('system.id',
+                name='system_utilisation_day_system_id_fk', ondelete='CASCADE'),
+                primary_key=True),
+        Column('day', Date, primary_key=True, index=True),
+        Column('recipe', Integer, nullable=False),
+        Column('manual', Integer, nullable=False),
+        Column('idle_automated', Integer, nullable=False),
+        Column('idle_manual', Integer, nullable=False),
+        Column('idle_broken', Integer, nullable=False),
+        Column('idle_removed', Integer, nullable=False),
+        mysql_engine='InnoDB'
+    )
+
+
+def downgrade():
+    op.drop_table('system_utilisation_day')
@@ -7,6 +7,7 @@
 from turbogears.database import session
 from turbogears import expose, flash, redirect, paginate, url
 from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.sql import select, func
 
 import cherrypy
 
@@ -21,7 +22,7 @@
 from bkr.server.bexceptions import DatabaseLookupError
 
 from bkr.server.model import (OSMajor, OSVersion, Distro, DistroTree,
-                             DistroTag, DistroActivity)
+                             DistroTag, DistroActivity, DistroTreeActivity)
 
 __all__ = ['Distros']
 
@@ -76,6 +77,26 @@ def get_osmajor(self, distro):
 
     get_family = get_osmajor
 
+    @expose()
+    def metadata_version(self):
+        """
+        Returns an opaque version string for the distro metadata returned by
+        :meth:`distros.get_osmajors`, :meth:`distros.get_osmajor` and
+        :meth:`distros.get_arch`. The string changes whenever a distro or
+        distro tree is added, or when one is tagged, untagged, edited or
+        expired, so clients can use it to check whether their cached copy of
+        the metadata is still current.
+
+        .. versionadded:: 29.2
+        """
+        row = session.connection(Distro).execute(select([
+                select([func.max(Distro.id)]).as_scalar(),
+                select([func.max(DistroTree.id)]).as_scalar(),
+                select([func.max(DistroActivity.id)]).as_scalar(),
+                select([func.max(DistroTreeActivity.id)]).as_scalar(),
+        ])).first()
+        return '-'.join(str(value or 0) for value in row)
+
     @expose()
     def get_arch(self, filter):
         """
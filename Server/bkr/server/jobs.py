@@ -633,7 +633,7 @@ def handleRecipe(self, xmlrecipe, user, guest=False, ignore_missing_tasks=False)
             recipe.partitions = lxml.etree.tostring(partitions, encoding=unicode)
         if xmlrecipe.find('distroRequires') is not None:
             recipe.distro_requires = lxml.etree.tostring(xmlrecipe.find('distroRequires'), encoding=unicode)
-            recipe.distro_tree = DistroTree.by_filter(recipe.distro_requires).first()
+            recipe.distro_tree = DistroTree.latest_by_filter(recipe.distro_requires)
             if recipe.distro_tree is None:
                 raise BX(_('No distro tree matches Recipe: %s') % recipe.distro_requires)
             # The attributes "tree", "initrd" and "kernel" in the installation table are populated later by the
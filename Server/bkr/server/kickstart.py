@@ -4,6 +4,7 @@
 # (at your option) any later version.
 
 import logging
+import os
 import pipes  # For pipes.quote, since it isn't available in shlex until 3.3
 import re
 import string
@@ -81,6 +82,97 @@ def _add_template(loaders, dir):
                 continue
 
     _add_template([template_env.loader], dir)
+    snippet_cache.clear()
+
+
+def _filesystem_searchpaths(loader):
+    if isinstance(loader, jinja2.FileSystemLoader):
+        for searchpath in loader.searchpath:
+            yield searchpath
+    for child in getattr(loader, 'loaders', None) or []:
+        for searchpath in _filesystem_searchpaths(child):
+            yield searchpath
+
+
+class SnippetCache(object):
+    """
+    Remembers which of the candidate paths each snippet (or kickstart
+    template) resolved to, including when none of them exist, and keeps the
+    compiled templates so that they are not reloaded and recompiled for every
+    render.
+
+    Template caching in the Jinja environment itself is disabled
+    (https://bugzilla.redhat.com/show_bug.cgi?id=862235), because an LRU keyed
+    by template name does not notice new snippets being added to /etc/beaker.
+    Instead, :meth:`check_for_changes` clears this cache whenever the mtime of
+    any directory under the template search path changes (which happens when
+    a template is created, deleted or renamed) or the loader is replaced.
+    Compiled templates are also reloaded if their own file has been modified.
+    """
+
+    #: Upper bound on the number of cached resolutions. There is one for each
+    #: combination of snippet name and system, so on a large inventory the
+    #: cache is cleared occasionally rather than being allowed to grow.
+    max_resolutions = 50000
+
+    def __init__(self, env):
+        self.env = env
+        self._signature = None
+        self.clear()
+
+    def clear(self):
+        self._resolved = {} # tuple of candidate names -> name or None
+        self._templates = {} # name -> compiled template
+
+    def _directory_mtimes(self):
+        mtimes = []
+        for searchpath in _filesystem_searchpaths(self.env.loader):
+            for top in ['snippets', 'kickstarts']:
+                for dirpath, dirnames, filenames in os.walk(os.path.join(searchpath, top)):
+                    try:
+                        mtimes.append((dirpath, os.stat(dirpath).st_mtime))
+                    except OSError:
+                        pass
+        return tuple(mtimes)
+
+    def check_for_changes(self):
+        signature = (id(self.env.loader), self._directory_mtimes())
+        if signature != self._signature:
+            self.clear()
+            self._signature = signature
+
+    def get_template(self, name):
+        template = self._templates.get(name)
+        if template is None or not template.is_up_to_date:
+            template = self.env.get_template(name)
+            self._templates[name] = template
+        return template
+
+    def resolve(self, candidates):
+        """
+        Returns the compiled template for the first of the given candidate
+        names which exists, or None if none of them exist.
+        """
+        candidates = tuple(candidates)
+        try:
+            name = self._resolved[candidates]
+        except KeyError:
+            name = None
+            for candidate in candidates:
+                try:
+                    self.get_template(candidate)
+                except jinja2.TemplateNotFound:
+                    continue
+                name = candidate
+                break
+            if len(self._resolved) >= self.max_resolutions:
+                self._resolved.clear()
+            self._resolved[candidates] = name
+        if name is None:
+            return None
+        return self.get_template(name)
+
+snippet_cache = SnippetCache(template_env)
 
 
 class TemplateRenderingEnvironment(object):
@@ -228,11 +320,9 @@ def kickstart_template(osmajor):
         'kickstarts/%s' % osmajor.rstrip(string.digits),
         'kickstarts/default',
     ]
-    for candidate in candidates:
-        try:
-            return template_env.get_template(candidate)
-        except jinja2.TemplateNotFound:
-            continue
+    template = snippet_cache.resolve(candidates)
+    if template is not None:
+        return template
     raise ValueError('No kickstart template found for %s, tried: %s'
                      % (osmajor, ', '.join(candidates)))
 
@@ -313,15 +403,10 @@ def generate_kickstart(install_options,
         'snippets/%s',
     ])
 
+    snippet_cache.check_for_changes()
+
     def snippet(name):
-        template = None
-        candidates = [location % name for location in snippet_locations]
-        for candidate in candidates:
-            try:
-                template = template_env.get_template(candidate)
-                break
-            except jinja2.TemplateNotFound:
-                continue
+        template = snippet_cache.resolve(location % name for location in snippet_locations)
         if template:
             retval = template.render(context)
             if retval and not retval.endswith('\n'):
@@ -38,11 +38,11 @@ def get_carbon():
             config.get('carbon.prefix', 'beaker.'))
     return _carbon
 
-def increment(name):
+def increment(name, value=1):
     if not config.get('carbon.address'):
         return
     carbon = get_carbon()
-    carbon.send(name, 1, int(time.time()))
+    carbon.send(name, value, int(time.time()))
 
 def measure(name, value):
     if not config.get('carbon.address'):
@@ -17,11 +17,13 @@
 
 from .base import DeclarativeMappedObject, MappedObject
 from .migration import DataMigration
+from .gauges import GaugeDelta
 from .types import (TaskStatus, CommandStatus, TaskResult, TaskPriority,
         SystemStatus, SystemType, ReleaseAction, ImageType, ResourceType,
         RecipeVirtStatus, SystemPermission, UUID, MACAddress, IPAddress,
-        GroupMembershipType, SystemSchedulerStatus)
-from .activity import Activity, ActivityMixin
+        GroupMembershipType, SystemSchedulerStatus, SystemFacetType)
+from .activity import Activity, ActivityMixin, ActivityBuffer, \
+        ArchivedActivity, ActivityArchiveSummary
 from .config import ConfigItem
 from .identity import (User, Group, Permission, SSHPubKey,
         UserGroup, ExcludedUserGroup, UserActivity, GroupActivity)
@@ -29,14 +31,16 @@
 from .distrolibrary import (Arch, KernelType, OSMajor, OSVersion,
         OSMajorInstallOptions, Distro, DistroTree, DistroTreeImage,
         DistroTreeRepo, DistroTag, DistroActivity, DistroTreeActivity,
-        LabControllerDistroTree, install_options_for_distro)
+        LabControllerDistroTree, DistroLibraryVersion, DistroFilterCache,
+        install_options_for_distro)
 from .tasklibrary import (Task, TaskLibrary, TaskPackage, TaskType,
         TaskBugzilla, TaskPropertyNeeded)
 from .inventory import (System, SystemStatusDuration, SystemCc, Hypervisor,
         Cpu, CpuFlag, Disk, Device, DeviceClass, Numa, Power, PowerType, Note,
         Key, Key_Value_String, Key_Value_Int, Provision, ProvisionFamily,
         ProvisionFamilyUpdate, ExcludeOSMajor, ExcludeOSVersion, LabInfo,
-        SystemAccessPolicy, SystemAccessPolicyRule, Reservation,
+        SystemAccessPolicy, SystemAccessPolicyRule, SystemAccess, SystemFacet,
+        Reservation, SystemUtilisationDay,
         SystemActivity, Command, SystemPool, SystemPoolActivity)
 from .installation import Installation, RenderedKickstart
 from .scheduler import (Watchdog, TaskBase, Job, RecipeSet, Recipe,
@@ -49,6 +53,8 @@
 from .reviewing import RecipeSetComment, RecipeReviewedState, RecipeTaskComment,\
     RecipeTaskResultComment
 from .openstack import OpenStackRegion
+from .reporting import (ReportingFactDay, MachineHoursFact, RecipeHoursFact,
+        TaskDurationFact, ResourceDurationFact)
 
 # Delayed property definitions due to circular dependencies
 class_mapper(Group).add_properties({
@@ -5,12 +5,17 @@
 # (at your option) any later version.
 
 import logging
+import types
+from collections import OrderedDict
 from datetime import datetime
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, Unicode
-from sqlalchemy.orm import object_mapper, relationship
+from sqlalchemy import (Column, Integer, ForeignKey, DateTime, Date, Unicode,
+        Index, UniqueConstraint, event, select, func, and_, exists)
+from sqlalchemy.orm import (object_mapper, class_mapper, object_session,
+        relationship, Session, SynonymProperty)
 from turbogears.database import session
 from bkr.server import identity
 from .base import DeclarativeMappedObject
+from .sql import insert_rows
 
 log = logging.getLogger(__name__)
 
@@ -40,26 +45,9 @@ def __init__(self, user=None, service=None, action=None,
         """
         super(Activity, self).__init__(**kw)
         self.user = user
-        self.service = service
-        try:
-            if identity.current.proxied_by_user is not None:
-                self.service = identity.current.proxied_by_user.user_name
-        except identity.RequestRequiredException:
-            pass
-
-        field_name_value_max_length = object_mapper(self).c.field_name.type.length
-        old_value_max_length        = object_mapper(self).c.old_value.type.length
-        new_value_max_length        = object_mapper(self).c.new_value.type.length
-        self.field_name = field_name[:field_name_value_max_length]
         self.action = action
-
-        if old_value is not None:
-            old_value = unicode(old_value)[:old_value_max_length]
-        if new_value is not None:
-            new_value = unicode(new_value)[:new_value_max_length]
-
-        self.old_value = old_value
-        self.new_value = new_value
+        self.service, self.field_name, self.old_value, self.new_value = \
+                _normalised_values(service, field_name, old_value, new_value)
 
     def __json__(self):
         return {
@@ -92,6 +80,165 @@ def object_id(self):
     def object_name(self):
         return None
 
+def _normalised_values(service, field_name, old_value, new_value):
+    """
+    Returns the service, field name, old value and new value to be stored
+    for an activity record.
+    """
+    try:
+        if identity.current.proxied_by_user is not None:
+            service = identity.current.proxied_by_user.user_name
+    except identity.RequestRequiredException:
+        pass
+    columns = Activity.__table__.c
+    field_name = field_name[:columns.field_name.type.length]
+    if old_value is not None:
+        old_value = unicode(old_value)[:columns.old_value.type.length]
+    if new_value is not None:
+        new_value = unicode(new_value)[:columns.new_value.type.length]
+    return service, field_name, old_value, new_value
+
+def _object_id_column(activity_type):
+    """
+    Returns the column of the activity_type's own table which refers to the
+    object, for example system_activity.system_id.
+    """
+    mapper = class_mapper(activity_type)
+    prop = mapper.get_property('object_id')
+    if isinstance(prop, SynonymProperty):
+        prop = mapper.get_property(prop.name)
+    return prop.columns[0]
+
+class ActivityBuffer(object):
+    """
+    Activity records waiting to be written for a session. They are written
+    when the session is next flushed (or committed) with one multi-row
+    INSERT per activity table, instead of each record being flushed as an
+    ORM object. Records added during a transaction or savepoint which is
+    rolled back are discarded.
+
+    Buffered records do not appear in the object's activity relationship
+    until it is next loaded.
+    """
+
+    #: Records are inserted in batches of at most this many rows.
+    batch_size = 1000
+
+    def __init__(self):
+        self.entries = []
+
+    @classmethod
+    def for_session(cls, sess):
+        buffer = sess.info.get('activity_buffer')
+        if buffer is None:
+            buffer = sess.info['activity_buffer'] = cls()
+            # Session.flush() returns early when nothing in the session is
+            # dirty, without firing any flush events, so the buffer would
+            # otherwise stay unwritten until commit.
+            sess.flush = types.MethodType(_flush_with_activity_buffer, sess)
+        return buffer
+
+    def add(self, sess, activity_type, obj, object_id, user, service, field,
+            action, old, new):
+        """
+        Buffers an activity record against *obj*, or against *object_id*
+        if the object is not loaded. The object may still be pending, its
+        id is only needed when the record is written.
+        """
+        service, field, old, new = _normalised_values(service, field, old, new)
+        values = dict(created=datetime.utcnow(),
+                type=class_mapper(activity_type).polymorphic_identity,
+                field_name=field, service=service, action=action,
+                old_value=old, new_value=new)
+        self.entries.append((sess.transaction, activity_type, obj, object_id,
+                user, values))
+
+    def _split(self, transaction):
+        """
+        Returns the records added while the given transaction, or any
+        transaction nested inside it, was in progress, and the rest.
+        """
+        transaction = _real_transaction(transaction)
+        within, rest = [], []
+        for entry in self.entries:
+            entry_transaction = entry[0]
+            if entry_transaction is None:
+                # added outside of any transaction
+                within.append(entry)
+                continue
+            while entry_transaction is not None and entry_transaction is not transaction:
+                entry_transaction = entry_transaction._parent
+            (within if entry_transaction is not None else rest).append(entry)
+        return within, rest
+
+    def discard(self, transaction):
+        discarded, self.entries = self._split(transaction)
+
+    def write(self, connection, transaction):
+        """
+        Writes the records belonging to the given transaction. Records
+        belonging to an enclosing transaction are kept until that
+        transaction is flushed, so that they are not lost if a savepoint
+        is rolled back.
+        """
+        entries, self.entries = self._split(transaction)
+        rows_by_type = OrderedDict()
+        for _, activity_type, obj, object_id, user, values in entries:
+            if obj is not None:
+                object_id = object_mapper(obj).primary_key_from_instance(obj)[0]
+            row = dict(values, user_id=user.user_id if user is not None else None)
+            rows_by_type.setdefault(activity_type, []).append((object_id, row))
+        for activity_type, rows in rows_by_type.iteritems():
+            object_id_column = _object_id_column(activity_type)
+            for start in xrange(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                ids = insert_rows(connection, Activity.__table__,
+                        [row for _, row in batch])
+                connection.execute(activity_type.__table__.insert(), [
+                        {'id': id, object_id_column.key: object_id}
+                        for id, (object_id, _) in zip(ids, batch)])
+
+def _real_transaction(transaction):
+    """
+    Returns the savepoint or top-level transaction which the given
+    (possibly sub-) transaction belongs to.
+    """
+    while (transaction is not None and not transaction.nested
+            and transaction._parent is not None):
+        transaction = transaction._parent
+    return transaction
+
+def _flush_with_activity_buffer(sess, objects=None):
+    type(sess).flush(sess, objects)
+    buffer = sess.info.get('activity_buffer')
+    if buffer is not None and buffer.entries:
+        # The flush had nothing else to do so after_flush never fired, or
+        # these belong to an enclosing transaction and write() keeps them.
+        with sess.begin(subtransactions=True):
+            buffer.write(sess.connection(), sess.transaction)
+
+@event.listens_for(Session, 'after_flush')
+def write_activity_buffer_after_flush(sess, flush_context):
+    buffer = sess.info.get('activity_buffer')
+    if buffer is not None and buffer.entries:
+        buffer.write(sess.connection(), sess.transaction)
+
+@event.listens_for(Session, 'before_commit')
+def write_activity_buffer_before_commit(sess):
+    buffer = sess.info.get('activity_buffer')
+    if buffer is not None and buffer.entries:
+        # Flushing first ensures pending objects have been assigned ids,
+        # and writes the buffer if there was anything to flush.
+        sess.flush()
+        if buffer.entries:
+            buffer.write(sess.connection(), sess.transaction)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_activity_buffer_after_rollback(sess, previous_transaction):
+    buffer = sess.info.get('activity_buffer')
+    if buffer is not None and buffer.entries:
+        buffer.discard(previous_transaction)
+
 class ActivityMixin(object):
     """Helper to create activity records and append them to an activity log
 
@@ -128,12 +275,34 @@ def _record_activity_inner(self, service, field, action=u'Changed',
         entry = self.activity_type(user, service, action=action,
                                    field_name=field,
                                    old_value=old, new_value=new, object=self)
-        log_details = dict(kind=self.activity_type.__name__, user=user,
-                           service=service, action=action,
-                           field=field, old=old, new=new, object_id=self.id)
-        log.debug(self._log_fmt, log_details)
+        if log.isEnabledFor(logging.DEBUG):
+            log_details = dict(kind=self.activity_type.__name__, user=user,
+                               service=service, action=action,
+                               field=field, old=old, new=new, object_id=self.id)
+            log.debug(self._log_fmt, log_details)
         return entry
 
+    def record_buffered_activity(self, **kwds):
+        """
+        Like record_activity, but the record is buffered and written
+        together with any others in a bulk insert when the session is next
+        flushed. Nothing is returned, and the record will not appear in
+        this object's activity relationship until it is reloaded. Suitable
+        for code paths which record many changes at once.
+        """
+        self._record_buffered_activity_inner(**kwds)
+
+    def _record_buffered_activity_inner(self, service, field,
+            action=u'Changed', old=None, new=None, user=None):
+        sess = object_session(self) or session.registry()
+        ActivityBuffer.for_session(sess).add(sess, self.activity_type, self,
+                None, user, service, field, action, old, new)
+        if log.isEnabledFor(logging.DEBUG):
+            log_details = dict(kind=self.activity_type.__name__, user=user,
+                               service=service, action=action,
+                               field=field, old=old, new=new, object_id=self.id)
+            log.debug(self._log_fmt, log_details)
+
     @classmethod
     def record_bulk_activity(cls, query, **kwds):
         """
@@ -145,11 +314,161 @@ def record_bulk_activity(cls, query, **kwds):
     @classmethod
     def _record_bulk_activity_inner(cls, query, service, field,
             action=u'Changed', old=None, new=None, user=None):
+        sess = query.session
+        buffer = ActivityBuffer.for_session(sess)
+        debug = log.isEnabledFor(logging.DEBUG)
         for object_id, in query.values(cls.id):
-            entry = cls.activity_type(user, service, action=action,
-                    field_name=field, old_value=old, new_value=new,
-                    object_id=object_id)
-            log_details = dict(kind=cls.activity_type.__name__, user=user,
-                               service=service, action=action,
-                               field=field, old=old, new=new, object_id=object_id)
-            log.debug(cls._log_fmt, log_details)
+            buffer.add(sess, cls.activity_type, None, object_id, user,
+                    service, field, action, old, new)
+            if debug:
+                log_details = dict(kind=cls.activity_type.__name__, user=user,
+                                   service=service, action=action,
+                                   field=field, old=old, new=new, object_id=object_id)
+                log.debug(cls._log_fmt, log_details)
+
+class ArchivedActivity(DeclarativeMappedObject):
+    """
+    An activity record which has been moved out of the activity tables by
+    beaker-archive-activity. Archived records are not linked to their object,
+    the object is identified by the record's type and object_id instead.
+    """
+
+    __tablename__ = 'activity_archive'
+    __table_args__ = (
+        Index('ix_activity_archive_type_object_id', 'type', 'object_id', 'created'),
+        {'mysql_engine': 'InnoDB'})
+    # The id of the original activity record
+    id = Column(Integer, autoincrement=False, primary_key=True)
+    user_id = Column(Integer, ForeignKey('tg_user.user_id'), index=True)
+    user = relationship('User')
+    created = Column(DateTime, nullable=False, index=True)
+    type = Column(Unicode(40), nullable=False)
+    object_id = Column(Integer)
+    field_name = Column(Unicode(40), nullable=False)
+    service = Column(Unicode(100), nullable=False)
+    action = Column(Unicode(40), nullable=False)
+    old_value = Column(Unicode(60))
+    new_value = Column(Unicode(60))
+
+    def __json__(self):
+        return {
+            'id': self.id,
+            'created': self.created,
+            'user': self.user,
+            'service': self.service,
+            'action': self.action,
+            'field_name': self.field_name,
+            'old_value': self.old_value,
+            'new_value': self.new_value,
+            'type': self.type,
+            'object_id': self.object_id,
+            'archived': True,
+        }
+
+    @classmethod
+    def archive(cls, before, limit=1000):
+        """
+        Moves up to *limit* of the oldest activity records created before
+        *before* into the archive, and adds them to the archive summary.
+        Returns the number of records which were archived.
+        """
+        connection = session.connection(Activity)
+        activity = Activity.__table__
+        ids = [id for id, in connection.execute(select([activity.c.id])
+                .where(activity.c.created < before)
+                .order_by(activity.c.id).limit(limit))]
+        if not ids:
+            return 0
+        type_tables = [(mapper.local_table, _object_id_column(mapper.class_))
+                for mapper in class_mapper(Activity).polymorphic_map.values()
+                if mapper.local_table is not activity]
+        source = activity
+        for table, _ in type_tables:
+            source = source.outerjoin(table, table.c.id == activity.c.id)
+        object_id = func.coalesce(*[column for _, column in type_tables])
+        columns = ['id', 'user_id', 'created', 'type', 'object_id',
+                'field_name', 'service', 'action', 'old_value', 'new_value']
+        connection.execute(cls.__table__.insert().from_select(columns,
+                select([activity.c.id, activity.c.user_id, activity.c.created,
+                        activity.c.type, object_id, activity.c.field_name,
+                        activity.c.service, activity.c.action,
+                        activity.c.old_value, activity.c.new_value])
+                .select_from(source)
+                .where(activity.c.id.in_(ids))))
+        ActivityArchiveSummary.add(connection, ids)
+        for table, _ in type_tables:
+            connection.execute(table.delete().where(table.c.id.in_(ids)))
+        connection.execute(activity.delete().where(activity.c.id.in_(ids)))
+        return len(ids)
+
+    @classmethod
+    def for_object(cls, activity_type, object_id):
+        return cls.query.filter(
+                cls.type == class_mapper(activity_type).polymorphic_identity,
+                cls.object_id == object_id)
+
+class ActivityArchiveSummary(DeclarativeMappedObject):
+    """
+    The number of archived activity records for each object, field and
+    month. Used to find out whether the archive needs to be searched at all
+    without scanning it.
+    """
+
+    __tablename__ = 'activity_archive_summary'
+    __table_args__ = (
+        UniqueConstraint('type', 'object_id', 'field_name', 'month',
+                name='activity_archive_summary_uix_1'),
+        {'mysql_engine': 'InnoDB'})
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    type = Column(Unicode(40), nullable=False)
+    object_id = Column(Integer)
+    field_name = Column(Unicode(40), nullable=False)
+    # The first day of the month
+    month = Column(Date, nullable=False)
+    count = Column(Integer, nullable=False)
+    first_created = Column(DateTime, nullable=False)
+    last_created = Column(DateTime, nullable=False)
+
+    @classmethod
+    def add(cls, connection, ids):
+        """
+        Counts the newly archived records with the given ids into the summary.
+        """
+        archive = ArchivedActivity.__table__
+        totals = {}
+        for type, object_id, field_name, created in connection.execute(
+                select([archive.c.type, archive.c.object_id,
+                        archive.c.field_name, archive.c.created])
+                .where(archive.c.id.in_(ids))):
+            key = (type, object_id, field_name, created.date().replace(day=1))
+            count, first, last = totals.get(key, (0, created, created))
+            totals[key] = (count + 1, min(first, created), max(last, created))
+        table = cls.__table__
+        for (type, object_id, field_name, month), (count, first, last) \
+                in totals.iteritems():
+            # Records are archived oldest first, so an existing row for the
+            # month only ever needs its last_created moved forwards.
+            result = connection.execute(table.update()
+                    .where(and_(table.c.type == type,
+                                table.c.object_id == object_id,
+                                table.c.field_name == field_name,
+                                table.c.month == month))
+                    .values(count=table.c.count + count, last_created=last))
+            if result.rowcount == 0:
+                connection.execute(table.insert(), type=type,
+                        object_id=object_id, field_name=field_name,
+                        month=month, count=count, first_created=first,
+                        last_created=last)
+
+    @classmethod
+    def has_archived(cls, activity_type, object_id, since=None):
+        """
+        Returns True if there are any archived activity records for the
+        given object, optionally only those created since the given datetime.
+        """
+        clause = and_(
+                cls.type == class_mapper(activity_type).polymorphic_identity,
+                cls.object_id == object_id)
+        if since is not None:
+            clause = and_(clause, cls.last_created >= since)
+        return session.query(exists().where(clause)).scalar()
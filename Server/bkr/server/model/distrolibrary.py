@@ -5,18 +5,23 @@
 # (at your option) any later version.
 
 import re
+import threading
+import time
 from datetime import datetime
+from itertools import chain
 import urlparse
 import xml.dom.minidom
 import lxml.etree
 from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint, Integer,
-        String, Unicode, DateTime, UnicodeText, Boolean)
+        BigInteger, String, Unicode, DateTime, UnicodeText, Boolean, event, func,
+        inspect)
 from sqlalchemy.sql import select, exists, or_
 from sqlalchemy.orm import (relationship, backref, dynamic_loader, synonym,
-                            validates)
+                            validates, Session)
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.associationproxy import association_proxy
+from turbogears import config
 from turbogears.database import session
 from bkr.server import identity
 from bkr.server.helpers import make_link
@@ -658,10 +663,14 @@ def add_tag(self, tag):
         Adds the given tag to this distro if it's not already present.
         """
         tagobj = DistroTag.lazy_create(tag=tag)
-        session.connection(self.__class__).execute(ConditionalInsert(
+        connection = session.connection(self.__class__)
+        result = connection.execute(ConditionalInsert(
                 distro_tag_map,
                 {distro_tag_map.c.distro_id: self.id,
                  distro_tag_map.c.distro_tag_id: tagobj.id}))
+        # This bypasses the session, so the after_flush hook will not see it
+        if result.rowcount:
+            DistroLibraryVersion.bump(connection)
 
 class DistroTree(DeclarativeMappedObject, ActivityMixin):
 
@@ -707,6 +716,36 @@ def by_filter(cls, filter):
         query = apply_distro_filter(filter, query)
         return query.order_by(DistroTree.date_created.desc())
 
+    @classmethod
+    def latest_by_filter_per_arch(cls, filter):
+        """
+        Returns a dict of Arch -> the most recently created distro tree
+        matching the given filter (in the same way as by_filter) for that arch.
+
+        Results are cached per process, see DistroFilterCache.
+        """
+        cache = distro_filter_cache()
+        if cache is not None:
+            tree_ids = cache.lookup(filter)
+        else:
+            tree_ids = _resolve_distro_filter(filter)
+        if not tree_ids:
+            return {}
+        trees = cls.query.filter(cls.id.in_(tree_ids.values())).all()
+        return dict((tree.arch, tree) for tree in trees)
+
+    @classmethod
+    def latest_by_filter(cls, filter):
+        """
+        Returns the most recently created distro tree matching the given
+        filter, or None. Equivalent to by_filter(filter).first() but the
+        result is cached.
+        """
+        trees = cls.latest_by_filter_per_arch(filter).values()
+        if not trees:
+            return None
+        return max(trees, key=lambda tree: (tree.date_created, tree.id))
+
     def __json__(self):
         return {
             'id': self.id,
@@ -902,3 +941,211 @@ def used(cls, query=None):
         if query is None:
             query = cls.query
         return query.filter(DistroTag.distros.any())
+
+
+def _normalised_filter_xml(filter):
+    """
+    Returns a canonical serialisation of the given distro filter XML, so that
+    filters which differ only in whitespace, comments or attribute order share
+    a cache entry.
+    """
+    parser = lxml.etree.XMLParser(remove_blank_text=True, remove_comments=True)
+    if isinstance(filter, unicode):
+        filter = filter.encode('utf8')
+    root = lxml.etree.fromstring(filter, parser)
+    for element in root.iter(tag=lxml.etree.Element):
+        attrib = sorted(element.attrib.items())
+        element.attrib.clear()
+        element.attrib.update(attrib)
+        if element.text is not None:
+            element.text = element.text.strip() or None
+        element.tail = None
+    return lxml.etree.tostring(root)
+
+
+class DistroLibraryVersion(DeclarativeMappedObject):
+    """
+    A single row whose version is incremented by every transaction which
+    changes distros, distro trees, their tags or their lab controller
+    associations. Other processes compare it to notice the change.
+    """
+    __tablename__ = 'distro_library_version'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, connection):
+        table = cls.__table__
+        result = connection.execute(table.update()
+                .where(table.c.id == 1)
+                .values(version=table.c.version + 1))
+        if result.rowcount == 0:
+            connection.execute(ConditionalInsert(table,
+                    {table.c.id: 1}, {table.c.version: 1}))
+
+
+def _distro_version_stamp():
+    """
+    Returns a value which changes whenever distros, distro trees, their tags
+    or their lab controller associations change. It only reads the version
+    row and the highest distro tree and lab controller association ids, so
+    it is cheap enough to check on every cache lookup in order to notice
+    changes made by other processes (such as beaker-import running against
+    the web application).
+    """
+    lca = LabControllerDistroTree.__table__
+    version = DistroLibraryVersion.__table__
+    return tuple(session.connection(DistroTree).execute(select([
+        select([version.c.version]).where(version.c.id == 1).as_scalar(),
+        select([func.max(DistroTree.id)]).as_scalar(),
+        select([func.max(lca.c.id)]).as_scalar(),
+    ])).first())
+
+
+def _resolve_distro_filter(filter):
+    """
+    Returns a dict of arch id -> id of the most recently created distro tree
+    matching the given filter for that arch.
+    """
+    # Delayed import to avoid circular dependency
+    from bkr.server.needpropertyxml import apply_distro_filter
+    query = session.query(DistroTree.arch_id, func.max(DistroTree.date_created))\
+            .filter(DistroTree.lab_controller_assocs.any())
+    query = apply_distro_filter(filter, query).group_by(DistroTree.arch_id)
+    result = {}
+    for arch_id, date_created in query.all():
+        tree_id = DistroTree.by_filter(filter)\
+                .filter(DistroTree.arch_id == arch_id)\
+                .filter(DistroTree.date_created == date_created)\
+                .order_by(DistroTree.id.desc())\
+                .with_entities(DistroTree.id).first()
+        if tree_id is not None:
+            result[arch_id] = tree_id[0]
+    return result
+
+
+class DistroFilterCache(object):
+    """
+    Caches the resolution of distro filters (<distroRequires/>) to the latest
+    matching distro tree for each arch, keyed by the normalised filter XML.
+    The same handful of filters (typically "latest nightly of some release")
+    are resolved for nearly every recipe submitted.
+
+    The whole cache is discarded whenever the distro version stamp changes, or
+    when this process flushes changes to distros, distro trees, tags or lab
+    controller associations. Entries are also discarded after *ttl* seconds
+    as a safety net for changes which the version stamp does not capture.
+    """
+
+    #: Maximum number of filters to keep results for.
+    max_entries = 1000
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stamp = None
+
+    def lookup(self, filter):
+        """
+        Returns a dict of arch id -> distro tree id for the given filter.
+        """
+        key = _normalised_filter_xml(filter)
+        stamp = _distro_version_stamp()
+        now = time.time()
+        with self._lock:
+            if stamp != self._stamp:
+                self._entries.clear()
+                self._stamp = stamp
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                return entry[1]
+        result = _resolve_distro_filter(filter)
+        with self._lock:
+            if stamp == self._stamp:
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+                self._entries[key] = (now, result)
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._stamp = None
+
+
+_distro_filter_cache = None
+
+
+def distro_filter_cache():
+    """
+    Returns the DistroFilterCache for this process, or None if it is disabled
+    by setting beaker.distro_filter_cache_ttl to 0.
+    """
+    global _distro_filter_cache
+    ttl = config.get('beaker.distro_filter_cache_ttl', 300)
+    if ttl <= 0:
+        return None
+    if _distro_filter_cache is None:
+        _distro_filter_cache = DistroFilterCache(ttl)
+    return _distro_filter_cache
+
+
+# The relationships of each class which distro filters can match on, in
+# addition to its columns. Others, such as DistroTree.recipes (which is
+# appended to whenever a recipe is submitted for the tree) and activity, do
+# not affect which distro trees match.
+_distro_library_relationships = {
+    Distro: ['_tags'],
+    DistroTree: ['lab_controller_assocs'],
+    DistroTag: ['distros'],
+    LabControllerDistroTree: [],
+}
+
+
+def _changes_distro_library(obj):
+    """
+    Returns True if flushing the modified object *obj* changes anything which
+    distro filters can match on.
+    """
+    for cls, relationships in _distro_library_relationships.iteritems():
+        if isinstance(obj, cls):
+            break
+    else:
+        return False
+    state = inspect(obj)
+    names = [prop.key for prop in state.mapper.column_attrs] + relationships
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_distro_filter_cache_after_flush(sess, flush_context):
+    """
+    Discards cached distro filter results when this session changes distros,
+    distro trees, tags or lab controller associations, and bumps the distro
+    library version so that other processes discard theirs. They are
+    discarded again when the transaction ends, in case results were cached in
+    the meantime from uncommitted (or rolled back) data.
+    """
+    for obj in chain(sess.new, sess.deleted):
+        if isinstance(obj, tuple(_distro_library_relationships)):
+            break
+    else:
+        for obj in sess.dirty:
+            if _changes_distro_library(obj):
+                break
+        else:
+            return
+    DistroLibraryVersion.bump(sess.connection(mapper=DistroLibraryVersion.__mapper__))
+    if _distro_filter_cache is not None:
+        _distro_filter_cache.invalidate()
+        sess.info['distro_filter_cache_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def invalidate_distro_filter_cache_after_transaction(sess):
+    if sess.info.pop('distro_filter_cache_stale', False) \
+            and _distro_filter_cache is not None:
+        _distro_filter_cache.invalidate()
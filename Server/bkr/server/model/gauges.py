@@ -0,0 +1,184 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Incremental maintenance of the real-time queue and utilisation gauges.
+
+Rather than having beakerd re-count every recipe, system and command on each
+metrics pass, the code paths which move an object from one state to another
+also insert a row into the gauge_delta table describing which gauges went up
+and which went down. The row is inserted in the same transaction as the state
+change itself, so it only becomes visible if the state change is committed.
+
+beakerd drains these rows periodically and applies them to its in-memory copy
+of the gauges. Transitions which are not tracked here (for example a system
+moving to a different lab, or a recipe changing its virt status) are corrected
+when beakerd periodically reconciles the gauges against the real tables.
+"""
+
+import logging
+from sqlalchemy import Column, Integer, Unicode
+from sqlalchemy.sql import select, func
+from turbogears import config
+from turbogears.database import session
+from .base import DeclarativeMappedObject
+from .types import RecipeVirtStatus
+
+log = logging.getLogger(__name__)
+
+class GaugeDelta(DeclarativeMappedObject):
+
+    __tablename__ = 'gauge_delta'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(255), nullable=False)
+    delta = Column(Integer, nullable=False)
+
+    @classmethod
+    def record(cls, old_names, new_names, connection=None):
+        """
+        Records that an object has stopped being counted under the gauges
+        *old_names* and is now counted under the gauges *new_names*. Either
+        may be empty, for objects which are appearing or disappearing.
+
+        The rows are inserted using *connection* if given (for use inside
+        mapper events) otherwise using the current session's connection.
+
+        Nothing is recorded when metrics reporting is disabled, since beakerd
+        will not be draining the table.
+        """
+        if not config.get('carbon.address'):
+            return
+        deltas = {}
+        for name in old_names:
+            deltas[name] = deltas.get(name, 0) - 1
+        for name in new_names:
+            deltas[name] = deltas.get(name, 0) + 1
+        rows = [{'name': name, 'delta': delta}
+                for name, delta in deltas.iteritems() if delta]
+        if not rows:
+            return
+        if connection is None:
+            connection = session.connection(cls)
+        connection.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def drain(cls, connection, batch_size=1000):
+        """
+        Returns a dict of (gauge name -> net delta) for all committed gauge
+        deltas, deleting the rows as they are consumed. Rows are deleted by id
+        rather than by high-water mark, since rows from transactions which
+        commit later may still be assigned a lower id.
+        """
+        table = cls.__table__
+        totals = {}
+        while True:
+            rows = connection.execute(select([table.c.id, table.c.name, table.c.delta])
+                    .order_by(table.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            for id, name, delta in rows:
+                totals[name] = totals.get(name, 0) + delta
+            connection.execute(table.delete().where(
+                    table.c.id.in_([row[0] for row in rows])))
+            if len(rows) < batch_size:
+                break
+        return totals
+
+    @classmethod
+    def max_id(cls, connection):
+        return connection.scalar(select([func.max(cls.__table__.c.id)]))
+
+    @classmethod
+    def discard_up_to(cls, connection, max_id):
+        """
+        Discards all deltas up to and including *max_id*, because a fresh
+        reconciliation has already accounted for them.
+        """
+        if max_id is None:
+            return
+        connection.execute(cls.__table__.delete().where(
+                cls.__table__.c.id <= max_id))
+
+
+def _metric_part(value):
+    # Graphite uses . as its path separator
+    return value.replace('.', '_')
+
+def recipe_gauge_names(recipe, status=None):
+    """
+    Returns the names of the recipe queue gauges which the given machine recipe
+    counts towards while it is in the given status (defaults to its current
+    status). These correspond to the gauges produced by
+    bkr.server.tools.beakerd.recipe_count_metrics().
+    """
+    if status is None:
+        status = recipe.status
+    if status.finished:
+        return []
+    names = ['recipes_%s.all' % status.name]
+    if recipe.virt_status == RecipeVirtStatus.possible:
+        names.append('recipes_%s.dynamic_virt_possible' % status.name)
+    if recipe.distro_tree is not None:
+        names.append('recipes_%s.by_arch.%s'
+                % (status.name, recipe.distro_tree.arch.arch))
+    return names
+
+def system_utilisation_state(system):
+    """
+    Returns the current utilisation state of the system, as used by
+    bkr.server.utilisation.system_utilisation_counts(): either the type of its
+    open reservation, or "idle_" followed by its status.
+    """
+    if system.user is not None and system.open_reservation is not None:
+        return system.open_reservation.type
+    return idle_state(system.status)
+
+def idle_state(status):
+    return 'idle_%s' % status.value.lower()
+
+def system_gauge_names(system, state):
+    """
+    Returns the names of the system utilisation gauges which the given system
+    counts towards while it is in the given utilisation state. These
+    correspond to the gauges produced by
+    bkr.server.tools.beakerd.system_count_metrics(), except for the "shared"
+    gauge which depends on the system's access policy and is only maintained
+    by reconciliation.
+    """
+    if state == 'idle_removed':
+        return []
+    names = ['systems_%s.all' % state]
+    names.extend('systems_%s.by_arch.%s' % (state, _metric_part(arch.arch))
+            for arch in system.arch)
+    if system.lab_controller is not None:
+        names.append('systems_%s.by_lab.%s'
+                % (state, _metric_part(system.lab_controller.fqdn)))
+    return names
+
+def command_gauge_names(command, status=None):
+    """
+    Returns the names of the command queue gauges which the given command
+    counts towards while it is in the given status (defaults to its current
+    status). These correspond to the gauges produced by
+    bkr.server.tools.beakerd.system_command_metrics().
+    """
+    if status is None:
+        status = command.status
+    if status.finished:
+        return []
+    system = command.system
+    names = ['system_commands_%s.all' % status.name]
+    if system is None:
+        return names
+    if system.lab_controller is not None:
+        names.append('system_commands_%s.by_lab.%s'
+                % (status.name, _metric_part(system.lab_controller.fqdn)))
+    names.extend('system_commands_%s.by_arch.%s'
+            % (status.name, _metric_part(arch.arch)) for arch in system.arch)
+    if system.power is not None and system.power.power_type is not None:
+        names.append('system_commands_%s.by_power_type.%s'
+                % (status.name, _metric_part(system.power.power_type.name)))
+    return names
@@ -16,9 +16,8 @@
 from kid import Element
 import passlib.context
 from sqlalchemy import (Table, Column, ForeignKey, Integer, Unicode,
-        UnicodeText, String, DateTime, Boolean, UniqueConstraint)
-from sqlalchemy.orm import mapper, relationship, validates, synonym
-from sqlalchemy.orm.exc import NoResultFound
+        UnicodeText, String, DateTime, Boolean, UniqueConstraint, event)
+from sqlalchemy.orm import mapper, relationship, validates, synonym, Session
 from sqlalchemy.sql import not_, and_, or_, exists
 from turbogears.config import get
 from turbogears.database import session
@@ -35,6 +34,23 @@
 
 log = logging.getLogger(__name__)
 
+def _identity_cache(sess):
+    """
+    Returns the cache of group memberships and permissions held for the given
+    session. The cache only lives as long as the current transaction, and is
+    invalidated whenever group membership or group permissions change.
+    """
+    return sess.info.setdefault('identity_cache', {})
+
+def invalidate_identity_cache(sess):
+    """
+    Discards all cached group memberships and permissions for the given
+    session. This only needs to be called explicitly after changing group
+    membership or permissions without going through the ORM.
+    """
+    if sess is not None:
+        sess.info.pop('identity_cache', None)
+
 group_permission_table = Table('group_permission', DeclarativeMappedObject.metadata,
     Column('group_id', Integer, ForeignKey('tg_group.group_id',
         onupdate='CASCADE', ondelete='CASCADE'), primary_key=True, index=True),
@@ -217,6 +233,19 @@ def to_json(self):
             data['can_edit_keystone_trust'] = False
         return data
 
+    def _cached(self, key, func):
+        """
+        Returns the result of func() for this user, cached for the rest of the
+        current transaction (see _identity_cache).
+        """
+        sess = session.object_session(self)
+        if sess is None or self.user_id is None:
+            return func()
+        cache = _identity_cache(sess).setdefault(key, {})
+        if self.user_id not in cache:
+            cache[self.user_id] = func()
+        return cache[self.user_id]
+
     def permissions(self):
         perms = set()
         for g in self.groups:
@@ -486,12 +515,17 @@ def rootpw_expired(self):
     def __repr__(self):
         return self.user_name
 
+    @property
+    def _group_names(self):
+        return self._cached('group_names', lambda: frozenset(
+                group.group_name for group in self.groups))
+
     def is_admin(self):
-        return u'admin' in [group.group_name for group in self.groups]
+        return u'admin' in self._group_names
 
     @hybrid_method
     def in_group(self, check_groups):
-        my_groups = [group.group_name for group in self.groups]
+        my_groups = self._group_names
         for my_g in check_groups:
             if my_g in my_groups:
                 return True
@@ -507,18 +541,20 @@ def in_group(cls, group): #pylint: disable=E0213
 
     def has_permission(self, requested_permission):
         """ Check if user has requested permission """
-        try:
-            permission = Permission.by_name(requested_permission)
-        except NoResultFound:
-            permission = None
-        if permission in self.permissions:
-            return True
-        return False
+        permission_names = self._cached('permission_names', lambda: frozenset(
+                permission.permission_name for permission in self.permissions))
+        return requested_permission in permission_names
 
     @property
     def groups(self):
-        return session.object_session(self).query(Group)\
-                .filter(Group.has_member(self)).all()
+        sess = session.object_session(self)
+        query = lambda: tuple(sess.query(Group).filter(Group.has_member(self)))
+        groups = self._cached('groups', query)
+        if not all(group in sess for group in groups):
+            # The cached instances have been expunged from the session
+            invalidate_identity_cache(sess)
+            groups = self._cached('groups', query)
+        return list(groups)
 
 
 class Group(DeclarativeMappedObject, ActivityMixin):
@@ -979,6 +1015,39 @@ def __init__(self, permission_name):
     def __unicode__(self):
         return self.permission_name
 
+# Group memberships and permissions are cached for the duration of
+# a transaction (see _identity_cache). Any change to membership or permissions
+# made through the ORM invalidates the cache, whether it is made by modifying
+# the collections below, or by adding or deleting the association objects
+# directly in the session.
+
+def _invalidate_identity_cache_for(target, *args):
+    invalidate_identity_cache(session.object_session(target))
+
+for _attr in [User.group_user_assocs, User.excluded_group_user_assocs,
+        Group.user_group_assocs, Group.excluded_user_group_assocs,
+        Group.permissions, Permission.groups]:
+    event.listen(_attr, 'append', _invalidate_identity_cache_for)
+    event.listen(_attr, 'remove', _invalidate_identity_cache_for)
+event.listen(Group.membership_type, 'set', _invalidate_identity_cache_for)
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_identity_cache_after_flush(sess, flush_context):
+    for obj in list(sess.new) + list(sess.deleted):
+        if isinstance(obj, (UserGroup, ExcludedUserGroup, Group, Permission)):
+            invalidate_identity_cache(sess)
+            return
+
+@event.listens_for(Session, 'after_transaction_end')
+def _invalidate_identity_cache_after_transaction(sess, transaction):
+    if transaction.parent is None:
+        invalidate_identity_cache(sess)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _invalidate_identity_cache_after_rollback(sess, previous_transaction):
+    invalidate_identity_cache(sess)
+
+
 class SSHPubKey(DeclarativeMappedObject):
 
     __tablename__ = 'sshpubkey'
@@ -5,23 +5,26 @@
 # (at your option) any later version.
 
 import sys
+import json
 import logging
 from datetime import datetime, timedelta
 from hashlib import md5
 from itertools import chain
-from collections import defaultdict
+from collections import defaultdict, Counter
 import urllib
 import xml.dom.minidom
 import lxml.etree
 from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint, Index,
         Integer, Unicode, UnicodeText, DateTime, String, Boolean, Numeric, Float,
         BigInteger, VARCHAR, TEXT, event, Date)
-from sqlalchemy.sql import select, and_, or_, not_, case, func, exists
+from sqlalchemy.sql import (select, and_, or_, not_, case, func, exists, null,
+        union, literal)
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import (mapper, relationship, synonym,
         column_property, dynamic_loader, contains_eager, validates,
-        object_mapper)
+        object_mapper, Session)
 from sqlalchemy.orm.attributes import NEVER_SET
+from sqlalchemy.inspection import inspect
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.associationproxy import association_proxy
@@ -37,9 +40,12 @@
 from bkr.server.util import is_valid_fqdn, convert_db_lookup_error
 from .base import DeclarativeMappedObject
 from .types import (SystemType, SystemStatus, ReleaseAction, CommandStatus,
-        SystemPermission, TaskStatus, SystemSchedulerStatus, ImageType)
+        SystemPermission, TaskStatus, SystemSchedulerStatus, ImageType,
+        GroupMembershipType, SystemFacetType)
 from .activity import Activity, ActivityMixin
-from .identity import User, Group
+from .gauges import (GaugeDelta, system_gauge_names, system_utilisation_state,
+        idle_state, command_gauge_names)
+from .identity import User, Group, UserGroup, ExcludedUserGroup
 from .lab import LabController
 from .distrolibrary import (Arch, KernelType, OSMajor, OSVersion, Distro, DistroTree,
         LabControllerDistroTree, install_options_for_distro)
@@ -237,6 +243,41 @@ class SystemStatusDuration(DeclarativeMappedObject):
             default=datetime.utcnow)
     finish_time = Column(DateTime, index=True)
 
+class SystemUtilisationDay(DeclarativeMappedObject):
+
+    """
+    Daily rollup of system utilisation, so that reports over long periods
+    do not need to replay every reservation and status change. Each row
+    records how many seconds the system spent in each utilisation state
+    (see bkr.server.utilisation) on one day, in UTC.
+
+    Rows are appended for each finished day by beaker-update-reporting-facts,
+    see bkr.server.utilisation.rollup_utilisation_day().
+    """
+    __tablename__ = 'system_utilisation_day'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    system_id = Column(Integer, ForeignKey('system.id',
+            name='system_utilisation_day_system_id_fk', ondelete='CASCADE'),
+            primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    recipe = Column(Integer, nullable=False, default=0)
+    manual = Column(Integer, nullable=False, default=0)
+    idle_automated = Column(Integer, nullable=False, default=0)
+    idle_manual = Column(Integer, nullable=False, default=0)
+    idle_broken = Column(Integer, nullable=False, default=0)
+    idle_removed = Column(Integer, nullable=False, default=0)
+
+def _inventory_section_checksum(value):
+    return md5(json.dumps(value, sort_keys=True, default=unicode)).hexdigest()
+
+def _inventory_values_equal(current, new):
+    if isinstance(current, float) or isinstance(new, float):
+        # Cpu.speed is stored with single precision
+        if current is None or new is None:
+            return current is new
+        return abs(float(current) - float(new)) <= 1e-5 * max(abs(float(current)), 1)
+    return current == new
+
 system_device_map = Table('system_device_map', DeclarativeMappedObject.metadata,
     Column('system_id', Integer,
            ForeignKey('system.id', onupdate='CASCADE', ondelete='CASCADE'),
@@ -265,7 +306,7 @@ class System(DeclarativeMappedObject, ActivityMixin):
     fqdn = Column(Unicode(255), nullable=False, unique=True)
     serial = Column(Unicode(1024))
     date_added = Column(DateTime, default=datetime.utcnow, nullable=False)
-    date_modified = Column(DateTime)
+    date_modified = Column(DateTime, index=True)
     date_lastcheckin = Column(DateTime)
     location = Column(String(255))
     vendor = Column(Unicode(255))
@@ -282,6 +323,9 @@ class System(DeclarativeMappedObject, ActivityMixin):
     status_reason = Column(Unicode(4000))
     memory = Column(Integer)
     checksum = Column(String(32))
+    # JSON object of inventory section -> checksum of that section, as last
+    # applied by System.update
+    inventory_checksums = Column(UnicodeText)
     lab_controller_id = Column(Integer, ForeignKey('lab_controller.id'))
     lab_controller = relationship(LabController, back_populates='systems')
     mac_address = Column(String(18))
@@ -661,7 +705,7 @@ def visible_to_user(self, user):
     def visible_to_user(cls, user): #pylint: disable=E0213
         if user.is_admin() or user.has_permission(u'secret_visible'):
             return true()
-        return or_(SystemAccessPolicy.grants(user, SystemPermission.view),
+        return or_(SystemAccess.granted(user, SystemPermission.view),
                 cls.owner == user,
                 cls.loaned == user,
                 cls.user == user)
@@ -960,7 +1004,7 @@ def can_edit(cls, user): #pylint: disable=E0213
         cls._ensure_user_is_authenticated(user)
         if user.is_admin():
             return true()
-        return or_(SystemAccessPolicy.grants(user, SystemPermission.edit_system),
+        return or_(SystemAccess.granted(user, SystemPermission.edit_system),
                 cls.owner == user)
 
     @hybrid_method
@@ -985,8 +1029,8 @@ def can_view_power(cls, user): #pylint: disable=E0213
         cls._ensure_user_is_authenticated(user)
         if user.is_admin():
             return true()
-        return or_(SystemAccessPolicy.grants(user, SystemPermission.edit_system),
-                SystemAccessPolicy.grants(user, SystemPermission.view_power),
+        return or_(SystemAccess.granted(user, SystemPermission.edit_system),
+                SystemAccess.granted(user, SystemPermission.view_power),
                 cls.owner == user)
 
     def can_lend(self, user):
@@ -1062,7 +1106,7 @@ def can_reserve(self, user):
     @can_reserve.expression
     def can_reserve(cls, user): #pylint: disable=E0213
         cls._ensure_user_is_authenticated(user)
-        return or_(SystemAccessPolicy.grants(user, SystemPermission.reserve),
+        return or_(SystemAccess.granted(user, SystemPermission.reserve),
                 cls.owner == user,
                 cls.loaned == user)
 
@@ -1215,15 +1259,13 @@ def update_legacy(self, inventory):
         """
         Update Key/Value pairs for legacy RHTS
         """
-        keys_to_update = set()
-        new_int_kvs = set()
-        new_string_kvs = set()
+        keys = dict((key.key_name, key) for key in
+                Key.query.filter(Key.key_name.in_(inventory.keys())))
+        wanted = {Key_Value_Int: set(), Key_Value_String: set()}
         for key_name, values in inventory.items():
-            try:
-                key = Key.by_name(key_name)
-            except InvalidRequestError:
+            key = keys.get(key_name)
+            if key is None:
                 continue
-            keys_to_update.add(key)
             if not isinstance(values, list):
                 values = [values]
             for value in values:
@@ -1232,49 +1274,56 @@ def update_legacy(self, inventory):
                     # to make our comparisons accurate
                     value = int(value)
                 if key.numeric:
-                    new_int_kvs.add((key, int(value)))
-                else:
-                    new_string_kvs.add((key, unicode(value)))
-
-        # Examine existing key-values to find what we already have, and what 
-        # needs to be removed
-        for kv in list(self.key_values_int):
-            if kv.key in keys_to_update:
-                if (kv.key, kv.key_value) in new_int_kvs:
-                    new_int_kvs.remove((kv.key, kv.key_value))
+                    wanted[Key_Value_Int].add((key.id, int(value)))
                 else:
-                    self.key_values_int.remove(kv)
-                    self.record_activity(user=identity.current.user,
-                            service=u'XMLRPC', action=u'Removed', field=u'Key/Value',
-                            old=u'%s/%s' % (kv.key.key_name, kv.key_value),
-                            new=None)
-        for kv in list(self.key_values_string):
-            if kv.key in keys_to_update:
-                if (kv.key, kv.key_value) in new_string_kvs:
-                    new_string_kvs.remove((kv.key, kv.key_value))
+                    wanted[Key_Value_String].add((key.id, unicode(value)))
+        if keys:
+            key_names = dict((key.id, key.key_name) for key in keys.values())
+            self._update_key_values(key_names, wanted)
+        self.date_modified = datetime.utcnow()
+        return 0
+
+    def _update_key_values(self, key_names, wanted):
+        """
+        Replaces this system's values for the given keys (dict of key id ->
+        key name) with the wanted (key id, value) pairs for each key/value
+        class, by comparing against the existing rows in a single query per
+        class.
+        """
+        conn = session.connection(System)
+        changed = False
+        for kv_class in [Key_Value_Int, Key_Value_String]:
+            table = kv_class.__table__
+            remaining = set(wanted[kv_class])
+            removed = []
+            for kv_id, key_id, value in conn.execute(
+                    select([table.c.id, table.c.key_id, table.c.key_value])
+                    .where(and_(table.c.system_id == self.id,
+                                table.c.key_id.in_(key_names.keys())))
+                    .order_by(table.c.id)):
+                if (key_id, value) in remaining:
+                    remaining.remove((key_id, value))
                 else:
-                    self.key_values_string.remove(kv)
-                    self.record_activity(user=identity.current.user,
+                    removed.append(kv_id)
+                    self.record_buffered_activity(user=identity.current.user,
                             service=u'XMLRPC', action=u'Removed', field=u'Key/Value',
-                            old=u'%s/%s' % (kv.key.key_name, kv.key_value),
+                            old=u'%s/%s' % (key_names[key_id], value),
                             new=None)
-
-        # Now we can just add the new ones
-        for key, value in new_int_kvs:
-            self.key_values_int.append(Key_Value_Int(key, value))
-            self.record_activity(user=identity.current.user,
-                    service=u'XMLRPC', action=u'Added',
-                    field=u'Key/Value', old=None,
-                    new=u'%s/%s' % (key.key_name, value))
-        for key, value in new_string_kvs:
-            self.key_values_string.append(Key_Value_String(key, value))
-            self.record_activity(user=identity.current.user,
-                    service=u'XMLRPC', action=u'Added',
-                    field=u'Key/Value', old=None,
-                    new=u'%s/%s' % (key.key_name, value))
-
-        self.date_modified = datetime.utcnow()
-        return 0
+            if removed:
+                conn.execute(table.delete().where(table.c.id.in_(removed)))
+            if remaining:
+                conn.execute(table.insert(), [
+                        {'system_id': self.id, 'key_id': key_id, 'key_value': value}
+                        for key_id, value in remaining])
+                for key_id, value in remaining:
+                    self.record_buffered_activity(user=identity.current.user,
+                            service=u'XMLRPC', action=u'Added',
+                            field=u'Key/Value', old=None,
+                            new=u'%s/%s' % (key_names[key_id], value))
+            changed = changed or removed or remaining
+        if changed:
+            session.expire(self, ['key_values_int', 'key_values_string'])
+            SystemFacet.refresh([self.id], conn)
 
 
     def update(self, inventory):
@@ -1286,36 +1335,70 @@ def update(self, inventory):
         md5sum = md5("%s" % inventory).hexdigest()
         if self.checksum == md5sum:
             return 0
-        self.record_activity(user=identity.current.user,
+        self.record_buffered_activity(user=identity.current.user,
                 service=u'XMLRPC', action=u'Changed', field=u'checksum',
                 old=self.checksum, new=md5sum)
         self.checksum = md5sum
-        for key in inventory:
-            if key in self.ALLOWED_ATTRS:
-                if key in self.PRESERVED_ATTRS and getattr(self, key, None):
-                    continue
-                setattr(self, key, inventory[key])
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Changed',
-                        field=key, old=None, new=inventory[key])
-            else:
-                try:
-                    method = self.get_update_method(key)
-                except KeyError:
-                    log.warning('Attempted to update unknown inventory property \'%s\' on %s' %
-                                (key, self.fqdn))
+        # Sections which are unchanged since they were last applied are
+        # skipped, so that a re-inventory only touches what has changed.
+        section_checksums = self._inventory_section_checksums()
+        # Changes made here are not out-of-band edits, see
+        # forget_inventory_checksums_before_flush
+        self._applying_inventory = True
+        try:
+            for key in inventory:
+                if key in self.ALLOWED_ATTRS:
+                    if key in self.PRESERVED_ATTRS and getattr(self, key, None):
+                        continue
+                    setattr(self, key, inventory[key])
+                    self.record_buffered_activity(user=identity.current.user,
+                            service=u'XMLRPC', action=u'Changed',
+                            field=key, old=None, new=inventory[key])
                 else:
-                    method(inventory[key])
-        self.date_modified = datetime.utcnow()
+                    try:
+                        method = self.get_update_method(key)
+                    except KeyError:
+                        log.warning('Attempted to update unknown inventory property \'%s\' on %s' %
+                                    (key, self.fqdn))
+                    else:
+                        section_checksum = _inventory_section_checksum(inventory[key])
+                        if section_checksums.get(key) == section_checksum:
+                            continue
+                        method(inventory[key])
+                        section_checksums[key] = section_checksum
+            self.inventory_checksums = json.dumps(section_checksums, sort_keys=True)
+            self.date_modified = datetime.utcnow()
+            session.flush()
+        finally:
+            self._applying_inventory = False
         return 0
 
+    def _inventory_section_checksums(self):
+        try:
+            return json.loads(self.inventory_checksums or '{}')
+        except ValueError:
+            return {}
+
+    def forget_inventory_checksums(self, sections):
+        """
+        Forgets the checksum of the last pushed inventory, and of the given
+        sections of it, so that the next push applies them again even if it
+        is identical.
+        """
+        self.checksum = None
+        section_checksums = self._inventory_section_checksums()
+        if any(section in section_checksums for section in sections):
+            for section in sections:
+                section_checksums.pop(section, None)
+            self.inventory_checksums = json.dumps(section_checksums, sort_keys=True)
+
     def updateHypervisor(self, hypervisor):
         if hypervisor:
             hvisor = Hypervisor.by_name(hypervisor)
         else:
             hvisor = None
         if self.hypervisor != hvisor:
-            self.record_activity(user=identity.current.user,
+            self.record_buffered_activity(user=identity.current.user,
                     service=u'XMLRPC', action=u'Changed',
                     field=u'Hypervisor', old=self.hypervisor, new=hvisor)
             self.hypervisor = hvisor
@@ -1325,112 +1408,193 @@ def updateArch(self, archinfo):
             new_arch = Arch.by_name(arch)
             if new_arch not in self.arch:
                 self.arch.append(new_arch)
-                self.record_activity(user=identity.current.user,
+                self.record_buffered_activity(user=identity.current.user,
                         service=u'XMLRPC', action=u'Added',
                         field=u'Arch', old=None, new=new_arch.arch)
 
     def updateDisk(self, diskinfo):
-        for olddisk in list(self.disks):
-            exists = False
-            for newdisk in diskinfo['Disks']:
-                if olddisk.matches(newdisk):
-                    exists = True
-                    break
-            if not exists:
-                self.disks.remove(olddisk)
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Removed',
-                        field=u'Disk:size', old=unicode(olddisk.size))
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Removed',
-                        field=u'Disk:sector_size', old=unicode(olddisk.sector_size))
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Removed',
-                        field=u'Disk:phys_sector_size', old=unicode(olddisk.phys_sector_size))
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Removed',
-                        field=u'Disk:model', old=olddisk.model)
-
-        for newdisk in diskinfo['Disks']:
-            exists = False
-            for olddisk in self.disks:
-                if olddisk.matches(newdisk):
-                    exists = True
-                    break
-            if not exists:
-                self.disks.append(Disk(**newdisk))
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Added',
-                        field=u'Disk:size', new=unicode(newdisk['size']))
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Added',
-                        field=u'Disk:sector_size', new=unicode(newdisk['sector_size']))
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Added',
-                        field=u'Disk:phys_sector_size',
-                        new=unicode(newdisk['phys_sector_size']))
-                self.record_activity(user=identity.current.user,
-                        service=u'XMLRPC', action=u'Added',
-                        field=u'Disk:model', new=unicode(newdisk['model']))
+        conn = session.connection(System)
+        table = Disk.__table__
+        wanted = [(int(disk['size']), int(disk['sector_size']),
+                   int(disk['phys_sector_size']), disk['model'])
+                  for disk in diskinfo['Disks']]
+        # Compare as multisets, since identical disks are very common
+        unmatched = Counter(wanted)
+        removed = []
+        for row in conn.execute(select([table.c.id, table.c.size,
+                    table.c.sector_size, table.c.phys_sector_size, table.c.model])
+                .where(table.c.system_id == self.id).order_by(table.c.id)):
+            disk = tuple(row[1:])
+            if unmatched[disk] > 0:
+                unmatched[disk] -= 1
+            else:
+                removed.append(row)
+        added = []
+        for disk in wanted:
+            if unmatched[disk] > 0:
+                unmatched[disk] -= 1
+                added.append(disk)
+        if removed:
+            conn.execute(table.delete().where(table.c.id.in_(
+                    [row.id for row in removed])))
+        for row in removed:
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Removed',
+                    field=u'Disk:size', old=unicode(row.size))
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Removed',
+                    field=u'Disk:sector_size', old=unicode(row.sector_size))
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Removed',
+                    field=u'Disk:phys_sector_size', old=unicode(row.phys_sector_size))
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Removed',
+                    field=u'Disk:model', old=row.model)
+        if added:
+            conn.execute(table.insert(), [
+                    {'system_id': self.id, 'size': size, 'sector_size': sector_size,
+                     'phys_sector_size': phys_sector_size, 'model': model}
+                    for size, sector_size, phys_sector_size, model in added])
+        for size, sector_size, phys_sector_size, model in added:
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Added',
+                    field=u'Disk:size', new=unicode(size))
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Added',
+                    field=u'Disk:sector_size', new=unicode(sector_size))
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Added',
+                    field=u'Disk:phys_sector_size', new=unicode(phys_sector_size))
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Added',
+                    field=u'Disk:model', new=unicode(model))
+        if removed or added:
+            session.expire(self, ['disks'])
+            SystemFacet.refresh([self.id], conn)
 
     def updateDevices(self, deviceinfo):
-        currentDevices = []
+        conn = session.connection(System)
+        # Look up all the device classes and devices in one query each,
+        # falling back to lazy_create only for ones which do not exist yet.
+        class_names = set(device['type'] or 'NONE' for device in deviceinfo)
+        device_classes = dict(conn.execute(
+                select([DeviceClass.device_class, DeviceClass.id])
+                .where(DeviceClass.device_class.in_(class_names))).fetchall())
+        wanted = []
         for device in deviceinfo:
-            device_class = DeviceClass.lazy_create(device_class=device['type'])
-            mydevice = Device.lazy_create(vendor_id = device['vendorID'],
-                                   device_id = device['deviceID'],
-                                   subsys_vendor_id = device['subsysVendorID'],
-                                   subsys_device_id = device['subsysDeviceID'],
-                                   bus = device['bus'],
-                                   driver = device['driver'],
-                                   device_class_id = device_class.id,
-                                   description = device['description'],
-                                   fw_version = device.get('fw_version', None))
-            if mydevice not in self.devices:
-                self.devices.append(mydevice)
-                self.record_activity(user=identity.current.user,
+            class_name = device['type'] or 'NONE'
+            if class_name not in device_classes:
+                device_classes[class_name] = DeviceClass.lazy_create(
+                        device_class=class_name).id
+            wanted.append((device['vendorID'], device['deviceID'],
+                    device['subsysVendorID'], device['subsysDeviceID'],
+                    device['bus'], device['driver'], device_classes[class_name],
+                    device['description'], device.get('fw_version', None)))
+        columns = [Device.vendor_id, Device.device_id, Device.subsys_vendor_id,
+                Device.subsys_device_id, Device.bus, Device.driver,
+                Device.device_class_id, Device.description, Device.fw_version]
+        existing = {}
+        if wanted:
+            for row in conn.execute(select([Device.id] + columns).where(or_(*[
+                    and_(*[column == value for column, value in zip(columns, device)])
+                    for device in set(wanted)]))):
+                existing.setdefault(tuple(row[1:]), row[0])
+        device_ids = []
+        for device in wanted:
+            device_id = existing.get(device)
+            if device_id is None:
+                # Not found by exact comparison, which can happen if the
+                # database collation considers it equal to an existing device
+                device_id = Device.lazy_create(**dict((column.key, value)
+                        for column, value in zip(columns, device))).id
+                existing[device] = device_id
+            if device_id not in device_ids:
+                device_ids.append(device_id)
+        current = set(row[0] for row in conn.execute(
+                select([system_device_map.c.device_id])
+                .where(system_device_map.c.system_id == self.id)))
+        added = [device_id for device_id in device_ids if device_id not in current]
+        removed = sorted(current.difference(device_ids))
+        if added:
+            conn.execute(system_device_map.insert(), [
+                    {'system_id': self.id, 'device_id': device_id}
+                    for device_id in added])
+            for device_id in added:
+                self.record_buffered_activity(user=identity.current.user,
                         service=u'XMLRPC', action=u'Added',
-                        field=u'Device', old=None, new=mydevice.id)
-            currentDevices.append(mydevice)
-        # Remove any old entries
-        for device in self.devices[:]:
-            if device not in currentDevices:
-                self.devices.remove(device)
-                self.record_activity(user=identity.current.user,
+                        field=u'Device', old=None, new=device_id)
+        if removed:
+            conn.execute(system_device_map.delete().where(and_(
+                    system_device_map.c.system_id == self.id,
+                    system_device_map.c.device_id.in_(removed))))
+            for device_id in removed:
+                self.record_buffered_activity(user=identity.current.user,
                         service=u'XMLRPC', action=u'Removed',
-                        field=u'Device', old=device.id, new=None)
+                        field=u'Device', old=device_id, new=None)
+        if added or removed:
+            session.expire(self, ['devices'])
 
     def updateCpu(self, cpuinfo):
-        # Remove all old CPU data
-        if self.cpu:
-            for flag in self.cpu.flags:
-                session.delete(flag)
-            session.delete(self.cpu)
-
-        # Create new Cpu
-        cpu = Cpu(vendor     = cpuinfo['vendor'],
-                  model      = cpuinfo['model'],
-                  model_name = cpuinfo['modelName'],
-                  family     = cpuinfo['family'],
-                  stepping   = cpuinfo['stepping'],
-                  speed      = cpuinfo['speed'],
-                  processors = cpuinfo['processors'],
-                  cores      = cpuinfo['cores'],
-                  sockets    = cpuinfo['sockets'],
-                  flags      = cpuinfo['CpuFlags'])
-
-        self.cpu = cpu
-        self.record_activity(user=identity.current.user,
-                service=u'XMLRPC', action=u'Changed',
-                field=u'CPU', old=None,
-                new=None) # XXX find a good way to record the actual changes
+        conn = session.connection(System)
+        values = dict(vendor=cpuinfo['vendor'],
+                      model=cpuinfo['model'],
+                      model_name=cpuinfo['modelName'],
+                      family=cpuinfo['family'],
+                      stepping=cpuinfo['stepping'],
+                      speed=cpuinfo['speed'],
+                      processors=cpuinfo['processors'],
+                      cores=cpuinfo['cores'],
+                      sockets=cpuinfo['sockets'])
+        values['hyper'] = bool(values['processors'] > values['cores'])
+        flags = set(cpuinfo['CpuFlags'] or [])
+        cpu_table = Cpu.__table__
+        flag_table = CpuFlag.__table__
+        cpu = conn.execute(select([cpu_table]).where(cpu_table.c.system_id == self.id)
+                .order_by(cpu_table.c.id)).fetchall()
+        if len(cpu) == 1:
+            cpu, = cpu
+            cpu_id = cpu.id
+            changed_values = dict((column, value) for column, value in values.items()
+                    if not _inventory_values_equal(cpu[column], value))
+            if changed_values:
+                conn.execute(cpu_table.update().where(cpu_table.c.id == cpu_id)
+                        .values(**changed_values))
+            current_flags = defaultdict(list)
+            for flag_id, flag in conn.execute(select([flag_table.c.id, flag_table.c.flag])
+                    .where(flag_table.c.cpu_id == cpu_id)):
+                current_flags[flag].append(flag_id)
+            # Drop removed flags, and duplicates of the remaining ones
+            removed_flag_ids = [flag_id for flag, flag_ids in current_flags.items()
+                    for flag_id in (flag_ids if flag not in flags else flag_ids[1:])]
+            added_flags = flags.difference(current_flags)
+        else:
+            # Missing, or somehow more than one, so start again
+            if cpu:
+                conn.execute(cpu_table.delete().where(cpu_table.c.system_id == self.id))
+            cpu_id = conn.execute(cpu_table.insert().values(system_id=self.id,
+                    **values)).inserted_primary_key[0]
+            changed_values = values
+            removed_flag_ids = []
+            added_flags = flags
+        if removed_flag_ids:
+            conn.execute(flag_table.delete().where(flag_table.c.id.in_(removed_flag_ids)))
+        if added_flags:
+            conn.execute(flag_table.insert(), [{'cpu_id': cpu_id, 'flag': flag}
+                    for flag in sorted(added_flags)])
+        if changed_values or removed_flag_ids or added_flags:
+            session.expire(self, ['cpu'])
+            SystemFacet.refresh([self.id], conn)
+            self.record_buffered_activity(user=identity.current.user,
+                    service=u'XMLRPC', action=u'Changed',
+                    field=u'CPU', old=None,
+                    new=None) # XXX find a good way to record the actual changes
 
     def updateNuma(self, numainfo):
         if self.numa:
             session.delete(self.numa)
         if numainfo.get('nodes', None) is not None:
             self.numa = Numa(nodes=numainfo['nodes'])
-        self.record_activity(user=identity.current.user,
+        self.record_buffered_activity(user=identity.current.user,
                 service=u'XMLRPC', action=u'Changed',
                 field=u'NUMA', old=None,
                 new=None) # XXX find a good way to record the actual changes
@@ -1742,6 +1906,8 @@ def _reserve(self, service, user, reservation_type):
                 'reserved') % self)
         self.user = user # do it here too, so that the ORM is aware
         self.scheduler_status = SystemSchedulerStatus.reserved
+        GaugeDelta.record(system_gauge_names(self, idle_state(self.status)),
+                system_gauge_names(self, reservation_type))
         reservation = Reservation(user=user, type=reservation_type)
         self.reservations.append(reservation)
         self.record_activity(user=user,
@@ -1771,6 +1937,8 @@ def unreserve(self, service=None, reservation=None, user=None):
                 finish_time=datetime.utcnow()).rowcount != 1:
             raise BX(_(u'System does not have an open reservation'))
         session.expire(reservation, ['finish_time'])
+        GaugeDelta.record(system_gauge_names(self, reservation.type),
+                system_gauge_names(self, idle_state(self.status)))
         old_user = self.user
         self.user = None
         self.scheduler_status = SystemSchedulerStatus.pending
@@ -1852,6 +2020,35 @@ def add_system_status_duration(system, child, oldchild, initiator):
     system.status_durations.insert(0, SystemStatusDuration(status=child))
     return child
 
+@event.listens_for(System.status, 'set', active_history=True)
+def record_system_status_gauges(system, new_status, old_status, initiator):
+    # New systems are counted by count_new_system_gauges below, and reserved
+    # systems are counted by their reservation type rather than their status.
+    if old_status in (None, NEVER_SET) or new_status == old_status:
+        return
+    if not inspect(system).has_identity or system.user is not None:
+        return
+    GaugeDelta.record(system_gauge_names(system, idle_state(old_status)),
+            system_gauge_names(system, idle_state(new_status)))
+
+@event.listens_for(System, 'after_insert')
+def count_new_system_gauges(mapper, connection, system):
+    GaugeDelta.record([], system_gauge_names(system, system_utilisation_state(system)),
+            connection=connection)
+
+@event.listens_for(Command.status, 'set', active_history=True)
+def record_command_status_gauges(command, new_status, old_status, initiator):
+    if old_status in (None, NEVER_SET) or new_status == old_status:
+        return
+    if not inspect(command).has_identity:
+        return
+    GaugeDelta.record(command_gauge_names(command, old_status),
+            command_gauge_names(command, new_status))
+
+@event.listens_for(Command, 'after_insert')
+def count_new_command_gauges(mapper, connection, command):
+    GaugeDelta.record([], command_gauge_names(command), connection=connection)
+
 @event.listens_for(System.custom_access_policy, 'set')
 def update_active_access_policy(system, policy, old_policy, initiator):
     system.active_access_policy = policy
@@ -2174,17 +2371,19 @@ def grants(self, user, permission):
         """
         Does this policy grant the given permission to the given user?
         """
+        group_ids = set(group.group_id for group in user.groups)
         return any(rule.permission == permission and
-                (rule.user == user or rule.group in user.groups or rule.everybody)
+                (rule.user == user or rule.everybody or
+                 (rule.group is not None and rule.group.group_id in group_ids))
                 for rule in self.rules)
 
     @grants.expression
     def grants(cls, user, permission): #pylint: disable=E0213
         # need to avoid passing an empty list to in_
         clauses = [SystemAccessPolicyRule.user == user, SystemAccessPolicyRule.everybody]
-        if user.groups:
-            clauses.append(SystemAccessPolicyRule.group_id.in_(
-                    [g.group_id for g in user.groups]))
+        group_ids = [g.group_id for g in user.groups]
+        if group_ids:
+            clauses.append(SystemAccessPolicyRule.group_id.in_(group_ids))
         return cls.rules.any(and_(SystemAccessPolicyRule.permission == permission,
                 or_(*clauses)))
 
@@ -2295,6 +2494,198 @@ def record_deletion(self, service=u'WEBUI'):
                                field=u'Access Policy Rule',
                                old=self.activity_value)
 
+class SystemAccess(DeclarativeMappedObject):
+
+    """
+    Materialised form of the system access policies: each row means that the
+    given permission is granted on the given system by its active access
+    policy. This lets scheduling and system listing queries check access with
+    a simple indexed lookup instead of evaluating the policy rules and the
+    user's group memberships.
+
+    Grants to users and to members of normal (and LDAP) groups are expanded
+    to one row per user. Grants to everybody are stored with user_id NULL.
+    Grants to inverted groups are also stored with user_id NULL, together with
+    the group's id in inverted_group_id, since expanding them would produce
+    a row for almost every user; users excluded from the group are filtered
+    out at query time.
+
+    The rows are refreshed after each flush which changes policy rules, group
+    membership, or a system's active policy (see
+    refresh_system_access_after_flush below). Grants to a system's owner or
+    to the user it is loaned to are not stored here, they are checked
+    directly against the system's columns.
+    """
+    __tablename__ = 'system_access'
+    __table_args__ = (
+        Index('ix_system_access_system_id_permission', 'system_id', 'permission'),
+        Index('ix_system_access_user_id_permission', 'user_id', 'permission'),
+        {'mysql_engine': 'InnoDB'}
+    )
+    id = Column(Integer, primary_key=True)
+    system_id = Column(Integer, ForeignKey('system.id',
+            name='system_access_system_id_fk', ondelete='CASCADE'),
+            nullable=False)
+    user_id = Column(Integer, ForeignKey('tg_user.user_id',
+            name='system_access_user_id_fk', ondelete='CASCADE'))
+    inverted_group_id = Column(Integer, ForeignKey('tg_group.group_id',
+            name='system_access_inverted_group_id_fk', ondelete='CASCADE'))
+    permission = Column(SystemPermission.db_type(), nullable=False)
+
+    @classmethod
+    def granted(cls, user, permission):
+        """
+        Returns a clause which is true for systems where the given permission
+        is granted to the given user by the system's active access policy.
+        Equivalent to SystemAccessPolicy.grants, but without needing to join
+        the policy.
+        """
+        excluded = exists([1]).where(and_(
+                ExcludedUserGroup.group_id == cls.inverted_group_id,
+                ExcludedUserGroup.user_id == user.user_id))
+        return exists([1]).where(and_(
+                cls.system_id == System.id,
+                cls.permission == permission,
+                or_(cls.user_id == user.user_id,
+                    and_(cls.user_id == None,
+                         or_(cls.inverted_group_id == None, not_(excluded))))))
+
+    @classmethod
+    def _grant_queries(cls, system_clause=None, user_ids=None):
+        """
+        Returns the queries which produce (system_id, user_id,
+        inverted_group_id, permission) rows for the systems matching
+        system_clause, or for the given users.
+        """
+        system = System.__table__
+        rule = SystemAccessPolicyRule.__table__
+        group = Group.__table__
+        user_group = UserGroup.__table__
+        policy_rules = system.join(rule,
+                rule.c.policy_id == system.c.active_access_policy_id)
+        user_rules = select([system.c.id, rule.c.user_id, null(), rule.c.permission])\
+                .select_from(policy_rules)\
+                .where(rule.c.user_id != None)
+        group_rules = select([system.c.id, user_group.c.user_id, null(), rule.c.permission])\
+                .select_from(policy_rules
+                    .join(group, rule.c.group_id == group.c.group_id)
+                    .join(user_group, user_group.c.group_id == group.c.group_id))\
+                .where(group.c.membership_type != GroupMembershipType.inverted)
+        if user_ids is not None:
+            return [user_rules.where(rule.c.user_id.in_(user_ids)),
+                    group_rules.where(user_group.c.user_id.in_(user_ids))]
+        everybody_rules = select([system.c.id, null(), null(), rule.c.permission])\
+                .select_from(policy_rules)\
+                .where(and_(rule.c.user_id == None, rule.c.group_id == None))
+        inverted_group_rules = select([system.c.id, null(), group.c.group_id, rule.c.permission])\
+                .select_from(policy_rules
+                    .join(group, rule.c.group_id == group.c.group_id))\
+                .where(group.c.membership_type == GroupMembershipType.inverted)
+        queries = [user_rules, group_rules, everybody_rules, inverted_group_rules]
+        if system_clause is not None:
+            queries = [query.where(system_clause) for query in queries]
+        return queries
+
+    @classmethod
+    def refresh(cls, system_ids=(), policy_ids=(), group_ids=(), user_ids=(),
+            connection=None):
+        """
+        Recomputes the rows for the given systems, for systems whose active
+        policy is one of the given policies or has a rule for one of the given
+        groups, and for the given users.
+        """
+        if connection is None:
+            connection = session.connection(cls)
+        table = cls.__table__
+        columns = ['system_id', 'user_id', 'inverted_group_id', 'permission']
+        system = System.__table__
+        rule = SystemAccessPolicyRule.__table__
+        system_clauses = []
+        if system_ids:
+            system_clauses.append(system.c.id.in_(system_ids))
+        if policy_ids:
+            system_clauses.append(system.c.active_access_policy_id.in_(policy_ids))
+        if group_ids:
+            system_clauses.append(system.c.active_access_policy_id.in_(
+                    select([rule.c.policy_id]).where(rule.c.group_id.in_(group_ids))))
+        if system_clauses:
+            system_clause = or_(*system_clauses)
+            connection.execute(table.delete().where(table.c.system_id.in_(
+                    select([system.c.id]).where(system_clause))))
+            connection.execute(table.insert().from_select(columns,
+                    union(*cls._grant_queries(system_clause=system_clause))))
+        if user_ids:
+            connection.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+            connection.execute(table.insert().from_select(columns,
+                    union(*cls._grant_queries(user_ids=user_ids))))
+
+    @classmethod
+    def rebuild(cls, connection=None):
+        """
+        Discards and recomputes the entire table.
+        """
+        if connection is None:
+            connection = session.connection(cls)
+        table = cls.__table__
+        connection.execute(table.delete())
+        connection.execute(table.insert().from_select(
+                ['system_id', 'user_id', 'inverted_group_id', 'permission'],
+                union(*cls._grant_queries())))
+
+    @classmethod
+    def check_consistency(cls, connection=None):
+        """
+        Compares the table against the current access policies. Returns a tuple
+        of (missing rows, unexpected rows), each a sorted list of
+        (system_id, user_id, inverted_group_id, permission) tuples.
+        """
+        if connection is None:
+            connection = session.connection(cls)
+        table = cls.__table__
+        expected = set(tuple(row) for row in
+                connection.execute(union(*cls._grant_queries())))
+        actual = set(tuple(row) for row in connection.execute(select([
+                table.c.system_id, table.c.user_id, table.c.inverted_group_id,
+                table.c.permission])))
+        return sorted(expected - actual), sorted(actual - expected)
+
+@event.listens_for(Session, 'after_flush')
+def refresh_system_access_after_flush(sess, flush_context):
+    """
+    Keeps the system_access table in sync with any changes to access
+    policies, group membership, or systems' active policies in this flush.
+    """
+    system_ids = set()
+    policy_ids = set()
+    group_ids = set()
+    user_ids = set()
+    for obj in chain(sess.new, sess.deleted):
+        if isinstance(obj, System):
+            system_ids.add(obj.id)
+        elif isinstance(obj, SystemAccessPolicyRule):
+            policy_ids.add(obj.policy_id)
+        elif isinstance(obj, UserGroup):
+            user_ids.add(obj.user_id)
+    for obj in sess.dirty:
+        if isinstance(obj, System):
+            if inspect(obj).attrs.active_access_policy.history.has_changes():
+                system_ids.add(obj.id)
+        elif isinstance(obj, SystemAccessPolicy):
+            if inspect(obj).attrs.rules.history.has_changes():
+                policy_ids.add(obj.id)
+        elif isinstance(obj, SystemAccessPolicyRule):
+            policy_ids.add(obj.policy_id)
+        elif isinstance(obj, Group):
+            if inspect(obj).attrs.membership_type.history.has_changes():
+                group_ids.add(obj.group_id)
+    system_ids.discard(None)
+    policy_ids.discard(None)
+    user_ids.discard(None)
+    if system_ids or policy_ids or group_ids or user_ids:
+        SystemAccess.refresh(system_ids=system_ids, policy_ids=policy_ids,
+                group_ids=group_ids, user_ids=user_ids,
+                connection=sess.connection())
+
 class Provision(DeclarativeMappedObject):
 
     __tablename__ = 'provision'
@@ -2408,7 +2799,8 @@ class Cpu(DeclarativeMappedObject):
     cores = Column(Integer)
     sockets = Column(Integer)
     hyper = Column(Boolean)
-    flags = relationship('CpuFlag', cascade='all, delete, delete-orphan')
+    flags = relationship('CpuFlag', back_populates='cpu',
+            cascade='all, delete, delete-orphan')
 
     def __init__(self, vendor=None, model=None, model_name=None, family=None, stepping=None,speed=None,processors=None,cores=None,sockets=None,flags=None):
         super(Cpu, self).__init__()
@@ -2441,6 +2833,7 @@ class CpuFlag(DeclarativeMappedObject):
     id = Column(Integer, autoincrement=True, primary_key=True)
     cpu_id = Column(Integer, ForeignKey('cpu.id',
            onupdate='CASCADE', ondelete='CASCADE'), nullable=False)
+    cpu = relationship(Cpu, back_populates='flags')
     flag = Column(String(255))
 
     def __init__(self, flag=None):
@@ -2829,6 +3222,187 @@ def by_key_value(cls, system, key, value):
                                   Key_Value_Int.key_value==value,
                                   Key_Value_Int.system==system)).one()
 
+class SystemFacet(DeclarativeMappedObject):
+
+    """
+    Denormalised search index of system inventory details which live in
+    one-to-many tables: CPU flags, disk sizes and key-values. Each row records
+    one value of one facet for a system, so that searches on several of these
+    details can be answered with an indexed EXISTS per criterion instead of
+    joining (and aliasing) the inventory tables once per criterion.
+
+    Key-value facets also record the key in key_id. String values are stored
+    in value and numeric values in int_value.
+
+    The rows are refreshed after each flush which changes a system's
+    inventory (see refresh_system_facets_after_flush below).
+    """
+    __tablename__ = 'system_facet'
+    __table_args__ = (
+        Index('ix_system_facet_facet_key_id_value', 'facet', 'key_id', 'value',
+                mysql_length={'value': 255}),
+        Index('ix_system_facet_facet_key_id_int_value', 'facet', 'key_id', 'int_value'),
+        {'mysql_engine': 'InnoDB'}
+    )
+    id = Column(Integer, primary_key=True)
+    system_id = Column(Integer, ForeignKey('system.id',
+            name='system_facet_system_id_fk', ondelete='CASCADE'),
+            nullable=False, index=True)
+    facet = Column(SystemFacetType.db_type(), nullable=False)
+    key_id = Column(Integer, ForeignKey('key_.id',
+            name='system_facet_key_id_fk', ondelete='CASCADE'))
+    value = Column(TEXT)
+    int_value = Column(BigInteger)
+
+    @classmethod
+    def matches(cls, facet, clause=None, key=None):
+        """
+        Returns a clause which is true for systems having a value for the given
+        facet (and key, for key-value facets) which satisfies the given clause
+        on SystemFacet.value or SystemFacet.int_value.
+        """
+        criteria = [cls.system_id == System.id, cls.facet == facet]
+        if key is not None:
+            criteria.append(cls.key_id == key.id)
+        if clause is not None:
+            criteria.append(clause)
+        return exists([1]).where(and_(*criteria))
+
+    @classmethod
+    def _facet_queries(cls, system_ids=None):
+        """
+        Returns the queries which produce (system_id, facet, key_id, value,
+        int_value) rows for the given systems, or for all systems.
+        """
+        cpu = Cpu.__table__
+        cpu_flag = CpuFlag.__table__
+        disk = Disk.__table__
+        kvs = Key_Value_String.__table__
+        kvi = Key_Value_Int.__table__
+        def facet(symbol):
+            return literal(symbol, SystemFacetType.db_type())
+        queries = [
+            select([cpu.c.system_id, facet(SystemFacetType.cpu_flag),
+                    null(), cpu_flag.c.flag, null()])
+                .select_from(cpu.join(cpu_flag, cpu_flag.c.cpu_id == cpu.c.id))
+                .where(cpu_flag.c.flag != None),
+            select([disk.c.system_id, facet(SystemFacetType.disk_size),
+                    null(), null(), disk.c.size])
+                .where(disk.c.size != None),
+            select([kvs.c.system_id, facet(SystemFacetType.key_value),
+                    kvs.c.key_id, kvs.c.key_value, null()]),
+            select([kvi.c.system_id, facet(SystemFacetType.key_value),
+                    kvi.c.key_id, null(), kvi.c.key_value]),
+        ]
+        if system_ids is not None:
+            queries = [query.where(table.c.system_id.in_(system_ids))
+                    for table, query in zip([cpu, disk, kvs, kvi], queries)]
+        return queries
+
+    @classmethod
+    def refresh(cls, system_ids, connection=None):
+        """
+        Recomputes the rows for the given systems.
+        """
+        if connection is None:
+            connection = session.connection(cls)
+        table = cls.__table__
+        connection.execute(table.delete().where(table.c.system_id.in_(system_ids)))
+        connection.execute(table.insert().from_select(
+                ['system_id', 'facet', 'key_id', 'value', 'int_value'],
+                union(*cls._facet_queries(system_ids))))
+
+    @classmethod
+    def rebuild(cls, connection=None):
+        """
+        Discards and recomputes the entire table.
+        """
+        if connection is None:
+            connection = session.connection(cls)
+        table = cls.__table__
+        connection.execute(table.delete())
+        connection.execute(table.insert().from_select(
+                ['system_id', 'facet', 'key_id', 'value', 'int_value'],
+                union(*cls._facet_queries())))
+
+    @classmethod
+    def check_consistency(cls, connection=None):
+        """
+        Compares the table against the current inventory. Returns a tuple of
+        (missing rows, unexpected rows), each a sorted list of (system_id,
+        facet, key_id, value, int_value) tuples.
+        """
+        if connection is None:
+            connection = session.connection(cls)
+        table = cls.__table__
+        expected = set(tuple(row) for row in
+                connection.execute(union(*cls._facet_queries())))
+        actual = set(tuple(row) for row in connection.execute(select([
+                table.c.system_id, table.c.facet, table.c.key_id,
+                table.c.value, table.c.int_value])))
+        return sorted(expected - actual), sorted(actual - expected)
+
+@event.listens_for(Session, 'after_flush')
+def refresh_system_facets_after_flush(sess, flush_context):
+    """
+    Keeps the system_facet table in sync with any changes to CPU flags, disks
+    or key-values in this flush.
+    """
+    system_ids = set()
+    cpu_ids = set()
+    for obj in chain(sess.new, sess.dirty, sess.deleted):
+        if isinstance(obj, (Cpu, Disk, Key_Value_String, Key_Value_Int)):
+            system_ids.add(obj.system_id)
+        elif isinstance(obj, CpuFlag):
+            cpu_ids.add(obj.cpu_id)
+    cpu_ids.discard(None)
+    if cpu_ids:
+        # Flags can be removed from a CPU without touching the CPU itself
+        cpu = Cpu.__table__
+        system_ids.update(row[0] for row in sess.connection().execute(
+                select([cpu.c.system_id]).where(cpu.c.id.in_(cpu_ids))))
+    system_ids.discard(None)
+    if system_ids:
+        SystemFacet.refresh(system_ids, connection=sess.connection())
+
+# System attributes and inventory classes holding the data which is applied
+# from each section of a pushed inventory
+_inventory_section_attrs = {'arch': 'Arch', 'devices': 'Devices',
+        'hypervisor': 'Hypervisor', 'cpu': 'Cpu', 'numa': 'Numa', 'disks': 'Disk'}
+_inventory_section_classes = [(Cpu, 'Cpu'), (CpuFlag, 'Cpu'), (Numa, 'Numa'),
+        (Disk, 'Disk')]
+
+@event.listens_for(Session, 'before_flush')
+def forget_inventory_checksums_before_flush(sess, flush_context, instances):
+    """
+    When inventory data is changed other than by System.update (for example
+    in the web UI, by CSV import or over XML-RPC), forgets the checksums of
+    the affected sections so that re-pushing the same inventory restores it.
+    """
+    changed_sections = {}
+    for obj in chain(sess.new, sess.dirty, sess.deleted):
+        if isinstance(obj, System):
+            attrs = inspect(obj).attrs
+            if any(attrs[attr].history.has_changes() for attr in System.ALLOWED_ATTRS):
+                changed_sections.setdefault(obj, set())
+            for attr, section in _inventory_section_attrs.iteritems():
+                if attrs[attr].history.has_changes():
+                    changed_sections.setdefault(obj, set()).add(section)
+            continue
+        for cls, section in _inventory_section_classes:
+            if isinstance(obj, cls):
+                # Objects detached from their system are also a change to
+                # the system's relationship, which is handled above
+                owner = obj.cpu if cls is CpuFlag else obj
+                system = owner.system if owner is not None else None
+                if system is not None:
+                    changed_sections.setdefault(system, set()).add(section)
+    for system, sections in changed_sections.iteritems():
+        if getattr(system, '_applying_inventory', False):
+            continue
+        if system.checksum is not None or system.inventory_checksums:
+            system.forget_inventory_checksums(sections)
+
 # available in python 2.7+ importlib
 def import_module(modname):
     __import__(modname)
@@ -0,0 +1,333 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Fact tables for the supported reporting queries.
+
+The supported reporting queries (see bkr/server/reporting-queries) scan every
+reservation, recipe and recipe task in the requested period, which takes
+minutes on a large installation. The tables here hold the same measurements
+aggregated per day, so that the equivalent queries under
+reporting-queries/facts only need to sum a few rows per day.
+
+Days are loaded oldest first by beaker-update-reporting-facts, once they have
+finished. The reporting_fact_day table records which days have been loaded and
+the latest of them is the high-water mark for the next run.
+"""
+
+import datetime
+import logging
+from collections import defaultdict
+from sqlalchemy import (Column, Integer, BigInteger, ForeignKey, DateTime,
+        Date, Unicode)
+from sqlalchemy.sql import select, and_, func
+from turbogears.database import session
+from .base import DeclarativeMappedObject
+from .inventory import Reservation
+from .installation import Installation
+from .scheduler import (Job, RecipeSet, Recipe, MachineRecipe, RecipeTask,
+        RecipeResource, SystemResource, VirtResource, GuestResource)
+from .distrolibrary import DistroTree
+
+log = logging.getLogger(__name__)
+
+# Names which the reporting queries use in place of an FQDN for resources
+# which are not individual systems.
+VIRT_RESOURCE_LABEL = u'All OpenStack'
+GUEST_RESOURCE_LABEL = u'All Guest'
+
+def _clamped_seconds(start, finish, period_start, period_end):
+    """
+    Returns the number of seconds between *start* and *finish* (None meaning
+    still running) which fall within the period.
+    """
+    start = max(start, period_start)
+    finish = min(finish or period_end, period_end)
+    return max(int((finish - start).total_seconds()), 0)
+
+def _overlapping(query, start_column, finish_column, period_start, period_end):
+    """
+    Returns two copies of *query*, restricted to the rows which overlap the
+    period and have finished, and to the rows which are still running.
+
+    The condition is split in two (rather than using finish >= start OR finish
+    IS NULL) so that the database can satisfy each half using the index on
+    *finish_column*.
+    """
+    return [query.where(and_(finish_column >= period_start,
+                    start_column < period_end)),
+            query.where(and_(finish_column == None,
+                    start_column < period_end))]
+
+def _durations_by_key(rows):
+    """
+    Returns a dict of key -> (count, total, minimum, maximum) from a sequence
+    of (key, seconds) pairs.
+    """
+    durations = {}
+    for key, seconds in rows:
+        if key not in durations:
+            durations[key] = (1, seconds, seconds, seconds)
+        else:
+            count, total, minimum, maximum = durations[key]
+            durations[key] = (count + 1, total + seconds,
+                    min(minimum, seconds), max(maximum, seconds))
+    return durations
+
+class MachineHoursFact(DeclarativeMappedObject):
+
+    """
+    Seconds each user had each system reserved on each day, whether manually
+    or by the scheduler.
+    """
+    __tablename__ = 'reporting_machine_hours'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey('tg_user.user_id',
+            name='reporting_machine_hours_user_id_fk', ondelete='CASCADE'),
+            primary_key=True)
+    system_id = Column(Integer, ForeignKey('system.id',
+            name='reporting_machine_hours_system_id_fk', ondelete='CASCADE'),
+            primary_key=True)
+    seconds = Column(Integer, nullable=False)
+
+    @classmethod
+    def load(cls, connection, start, end):
+        reservation = Reservation.__table__
+        totals = defaultdict(int)
+        query = select([reservation.c.user_id, reservation.c.system_id,
+                reservation.c.start_time, reservation.c.finish_time])
+        for overlapping in _overlapping(query, reservation.c.start_time,
+                reservation.c.finish_time, start, end):
+            for user_id, system_id, res_start, res_finish \
+                    in connection.execute(overlapping):
+                totals[(user_id, system_id)] += _clamped_seconds(
+                        res_start, res_finish, start, end)
+        return [{'day': start.date(), 'user_id': user_id,
+                 'system_id': system_id, 'seconds': seconds}
+                for (user_id, system_id), seconds in totals.iteritems()]
+
+class RecipeHoursFact(DeclarativeMappedObject):
+
+    """
+    Seconds spent running each user's machine recipes on each day, by the arch
+    of the recipe distro and the system the recipes ran on (NULL for recipes
+    which ran on dynamically created VMs).
+    """
+    __tablename__ = 'reporting_recipe_hours'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('tg_user.user_id',
+            name='reporting_recipe_hours_user_id_fk', ondelete='CASCADE'),
+            nullable=False)
+    arch_id = Column(Integer, ForeignKey('arch.id',
+            name='reporting_recipe_hours_arch_id_fk'), nullable=False)
+    system_id = Column(Integer, ForeignKey('system.id',
+            name='reporting_recipe_hours_system_id_fk', ondelete='CASCADE'))
+    seconds = Column(Integer, nullable=False)
+
+    @classmethod
+    def load(cls, connection, start, end):
+        recipe = Recipe.__table__
+        recipe_resource = RecipeResource.__table__
+        system_resource = SystemResource.__table__
+        totals = defaultdict(int)
+        query = select([Job.__table__.c.owner_id, DistroTree.__table__.c.arch_id,
+                        system_resource.c.system_id,
+                        recipe.c.start_time, recipe.c.finish_time],
+                from_obj=recipe
+                    .join(MachineRecipe.__table__)
+                    .join(RecipeSet.__table__)
+                    .join(Job.__table__)
+                    .join(DistroTree.__table__)
+                    .join(recipe_resource,
+                        recipe_resource.c.recipe_id == recipe.c.id)
+                    .outerjoin(system_resource,
+                        system_resource.c.id == recipe_resource.c.id))
+        for overlapping in _overlapping(query, recipe.c.start_time,
+                recipe.c.finish_time, start, end):
+            for user_id, arch_id, system_id, recipe_start, recipe_finish \
+                    in connection.execute(overlapping):
+                totals[(user_id, arch_id, system_id)] += _clamped_seconds(
+                        recipe_start, recipe_finish, start, end)
+        return [{'day': start.date(), 'user_id': user_id, 'arch_id': arch_id,
+                 'system_id': system_id, 'seconds': seconds}
+                for (user_id, arch_id, system_id), seconds in totals.iteritems()]
+
+class TaskDurationFact(DeclarativeMappedObject):
+
+    """
+    Executions of each task which finished on each day, by the arch of the
+    recipe distro, with the total, shortest and longest duration in seconds.
+    """
+    __tablename__ = 'reporting_task_duration'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    day = Column(Date, primary_key=True)
+    task_id = Column(Integer, ForeignKey('task.id',
+            name='reporting_task_duration_task_id_fk', ondelete='CASCADE'),
+            primary_key=True)
+    arch_id = Column(Integer, ForeignKey('arch.id',
+            name='reporting_task_duration_arch_id_fk'), primary_key=True)
+    executions = Column(Integer, nullable=False)
+    total_seconds = Column(BigInteger, nullable=False)
+    min_seconds = Column(Integer, nullable=False)
+    max_seconds = Column(Integer, nullable=False)
+
+    @classmethod
+    def load(cls, connection, start, end):
+        recipe_task = RecipeTask.__table__
+        query = select([recipe_task.c.task_id, DistroTree.__table__.c.arch_id,
+                        recipe_task.c.start_time, recipe_task.c.finish_time],
+                from_obj=recipe_task
+                    .join(Recipe.__table__)
+                    .join(DistroTree.__table__))\
+                .where(and_(recipe_task.c.task_id != None,
+                        recipe_task.c.start_time != None,
+                        recipe_task.c.finish_time >= start,
+                        recipe_task.c.finish_time < end))
+        durations = _durations_by_key(
+                ((task_id, arch_id), int((task_finish - task_start).total_seconds()))
+                for task_id, arch_id, task_start, task_finish
+                in connection.execute(query))
+        return [{'day': start.date(), 'task_id': task_id, 'arch_id': arch_id,
+                 'executions': count, 'total_seconds': total,
+                 'min_seconds': minimum, 'max_seconds': maximum}
+                for (task_id, arch_id), (count, total, minimum, maximum)
+                in durations.iteritems()]
+
+class ResourceDurationFact(DeclarativeMappedObject):
+
+    """
+    Recipe wait times (from when the recipe set was queued until the recipe
+    started) and installation durations on each day, by resource. Systems are
+    identified by FQDN, while dynamically created VMs and guests are each
+    counted under a single label as in the original reporting queries.
+    """
+    __tablename__ = 'reporting_resource_duration'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    # 'wait' or 'install'
+    measure = Column(Unicode(16), nullable=False)
+    fqdn = Column(Unicode(255), nullable=False)
+    recipes = Column(Integer, nullable=False)
+    total_seconds = Column(BigInteger, nullable=False)
+    min_seconds = Column(Integer, nullable=False)
+    max_seconds = Column(Integer, nullable=False)
+
+    @classmethod
+    def _resource_query(cls, columns, from_obj):
+        recipe_resource = RecipeResource.__table__
+        system_resource = SystemResource.__table__
+        virt_resource = VirtResource.__table__
+        guest_resource = GuestResource.__table__
+        return select([recipe_resource.c.fqdn, system_resource.c.id,
+                       virt_resource.c.id, guest_resource.c.id] + columns,
+                from_obj=from_obj
+                    .join(recipe_resource,
+                        recipe_resource.c.recipe_id == Recipe.__table__.c.id)
+                    .outerjoin(system_resource,
+                        system_resource.c.id == recipe_resource.c.id)
+                    .outerjoin(virt_resource,
+                        virt_resource.c.id == recipe_resource.c.id)
+                    .outerjoin(guest_resource,
+                        guest_resource.c.id == recipe_resource.c.id))
+
+    @classmethod
+    def _label(cls, fqdn, system_resource_id, virt_resource_id,
+            guest_resource_id, include_guests):
+        if system_resource_id is not None:
+            return fqdn
+        if virt_resource_id is not None:
+            return VIRT_RESOURCE_LABEL
+        if guest_resource_id is not None and include_guests:
+            return GUEST_RESOURCE_LABEL
+        return None
+
+    @classmethod
+    def _rows(cls, measure, start, rows, include_guests):
+        durations = _durations_by_key(
+                (cls._label(fqdn, system_id, virt_id, guest_id, include_guests),
+                 int((finish - begin).total_seconds()))
+                for fqdn, system_id, virt_id, guest_id, begin, finish in rows)
+        return [{'day': start.date(), 'measure': measure, 'fqdn': fqdn,
+                 'recipes': count, 'total_seconds': total,
+                 'min_seconds': minimum, 'max_seconds': maximum}
+                for fqdn, (count, total, minimum, maximum)
+                in durations.iteritems() if fqdn is not None]
+
+    @classmethod
+    def load(cls, connection, start, end):
+        recipe = Recipe.__table__
+        recipe_set = RecipeSet.__table__
+        installation = Installation.__table__
+        # wait times are counted on the day the recipe started
+        wait_query = cls._resource_query(
+                [recipe_set.c.queue_time, recipe.c.start_time],
+                recipe.join(recipe_set))\
+                .where(and_(recipe.c.start_time >= start,
+                        recipe.c.start_time < end))
+        # installation durations are counted on the day they finished
+        install_query = cls._resource_query(
+                [installation.c.install_started, installation.c.install_finished],
+                installation.join(recipe,
+                    installation.c.recipe_id == recipe.c.id))\
+                .where(and_(installation.c.install_started != None,
+                        installation.c.install_finished >= start,
+                        installation.c.install_finished < end))
+        return (cls._rows(u'wait', start, connection.execute(wait_query),
+                    include_guests=False) +
+                cls._rows(u'install', start, connection.execute(install_query),
+                    include_guests=True))
+
+class ReportingFactDay(DeclarativeMappedObject):
+
+    """
+    One row for each day which has been loaded into the reporting fact tables.
+    """
+    __tablename__ = 'reporting_fact_day'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    day = Column(Date, primary_key=True)
+    loaded = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    fact_classes = [MachineHoursFact, RecipeHoursFact, TaskDurationFact,
+            ResourceDurationFact]
+
+    @classmethod
+    def next_day(cls):
+        """
+        Returns the day after the last day which was loaded or, if nothing has
+        been loaded yet, the day of the oldest reservation or queued recipe
+        set. Returns None if there is nothing to load.
+        """
+        last_day = session.query(func.max(cls.day)).scalar()
+        if last_day is not None:
+            return last_day + datetime.timedelta(days=1)
+        oldest = [value for value in [
+                session.query(func.min(Reservation.start_time)).scalar(),
+                session.query(func.min(RecipeSet.queue_time)).scalar()]
+                if value is not None]
+        if not oldest:
+            return None
+        return min(oldest).date()
+
+    @classmethod
+    def load(cls, day):
+        """
+        Loads the facts for the given day into each of the fact tables, in the
+        current transaction.
+        """
+        start = datetime.datetime.combine(day, datetime.time())
+        end = start + datetime.timedelta(days=1)
+        connection = session.connection(cls)
+        for fact_class in cls.fact_classes:
+            rows = fact_class.load(connection, start, end)
+            log.debug('Loading %s rows into %s for %s', len(rows),
+                    fact_class.__tablename__, day)
+            if rows:
+                connection.execute(fact_class.__table__.insert(), rows)
+        connection.execute(cls.__table__.insert(),
+                {'day': day, 'loaded': datetime.datetime.utcnow()})
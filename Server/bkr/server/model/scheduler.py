@@ -47,6 +47,8 @@
 from bkr.server.util import absolute_url
 from .activity import Activity, ActivityMixin
 from .base import DeclarativeMappedObject
+from .sql import insert_rows
+from .gauges import GaugeDelta, recipe_gauge_names
 from .distrolibrary import (OSMajor, OSVersion, Distro, DistroTree,
                             LabControllerDistroTree, install_options_for_distro, KernelType)
 from .identity import User, Group
@@ -522,6 +524,9 @@ def _change_status(self, new_status, **kw):
                 raise StaleTaskStatusException(
                     'Status for %s updated in another transaction'
                     % self.t_id)
+            if isinstance(self, MachineRecipe):
+                GaugeDelta.record(recipe_gauge_names(self, current_status),
+                                  recipe_gauge_names(self, new_status))
             # update the ORM session state as well
             self.status = new_status
             return True
@@ -1982,7 +1987,7 @@ class Recipe(TaskBase, ActivityMixin):
                     default=TaskStatus.new, index=True)
     reservation_request = relationship(RecipeReservationRequest, uselist=False)
     start_time = Column(DateTime, index=True)
-    finish_time = Column(DateTime)
+    finish_time = Column(DateTime, index=True)
     _host_requires = Column(UnicodeText())
     _distro_requires = Column(UnicodeText())
     # This column is actually a custom user-supplied kickstart *template*
@@ -2003,6 +2008,9 @@ class Recipe(TaskBase, ActivityMixin):
     ftasks = Column(Integer, default=0)
     # Total Panic tasks
     ktasks = Column(Integer, default=0)
+    # Number of results recorded against the recipe's tasks, NULL until it
+    # has first been counted. See Recipe.get_result_count().
+    result_count = Column(Integer)
     whiteboard = Column(Unicode(4096))
     ks_meta = Column(String(1024))
     kernel_options = Column(String(1024))
@@ -2124,6 +2132,40 @@ def purge(self):
                        prefixes=[RecipeTaskResult.__table__.name]) \
             .where(RecipeTask.recipe_id == self.id)
         session.connection(RecipeTaskResult).execute(query)
+        self.result_count = 0
+
+    @classmethod
+    def get_result_count(cls, recipe_id):
+        """
+        Returns the number of results recorded against the tasks in the given
+        recipe. The count is cached in recipe.result_count, so the results
+        only need to be counted the first time.
+        """
+        table = cls.__table__
+        connection = session.connection(cls)
+        count = connection.scalar(select([table.c.result_count])
+                .where(table.c.id == recipe_id))
+        if count is None:
+            count = RecipeTaskResult.query.join(RecipeTaskResult.recipetask)\
+                    .filter(RecipeTask.recipe_id == recipe_id).count()
+            connection.execute(table.update()
+                    .where(and_(table.c.id == recipe_id,
+                                table.c.result_count == None))
+                    .values(result_count=count))
+        return count
+
+    @classmethod
+    def add_to_result_count(cls, recipe_id, count):
+        """
+        Adds to the cached result count for the given recipe, if it has been
+        counted already. The update is done in SQL so that concurrent
+        submissions are not lost.
+        """
+        table = cls.__table__
+        session.connection(cls).execute(table.update()
+                .where(and_(table.c.id == recipe_id,
+                            table.c.result_count != None))
+                .values(result_count=table.c.result_count + count))
 
     def task_repo(self):
         return ('beaker-tasks', absolute_url('/repos/%s' % self.id,
@@ -3253,7 +3295,7 @@ def candidate_systems(self, only_in_lab=True):
         from bkr.server.needpropertyxml import XmlHost
         host_filter = XmlHost.from_string(self.host_requires)
         if not host_filter.force:
-            systems = host_filter.apply_filter(systems). \
+            systems = host_filter.apply_cached_filter(systems). \
                 filter(System.status == SystemStatus.automated)
             systems = systems.filter(System.compatible_with_distro_tree(arch=self.installation.arch,
                                                                         osmajor=self.installation.osmajor,
@@ -3279,7 +3321,7 @@ def hypothetical_candidate_systems(cls, user, distro_tree=None, lab_controller=N
         # delayed import to avoid circular dependency
         from bkr.server.needpropertyxml import XmlHost
         systems = XmlHost.from_string('<hostRequires><system_type value="%s"/></hostRequires>' %
-                                      cls.systemtype).apply_filter(systems)
+                                      cls.systemtype).apply_cached_filter(systems)
         if not force:
             systems = systems.filter(System.status == SystemStatus.automated)
             if distro_tree:
@@ -3371,6 +3413,11 @@ def runnable_on_system(cls, system):
         return recipes
 
 
+@event.listens_for(MachineRecipe, 'after_insert')
+def count_new_recipe_gauges(mapper, connection, recipe):
+    GaugeDelta.record([], recipe_gauge_names(recipe), connection=connection)
+
+
 class RecipeTag(DeclarativeMappedObject):
     """
     Each recipe can be tagged with information that identifies what is being
@@ -3714,6 +3761,7 @@ def _abort_cancel(self, status, msg=None):
             result=TaskResult.warn,
             score=0,
             log=msg))
+        Recipe.add_to_result_count(self.recipe_id, 1)
 
     def pass_(self, path, score, summary):
         """
@@ -3751,29 +3799,39 @@ def _result(self, result, path, score, summary):
         """
         if self.is_finished():
             raise ValueError('Cannot record result for finished task %s' % self.t_id)
-        # see https://bugzilla.redhat.com/show_bug.cgi?id=1586049
-        # and https://bugzilla.redhat.com/show_bug.cgi?id=1600281
-        # MySQL 5.x (non-strict) was coercing whatever string passed in to an
-        # int value, and silently capping it at the maximum representable
-        # value, whereas MariaDB (strict) will raise an error. This is a
-        # backwards compatible "hack" for the same MySQL 5.x behaviour.
-        if isinstance(score, basestring):
-            number_match = re.match('-?\d+(\.\d+)?', score)
-            if not number_match:
-                score = 0
-            else:
-                score = round(decimal.Decimal(number_match.group()))
-        score = min(score, RecipeTaskResult.max_score)
         recipeTaskResult = RecipeTaskResult(recipetask=self,
                                             path=path,
                                             result=result,
-                                            score=score,
+                                            score=_normalised_score(score),
                                             log=summary)
         # Flush the result to the DB so we can return the id.
         session.add(recipeTaskResult)
         session.flush()
+        Recipe.add_to_result_count(self.recipe_id, 1)
         return recipeTaskResult.id
 
+    def record_results(self, results):
+        """
+        Records several results at once. *results* is a list of (result, path,
+        score, summary) tuples, where result is a TaskResult. The results are
+        inserted in bulk without going through the ORM, and their ids are
+        returned in the same order.
+        """
+        if self.is_finished():
+            raise ValueError('Cannot record result for finished task %s' % self.t_id)
+        now = datetime.utcnow()
+        rows = [dict(recipe_task_id=self.id, path=path, result=result,
+                     score=_normalised_score(score), log=summary,
+                     start_time=now)
+                for result, path, score, summary in results]
+        session.flush()
+        ids = insert_rows(session.connection(RecipeTaskResult),
+                RecipeTaskResult.__table__, rows)
+        Recipe.add_to_result_count(self.recipe_id, len(rows))
+        # Any results already loaded for this task are now out of date
+        session.expire(self, ['results'])
+        return ids
+
     @property
     def resource(self):
         return self.recipe.resource
@@ -3951,6 +4009,21 @@ class RecipeTaskRpm(DeclarativeMappedObject):
     running_kernel = Column(Boolean)
 
 
+def _normalised_score(score):
+    # see https://bugzilla.redhat.com/show_bug.cgi?id=1586049
+    # and https://bugzilla.redhat.com/show_bug.cgi?id=1600281
+    # MySQL 5.x (non-strict) was coercing whatever string passed in to an
+    # int value, and silently capping it at the maximum representable
+    # value, whereas MariaDB (strict) will raise an error. This is a
+    # backwards compatible "hack" for the same MySQL 5.x behaviour.
+    if isinstance(score, basestring):
+        number_match = re.match('-?\d+(\.\d+)?', score)
+        if not number_match:
+            score = 0
+        else:
+            score = round(decimal.Decimal(number_match.group()))
+    return min(score, RecipeTaskResult.max_score)
+
 class RecipeTaskResult(TaskBase):
     """
     Each task can report multiple results
@@ -52,3 +52,42 @@ def visit_conditional_insert(element, compiler, **kwargs):
             whereclause=element.unique_condition, for_update=True)))
     text += 'WHERE ' + compiler.process(nonexistence_clause)
     return text
+
+_autoinc_settings = None
+
+def _autoincrement_step(connection):
+    """
+    If the ids generated by a single multi-row INSERT can be assumed to form
+    an arithmetic sequence, returns the step between them. Otherwise returns
+    None.
+
+    InnoDB guarantees this unless innodb_autoinc_lock_mode is 2 (interleaved).
+    Each id is then auto_increment_increment greater than the previous one;
+    the first id already accounts for auto_increment_offset.
+    """
+    global _autoinc_settings
+    if connection.dialect.name != 'mysql':
+        return None
+    if _autoinc_settings is None:
+        _autoinc_settings = tuple(connection.execute(sqltext(
+                'SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment')).first())
+    lock_mode, increment = _autoinc_settings
+    if lock_mode not in (0, 1) or not increment or increment < 1:
+        return None
+    return increment
+
+def insert_rows(connection, table, rows):
+    """
+    Inserts the given rows (a list of dicts) into a table with an
+    autoincrement primary key, returning the ids of the new rows in the same
+    order. Uses a single multi-row INSERT where the database guarantees how
+    the ids it assigns are spaced, otherwise one INSERT per row.
+    """
+    if not rows:
+        return []
+    step = _autoincrement_step(connection)
+    if step is not None:
+        result = connection.execute(table.insert().values(rows))
+        return range(result.lastrowid, result.lastrowid + len(rows) * step, step)
+    return [connection.execute(table.insert(), row).inserted_primary_key[0]
+            for row in rows]
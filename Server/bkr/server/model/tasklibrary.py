@@ -20,7 +20,7 @@
 from turbogears.database import session
 from bkr.common.helpers import (AtomicFileReplacement, Flock,
                                 makedirs_ignore, unlink_ignore)
-from bkr.server import identity, testinfo
+from bkr.server import identity, testinfo, rpmpayload
 from bkr.server.bexceptions import BX
 from bkr.server.hybrid import hybrid_method
 from bkr.server.util import absolute_url, run_createrepo, convert_db_lookup_error
@@ -179,7 +179,7 @@ def update_task(self, rpm_name, write_rpm):
         tasks = self.update_tasks([(rpm_name, write_rpm)])
         return tasks[0]
 
-    def update_tasks(self, rpm_names_write_rpm):
+    def update_tasks(self, rpm_names_write_rpm, pool=None):
         """Updates the the task rpm library
 
            rpm_names_write_rpm is a list of two element tuples,
@@ -191,6 +191,9 @@ def update_tasks(self, rpm_names_write_rpm):
            write_rpm must be a callable that takes a file object as its
            sole argument and populates it with the raw task RPM contents
 
+           If pool is given, it is a multiprocessing pool which is used to
+           read the task details from the RPMs in parallel.
+
            Expects to be called in a transaction, and for that transaction
            to be rolled back if an exception is thrown.
         """
@@ -218,11 +221,16 @@ def update_tasks(self, rpm_names_write_rpm):
 
 
         try:
+            # Read the RPMs before taking the lock, they are not visible to
+            # anyone else yet.
+            temp_paths = [atomic_file.temp_path for __, atomic_file in to_sync]
+            if pool is not None:
+                taskinfos = pool.map(_read_taskinfo_from_path, temp_paths)
+            else:
+                taskinfos = map(_read_taskinfo_from_path, temp_paths)
             with Flock(self.rpmspath):
-                for rpm_name, atomic_file in to_sync:
-                    f = atomic_file.temp_file
-                    f.seek(0)
-                    task, downgrade = Task.create_from_taskinfo(self.read_taskinfo(f))
+                for (rpm_name, atomic_file), taskinfo in zip(to_sync, taskinfos):
+                    task, downgrade = Task.create_from_taskinfo(taskinfo)
                     old_rpm_name = task.rpm
                     task.rpm = rpm_name
                     if old_rpm_name:
@@ -291,17 +299,30 @@ def read_taskinfo(self, fd):
             if file.endswith('testinfo.desc'):
                 taskinfo_file = file
         if taskinfo_file:
-            fd.seek(0)
-            p1 = subprocess.Popen(["rpm2cpio"],
-                                  stdin=fd.fileno(), stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE)
-            p2 = subprocess.Popen(["cpio", "--quiet", "--extract",
-                                   "--to-stdout", ".%s" % taskinfo_file],
-                                  stdin=p1.stdout, stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE)
-            taskinfo['desc'] = p2.communicate()[0]
+            try:
+                taskinfo['desc'] = rpmpayload.read_payload_file(fd,
+                        taskinfo_file) or ''
+            except rpmpayload.UnsupportedPayload as e:
+                log.debug('Extracting %s with rpm2cpio: %s', taskinfo_file, e)
+                taskinfo['desc'] = self._extract_with_cpio(fd, taskinfo_file)
         return taskinfo
 
+    def _extract_with_cpio(self, fd, path):
+        fd.seek(0)
+        p1 = subprocess.Popen(["rpm2cpio"],
+                              stdin=fd.fileno(), stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+        p2 = subprocess.Popen(["cpio", "--quiet", "--extract",
+                               "--to-stdout", ".%s" % path],
+                              stdin=p1.stdout, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+        return p2.communicate()[0]
+
+def _read_taskinfo_from_path(path):
+    # Module level so that it can be run in a multiprocessing pool
+    with open(path, 'rb') as f:
+        return TaskLibrary().read_taskinfo(f)
+
 
 class Task(DeclarativeMappedObject):
     """
@@ -165,6 +165,14 @@ class GroupMembershipType(DeclEnum):
         ('inverted', u'inverted', dict(label=_(u'Inverted'))),
     ]
 
+class SystemFacetType(DeclEnum):
+
+    symbols = [
+        ('cpu_flag',  u'cpu_flag',  dict()),
+        ('disk_size', u'disk_size', dict()),
+        ('key_value', u'key_value', dict()),
+    ]
+
 class RecipeReservationCondition(DeclEnum):
     symbols = [
         ('onabort', u'onabort', dict()),
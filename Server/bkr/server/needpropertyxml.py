@@ -5,20 +5,28 @@
 # (at your option) any later version.
 
 import operator
+import binascii
+import threading
+import time
+import weakref
+from itertools import chain
 
 import datetime
 from lxml import etree
-from sqlalchemy import or_, and_, not_, exists, func
-from sqlalchemy.orm import aliased
+from sqlalchemy import or_, and_, not_, exists, func, event
+from sqlalchemy.orm import aliased, Session
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.inspection import inspect
 from sqlalchemy.sql import false
+from turbogears import config
 
-from bkr.server.model import (Arch, Distro, DistroTree, DistroTag,
+from bkr.server.model import (session, Arch, Distro, DistroTree, DistroTag,
                               OSMajor, OSVersion, SystemPool, System, User,
                               Key, Key_Value_Int, Key_Value_String,
                               LabController, LabControllerDistroTree,
                               Hypervisor, Cpu, CpuFlag, Numa, Device,
-                              DeviceClass, Disk, Power, PowerType)
+                              DeviceClass, Disk, Power, PowerType,
+                              SystemFacet, SystemFacetType)
 
 
 # This follows the SI conventions used in disks and networks --
@@ -75,6 +83,218 @@ def date_filter(col, op, value):
     return clause
 
 
+def _ids_to_bitset(ids):
+    """
+    Returns a bitset (as a long) with bit n set for each system id n.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    buf = bytearray((max(ids) >> 3) + 1)
+    for system_id in ids:
+        buf[system_id >> 3] |= 1 << (system_id & 7)
+    buf.reverse()
+    return long(binascii.hexlify(buf), 16)
+
+
+def _bitset_to_ids(bits):
+    """
+    Returns a sorted list of the system ids whose bits are set.
+    """
+    if not bits:
+        return []
+    hexbits = '%x' % bits
+    if len(hexbits) % 2:
+        hexbits = '0' + hexbits
+    buf = bytearray(binascii.unhexlify(hexbits))
+    buf.reverse()
+    return [(n << 3) + bit for n, byte in enumerate(buf) if byte
+            for bit in xrange(8) if byte & (1 << bit)]
+
+
+def _and_bitsets(results):
+    results = [result for result in results if result is not None]
+    if not results:
+        return None
+    return (reduce(operator.and_, [result[0] for result in results]),
+            reduce(operator.or_, [result[1] for result in results]),
+            _required_bitset(results))
+
+
+def _or_bitsets(results):
+    results = [result for result in results if result is not None]
+    if not results:
+        return None
+    return (reduce(operator.or_, [result[0] for result in results]),
+            reduce(operator.and_, [result[1] for result in results]),
+            _required_bitset(results))
+
+
+def _required_bitset(results):
+    required = [result[2] for result in results if result[2] is not None]
+    if not required:
+        return None
+    return reduce(operator.and_, required)
+
+
+class _CacheEntry(object):
+
+    def __init__(self, result, loaded, stale):
+        self.result = result
+        self.loaded = loaded
+        # systems whose bits need to be evaluated again
+        self.stale = stale
+
+
+class HostFilterCache(object):
+    """
+    Caches the results of leaf host filters (such as <arch/>, <system_type/>
+    or <key_value/>) as bitsets over system ids, so that they can be shared
+    by all recipes which use the same leaf. See ElementWrapper.bitsets().
+
+    Cached results are discarded after *ttl* seconds. When a flush changes
+    the inventory of some systems, only the bits for those systems are
+    evaluated again the next time the result is used (see
+    invalidate_host_filter_cache_after_flush below). Changes made by other
+    processes (such as the web application, when the cache belongs to
+    beakerd) are noticed on each lookup by checking for systems whose
+    date_modified has changed, and only their bits are evaluated again.
+    """
+
+    max_entries = 10000
+
+    #: How far back (in seconds) to look for modified systems. A change is
+    #: stamped with date_modified some time before it is committed, and the
+    #: clocks of the web and scheduler hosts may differ slightly.
+    modification_window = 60
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        # bits invalidated while a result was being evaluated, by token
+        self._pending = {}
+        self._lock = threading.Lock()
+        # when we last checked for modified systems, and the date_modified we
+        # saw then for the systems which were inside the window
+        self._checked = None
+        self._seen_modified = {}
+        _host_filter_caches.add(self)
+
+    def _invalidate_modified_systems(self):
+        """
+        Marks the systems which have been modified (by any process) since the
+        last check as stale.
+        """
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            checked, self._checked = self._checked, now
+        if checked is None:
+            # nothing can have been cached before the first check
+            return
+        since = checked - datetime.timedelta(seconds=self.modification_window)
+        modified = dict(session.query(System.id, System.date_modified)
+                .filter(System.date_modified >= since))
+        # date_modified only has a resolution of one second, so a system
+        # modified again within the same second would look unchanged
+        recent = checked - datetime.timedelta(seconds=1)
+        with self._lock:
+            system_ids = [system_id for system_id, date_modified
+                    in modified.iteritems()
+                    if date_modified >= recent
+                    or self._seen_modified.get(system_id) != date_modified]
+            self._seen_modified = modified
+        if system_ids:
+            self.invalidate(system_ids)
+
+    def lookup(self, element):
+        key = (element.__class__.__name__,
+               etree.tostring(element.wrappedEl, with_tail=False))
+        self._invalidate_modified_systems()
+        now = time.time()
+        token = object()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.loaded > self.ttl:
+                entry = None
+            if entry is not None and (not entry.stale or entry.result is None):
+                return entry.result
+            self._pending[token] = 0
+        try:
+            if entry is None:
+                result = self.evaluate(element)
+                loaded = now
+            else:
+                result = self._refresh(element, entry.result, entry.stale)
+                loaded = entry.loaded
+        except Exception:
+            with self._lock:
+                del self._pending[token]
+            raise
+        with self._lock:
+            stale = self._pending.pop(token)
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._entries.clear()
+            self._entries[key] = _CacheEntry(result, loaded, stale)
+        return result
+
+    def _refresh(self, element, result, stale):
+        fresh = self.evaluate(element, restrict=stale)
+        if fresh is None:
+            return None
+        keep = ~stale
+        matched = (result[0] & keep) | fresh[0]
+        unmatched = (result[1] & keep) | fresh[1]
+        required = None
+        if result[2] is not None and fresh[2] is not None:
+            required = (result[2] & keep) | fresh[2]
+        return (matched, unmatched, required)
+
+    def evaluate(self, element, restrict=None):
+        """
+        Evaluates a leaf filter against the database, for all systems or for
+        the systems in the *restrict* bitset.
+        """
+        query = session.query(System.id)
+        if restrict is not None:
+            query = query.filter(System.id.in_(_bitset_to_ids(restrict)))
+        joins, clause = element.filter(query)
+        if clause is None:
+            return None
+        required = None
+        if joins is not query:
+            required = _ids_to_bitset(system_id for system_id, in joins)
+        return (_ids_to_bitset(system_id for system_id, in joins.filter(clause)),
+                _ids_to_bitset(system_id for system_id, in joins.filter(not_(clause))),
+                required)
+
+    def invalidate(self, system_ids):
+        bits = _ids_to_bitset(system_ids)
+        with self._lock:
+            for entry in self._entries.itervalues():
+                entry.stale |= bits
+            for token in self._pending:
+                self._pending[token] |= bits
+
+
+# All caches in this process, so that they can be invalidated after flushes
+_host_filter_caches = weakref.WeakSet()
+_host_filter_cache = None
+
+
+def host_filter_cache():
+    """
+    Returns the HostFilterCache for this process, or None if it is disabled
+    by setting beaker.host_filter_cache_ttl to 0.
+    """
+    global _host_filter_cache
+    ttl = config.get('beaker.host_filter_cache_ttl', 60)
+    if ttl <= 0:
+        return None
+    if _host_filter_cache is None:
+        _host_filter_cache = HostFilterCache(ttl)
+    return _host_filter_cache
+
+
 class ElementWrapper(object):
     # Operator translation table
     op_table = {'=': '__eq__',
@@ -88,6 +308,11 @@ class ElementWrapper(object):
 
     subclassDict = []
 
+    # Leaf filters whose result depends only on the systems' inventory and
+    # configuration set this, so that HostFilterCache can share their result
+    # between recipes.
+    cacheable = False
+
     def get_subclass(self, element):
         name = element.tag
 
@@ -138,6 +363,20 @@ def apply_filter(self, query):
     def filter(self, joins):
         return (joins, None)
 
+    def bitsets(self, cache):
+        """
+        Evaluates this filter as bitsets over system ids, with bit n set for
+        the system whose id is n. Returns a tuple of (matched, unmatched,
+        required) bitsets: the systems for which the filter clause is true,
+        the systems for which it is false (systems where it is NULL are in
+        neither), and the systems which are kept by any inner joins the filter
+        adds to the query (or None if it adds none). Returns None if the filter
+        has no clause.
+        """
+        if self.cacheable:
+            return cache.lookup(self)
+        return cache.evaluate(self)
+
     def filter_disk(self):
         return None
 
@@ -168,6 +407,10 @@ def filter(self, joins):
             return (joins, None)
         return (joins, and_(*queries))
 
+    def bitsets(self, cache):
+        return _and_bitsets(child.bitsets(cache) for child in self
+                            if callable(getattr(child, 'bitsets', None)))
+
     def filter_disk(self):
         queries = []
         for child in self:
@@ -208,6 +451,10 @@ def filter(self, joins):
             return (joins, None)
         return (joins, or_(*queries))
 
+    def bitsets(self, cache):
+        return _or_bitsets(child.bitsets(cache) for child in self
+                           if callable(getattr(child, 'bitsets', None)))
+
     def filter_disk(self):
         queries = []
         for child in self:
@@ -248,6 +495,14 @@ def filter(self, joins):
             return (joins, None)
         return (joins, not_(and_(*queries)))
 
+    def bitsets(self, cache):
+        result = _and_bitsets(child.bitsets(cache) for child in self
+                              if callable(getattr(child, 'bitsets', None)))
+        if result is None:
+            return None
+        matched, unmatched, required = result
+        return (unmatched, matched, required)
+
     def filter_disk(self):
         queries = []
         for child in self:
@@ -365,6 +620,8 @@ class XmlPool(ElementWrapper):
     Filter based on pool
     """
 
+    cacheable = True
+
     op_table = {'=': '__eq__',
                 '==': '__eq__',
                 '!=': '__ne__'}
@@ -398,6 +655,8 @@ class XmlKeyValue(ElementWrapper):
     Filter based on key_value
     """
 
+    cacheable = True
+
     def filter(self, joins):
         key = self.get_xml_attr('key', unicode, None)
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
@@ -410,31 +669,22 @@ def filter(self, joins):
             # makes no sense, discard
             return (joins, None)
         if _key.numeric:
-            key_value_cls = Key_Value_Int
-            collection = System.key_values_int
+            column = SystemFacet.int_value
         else:
-            key_value_cls = Key_Value_String
-            collection = System.key_values_string
+            column = SystemFacet.value
         # <key_value key="THING" op="==" /> -- must have key with any value
         # <key_value key="THING" op="==" value="VALUE" /> -- must have key with given value
         # <key_value key="THING" op="!=" /> -- must not have key
         # <key_value key="THING" op="!=" value="VALUE" /> -- must not have key with given value
-        if op == '__ne__' and value is None:
-            query = not_(collection.any(key_value_cls.key == _key))
+        if value is None:
+            clause = None
         elif op == '__ne__':
-            query = not_(collection.any(and_(
-                key_value_cls.key == _key,
-                key_value_cls.key_value == value)))
-        elif op == '__eq__' and value is None:
-            query = collection.any(key_value_cls.key == _key)
-        elif op == '__eq__':
-            query = collection.any(and_(
-                key_value_cls.key == _key,
-                key_value_cls.key_value == value))
+            clause = column == value
         else:
-            query = collection.any(and_(
-                key_value_cls.key == _key,
-                getattr(key_value_cls.key_value, op)(value)))
+            clause = getattr(column, op)(value)
+        query = SystemFacet.matches(SystemFacetType.key_value, clause, key=_key)
+        if op == '__ne__':
+            query = not_(query)
         return (joins, query)
 
 
@@ -444,6 +694,8 @@ class XmlAutoProv(ElementWrapper):
     lab controller
     """
 
+    cacheable = True
+
     def filter(self, joins):
         value = self.get_xml_attr('value', unicode, False)
         query = None
@@ -457,6 +709,9 @@ class XmlHostLabController(ElementWrapper):
     """
     Pick a system from this lab controller
     """
+
+    cacheable = True
+
     op_table = {'=': '__eq__',
                 '==': '__eq__',
                 '!=': '__ne__'}
@@ -518,6 +773,8 @@ class XmlHypervisor(ElementWrapper):
     Pick a system based on the hypervisor.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, '')
@@ -547,6 +804,8 @@ class XmlSystemType(ElementWrapper):
     Pick a system with the correct system type.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         value = self.get_xml_attr('value', unicode, None)
         query = None
@@ -586,6 +845,8 @@ class XmlHostName(ElementWrapper):
     Pick a system wth the correct hostname.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -644,6 +905,8 @@ class XmlSystemLender(ElementWrapper):
     Pick a system wth the correct lender.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -658,6 +921,8 @@ class XmlSystemVendor(ElementWrapper):
     Pick a system wth the correct vendor.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -672,6 +937,8 @@ class XmlSystemLocation(ElementWrapper):
     Pick a system wth the correct location.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -686,6 +953,8 @@ class XmlSystemSerial(ElementWrapper):
     Pick a system wth the correct Serial Number.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -700,6 +969,8 @@ class XmlSystemModel(ElementWrapper):
     Pick a system wth the correct model.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -714,6 +985,8 @@ class XmlMemory(ElementWrapper):
     Pick a system wth the correct amount of memory.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -811,6 +1084,8 @@ class XmlSystemPowertype(ElementWrapper):
     Pick a system that has been loaned to this user.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -826,6 +1101,8 @@ class XmlCpuProcessors(ElementWrapper):
     Pick a system with the correct amount of cpu processors.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -855,6 +1132,8 @@ class XmlCpuCores(ElementWrapper):
     Pick a system with the correct amount of cpu cores.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -881,6 +1160,8 @@ class XmlCpuFamily(ElementWrapper):
     Pick a system with the correct cpu family.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -896,6 +1177,8 @@ class XmlCpuModel(ElementWrapper):
     Pick a system with the correct cpu model.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -911,6 +1194,8 @@ class XmlCpuModelName(ElementWrapper):
     Pick a system with the correct cpu model_name.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -926,6 +1211,8 @@ class XmlCpuSockets(ElementWrapper):
     Pick a system with the correct number of cpu sockets.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -941,6 +1228,8 @@ class XmlCpuSpeed(ElementWrapper):
     Pick a system with the correct cpu speed.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', float, None)
@@ -956,6 +1245,8 @@ class XmlCpuStepping(ElementWrapper):
     Pick a system with the correct cpu stepping.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -971,6 +1262,8 @@ class XmlCpuVendor(ElementWrapper):
     Pick a system with the correct cpu vendor.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', unicode, None)
@@ -986,6 +1279,8 @@ class XmlCpuHyper(ElementWrapper):
     Pick a system with cpu's that have hyperthreading enabled.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = '__eq__'
         uvalue = self.get_xml_attr('value', unicode, False).lower()
@@ -1002,6 +1297,8 @@ class XmlCpuFlag(ElementWrapper):
     Filter systems based on System.cpu.flags
     """
 
+    cacheable = True
+
     op_table = {'=': '__eq__',
                 '==': '__eq__',
                 'like': 'like',
@@ -1013,12 +1310,10 @@ def filter(self, joins):
         value = self.get_xml_attr('value', unicode, None)
         query = None
         if value:
-            joins = joins.join(System.cpu)
-            query = getattr(CpuFlag.flag, equal)(value)
+            query = SystemFacet.matches(SystemFacetType.cpu_flag,
+                    getattr(SystemFacet.value, equal)(value))
             if op == '__ne__':
-                query = not_(Cpu.flags.any(query))
-            else:
-                query = Cpu.flags.any(query)
+                query = not_(query)
         return (joins, query)
 
 
@@ -1027,6 +1322,8 @@ class XmlArch(ElementWrapper):
     Pick a system with the correct arch
     """
 
+    cacheable = True
+
     op_table = {'=': '__eq__',
                 '==': '__eq__',
                 '!=': '__ne__'}
@@ -1070,6 +1367,8 @@ class XmlNumaNodeCount(ElementWrapper):
     Pick a system with the correct number of NUMA nodes.
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -1085,6 +1384,8 @@ class XmlDevice(ElementWrapper):
     Pick a system with a matching device.
     """
 
+    cacheable = True
+
     op_table = {'=': '__eq__',
                 '==': '__eq__',
                 'like': 'like',
@@ -1188,6 +1489,13 @@ class XmlDisk(XmlAnd):
         'phys_sector_size': XmlDiskPhysSectorSize,
     }
 
+    # The child filters all apply to the same disk, so this is a single leaf
+    # as far as bitsets are concerned.
+    cacheable = True
+
+    def bitsets(self, cache):
+        return ElementWrapper.bitsets(self, cache)
+
     def filter(self, joins):
         clauses = []
         for child in self:
@@ -1205,6 +1513,8 @@ class XmlDiskSpace(ElementWrapper):
     Filter systems by total disk space
     """
 
+    cacheable = True
+
     def _bytes_value(self):
         value = self.get_xml_attr('value', int, None)
         units = self.get_xml_attr('units', unicode, 'bytes')
@@ -1225,6 +1535,8 @@ class XmlDiskCount(ElementWrapper):
     Filter systems by total number of disks
     """
 
+    cacheable = True
+
     def filter(self, joins):
         op = self.op_table[self.get_xml_attr('op', unicode, '==')]
         value = self.get_xml_attr('value', int, None)
@@ -1322,6 +1634,31 @@ def force(self):
         """
         return self.get_xml_attr('force', unicode, None)
 
+    def apply_cached_filter(self, query, cache=None):
+        """
+        Equivalent to apply_filter(), but the filter is evaluated using
+        bitsets of the matching system ids, reusing cached results for leaf
+        filters where possible. The result is applied to the query as an IN
+        clause on System.id.
+
+        If no cache is given, the process-wide cache is used. If that is
+        disabled, this falls back to apply_filter().
+        """
+        if cache is None:
+            cache = host_filter_cache()
+            if cache is None:
+                return self.apply_filter(query)
+        result = self.bitsets(cache)
+        if result is None:
+            return query
+        matched, unmatched, required = result
+        if required is not None:
+            matched &= required
+        system_ids = _bitset_to_ids(matched)
+        if not system_ids:
+            return query.filter(false())
+        return query.filter(System.id.in_(system_ids))
+
     def virtualisable(self):
         if self.force:
             return False
@@ -1359,6 +1696,48 @@ class XmlDistro(XmlAnd):
     }
 
 
+@event.listens_for(Session, 'after_flush')
+def invalidate_host_filter_cache_after_flush(sess, flush_context):
+    """
+    Marks the cached host filter results as stale for any systems whose
+    inventory is changed by this flush. They are marked again when the
+    transaction ends, in case the cache was refreshed using uncommitted
+    changes which were then rolled back.
+    """
+    if not _host_filter_caches:
+        return
+    system_ids = set()
+    for obj in chain(sess.new, sess.dirty, sess.deleted):
+        if isinstance(obj, System):
+            system_ids.add(obj.id)
+        elif isinstance(obj, (Cpu, Disk, Numa, Power, Key_Value_String,
+                              Key_Value_Int)):
+            system_ids.add(obj.system_id)
+        elif isinstance(obj, CpuFlag):
+            # A flag removed from its Cpu has no cpu any more, but then the
+            # Cpu itself is dirty and is handled above.
+            if obj.cpu is not None:
+                system_ids.add(obj.cpu.system_id)
+        elif isinstance(obj, SystemPool):
+            history = inspect(obj).attrs.systems.history
+            system_ids.update(system.id for system in
+                              chain(history.added or (), history.deleted or ()))
+    system_ids.discard(None)
+    if system_ids:
+        for cache in list(_host_filter_caches):
+            cache.invalidate(system_ids)
+        sess.info.setdefault('host_filter_cache_stale_ids', set()).update(system_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def invalidate_host_filter_cache_after_transaction(sess):
+    system_ids = sess.info.pop('host_filter_cache_stale_ids', None)
+    if system_ids:
+        for cache in list(_host_filter_caches):
+            cache.invalidate(system_ids)
+
+
 def apply_distro_filter(filter, query):
     if isinstance(filter, basestring):
         filter = XmlDistro(etree.fromstring(filter))
@@ -21,12 +21,22 @@
                               RecipeTaskResult, LogRecipeTaskResult,
                               LabController, Watchdog, ResourceType,
                               RecipeTaskComment, RecipeTaskResultComment,
-                              Recipe)
+                              Recipe, TaskResult)
 from flask import redirect, request, jsonify
 from bkr.server.app import app
 from bkr.server.flask_util import auth_required, convert_internal_errors, \
     BadRequest400, NotFound404, Forbidden403, read_json_request
 
+# maps from the result_type names accepted by RecipeTasks.result
+_result_type_values = {
+    'pass_': TaskResult.pass_,
+    'warn': TaskResult.warn,
+    'fail': TaskResult.fail,
+    'panic': TaskResult.panic,
+    'result_none': TaskResult.none,
+    'skip': TaskResult.skip,
+}
+
 class RecipeTasks(RPCRoot):
     # For XMLRPC methods in this class.
     exposed = True
@@ -63,13 +73,12 @@ def _check_log_limit(self, recipetask):
             self._warn_once(recipetask, u'Too many logs in recipe')
             raise ValueError('Too many logs in recipe %s' % recipetask.recipe_id)
 
-    def _check_result_limit(self, recipetask):
+    def _check_result_limit(self, recipetask, adding=1):
         max_results_per_recipe = config.get('beaker.max_results_per_recipe', 7500)
         if not max_results_per_recipe or max_results_per_recipe <= 0:
             return
-        result_count = RecipeTaskResult.query.join(RecipeTaskResult.recipetask)\
-                .filter(RecipeTask.recipe_id == recipetask.recipe_id).count()
-        if result_count >= max_results_per_recipe:
+        result_count = Recipe.get_result_count(recipetask.recipe_id)
+        if result_count + adding > max_results_per_recipe:
             self._warn_once(recipetask, u'Too many results in recipe')
             raise ValueError(u'Too many results in recipe %s' % recipetask.recipe_id)
 
@@ -239,6 +248,35 @@ def result(self, task_id, result_type, path=None, score=None, summary=None):
         kwargs = dict(path=path, score=score, summary=summary)
         return getattr(task,result_type)(**kwargs)
 
+    @cherrypy.expose
+    @identity.require(identity.not_anonymous())
+    def results(self, task_id, results):
+        """
+        Records several results against a recipe-task at once. *results* is
+        a list of dicts with the keys ``result_type``, ``path``, ``score``
+        and ``summary``, which have the same meaning as the arguments to
+        :meth:`result`. The results are inserted together, and a list of
+        their ids is returned in the same order.
+
+        Either all of the results are recorded, or none of them are.
+        """
+        try:
+            task = RecipeTask.by_id(task_id)
+        except InvalidRequestError:
+            raise BX(_('Invalid task ID: %s' % task_id))
+        rows = []
+        for result in results:
+            result_type = result.get('result_type')
+            if result_type not in task.result_types:
+                raise BX(_('Invalid result_type: %s, must be one of %s' %
+                                 (result_type, task.result_types)))
+            rows.append((_result_type_values[result_type], result.get('path'),
+                    result.get('score'), result.get('summary')))
+        if not rows:
+            return []
+        self._check_result_limit(task, adding=len(rows))
+        return task.record_results(rows)
+
     @expose(format='json')
     def to_xml(self, id):
         taskxml = RecipeTask.by_id(id).to_xml().toprettyxml()
@@ -0,0 +1,14 @@
+-- Equivalent of install-duration-by-resource, reading the daily totals in the 
+-- reporting_resource_duration fact table. Each installation is counted on the 
+-- day it finished. Like the original query this covers all loaded days, add 
+-- a condition on reporting_resource_duration.day to limit it to a period.
+
+SELECT
+    fqdn,
+    SUM(total_seconds) / SUM(recipes) / 60 / 60 AS avg_install_hours,
+    MIN(min_seconds) / 60 / 60 AS min_install_hours,
+    MAX(max_seconds) / 60 / 60 AS max_install_hours
+FROM reporting_resource_duration
+WHERE measure = 'install'
+GROUP BY fqdn
+ORDER BY min_install_hours desc;
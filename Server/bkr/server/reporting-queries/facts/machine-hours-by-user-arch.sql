@@ -0,0 +1,41 @@
+
+-- Equivalent of machine-hours-by-user-arch, reading the daily totals in the 
+-- reporting_machine_hours fact table instead of the reservation table. The 
+-- fact tables are filled in by beaker-update-reporting-facts, so days which 
+-- have not been loaded yet are not counted.
+
+-- The reporting period is given as a range of days, the end day is not 
+-- included.
+
+SELECT
+    tg_user.user_name AS username,
+    system_arch.arch AS arch,
+    SUM(reporting_machine_hours.seconds) / 60 / 60 AS machine_hours
+FROM reporting_machine_hours
+INNER JOIN system ON reporting_machine_hours.system_id = system.id
+INNER JOIN
+    (SELECT system.id, MAX(arch.arch) arch
+    FROM system
+    LEFT OUTER JOIN system_arch_map ON system_arch_map.system_id = system.id
+    LEFT OUTER JOIN arch ON system_arch_map.arch_id = arch.id
+    GROUP BY system.id) system_arch
+    ON system_arch.id = system.id
+INNER JOIN tg_user ON reporting_machine_hours.user_id = tg_user.user_id
+LEFT OUTER JOIN system_access_policy ON system.active_access_policy_id = system_access_policy.id
+WHERE reporting_machine_hours.day >= '2012-10-01'
+    AND reporting_machine_hours.day < '2012-11-01'
+    -- limit to systems which everybody is allowed to view and reserve
+    AND EXISTS (
+        SELECT 1
+        FROM system_access_policy_rule
+        WHERE policy_id = system_access_policy.id
+            AND permission = 'view'
+            AND user_id IS NULL AND group_id IS NULL)
+    AND EXISTS (
+        SELECT 1
+        FROM system_access_policy_rule
+        WHERE policy_id = system_access_policy.id
+            AND permission = 'reserve'
+            AND user_id IS NULL AND group_id IS NULL)
+GROUP BY tg_user.user_name, system_arch.arch
+ORDER BY tg_user.user_name, system_arch.arch;
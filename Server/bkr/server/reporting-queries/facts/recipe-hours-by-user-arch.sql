@@ -0,0 +1,35 @@
+
+-- Equivalent of recipe-hours-by-user-arch, reading the daily totals in the 
+-- reporting_recipe_hours fact table instead of the recipe tables. The fact 
+-- tables are filled in by beaker-update-reporting-facts, so days which have 
+-- not been loaded yet are not counted.
+
+-- The reporting period is given as a range of days, the end day is not 
+-- included.
+
+SELECT
+    job_owner.user_name AS username,
+    distro_tree_arch.arch AS arch,
+    SUM(reporting_recipe_hours.seconds) / 60 / 60 AS recipe_hours
+FROM reporting_recipe_hours
+INNER JOIN tg_user job_owner ON reporting_recipe_hours.user_id = job_owner.user_id
+INNER JOIN arch distro_tree_arch ON reporting_recipe_hours.arch_id = distro_tree_arch.id
+LEFT OUTER JOIN system ON reporting_recipe_hours.system_id = system.id
+LEFT OUTER JOIN system_access_policy ON system.active_access_policy_id = system_access_policy.id
+WHERE reporting_recipe_hours.day >= '2012-10-01'
+    AND reporting_recipe_hours.day < '2012-11-01'
+    -- limit to systems which everybody is allowed to view and reserve
+    AND EXISTS (
+        SELECT 1
+        FROM system_access_policy_rule
+        WHERE policy_id = system_access_policy.id
+            AND permission = 'view'
+            AND user_id IS NULL AND group_id IS NULL)
+    AND EXISTS (
+        SELECT 1
+        FROM system_access_policy_rule
+        WHERE policy_id = system_access_policy.id
+            AND permission = 'reserve'
+            AND user_id IS NULL AND group_id IS NULL)
+GROUP BY job_owner.user_name, distro_tree_arch.arch
+ORDER BY job_owner.user_name, distro_tree_arch.arch;
@@ -0,0 +1,26 @@
+
+-- Equivalent of task-durations-by-arch, reading the daily totals in the 
+-- reporting_task_duration fact table instead of the recipe_task table. The 
+-- fact tables are filled in by beaker-update-reporting-facts, so days which 
+-- have not been loaded yet are not counted.
+
+-- Each task execution is counted on the day it finished, with its whole 
+-- duration. Executions which were still running at the end of the period, or 
+-- which started before it, are therefore not clamped to the period as in the 
+-- original query.
+
+SELECT
+    task.name AS task,
+    distro_tree_arch.arch AS arch,
+    SUM(reporting_task_duration.executions) AS executions,
+    MIN(reporting_task_duration.min_seconds) / 60 / 60 AS min_duration,
+    SUM(reporting_task_duration.total_seconds)
+        / SUM(reporting_task_duration.executions) / 60 / 60 AS avg_duration,
+    MAX(reporting_task_duration.max_seconds) / 60 / 60 AS max_duration
+FROM reporting_task_duration
+INNER JOIN task ON reporting_task_duration.task_id = task.id
+INNER JOIN arch distro_tree_arch ON reporting_task_duration.arch_id = distro_tree_arch.id
+WHERE reporting_task_duration.day >= '2012-10-01'
+    AND reporting_task_duration.day < '2012-11-01'
+GROUP BY task.name, distro_tree_arch.arch
+ORDER BY task.name, distro_tree_arch.arch;
@@ -0,0 +1,15 @@
+-- Equivalent of wait-duration-by-resource, reading the daily totals in the 
+-- reporting_resource_duration fact table. Each recipe's wait time is counted 
+-- on the day the recipe started. Like the original query this covers all 
+-- loaded days, add a condition on reporting_resource_duration.day to limit it 
+-- to a period.
+
+SELECT
+    fqdn,
+    SUM(total_seconds) / SUM(recipes) / 60 / 60 AS avg_wait_hours,
+    MIN(min_seconds) / 60 / 60 AS min_wait_hours,
+    MAX(max_seconds) / 60 / 60 AS max_wait_hours
+FROM reporting_resource_duration
+WHERE measure = 'wait'
+GROUP BY fqdn
+ORDER BY avg_wait_hours desc;
@@ -0,0 +1,144 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Reads files out of an RPM payload without spawning rpm2cpio and cpio.
+
+The payload of an RPM is a cpio archive in the "newc" format, usually
+compressed with gzip, xz or zstd. The archive is decompressed and scanned as
+a stream, so reading stops as soon as the wanted file has been found.
+"""
+
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class UnsupportedPayload(ValueError):
+    """
+    Raised when the RPM payload is in a format which cannot be read here,
+    for example if the module needed to decompress it is not installed.
+    """
+    pass
+
+_LEAD_SIZE = 96
+_HEADER_MAGIC = '\x8e\xad\xe8'
+_CPIO_MAGIC = '070701'
+_CPIO_HEADER_SIZE = 110
+_CPIO_TRAILER = 'TRAILER!!!'
+_CHUNK_SIZE = 64 * 1024
+
+def _skip_header(f, pad):
+    intro = f.read(16)
+    if len(intro) != 16 or not intro.startswith(_HEADER_MAGIC):
+        raise ValueError('Not an RPM package (bad header magic)')
+    index_count, data_size = struct.unpack('>II', intro[8:])
+    size = index_count * 16 + data_size
+    if pad and size % 8:
+        # the signature header is padded to a multiple of 8 bytes
+        size += 8 - size % 8
+    f.seek(size, 1)
+
+def _decompressor(magic):
+    """
+    Returns a function which decompresses successive chunks of the payload,
+    based on the first few bytes of the payload.
+    """
+    if magic.startswith('\x1f\x8b'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+    if magic.startswith('\xfd7zXZ\x00'):
+        if lzma is None:
+            raise UnsupportedPayload('xz payload requires the lzma module')
+        return lzma.LZMADecompressor().decompress
+    if magic.startswith('\x28\xb5\x2f\xfd'):
+        if zstandard is None:
+            raise UnsupportedPayload('zstd payload requires the zstandard module')
+        return zstandard.ZstdDecompressor().decompressobj().decompress
+    if magic.startswith(_CPIO_MAGIC):
+        return lambda data: data
+    raise UnsupportedPayload('Unrecognised payload compression')
+
+def _payload_chunks(f):
+    """
+    Yields the decompressed payload of the RPM open as *f*, in chunks.
+    """
+    f.seek(0)
+    if len(f.read(_LEAD_SIZE)) != _LEAD_SIZE:
+        raise ValueError('Not an RPM package (truncated lead)')
+    _skip_header(f, pad=True)
+    _skip_header(f, pad=False)
+    data = f.read(_CHUNK_SIZE)
+    decompress = _decompressor(data[:8])
+    while data:
+        chunk = decompress(data)
+        if chunk:
+            yield chunk
+        data = f.read(_CHUNK_SIZE)
+
+class _StreamBuffer(object):
+    """
+    Allows reading exact numbers of bytes from a stream of chunks.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = ''
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                raise ValueError('Truncated cpio archive in RPM payload')
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def skip(self, size):
+        while len(self.buffer) < size:
+            size -= len(self.buffer)
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                raise ValueError('Truncated cpio archive in RPM payload')
+        self.buffer = self.buffer[size:]
+
+def _pad4(size):
+    return (4 - size % 4) % 4
+
+def read_payload_file(f, path):
+    """
+    Returns the contents of the file with the given absolute *path* from the
+    payload of the RPM open as *f*, or None if the payload does not contain
+    it. Raises UnsupportedPayload if the payload cannot be read here, in which
+    case the caller can fall back to rpm2cpio.
+    """
+    wanted = path.lstrip('/')
+    stream = _StreamBuffer(_payload_chunks(f))
+    while True:
+        header = stream.read(_CPIO_HEADER_SIZE)
+        if header[:6] != _CPIO_MAGIC:
+            # rpm uses a different format (07070X) for packages with
+            # files larger than 4GB, which task RPMs never are
+            raise UnsupportedPayload('Unrecognised cpio format %r' % header[:6])
+        file_size = int(header[54:62], 16)
+        name_size = int(header[94:102], 16)
+        name = stream.read(name_size)[:-1]
+        stream.skip(_pad4(_CPIO_HEADER_SIZE + name_size))
+        if name == _CPIO_TRAILER:
+            return None
+        if name.lstrip('.').lstrip('/') == wanted:
+            return stream.read(file_size)
+        stream.skip(file_size + _pad4(file_size))
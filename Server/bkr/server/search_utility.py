@@ -807,6 +807,14 @@ def append_results(self,cls_ref,value,column,operation,**kw):
         # System.arch_is_not_filter
         value = value.strip()
         underscored_operation = re.sub(' ','_',operation)
+        # Columns which are indexed in the system_facet table can be filtered
+        # with an EXISTS against the index, so that they don't need a join.
+        col_op_facet = getattr(cls_ref, '%s_%s_facet' % (column.lower(), underscored_operation), None)
+        if col_op_facet is not None:
+            facet_clause = col_op_facet(value, **kw)
+            if facet_clause is not None:
+                self.queri = self.queri.filter(facet_clause)
+                return
         col_op_filter = getattr(cls_ref,'%s_%s_filter' % (column.lower(),underscored_operation),None)
          
         #At this point we can also call a custom function before we try to append our results
@@ -1410,6 +1418,42 @@ def value_greater_than_pre(cls,value,**kw):
     def value_contains_pre(cls,value,**kw):
         return cls.value_pre(value,**kw)
 
+    @classmethod
+    def _value_facet(cls, operation, value, keyvalue):
+        key = model.Key.by_name(keyvalue)
+        if key.numeric:
+            col_type, column = 'integer', model.SystemFacet.int_value
+        else:
+            col_type, column = 'string', model.SystemFacet.value
+        filter_func = Modeller().return_function(col_type, operation)
+        return model.SystemFacet.matches(model.SystemFacetType.key_value,
+                filter_func(column, value), key=key)
+
+    @classmethod
+    def value_is_facet(cls, value, **kw):
+        if not value:
+            # "is empty" also matches systems without the key, leave it to the join
+            return None
+        return cls._value_facet('is', value, kw['keyvalue'])
+
+    @classmethod
+    def value_is_not_facet(cls, value, **kw):
+        if not value:
+            return None
+        return not_(cls._value_facet('is', value, kw['keyvalue']))
+
+    @classmethod
+    def value_contains_facet(cls, value, **kw):
+        return cls._value_facet('contains', value, kw['keyvalue'])
+
+    @classmethod
+    def value_less_than_facet(cls, value, **kw):
+        return cls._value_facet('less than', value, kw['keyvalue'])
+
+    @classmethod
+    def value_greater_than_facet(cls, value, **kw):
+        return cls._value_facet('greater than', value, kw['keyvalue'])
+
     @classmethod
     def value_less_than_filter(cls, col, val, key_name):
         result = model.Key.by_name(key_name)
@@ -1527,6 +1571,28 @@ class Cpu(SystemObject):
                                               relations= lambda: [model.System.cpu, model.CpuFlag])
                          }
 
+    @classmethod
+    def _flags_facet(cls, operation, value):
+        filter_func = Modeller().return_function('string', operation)
+        return model.SystemFacet.matches(model.SystemFacetType.cpu_flag,
+                filter_func(model.SystemFacet.value, value))
+
+    @classmethod
+    def flags_is_facet(cls, value, **kw):
+        if not value:
+            return None
+        return cls._flags_facet('is', value)
+
+    @classmethod
+    def flags_is_not_facet(cls, value, **kw):
+        if not value:
+            return None
+        return not_(cls._flags_facet('is', value))
+
+    @classmethod
+    def flags_contains_facet(cls, value, **kw):
+        return cls._flags_facet('contains', value)
+
     @classmethod
     def flags_is_not_filter(cls,col,val,**kw):
         """
@@ -1580,3 +1646,32 @@ def _is_not_filter(cls, col, val):
     size_is_not_filter = _is_not_filter
     sectorsize_is_not_filter = _is_not_filter
     physicalsectorsize_is_not_filter = _is_not_filter
+
+    # Disk sizes are indexed in the system_facet table. Note that each
+    # Disk/Size criterion is matched against any of the system's disks,
+    # independently of any other Disk criteria.
+    @classmethod
+    def _size_facet(cls, operation, value):
+        if not value:
+            return None
+        if operation == 'is not':
+            return not_(cls._size_facet('is', value))
+        filter_func = Modeller().return_function('integer', operation)
+        return model.SystemFacet.matches(model.SystemFacetType.disk_size,
+                filter_func(model.SystemFacet.int_value, value))
+
+    @classmethod
+    def size_is_facet(cls, value, **kw):
+        return cls._size_facet('is', value)
+
+    @classmethod
+    def size_is_not_facet(cls, value, **kw):
+        return cls._size_facet('is not', value)
+
+    @classmethod
+    def size_less_than_facet(cls, value, **kw):
+        return cls._size_facet('less than', value)
+
+    @classmethod
+    def size_greater_than_facet(cls, value, **kw):
+        return cls._size_facet('greater than', value)
@@ -0,0 +1,166 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Profiling of the SQL statements issued while handling a web request or
+a beakerd scheduling item.
+
+:func:`install_hooks` attaches SQLAlchemy cursor execution events to every
+engine. Each statement's duration is added to the profile for the current
+thread (if one has been started with :func:`start`), and statements slower
+than ``beaker.slow_query_threshold`` seconds are logged along with a normalised
+fingerprint, so that slow statements can be grouped regardless of their
+literal values.
+
+When the profile is finished, requests which issued more than their query
+budget are logged along with the statements they repeated most often, which
+is usually enough to spot an N+1 query pattern.
+"""
+
+import re
+import time
+import hashlib
+import threading
+import logging
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from turbogears import config
+from bkr.server import metrics
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+_hooks_installed = False
+_hooks_lock = threading.Lock()
+
+_string_literal_pattern = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_number_literal_pattern = re.compile(r'\b\d+(?:\.\d+)?\b')
+_in_list_pattern = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_whitespace_pattern = re.compile(r'\s+')
+
+def fingerprint(statement):
+    """
+    Returns a normalised form of the given SQL statement, with literal values
+    and bind parameter placeholders replaced by ``?`` and IN lists collapsed,
+    so that statements which differ only in their parameters are identical.
+    """
+    statement = _string_literal_pattern.sub('?', statement)
+    statement = statement.replace('%s', '?')
+    statement = re.sub(r'%\(\w+\)s|:\w+', '?', statement)
+    statement = _number_literal_pattern.sub('?', statement)
+    statement = _in_list_pattern.sub('IN (...)', statement)
+    return _whitespace_pattern.sub(' ', statement).strip()
+
+def fingerprint_id(fingerprint):
+    """
+    Returns a short stable identifier for a fingerprint, for grouping slow
+    query log messages.
+    """
+    return hashlib.md5(fingerprint.encode('utf8')).hexdigest()[:12]
+
+
+class QueryProfile(object):
+    """
+    Statistics about the SQL statements issued on behalf of one web request
+    or beakerd item.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.statement_count = 0
+        self.total_time = 0.0
+        self.slowest = [] # list of (duration, statement), longest first
+        self.by_fingerprint = {} # fingerprint -> (count, total duration)
+
+    def record(self, statement, duration, keep_slowest=5):
+        self.statement_count += 1
+        self.total_time += duration
+        if len(self.slowest) < keep_slowest or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[keep_slowest:]
+        fp = fingerprint(statement)
+        count, total = self.by_fingerprint.get(fp, (0, 0.0))
+        self.by_fingerprint[fp] = (count + 1, total + duration)
+
+    def most_repeated(self, n=3):
+        """
+        Returns the n most frequently issued fingerprints as a list of
+        (fingerprint, count, total duration).
+        """
+        items = sorted(self.by_fingerprint.iteritems(),
+                key=lambda item: item[1][0], reverse=True)[:n]
+        return [(fp, count, total) for fp, (count, total) in items]
+
+
+def current():
+    """
+    Returns the profile for the current thread, or None if no profile is in
+    progress.
+    """
+    return getattr(_local, 'profile', None)
+
+def start(label):
+    """
+    Starts a new profile for the current thread, discarding any unfinished one.
+    """
+    _local.profile = QueryProfile(label)
+    return _local.profile
+
+def finish(budget=None):
+    """
+    Finishes the current thread's profile and returns it. If *budget* is given
+    and the profile issued more statements than that, an alarm is raised: the
+    offending profile is logged and a counter is incremented in Graphite.
+    """
+    profile = current()
+    _local.profile = None
+    if profile is None:
+        return None
+    metrics.increment('counters.sql_statements', profile.statement_count)
+    if budget is not None and profile.statement_count > budget:
+        metrics.increment('counters.sql_query_budget_exceeded')
+        log.warning('%s issued %d SQL statements (budget %d) taking %.3f seconds. '
+                'Most repeated statements: %s', profile.label,
+                profile.statement_count, budget, profile.total_time,
+                '; '.join('%d x [%s] %s' % (count, fingerprint_id(fp), fp)
+                          for fp, count, total in profile.most_repeated()))
+    return profile
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The start time lives on the execution context rather than the
+    # connection, so that a statement which fails (and therefore never reaches
+    # after_cursor_execute) cannot leave a stale entry behind.
+    if context is not None:
+        context._sqlprofile_start_time = time.time()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_time = getattr(context, '_sqlprofile_start_time', None)
+    if start_time is None:
+        return
+    duration = time.time() - start_time
+    profile = current()
+    if profile is not None:
+        profile.record(statement, duration)
+    threshold = config.get('beaker.slow_query_threshold')
+    if threshold is not None and duration >= threshold:
+        fp = fingerprint(statement)
+        metrics.increment('counters.sql_slow_queries')
+        log.warning('Slow SQL statement [%s] took %.3f seconds%s: %s',
+                fingerprint_id(fp), duration,
+                ' in %s' % profile.label if profile is not None else '', fp)
+
+def install_hooks():
+    """
+    Attaches the profiling events to all SQLAlchemy engines. Safe to call more
+    than once.
+    """
+    global _hooks_installed
+    with _hooks_lock:
+        if _hooks_installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _hooks_installed = True
@@ -0,0 +1,232 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Timing and work-volume statistics for the stages of the beakerd scheduling
+loop.
+
+Each stage (update_dirty_jobs, process_new_recipes, and so on) has
+a :class:`StageStats` instance which accumulates the duration of each run of
+the stage, and the duration and outcome of each item the stage handled. At the
+end of each reporting interval beakerd takes a snapshot of the statistics,
+sends them to Graphite, logs the slowest items, and writes the snapshot to
+a file which ``beakerd --stats`` can display.
+"""
+
+import math
+import time
+import threading
+import heapq
+import json
+import logging
+from turbogears import config
+from bkr.server import metrics, sqlprofile
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the buckets in the stage duration histogram.
+# The last bucket catches everything slower than the second-last.
+HISTOGRAM_BUCKETS = [0.01, 0.1, 1.0, 10.0, 60.0, float('inf')]
+
+# Upper limit on the number of slowest items which can be reported per stage.
+MAX_SLOWEST_ITEMS = 100
+
+def _percentile(values, fraction):
+    """
+    Returns the value at the given fraction (between 0 and 1) of the sorted
+    list of values, using the nearest-rank method.
+    """
+    if not values:
+        return 0.0
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+def _bucket_label(bound):
+    if bound == float('inf'):
+        return 'inf'
+    return '%g' % bound
+
+
+class _ItemTimer(object):
+
+    def __init__(self, stats, item_id):
+        self.stats = stats
+        self.item_id = item_id
+        self.failed = False
+
+    def __enter__(self):
+        self.start = time.time()
+        sqlprofile.start('%s(%s)' % (self.stats.name, self.item_id))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record_item(self.item_id, time.time() - self.start,
+                failed=self.failed or exc_type is not None)
+        sqlprofile.finish(budget=config.get('beakerd.sql_query_budget'))
+        return False
+
+
+class StageStats(object):
+    """
+    Statistics for one stage, accumulated since the last snapshot. Items may
+    be recorded from several threads at once (provision_virt_recipes uses
+    a thread pool) so all access is serialized by a lock.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.runs = 0
+        self.run_durations = []
+        self.items = 0
+        self.errors = 0
+        self.item_durations = []
+        self.slowest = [] # heap of (duration, item_id)
+
+    def record_run(self, duration):
+        with self._lock:
+            self.runs += 1
+            self.run_durations.append(duration)
+
+    def record_item(self, item_id, duration, failed=False):
+        with self._lock:
+            self.items += 1
+            if failed:
+                self.errors += 1
+            self.item_durations.append(duration)
+            heapq.heappush(self.slowest, (duration, item_id))
+            if len(self.slowest) > MAX_SLOWEST_ITEMS:
+                heapq.heappop(self.slowest)
+
+    def time_item(self, item_id):
+        """
+        Returns a context manager which records the duration of handling the
+        given item. Set its ``failed`` attribute if handling the item failed
+        but the exception was caught.
+        """
+        return _ItemTimer(self, item_id)
+
+    def snapshot(self, slowest=5):
+        """
+        Returns a dict summarizing the statistics accumulated since the last
+        snapshot, and resets them.
+        """
+        with self._lock:
+            run_durations = sorted(self.run_durations)
+            item_durations = sorted(self.item_durations)
+            result = {
+                'runs': self.runs,
+                'items': self.items,
+                'errors': self.errors,
+                'duration_total': sum(run_durations),
+                'duration_max': run_durations[-1] if run_durations else 0.0,
+                'duration_p99': _percentile(run_durations, 0.99),
+                'item_duration_p99': _percentile(item_durations, 0.99),
+                'slowest_items': [{'id': item_id, 'duration': duration}
+                        for duration, item_id in heapq.nlargest(slowest, self.slowest)],
+            }
+            histogram = []
+            remaining = run_durations
+            for bound in HISTOGRAM_BUCKETS:
+                count = len([d for d in remaining if d <= bound])
+                histogram.append((_bucket_label(bound), count))
+                remaining = remaining[count:]
+            result['duration_histogram'] = histogram
+            self._reset()
+        return result
+
+
+class StageStatsRegistry(object):
+    """
+    The set of :class:`StageStats` for all stages, in the order they were first
+    used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = []
+        self._by_name = {}
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._by_name:
+                stats = StageStats(name)
+                self._stages.append(stats)
+                self._by_name[name] = stats
+            return self._by_name[name]
+
+    def time_stage(self, name, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs) and records its duration as one run of the
+        named stage.
+        """
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self[name].record_run(time.time() - start)
+
+    def report(self, interval, slowest=5, stats_file=None):
+        """
+        Takes a snapshot of all stages, sends it to Graphite, logs the slowest
+        items and writes it to *stats_file* (if given) for ``beakerd --stats``.
+        Returns the snapshot.
+        """
+        with self._lock:
+            stages = list(self._stages)
+        snapshot = {'timestamp': time.time(), 'interval': interval, 'stages': []}
+        for stats in stages:
+            summary = stats.snapshot(slowest=slowest)
+            summary['name'] = stats.name
+            snapshot['stages'].append(summary)
+            for key in ['items', 'errors']:
+                metrics.measure('counters.beakerd.%s.%s' % (stats.name, key),
+                        summary[key])
+            for key in ['duration_total', 'duration_max', 'duration_p99',
+                    'item_duration_p99']:
+                metrics.measure('durations.beakerd.%s.%s' % (stats.name, key),
+                        summary[key])
+            if summary['slowest_items']:
+                log.debug('Slowest items in %s over the last %d seconds: %s',
+                        stats.name, interval, ', '.join('%s (%.3fs)'
+                        % (item['id'], item['duration'])
+                        for item in summary['slowest_items']))
+        if stats_file:
+            try:
+                with open(stats_file, 'w') as f:
+                    json.dump(snapshot, f)
+            except IOError:
+                log.exception('Failed to write beakerd statistics to %s', stats_file)
+        return snapshot
+
+
+def format_snapshot(snapshot):
+    """
+    Formats a snapshot produced by :meth:`StageStatsRegistry.report` as
+    a human-readable table, for ``beakerd --stats``.
+    """
+    lines = ['Statistics for the %d seconds up to %s' % (snapshot['interval'],
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['timestamp'])))]
+    lines.append('%-32s %6s %7s %7s %10s %10s %10s' % ('Stage', 'Runs',
+            'Items', 'Errors', 'Total (s)', 'p99 (s)', 'Item p99'))
+    for stage in snapshot['stages']:
+        lines.append('%-32s %6d %7d %7d %10.3f %10.3f %10.3f' % (stage['name'],
+                stage['runs'], stage['items'], stage['errors'],
+                stage['duration_total'], stage['duration_p99'],
+                stage['item_duration_p99']))
+    for stage in snapshot['stages']:
+        if not stage['runs']:
+            continue
+        lines.append('')
+        lines.append('%s duration histogram: %s' % (stage['name'], ', '.join(
+                '<=%s: %d' % (label, count) for label, count in stage['duration_histogram'])))
+        if stage['slowest_items']:
+            lines.append('%s slowest items: %s' % (stage['name'], ', '.join(
+                    '%s (%.3fs)' % (item['id'], item['duration'])
+                    for item in stage['slowest_items'])))
+    return '\n'.join(lines)
@@ -32,7 +32,7 @@
     VirtResource, Hypervisor, Numa, LabController, SystemType, \
     Command, Power, PowerType, ReleaseAction, Recipe, RecipeSet, RecipeTask, RecipeResource, Job, \
     TaskStatus, \
-    Note
+    Note, ArchivedActivity, ActivityArchiveSummary
 from bkr.server.util import absolute_url
 
 log = logging.getLogger(__name__)
@@ -259,13 +259,17 @@ def provision(self, fqdn, distro_tree_id, ks_meta=None,
         return system.fqdn  # because turbogears makes us return something
 
     @expose()
-    def history(self, fqdn, since=None):
+    def history(self, fqdn, since=None, include_archived=False):
         """
         Returns the history for the given system.
         If the *since* argument is given, all history entries between that
         timestamp and the present are returned. By default, history entries
         from the past 24 hours are returned.
 
+        Entries which have been moved to the activity archive (see
+        :manpage:`beaker-archive-activity(8)`) are only returned if
+        *include_archived* is True.
+
         History entries are returned as a list of structures (dicts), each of
         which has the following keys:
 
@@ -290,6 +294,9 @@ def history(self, fqdn, since=None):
         All timestamps are expressed in UTC.
 
         .. versionadded:: 0.6.6
+
+        .. versionchanged:: 29.2
+           Added *include_archived* parameter.
         """
         if since is None:
             since = datetime.datetime.utcnow() - datetime.timedelta(days=1)
@@ -299,7 +306,13 @@ def history(self, fqdn, since=None):
         system = System.by_fqdn(fqdn, identity.current.user)
         activities = SystemActivity.query.filter(and_(
             SystemActivity.object == system,
-            SystemActivity.created >= since))
+            SystemActivity.created >= since)).all()
+        # The summary tells us cheaply whether the archive needs searching
+        if include_archived and ActivityArchiveSummary.has_archived(
+                SystemActivity, system.id, since):
+            activities = ArchivedActivity.for_object(SystemActivity, system.id)\
+                .filter(ArchivedActivity.created >= since)\
+                .order_by(ArchivedActivity.id).all() + activities
         return [dict(created=a.created,
                      user=a.user.user_name if a.user else None,
                      service=a.service,
@@ -1466,24 +1479,33 @@ def get_system_activity(fqdn):
         Previous value of the field before the action was performed (if applicable).
     ``new_value``
         New value of the field after the action was performed (if applicable).
+
+    Records which have been moved to the activity archive (see
+    :manpage:`beaker-archive-activity(8)`) are returned instead if the
+    ``archived`` query parameter is set to ``1``.
     """
     system = _get_system_by_FQDN(fqdn)
-    query = system.dyn_activity
+    if request.args.get('archived') == '1':
+        cls = ArchivedActivity
+        query = ArchivedActivity.for_object(SystemActivity, system.id)
+    else:
+        cls = SystemActivity
+        query = system.dyn_activity
     # outerjoin user for sorting/filtering and also for eager loading
-    query = query.outerjoin(SystemActivity.user) \
-        .options(contains_eager(SystemActivity.user))
+    query = query.outerjoin(cls.user) \
+        .options(contains_eager(cls.user))
     json_result = json_collection(query, columns={
-        'id': SystemActivity.id,
+        'id': cls.id,
         'user': User.user_name,
         'user.user_name': User.user_name,
         'user.email_address': User.email_address,
         'user.display_name': User.display_name,
-        'service': SystemActivity.service,
-        'created': SystemActivity.created,
-        'field_name': SystemActivity.field_name,
-        'action': SystemActivity.action,
-        'old_value': SystemActivity.old_value,
-        'new_value': SystemActivity.new_value,
+        'service': cls.service,
+        'created': cls.created,
+        'field_name': cls.field_name,
+        'action': cls.action,
+        'old_value': cls.old_value,
+        'new_value': cls.new_value,
     })
     return jsonify(json_result)
 
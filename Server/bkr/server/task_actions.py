@@ -21,8 +21,10 @@
 * TR: Result within a task
 """
 
+import zlib
 import lxml.etree
 from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import joinedload_all
 from bkr.server import identity
 from bkr.server.model import (Job, RecipeSet, Recipe,
                               RecipeTask, RecipeTaskResult, TaskBase)
@@ -45,6 +47,45 @@ class TaskActions(RPCRoot):
 
     stoppable_task_types = dict([(rep, obj) for rep,obj in task_types.iteritems() if obj not in unstoppable_task_types])
 
+    # Maximum number of ids in a single IN clause when bulk loading
+    batch_size = 500
+
+    @staticmethod
+    def _task_info_options(task_type):
+        # Eager loads for everything task_info() touches, so that bulk
+        # loading does not issue further queries per component
+        def job_options(path):
+            return [joinedload_all(*(path + (rel,))) for rel in
+                    (Job.owner, Job.submitter, Job.group)]
+        if task_type is Job:
+            return job_options(())
+        if task_type is RecipeSet:
+            return job_options((RecipeSet.job,))
+        if task_type is Recipe:
+            return [joinedload_all(Recipe.resource)] + \
+                    job_options((Recipe.recipeset, RecipeSet.job))
+        if task_type is RecipeTask:
+            return [joinedload_all(RecipeTask.recipe, Recipe.resource)] + \
+                    job_options((RecipeTask.recipe, Recipe.recipeset, RecipeSet.job))
+        return []
+
+    @staticmethod
+    def _fingerprint(info):
+        if info is None:
+            return 'none'
+        worker = info['worker']['name'] if info['worker'] else None
+        return '%08x' % (zlib.crc32(repr((info['state'], info['result'],
+                worker, info['is_finished'], info['is_failed']))) & 0xffffffff)
+
+    @staticmethod
+    def _parse_token(token):
+        fingerprints = {}
+        for item in (token or '').split(','):
+            taskid, sep, fingerprint = item.rpartition('=')
+            if sep:
+                fingerprints[taskid] = fingerprint
+        return fingerprints
+
     @cherrypy.expose
     def task_info(self, taskid,flat=True):
         """
@@ -56,6 +97,65 @@ def task_info(self, taskid,flat=True):
         """
         return TaskBase.get_by_t_id(taskid).task_info()
 
+    @cherrypy.expose
+    def task_info_many(self, taskids, since=None):
+        """
+        Returns the current state of many job components at once. This is
+        equivalent to calling :meth:`taskactions.task_info` for each of them,
+        but it loads all the components of each type in a single query.
+
+        The return value is an XML-RPC structure (dict) with the following keys:
+
+            'tasks'
+                A dict of *taskid* to the structure returned by
+                :meth:`taskactions.task_info`, or nil if there is no such job
+                component. If *since* is given, only the components whose state
+                has changed are included.
+            'token'
+                An opaque string which can be passed as *since* in the next
+                call, so that only components whose state has changed since
+                this call are returned.
+
+        :param taskids: list of job components, see above
+        :type taskids: array of strings
+        :param since: token returned by a previous call, or nil to return all
+            of the given components
+        :type since: string
+
+        .. versionadded:: 29.2
+        """
+        requested = []
+        ids_by_type = {}
+        for taskid in taskids:
+            task_type, _, task_id = taskid.partition(':')
+            if task_type not in self.task_types:
+                raise BX(_('You have specified an invalid task type:%s' % task_type))
+            try:
+                task_id = int(task_id)
+            except ValueError:
+                raise BX(_('%s is not a valid %s id' % (task_id, task_type)))
+            requested.append((taskid, task_type, task_id))
+            ids_by_type.setdefault(task_type, set()).add(task_id)
+        infos = {}
+        for task_type, ids in ids_by_type.iteritems():
+            cls = self.task_types[task_type]
+            ids = sorted(ids)
+            for i in range(0, len(ids), self.batch_size):
+                components = cls.query.filter(cls.id.in_(ids[i:i + self.batch_size]))\
+                        .options(*self._task_info_options(cls))
+                for component in components:
+                    infos[(task_type, component.id)] = component.task_info()
+        previous = self._parse_token(since)
+        tasks = {}
+        fingerprints = []
+        for taskid, task_type, task_id in requested:
+            info = infos.get((task_type, task_id))
+            fingerprint = self._fingerprint(info)
+            fingerprints.append('%s=%s' % (taskid, fingerprint))
+            if previous.get(taskid) != fingerprint:
+                tasks[taskid] = info
+        return {'tasks': tasks, 'token': ','.join(fingerprints)}
+
     @cherrypy.expose
     def to_xml(self, taskid, clone=False, exclude_enclosing_job=True, include_logs=True):
         """
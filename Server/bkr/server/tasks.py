@@ -15,7 +15,7 @@
 from bkr.server.app import app
 from bkr.common.helpers import siphon
 from bkr.common.bexceptions import BX
-from sqlalchemy import or_, not_
+from sqlalchemy import or_, not_, func, case
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import joinedload
 from bkr.server.flask_util import NotFound404, request_wants_json, \
@@ -169,6 +169,22 @@ def filter(self, filter):
             result.append({'name': task.name, 'arches': excluded_arches})
         return result
 
+    @cherrypy.expose
+    def metadata_version(self):
+        """
+        Returns an opaque version string for the task library, as returned by
+        :meth:`tasks.filter`. The string changes whenever a task is uploaded,
+        updated or disabled, so clients can use it to check whether their
+        cached task lists are still current.
+
+        .. versionadded:: 29.2
+        """
+        count, valid_count, last_updated = session.query(func.count(Task.id),
+                func.count(case([(Task.valid == True, 1)])),
+                func.max(Task.update_date)).one()
+        return '%s-%s-%s' % (count, valid_count,
+                last_updated.isoformat() if last_updated else '')
+
     @cherrypy.expose
     @identity.require(identity.not_anonymous())
     def upload(self, task_rpm_name, task_rpm_data):
@@ -0,0 +1,58 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import shutil
+import tempfile
+import unittest
+import jinja2.sandbox
+from bkr.server.kickstart import SnippetCache
+
+class SnippetCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.template_dir)
+        os.makedirs(os.path.join(self.template_dir, 'snippets', 'per_lab', 'lab_env'))
+        self.write('snippets/lab_env', u'base')
+        self.env = jinja2.sandbox.SandboxedEnvironment(cache_size=0,
+                loader=jinja2.FileSystemLoader(self.template_dir))
+        self.cache = SnippetCache(self.env)
+        self.candidates = ['snippets/per_lab/lab_env/lab.example.com',
+                           'snippets/lab_env']
+
+    def write(self, name, contents):
+        with open(os.path.join(self.template_dir, name), 'w') as f:
+            f.write(contents)
+
+    def test_resolves_first_existing_candidate(self):
+        self.cache.check_for_changes()
+        self.assertEquals(self.cache.resolve(self.candidates).render(), u'base')
+        self.assertEquals(self.cache.resolve(['snippets/nonexistent']), None)
+
+    def test_reuses_compiled_templates(self):
+        self.cache.check_for_changes()
+        first = self.cache.resolve(self.candidates)
+        self.assertTrue(self.cache.resolve(self.candidates) is first)
+
+    def test_new_snippet_invalidates_resolution(self):
+        self.cache.check_for_changes()
+        self.assertEquals(self.cache.resolve(self.candidates).render(), u'base')
+        self.write('snippets/per_lab/lab_env/lab.example.com', u'per-lab')
+        # make sure the directory mtime changes even on coarse filesystems
+        lab_env_dir = os.path.join(self.template_dir, 'snippets', 'per_lab', 'lab_env')
+        mtime = os.stat(lab_env_dir).st_mtime
+        os.utime(lab_env_dir, (mtime + 10, mtime + 10))
+        self.cache.check_for_changes()
+        self.assertEquals(self.cache.resolve(self.candidates).render(), u'per-lab')
+
+    def test_modified_snippet_is_reloaded(self):
+        self.cache.check_for_changes()
+        self.assertEquals(self.cache.resolve(self.candidates).render(), u'base')
+        path = os.path.join(self.template_dir, 'snippets', 'lab_env')
+        self.write('snippets/lab_env', u'modified')
+        mtime = os.stat(path).st_mtime
+        os.utime(path, (mtime + 10, mtime + 10))
+        self.assertEquals(self.cache.resolve(self.candidates).render(), u'modified')
@@ -0,0 +1,77 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import gzip
+import struct
+import tempfile
+import unittest
+import pkg_resources
+from StringIO import StringIO
+from bkr.server.rpmpayload import read_payload_file, UnsupportedPayload, lzma
+
+def cpio_newc(files):
+    archive = ''
+    for name, data in files + [('TRAILER!!!', '')]:
+        name += '\0'
+        header = '070701' + ''.join('%08x' % value for value in
+                [0, 0o100644, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0])
+        archive += header + name
+        archive += '\0' * ((4 - len(archive) % 4) % 4)
+        archive += data
+        archive += '\0' * ((4 - len(archive) % 4) % 4)
+    return archive
+
+def fake_rpm(payload):
+    # lead, then an empty signature header and an empty main header
+    empty_header = '\x8e\xad\xe8\x01' + '\0' * 4 + struct.pack('>II', 0, 0)
+    f = tempfile.TemporaryFile()
+    f.write('\xed\xab\xee\xdb' + '\0' * 92 + empty_header + empty_header + payload)
+    f.flush()
+    return f
+
+class ReadPayloadFileTest(unittest.TestCase):
+
+    files = [('./mnt/tests/a/Makefile', 'all:\n'),
+             ('./mnt/tests/a/testinfo.desc', 'Name: /a\n'),
+             ('./mnt/tests/a/runtest.sh', '#!/bin/sh\n' * 1000)]
+
+    def test_task_rpm(self):
+        rpm_file = pkg_resources.resource_filename('bkr.server.tests',
+                'tmp-distribution-beaker-task_test-2.0-5.noarch.rpm')
+        with open(rpm_file, 'rb') as f:
+            desc = read_payload_file(f,
+                    '/mnt/tests/distribution/beaker/task_test/testinfo.desc')
+        self.assertIn('Name:         /distribution/beaker/task_test\n', desc)
+
+    def test_uncompressed_payload(self):
+        f = fake_rpm(cpio_newc(self.files))
+        self.assertEquals(read_payload_file(f, '/mnt/tests/a/runtest.sh'),
+                '#!/bin/sh\n' * 1000)
+        self.assertEquals(read_payload_file(f, '/mnt/tests/a/testinfo.desc'),
+                'Name: /a\n')
+
+    def test_gzip_payload(self):
+        compressed = StringIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as gz:
+            gz.write(cpio_newc(self.files))
+        f = fake_rpm(compressed.getvalue())
+        self.assertEquals(read_payload_file(f, '/mnt/tests/a/testinfo.desc'),
+                'Name: /a\n')
+
+    def test_xz_payload(self):
+        if lzma is None:
+            raise unittest.SkipTest('lzma module is not available')
+        f = fake_rpm(lzma.compress(cpio_newc(self.files)))
+        self.assertEquals(read_payload_file(f, '/mnt/tests/a/testinfo.desc'),
+                'Name: /a\n')
+
+    def test_missing_file(self):
+        f = fake_rpm(cpio_newc(self.files))
+        self.assertIsNone(read_payload_file(f, '/mnt/tests/b/testinfo.desc'))
+
+    def test_unrecognised_compression(self):
+        f = fake_rpm('BZh91AY&SY' + '\0' * 100)
+        self.assertRaises(UnsupportedPayload, read_payload_file, f,
+                '/mnt/tests/a/testinfo.desc')
@@ -0,0 +1,84 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import unittest
+from mock import patch
+from bkr.server import sqlprofile
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_literals_and_placeholders_are_normalised(self):
+        self.assertEquals(sqlprofile.fingerprint(
+                "SELECT system.id FROM system\n  WHERE system.fqdn = 'a.example.com' "
+                "AND system.lab_controller_id = 42 AND system.status = %s"),
+                'SELECT system.id FROM system WHERE system.fqdn = ? '
+                'AND system.lab_controller_id = ? AND system.status = ?')
+
+    def test_in_lists_are_collapsed(self):
+        self.assertEquals(
+                sqlprofile.fingerprint('SELECT * FROM tg_group WHERE group_id IN (%s, %s, %s)'),
+                sqlprofile.fingerprint('SELECT * FROM tg_group WHERE group_id IN (%s)'))
+
+    def test_identifiers_with_digits_are_preserved(self):
+        self.assertEquals(sqlprofile.fingerprint('SELECT arch_1.arch FROM arch AS arch_1'),
+                'SELECT arch_1.arch FROM arch AS arch_1')
+
+
+class QueryProfileTest(unittest.TestCase):
+
+    def tearDown(self):
+        sqlprofile.finish()
+
+    def test_records_statements_for_current_thread(self):
+        sqlprofile.start('GET /systems/')
+        for recipe_id in range(10):
+            sqlprofile.current().record(
+                    'SELECT * FROM log_recipe WHERE recipe_id = %d' % recipe_id, 0.01)
+        sqlprofile.current().record('SELECT * FROM recipe', 0.5)
+        profile = sqlprofile.finish()
+        self.assertEquals(profile.statement_count, 11)
+        self.assertAlmostEquals(profile.total_time, 0.6)
+        self.assertEquals(profile.slowest[0], (0.5, 'SELECT * FROM recipe'))
+        fp, count, total = profile.most_repeated(1)[0]
+        self.assertEquals(fp, 'SELECT * FROM log_recipe WHERE recipe_id = ?')
+        self.assertEquals(count, 10)
+        self.assertEquals(sqlprofile.current(), None)
+
+    @patch('bkr.server.sqlprofile.metrics')
+    def test_budget_alarm(self, mock_metrics):
+        sqlprofile.start('GET /jobs/1')
+        for _ in range(3):
+            sqlprofile.current().record('SELECT 1', 0.001)
+        sqlprofile.finish(budget=5)
+        self.assertNotIn(('counters.sql_query_budget_exceeded',),
+                [call[0] for call in mock_metrics.increment.call_args_list])
+        sqlprofile.start('GET /jobs/1')
+        for _ in range(6):
+            sqlprofile.current().record('SELECT 1', 0.001)
+        sqlprofile.finish(budget=5)
+        mock_metrics.increment.assert_any_call('counters.sql_query_budget_exceeded')
+
+
+class CursorExecuteHooksTest(unittest.TestCase):
+
+    def tearDown(self):
+        sqlprofile.finish()
+
+    def test_failed_statement_does_not_leak_start_time(self):
+        class Context(object): pass
+        sqlprofile.start('GET /recipes/1')
+        conn = object()
+        # the first statement fails, so after_cursor_execute never fires for it
+        sqlprofile._before_cursor_execute(conn, None, 'SELECT broken', None, Context(), False)
+        context = Context()
+        sqlprofile._before_cursor_execute(conn, None, 'SELECT 1', None, context, False)
+        sqlprofile._after_cursor_execute(conn, None, 'SELECT 1', None, context, False)
+        # a statement executed without a context is not timed
+        sqlprofile._before_cursor_execute(conn, None, 'SELECT 2', None, None, False)
+        sqlprofile._after_cursor_execute(conn, None, 'SELECT 2', None, None, False)
+        profile = sqlprofile.finish()
+        self.assertEquals(profile.statement_count, 1)
+        self.assertEquals(profile.slowest[0][1], 'SELECT 1')
+        self.assertFalse(hasattr(conn, 'info'))
@@ -0,0 +1,61 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import unittest
+from mock import patch
+from bkr.server.stage_stats import StageStats, StageStatsRegistry, \
+        format_snapshot
+
+class StageStatsTest(unittest.TestCase):
+
+    def test_snapshot_summarizes_and_resets(self):
+        stats = StageStats('process_new_recipes')
+        for run_duration in [0.005, 0.5, 2.0]:
+            stats.record_run(run_duration)
+        for item_id in range(1, 101):
+            stats.record_item(item_id, item_id / 100.0, failed=(item_id % 10 == 0))
+        summary = stats.snapshot(slowest=3)
+        self.assertEquals(summary['runs'], 3)
+        self.assertEquals(summary['items'], 100)
+        self.assertEquals(summary['errors'], 10)
+        self.assertEquals(summary['duration_max'], 2.0)
+        self.assertEquals(summary['item_duration_p99'], 0.99)
+        self.assertEquals([item['id'] for item in summary['slowest_items']],
+                [100, 99, 98])
+        self.assertEquals(summary['duration_histogram'],
+                [('0.01', 1), ('0.1', 0), ('1', 1), ('10', 1), ('60', 0), ('inf', 0)])
+        summary = stats.snapshot()
+        self.assertEquals(summary['runs'], 0)
+        self.assertEquals(summary['items'], 0)
+        self.assertEquals(summary['slowest_items'], [])
+
+    def test_item_timer_records_failures(self):
+        stats = StageStats('update_dirty_jobs')
+        with stats.time_item(1):
+            pass
+        with stats.time_item(2) as timer:
+            timer.failed = True
+        try:
+            with stats.time_item(3):
+                raise ValueError()
+        except ValueError:
+            pass
+        summary = stats.snapshot()
+        self.assertEquals(summary['items'], 3)
+        self.assertEquals(summary['errors'], 2)
+
+    @patch('bkr.server.stage_stats.metrics')
+    def test_report(self, mock_metrics):
+        registry = StageStatsRegistry()
+        self.assertEquals(registry.time_stage('schedule_pending_systems',
+                lambda: True), True)
+        registry['schedule_pending_systems'].record_item(42, 1.5)
+        snapshot = registry.report(60)
+        mock_metrics.measure.assert_any_call(
+                'counters.beakerd.schedule_pending_systems.items', 1)
+        mock_metrics.measure.assert_any_call(
+                'durations.beakerd.schedule_pending_systems.item_duration_p99', 1.5)
+        self.assertIn('schedule_pending_systems slowest items: 42 (1.500s)',
+                format_snapshot(snapshot))
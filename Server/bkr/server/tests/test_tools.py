@@ -28,6 +28,18 @@ def test_remove_descendants(self):
         ]
         self.assertEquals(list(log_delete.remove_descendants(input)), expected)
 
+    def test_log_dir(self):
+        filepath = '2016/01/0/1/2'
+        self.assertEquals(log_delete._log_dir('/var/www/beaker/logs', None,
+                u'/', u'console.log', filepath),
+                '/var/www/beaker/logs/2016/01/0/1/2/')
+        self.assertEquals(log_delete._log_dir('/var/www/beaker/logs', None,
+                u'debug', u'install.log', filepath),
+                '/var/www/beaker/logs/2016/01/0/1/2/debug/')
+        self.assertEquals(log_delete._log_dir('/var/www/beaker/logs',
+                u'http://archive/beaker/2016/01/0/1/2', u'/', u'console.log',
+                filepath), 'http://archive/beaker/2016/01/0/1/2/')
+
 
 def list_msdos_filesystem(image_filename):
     mdir = subprocess.Popen(['mdir', '-i', image_filename, '-/', '-b', '::'],
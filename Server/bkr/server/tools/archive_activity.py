@@ -0,0 +1,77 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+__description__ = 'Moves old activity records into the activity archive'
+
+# pkg_resources.requires() does not work if multiple versions are installed in 
+# parallel. This semi-supported hack using __requires__ is the workaround.
+# http://bugs.python.org/setuptools/issue139
+# (Fedora/EPEL has python-cherrypy2 = 2.3 and python-cherrypy = 3)
+__requires__ = ['TurboGears']
+
+import sys
+import logging
+import datetime
+import optparse
+from turbogears import config
+from bkr.common import __version__
+from bkr.log import log_to_stream
+from bkr.server.util import load_config_or_exit
+from bkr.server.model import session, Activity, ArchivedActivity
+
+log = logging.getLogger(__name__)
+
+def archive_activity(age, batch_size, dry_run=False):
+    """
+    Archives activity records which are more than *age* days old, committing
+    after every *batch_size* records. Returns the number of records archived
+    (or which would be archived, if *dry_run* is True).
+    """
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=age)
+    if dry_run:
+        with session.begin():
+            return Activity.query.filter(Activity.created < before).count()
+    total = 0
+    while True:
+        with session.begin():
+            archived = ArchivedActivity.archive(before, limit=batch_size)
+        total += archived
+        log.debug('Archived %s activity records so far', total)
+        if archived < batch_size:
+            return total
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]',
+            description=__description__,
+            version=__version__)
+    parser.add_option('-c', '--config', metavar='FILENAME',
+            help='Read configuration from FILENAME')
+    parser.add_option('--age', metavar='DAYS', type='int',
+            help='Archive activity records older than DAYS days '
+                 '[default: beaker.activity_archive_days, or 365]')
+    parser.add_option('--batch-size', metavar='N', type='int',
+            help='Commit after archiving every N records [default: %default]')
+    parser.add_option('--dry-run', action='store_true',
+            help='Report how many records would be archived, but do not '
+                 'archive them')
+    parser.add_option('--debug', action='store_true',
+            help='Print debugging messages to stderr')
+    parser.set_defaults(batch_size=1000, dry_run=False, debug=False)
+    options, args = parser.parse_args()
+    load_config_or_exit(options.config)
+    log_to_stream(sys.stderr, level=logging.DEBUG if options.debug else logging.WARNING)
+
+    age = options.age
+    if age is None:
+        age = config.get('beaker.activity_archive_days', 365)
+    if age < 0 or options.batch_size < 1:
+        parser.error('--age must not be negative and --batch-size must be positive')
+    count = archive_activity(age, options.batch_size, dry_run=options.dry_run)
+    if options.dry_run:
+        print '%s activity records would be archived' % count
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,7 +17,8 @@
 import random
 from bkr.common import __version__
 from bkr.log import log_to_stream, log_to_syslog
-from bkr.server import needpropertyxml, utilisation, metrics, dynamic_virt
+from bkr.server import needpropertyxml, utilisation, metrics, dynamic_virt, \
+        sqlprofile
 from bkr.server.bexceptions import BX, \
     StaleTaskStatusException, InsufficientSystemPermissions, \
     StaleSystemUserException
@@ -26,12 +27,13 @@
         Watchdog, System, DistroTree, LabControllerDistroTree, SystemStatus,
         SystemResource, GuestResource, Arch,
         SystemAccessPolicy, SystemPermission, ConfigItem, Command,
-        Power, PowerType, DataMigration, SystemSchedulerStatus)
+        Power, PowerType, DataMigration, SystemSchedulerStatus, GaugeDelta)
 from bkr.server.model.scheduler import machine_guest_map
 from bkr.server.needpropertyxml import XmlHost
 from bkr.server.util import load_config_or_exit, log_traceback, \
         get_reports_engine
 from bkr.server.recipetasks import RecipeTasks
+from bkr.server.stage_stats import StageStatsRegistry, format_snapshot
 from turbogears.database import session, get_engine
 from turbogears import config
 from turbomail.control import interface
@@ -54,11 +56,13 @@
 import os
 import concurrent.futures
 import logging
+import json
 
 log = logging.getLogger(__name__)
 running = True
 event = threading.Event()
 _threadpool_executor = None
+stage_stats = StageStatsRegistry()
 
 from optparse import OptionParser
 
@@ -75,8 +79,25 @@ def get_parser():
                       help="specify a pid file")
     parser.add_option("-c", "--config", action="store", type="string",
                       dest="configfile", help="location of config file.")
+    parser.add_option("--stats", default=False, action="store_true",
+                      help="print the most recent per-stage statistics "
+                           "reported by the running beakerd, and exit")
     return parser
 
+def _stats_file():
+    return config.get('beakerd.stats_file', '/var/run/beaker/beakerd-stats.json')
+
+def print_stats():
+    try:
+        with open(_stats_file()) as f:
+            snapshot = json.load(f)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('Could not read beakerd statistics from %s: %s\n'
+                % (_stats_file(), e))
+        return 1
+    print format_snapshot(snapshot)
+    return 0
+
 def _virt_enabled():
     return bool(config.get('openstack.identity_api_url'))
 
@@ -98,15 +119,17 @@ def update_dirty_jobs():
         log.debug('Updating dirty jobs [%s ... %s] (%d total)',
                   job_ids[0], job_ids[-1], len(job_ids))
     for job_id in job_ids:
-        session.begin()
-        try:
-            update_dirty_job(job_id)
-            session.commit()
-        except Exception as e:
-            log.exception('Error in update_dirty_job(%s)', job_id)
-            session.rollback()
-        finally:
-            session.close()
+        with stage_stats['update_dirty_jobs'].time_item(job_id) as timer:
+            session.begin()
+            try:
+                update_dirty_job(job_id)
+                session.commit()
+            except Exception as e:
+                log.exception('Error in update_dirty_job(%s)', job_id)
+                session.rollback()
+                timer.failed = True
+            finally:
+                session.close()
         work_done = True
         if event.is_set():
             break
@@ -128,15 +151,17 @@ def process_new_recipes(*args):
         log.debug('Processing new recipes [%s ... %s] (%d total)',
                   recipe_ids[0], recipe_ids[-1], len(recipe_ids))
     for recipe_id in recipe_ids:
-        session.begin()
-        try:
-            process_new_recipe(recipe_id)
-            session.commit()
-        except Exception as e:
-            log.exception('Error in process_new_recipe(%s)', recipe_id)
-            session.rollback()
-        finally:
-            session.close()
+        with stage_stats['process_new_recipes'].time_item(recipe_id) as timer:
+            session.begin()
+            try:
+                process_new_recipe(recipe_id)
+                session.commit()
+            except Exception as e:
+                log.exception('Error in process_new_recipe(%s)', recipe_id)
+                session.rollback()
+                timer.failed = True
+            finally:
+                session.close()
         work_done = True
     return work_done
 
@@ -200,15 +225,17 @@ def queue_processed_recipesets(*args):
         log.debug('Queuing processed recipe sets [%s ... %s] (%d total)',
                   recipeset_ids[0], recipeset_ids[-1], len(recipeset_ids))
     for rs_id in recipeset_ids:
-        session.begin()
-        try:
-            queue_processed_recipeset(rs_id)
-            session.commit()
-        except Exception as e:
-            log.exception('Error in queue_processed_recipeset(%s)', rs_id)
-            session.rollback()
-        finally:
-            session.close()
+        with stage_stats['queue_processed_recipesets'].time_item(rs_id) as timer:
+            session.begin()
+            try:
+                queue_processed_recipeset(rs_id)
+                session.commit()
+            except Exception as e:
+                log.exception('Error in queue_processed_recipeset(%s)', rs_id)
+                session.rollback()
+                timer.failed = True
+            finally:
+                session.close()
         work_done = True
     return work_done
 
@@ -377,15 +404,17 @@ def abort_dead_recipes(*args):
         log.debug('Aborting dead recipes [%s ... %s] (%d total)',
                   recipe_ids[0], recipe_ids[-1], len(recipe_ids))
     for recipe_id in recipe_ids:
-        session.begin()
-        try:
-            abort_dead_recipe(recipe_id)
-            session.commit()
-        except exceptions.Exception as e:
-            log.exception('Error in abort_dead_recipe(%s)', recipe_id)
-            session.rollback()
-        finally:
-            session.close()
+        with stage_stats['abort_dead_recipes'].time_item(recipe_id) as timer:
+            session.begin()
+            try:
+                abort_dead_recipe(recipe_id)
+                session.commit()
+            except exceptions.Exception as e:
+                log.exception('Error in abort_dead_recipe(%s)', recipe_id)
+                session.rollback()
+                timer.failed = True
+            finally:
+                session.close()
         work_done = True
     return work_done
 
@@ -413,15 +442,17 @@ def schedule_pending_systems():
     if system_ids:
         log.debug('Scheduling pending systems (%d total)', len(system_ids))
     for system_id in system_ids:
-        session.begin()
-        try:
-            schedule_pending_system(system_id)
-            session.commit()
-        except Exception as e:
-            log.exception('Error in schedule_pending_system(%s)', system_id)
-            session.rollback()
-        finally:
-            session.close()
+        with stage_stats['schedule_pending_systems'].time_item(system_id) as timer:
+            session.begin()
+            try:
+                schedule_pending_system(system_id)
+                session.commit()
+            except Exception as e:
+                log.exception('Error in schedule_pending_system(%s)', system_id)
+                session.rollback()
+                timer.failed = True
+            finally:
+                session.close()
         work_done = True
     return work_done
 
@@ -495,14 +526,23 @@ def provision_virt_recipes(*args):
     if recipe_ids:
         log.debug('Provisioning dynamic virt guests for recipes [%s ... %s] (%d total)',
                   recipe_ids[0], recipe_ids[-1], len(recipe_ids))
-    futures = [get_virt_executor().submit(provision_virt_recipe, recipe_id)
+    futures = [get_virt_executor().submit(_timed_provision_virt_recipe, recipe_id)
                for recipe_id in recipe_ids]
     if futures:
         concurrent.futures.wait(futures)
         work_done = True
     return work_done
 
+def _timed_provision_virt_recipe(recipe_id):
+    with stage_stats['provision_virt_recipes'].time_item(recipe_id) as timer:
+        if not provision_virt_recipe(recipe_id):
+            timer.failed = True
+
 def provision_virt_recipe(recipe_id):
+    """
+    Returns False if provisioning failed and the recipe was marked as
+    virt_status failed, otherwise True.
+    """
     log.debug('Attempting to provision dynamic virt guest for recipe %s', recipe_id)
     session.begin()
     try:
@@ -519,7 +559,7 @@ def provision_virt_recipe(recipe_id):
             log.info('No OpenStack flavors matched recipe %s, marking precluded',
                     recipe.id)
             recipe.virt_status = RecipeVirtStatus.precluded
-            return
+            return True
         # cheapest flavor has the smallest disk and ram
         # id guarantees consistency of our results
         flavor = min(possible_flavors, key=lambda flavor: (flavor.ram, flavor.disk, flavor.id))
@@ -553,6 +593,7 @@ def provision_virt_recipe(recipe_id):
                 # suppress this exception so the original one is not masked
             raise exc_type, exc_value, exc_tb
         session.commit()
+        return True
     except Exception as e:
         log.exception('Error in provision_virt_recipe(%s)', recipe_id)
         session.rollback()
@@ -560,6 +601,7 @@ def provision_virt_recipe(recipe_id):
         with session.begin():
             recipe = Recipe.by_id(recipe_id)
             recipe.virt_status = RecipeVirtStatus.failed
+        return False
     finally:
         session.close()
 
@@ -576,15 +618,17 @@ def provision_scheduled_recipesets(*args):
         log.debug('Provisioning scheduled recipe sets [%s ... %s] (%d total)',
                   recipeset_ids[0], recipeset_ids[-1], len(recipeset_ids))
     for rs_id in recipeset_ids:
-        session.begin()
-        try:
-            provision_scheduled_recipeset(rs_id)
-            session.commit()
-        except exceptions.Exception:
-            log.exception('Error in provision_scheduled_recipeset(%s)', rs_id)
-            session.rollback()
-        finally:
-            session.close()
+        with stage_stats['provision_scheduled_recipesets'].time_item(rs_id) as timer:
+            session.begin()
+            try:
+                provision_scheduled_recipeset(rs_id)
+                session.commit()
+            except exceptions.Exception:
+                log.exception('Error in provision_scheduled_recipeset(%s)', rs_id)
+                session.rollback()
+                timer.failed = True
+            finally:
+                session.close()
         work_done = True
     return work_done
 
@@ -625,17 +669,27 @@ def run_data_migrations():
 
 # Real-time metrics reporting
 
+# The current value of each gauge is kept here, keyed by name without the
+# "gauges." prefix. It is recomputed from scratch by reconcile_gauges() every
+# beakerd.gauge_reconcile_interval seconds, and in between it is kept up to
+# date by applying the deltas recorded by state transitions (see
+# bkr.server.model.gauges). Only the metrics thread touches it.
+_gauges = {}
+
+def _measure_gauge(name, value):
+    _gauges[name] = value
+    metrics.measure('gauges.%s' % name, value)
+
 # Recipe queue
 def _recipe_count_metrics_for_query(name, query=None):
     for status, count in MachineRecipe.get_queue_stats(query).items():
-        metrics.measure('gauges.recipes_%s.%s' % (status, name), count)
+        _measure_gauge('recipes_%s.%s' % (status, name), count)
 
 def _recipe_count_metrics_for_query_grouped(name, grouping, query):
     group_counts = MachineRecipe.get_queue_stats_by_group(grouping, query)
     for group, counts in group_counts.iteritems():
         for status, count in counts.iteritems():
-            metrics.measure('gauges.recipes_%s.%s.%s' %
-                                   (status, name, group), count)
+            _measure_gauge('recipes_%s.%s.%s' % (status, name, group), count)
 
 def recipe_count_metrics():
     _recipe_count_metrics_for_query('all')
@@ -654,14 +708,14 @@ def _system_count_metrics_for_query(name, query):
     counts = utilisation.system_utilisation_counts(query)
     for state, count in counts.iteritems():
         if state != 'idle_removed':
-            metrics.measure('gauges.systems_%s.%s' % (state, name), count)
+            _measure_gauge('systems_%s.%s' % (state, name), count)
 
 def _system_count_metrics_for_query_grouped(name, grouping, query):
     group_counts = utilisation.system_utilisation_counts_by_group(grouping, query)
     for group, counts in group_counts.iteritems():
         for state, count in counts.iteritems():
             if state != 'idle_removed':
-                metrics.measure('gauges.systems_%s.%s.%s' % (state, name,
+                _measure_gauge('systems_%s.%s.%s' % (state, name,
                         group.replace('.', '_')), count)
 
 def system_count_metrics():
@@ -677,13 +731,13 @@ def system_count_metrics():
 # System power commands
 def _system_command_metrics_for_query(name, query):
     for status, count in Command.get_queue_stats(query).items():
-        metrics.measure('gauges.system_commands_%s.%s' % (status, name), count)
+        _measure_gauge('system_commands_%s.%s' % (status, name), count)
 
 def _system_command_metrics_for_query_grouped(name, grouping, query):
     group_counts = Command.get_queue_stats_by_group(grouping, query)
     for group, counts in group_counts.iteritems():
         for status, count in counts.iteritems():
-            metrics.measure('gauges.system_commands_%s.%s.%s'
+            _measure_gauge('system_commands_%s.%s.%s'
                     % (status, name, group.replace('.', '_')), count)
 
 def system_command_metrics():
@@ -700,6 +754,56 @@ def system_command_metrics():
 def dirty_job_metrics():
     metrics.measure('gauges.dirty_jobs', Job.query.filter(Job.is_dirty).count())
 
+# Yesterday's system utilisation, from the daily rollup
+def daily_utilisation_metrics():
+    today = datetime.utcnow().date()
+    yesterday = today - timedelta(days=1)
+    # removed systems are left out, as in the real-time gauges
+    totals = dict((state, 0) for state in utilisation.utilisation_states
+            if state != 'idle_removed')
+    for tally in utilisation.daily_utilisation(yesterday, today).itervalues():
+        for state in totals:
+            totals[state] += tally[state].total_seconds()
+    total = sum(totals.itervalues())
+    if not total:
+        # yesterday has not been rolled up yet
+        return
+    for state, seconds in totals.iteritems():
+        metrics.measure('gauges.systems_%s_yesterday_percent' % state,
+                100.0 * seconds / total)
+
+def reconcile_gauges():
+    """
+    Recomputes all gauges from scratch using the (expensive) GROUP BY queries
+    against the current session, which is bound to the reports engine. Any
+    deltas which were committed before we started are discarded, since their
+    effect is already reflected in the counts.
+
+    Transactions which commit while the counts are being computed can cause
+    the gauges to be off by a little, which is corrected on the next pass.
+    """
+    with get_engine().begin() as connection:
+        max_delta_id = GaugeDelta.max_id(connection)
+    _gauges.clear()
+    recipe_count_metrics()
+    system_count_metrics()
+    system_command_metrics()
+    with get_engine().begin() as connection:
+        GaugeDelta.discard_up_to(connection, max_delta_id)
+
+def apply_gauge_deltas():
+    """
+    Applies all committed gauge deltas to the in-memory gauges and reports
+    their current values. The deltas are read from the main engine, since the
+    reports engine may be a read-only replica.
+    """
+    with get_engine().begin() as connection:
+        deltas = GaugeDelta.drain(connection)
+    for name, delta in deltas.iteritems():
+        _gauges[name] = _gauges.get(name, 0) + delta
+    for name, value in _gauges.iteritems():
+        metrics.measure('gauges.%s' % name, value)
+
 # These functions are run in separate threads, so we want to log any uncaught
 # exceptions instead of letting them be written to stderr and lost to the ether
 
@@ -709,14 +813,19 @@ def metrics_loop(*args, **kwargs):
     metrics_session = create_session(bind=get_reports_engine())
     session.registry.set(metrics_session)
 
+    reconcile_interval = config.get('beakerd.gauge_reconcile_interval', 600)
+    last_reconciled = None
     while running:
         start = time.time()
         try:
             session.begin()
-            recipe_count_metrics()
-            system_count_metrics()
+            if last_reconciled is None or start - last_reconciled >= reconcile_interval:
+                reconcile_gauges()
+                last_reconciled = start
+            else:
+                apply_gauge_deltas()
             dirty_job_metrics()
-            system_command_metrics()
+            daily_utilisation_metrics()
         except Exception:
             log.exception('Exception in metrics loop')
         finally:
@@ -729,30 +838,31 @@ def metrics_loop(*args, **kwargs):
 
 def _main_recipes():
     work_done = False
-    if update_dirty_jobs():
+    run = stage_stats.time_stage
+    if run('update_dirty_jobs', update_dirty_jobs):
         work_done = True
-    if abort_dead_recipes():
+    if run('abort_dead_recipes', abort_dead_recipes):
         work_done = True
-        update_dirty_jobs()
-    if process_new_recipes():
+        run('update_dirty_jobs', update_dirty_jobs)
+    if run('process_new_recipes', process_new_recipes):
         work_done = True
-        update_dirty_jobs()
-    if queue_processed_recipesets():
+        run('update_dirty_jobs', update_dirty_jobs)
+    if run('queue_processed_recipesets', queue_processed_recipesets):
         work_done = True
-        update_dirty_jobs()
+        run('update_dirty_jobs', update_dirty_jobs)
     if _virt_enabled():
-        if provision_virt_recipes():
+        if run('provision_virt_recipes', provision_virt_recipes):
             work_done = True
-            update_dirty_jobs()
-    if schedule_pending_systems():
+            run('update_dirty_jobs', update_dirty_jobs)
+    if run('schedule_pending_systems', schedule_pending_systems):
         work_done = True
-        update_dirty_jobs()
-    if provision_scheduled_recipesets():
+        run('update_dirty_jobs', update_dirty_jobs)
+    if run('provision_scheduled_recipesets', provision_scheduled_recipesets):
         work_done = True
         # update_dirty_jobs() will be done at the start of the next loop
         # iteration, so no need to do it here at the end as well
     if _outstanding_data_migrations:
-        run_data_migrations()
+        run('run_data_migrations', run_data_migrations)
         work_done = True
     return work_done
 
@@ -774,6 +884,7 @@ def schedule():
                 ', '.join(m.name for m in _outstanding_data_migrations))
 
     interface.start(config)
+    sqlprofile.install_hooks()
 
     if config.get('carbon.address'):
         log.debug('starting metrics thread')
@@ -789,9 +900,18 @@ def schedule():
     main_recipes_thread.daemon = True
     main_recipes_thread.start()
 
+    stats_interval = config.get('beakerd.stats_interval', 60)
+    stats_slowest_items = config.get('beakerd.stats_slowest_items', 5)
+    last_stats_report = time.time()
+
     try:
         while True:
             time.sleep(20)
+            now = time.time()
+            if now - last_stats_report >= stats_interval:
+                stage_stats.report(int(now - last_stats_report),
+                        slowest=stats_slowest_items, stats_file=_stats_file())
+                last_stats_report = now
             running_threads = set([t.name for t in threading.enumerate()])
             if not running_threads.issuperset(beakerd_threads):
                 log.critical("a thread has died, shutting down")
@@ -824,6 +944,9 @@ def main():
 
     load_config_or_exit(opts.configfile)
 
+    if opts.stats:
+        sys.exit(print_stats())
+
     signal.signal(signal.SIGINT, sigterm_handler)
     signal.signal(signal.SIGTERM, sigterm_handler)
 
@@ -14,16 +14,20 @@
 import os, os.path
 import errno
 import datetime
+import time
 import shutil
+import threading
 import urlparse
 import warnings
 import requests
+import concurrent.futures
 from turbogears import config
-from sqlalchemy.sql import and_
+from sqlalchemy.sql import and_, select, null
 from bkr.common import __version__
 from bkr.log import log_to_stream
 from optparse import OptionParser
-from bkr.server.model import Job
+from bkr.server.model import Job, RecipeSet, Recipe, RecipeTask, \
+        RecipeTaskResult, Log, LogRecipe, LogRecipeTask, LogRecipeTaskResult
 from bkr.server.util import load_config_or_exit
 from turbogears.database import session
 import logging
@@ -65,6 +69,83 @@ def remove_descendants(paths):
             previous = path
             yield path
 
+def _log_dir(logspath, server, path, filename, filepath):
+    """
+    Returns the directory containing a log, computed from its row in the same
+    way as :attr:`bkr.server.model.Log.full_path`.
+    """
+    combined_path = os.path.join((path or '').lstrip('/'), filename)
+    if server:
+        if not server.endswith('/'):
+            server += '/'
+        full_path = server + combined_path
+    else:
+        full_path = os.path.join(logspath, filepath, combined_path)
+    # We always delete entire directories, not individual log files,
+    # because that's faster, and because we never mix unrelated log
+    # files together in the same directory so it's safe to do that.
+    # We keep a trailing slash on the directories otherwise when we try
+    # to DELETE them, Apache will first redirect us to the trailing
+    # slash.
+    return os.path.dirname(full_path) + '/'
+
+def log_dirs_for_jobs(job_ids):
+    """
+    Returns a dict of (job id -> list of log directories to be deleted) for the
+    given jobs. The logs are fetched with one query per log table for the whole
+    batch, rather than by loading each job's object graph.
+    """
+    recipe_set = RecipeSet.__table__
+    recipe = Recipe.__table__
+    recipe_task = RecipeTask.__table__
+    recipe_task_result = RecipeTaskResult.__table__
+    queries = []
+    log_table = LogRecipe.__table__
+    queries.append(select([recipe_set.c.job_id, recipe_set.c.queue_time,
+                recipe.c.id, null(), null(), log_table.c.server,
+                log_table.c.path, log_table.c.filename])
+            .select_from(log_table
+                .join(recipe, log_table.c.recipe_id == recipe.c.id)
+                .join(recipe_set, recipe.c.recipe_set_id == recipe_set.c.id))
+            .where(recipe_set.c.job_id.in_(job_ids)))
+    log_table = LogRecipeTask.__table__
+    queries.append(select([recipe_set.c.job_id, recipe_set.c.queue_time,
+                recipe.c.id, recipe_task.c.id, null(), log_table.c.server,
+                log_table.c.path, log_table.c.filename])
+            .select_from(log_table
+                .join(recipe_task, log_table.c.recipe_task_id == recipe_task.c.id)
+                .join(recipe, recipe_task.c.recipe_id == recipe.c.id)
+                .join(recipe_set, recipe.c.recipe_set_id == recipe_set.c.id))
+            .where(recipe_set.c.job_id.in_(job_ids)))
+    log_table = LogRecipeTaskResult.__table__
+    queries.append(select([recipe_set.c.job_id, recipe_set.c.queue_time,
+                recipe.c.id, recipe_task.c.id, recipe_task_result.c.id,
+                log_table.c.server, log_table.c.path, log_table.c.filename])
+            .select_from(log_table
+                .join(recipe_task_result,
+                    log_table.c.recipe_task_result_id == recipe_task_result.c.id)
+                .join(recipe_task,
+                    recipe_task_result.c.recipe_task_id == recipe_task.c.id)
+                .join(recipe, recipe_task.c.recipe_id == recipe.c.id)
+                .join(recipe_set, recipe.c.recipe_set_id == recipe_set.c.id))
+            .where(recipe_set.c.job_id.in_(job_ids)))
+    logspath = config.get('basepath.logs')
+    dirs = dict((job_id, set()) for job_id in job_ids)
+    for query in queries:
+        for job_id, queue_time, recipe_id, task_id, result_id, server, path, \
+                filename in session.execute(query):
+            # Keep this in sync with the filepath properties of Recipe,
+            # RecipeTask and RecipeTaskResult
+            filepath = '%s/%02d/%s/%s/%s' % (queue_time.year, queue_time.month,
+                    job_id // Log.MAX_ENTRIES_PER_DIRECTORY, job_id, recipe_id)
+            if task_id is not None:
+                filepath += '/%s' % task_id
+            if result_id is not None:
+                filepath += '/%s' % result_id
+            dirs[job_id].add(_log_dir(logspath, server, path, filename, filepath))
+    return dict((job_id, list(remove_descendants(job_dirs)))
+            for job_id, job_dirs in dirs.iteritems())
+
 class MultipleAuth(requests.auth.AuthBase):
 
     def __init__(self, auths, *args, **kwargs):
@@ -77,6 +158,67 @@ def __call__(self, request):
         return request
 
 
+def _requests_session():
+    requests_session = requests.Session()
+    log_delete_user = config.get('beaker.log_delete_user')
+    log_delete_password = config.get('beaker.log_delete_password')
+
+    available_auths = []
+    available_auth_names = []
+
+    if _kerberos_available:
+        available_auths.append(requests_kerberos.HTTPKerberosAuth(
+            mutual_authentication=requests_kerberos.DISABLED))
+        available_auth_names.append('Kerberos')
+
+    if log_delete_user and log_delete_password:
+        available_auths.append(requests.auth.HTTPDigestAuth(log_delete_user,
+            log_delete_password))
+        available_auth_names.append('HTTPDigestAuth')
+    requests_session.auth = MultipleAuth(available_auths)
+    logger.debug('Available authentication methods: %s' %
+        ', '.join(available_auth_names))
+    return requests_session
+
+
+class LogDirDeleter(object):
+    """
+    Deletes log directories, either locally or on a remote archive server
+    using WebDAV. Each worker thread has its own requests session, since the
+    authentication handlers keep per-connection state.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = _requests_session()
+        return self._local.session
+
+    def delete(self, path):
+        if urlparse.urlparse(path).scheme:
+            requests_session = self._session()
+            # We need to handle redirects ourselves, since requests
+            # turns DELETE into GET on 302 which we do not want.
+            response = requests_session.delete(path, allow_redirects=False)
+            redirect_limit = 10
+            while redirect_limit > 0 and response.status_code in (
+                    301, 302, 303, 307):
+                response = requests_session.delete(
+                        response.headers['Location'],
+                        allow_redirects=False)
+                redirect_limit -= 1
+            if response.status_code not in (200, 204, 404):
+                response.raise_for_status()
+        else:
+            try:
+                shutil.rmtree(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+
 def main(argv=None):
 
     parser = OptionParser('usage: %prog [options]',
@@ -94,41 +236,78 @@ def main(argv=None):
                 'COMMIT after performing database operations')
     parser.add_option('--limit', default=None, type='int',
         help='Set a limit on the number of jobs whose logs will be deleted')
-    parser.set_defaults(verbose=False, debug=False, dry_run=False)
+    parser.add_option('--threads', type='int', metavar='N',
+        help='Delete up to N log directories concurrently [default: %default]')
+    parser.add_option('--batch-size', type='int', metavar='N',
+        help='Fetch logs for N jobs at a time [default: %default]')
+    parser.set_defaults(verbose=False, debug=False, dry_run=False,
+            threads=8, batch_size=100)
     options, args = parser.parse_args(argv)
+    if options.threads < 1:
+        parser.error('--threads must be at least 1')
+    if options.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
     load_config_or_exit(options.config)
 
     # urllib3 installs a NullHandler, we can just remove it and let the messages propagate
     logging.getLogger('requests.packages.urllib3').handlers[:] = []
     log_to_stream(sys.stderr, level=logging.DEBUG if options.debug else logging.WARNING)
-    return log_delete(options.verbose, options.dry_run, options.limit)
+    return log_delete(options.verbose, options.dry_run, options.limit,
+            threads=options.threads, batch_size=options.batch_size)
 
-def log_delete(print_logs=False, dry=False, limit=None):
+def _purge_jobs(job_ids, print_logs, dry, executor, deleter, progress):
+    """
+    Deletes the log directories for a batch of jobs using the executor, then
+    marks each job as purged if all of its directories were deleted. Jobs with
+    failed deletions are left unpurged, so they are retried on the next run.
+    Returns True if everything succeeded.
+    """
+    with session.begin():
+        dirs_by_job = log_dirs_for_jobs(job_ids)
+    futures = {}
+    for job_id in job_ids:
+        logger.info('Purging logs for deleted job %s', job_id)
+        for path in dirs_by_job[job_id]:
+            if dry:
+                if print_logs:
+                    print path
+                continue
+            futures[executor.submit(deleter.delete, path)] = (job_id, path)
+    failed_job_ids = set()
+    for future in concurrent.futures.as_completed(futures):
+        job_id, path = futures[future]
+        try:
+            future.result()
+        except Exception:
+            logger.exception('Exception while deleting %s for job %s', path, job_id)
+            failed_job_ids.add(job_id)
+            continue
+        progress['dirs'] += 1
+        if print_logs:
+            print path
+    for job_id in job_ids:
+        if job_id in failed_job_ids:
+            continue
+        try:
+            session.begin()
+            Job.by_id(job_id).purge()
+            if not dry:
+                session.commit()
+            else:
+                session.rollback()
+            session.close()
+            progress['jobs'] += 1
+        except Exception:
+            logger.exception('Exception while purging job %s', job_id)
+            failed_job_ids.add(job_id)
+            session.close()
+    return not failed_job_ids
+
+def log_delete(print_logs=False, dry=False, limit=None, threads=8, batch_size=100):
     if dry:
         logger.info('Dry run only')
 
     failed = False
-    if not dry:
-        requests_session = requests.Session()
-        log_delete_user = config.get('beaker.log_delete_user')
-        log_delete_password = config.get('beaker.log_delete_password')
-
-        available_auths = []
-        available_auth_names = []
-
-        if _kerberos_available:
-            available_auths.append(requests_kerberos.HTTPKerberosAuth(
-                mutual_authentication=requests_kerberos.DISABLED))
-            available_auth_names.append('Kerberos')
-
-        if log_delete_user and log_delete_password:
-            available_auths.append(requests.auth.HTTPDigestAuth(log_delete_user,
-                log_delete_password))
-            available_auth_names.append('HTTPDigestAuth')
-        requests_session.auth = MultipleAuth(available_auths)
-        logger.debug('Available authentication methods: %s' %
-            ', '.join(available_auth_names))
-
     logger.info('Fetching expired jobs to be deleted')
     try:
         session.begin()
@@ -149,53 +328,28 @@ def log_delete(print_logs=False, dry=False, limit=None):
     with session.begin():
         jobs = Job.query.filter(and_(Job.is_deleted, Job.purged == None)).limit(limit)
         job_ids = [job_id for job_id, in jobs.values(Job.id)]
-    for jobid in job_ids:
-        logger.info('Purging logs for deleted job %s', jobid)
-        try:
-            session.begin()
-            job = Job.by_id(jobid)
-            all_logs = job.all_logs(load_parent=False)
-            # We always delete entire directories, not individual log files, 
-            # because that's faster, and because we never mix unrelated log 
-            # files together in the same directory so it's safe to do that.
-            # We keep a trailing slash on the directories otherwise when we try 
-            # to DELETE them, Apache will first redirect us to the trailing 
-            # slash.
-            log_dirs = (os.path.dirname(log.full_path) + '/' for log in all_logs)
-            for path in remove_descendants(log_dirs):
-                if not dry:
-                    if urlparse.urlparse(path).scheme:
-                        # We need to handle redirects ourselves, since requests
-                        # turns DELETE into GET on 302 which we do not want.
-                        response = requests_session.delete(path, allow_redirects=False)
-                        redirect_limit = 10
-                        while redirect_limit > 0 and response.status_code in (
-                                301, 302, 303, 307):
-                            response = requests_session.delete(
-                                    response.headers['Location'],
-                                    allow_redirects=False)
-                            redirect_limit -= 1
-                        if response.status_code not in (200, 204, 404):
-                            response.raise_for_status()
-                    else:
-                        try:
-                            shutil.rmtree(path)
-                        except OSError, e:
-                            if e.errno == errno.ENOENT:
-                                pass
-                if print_logs:
-                    print path
-            job.purge()
-            if not dry:
-                session.commit()
-            else:
-                session.rollback()
-            session.close()
-        except Exception, e:
-            logger.exception('Exception while purging logs for job %s', jobid)
-            failed = True
-            session.close()
-            continue
+    deleter = LogDirDeleter()
+    progress = {'jobs': 0, 'dirs': 0}
+    start_time = time.time()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    try:
+        for i in range(0, len(job_ids), batch_size):
+            batch = job_ids[i:i + batch_size]
+            try:
+                if not _purge_jobs(batch, print_logs, dry, executor, deleter, progress):
+                    failed = True
+            except Exception:
+                logger.exception('Exception while purging logs for jobs %s to %s',
+                        batch[0], batch[-1])
+                failed = True
+                session.close()
+            elapsed = time.time() - start_time
+            logger.info('Purged %d of %d jobs, deleted %d log directories '
+                    'in %.1f seconds (%.1f directories/sec)',
+                    progress['jobs'], len(job_ids), progress['dirs'], elapsed,
+                    progress['dirs'] / elapsed if elapsed else 0.0)
+    finally:
+        executor.shutdown(wait=True)
     return 1 if failed else 0
 
 if __name__ == '__main__':
@@ -18,7 +18,15 @@
 from turbogears.config import get
 import os
 import sys
+import errno
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import multiprocessing
 import urlparse
+import concurrent.futures
 import dnf
 import urllib
 import requests
@@ -40,6 +48,8 @@ def get_parser():
                       default=None,
                       help="Optionally specify the harness dest.")
     parser.add_option("-c","--config-file",dest="configfile",default=None)
+    parser.add_option('-j', '--jobs', type='int', default=4,
+            help='Sync up to N OS majors concurrently [default: %default]')
     parser.add_option('--debug', action='store_true',
             help='Show detailed progress information')
     return parser
@@ -71,75 +81,359 @@ def _target_params(self):
         tp['dest'] = self.package_dir
         return tp
 
+class ChecksumCache(object):
+    """
+    Checksums of the packages in the local harness repos, so that packages
+    which were verified on a previous run are not hashed again. An entry is
+    only trusted while the size and mtime of the file are unchanged.
+
+    The cache is also used to find an existing copy of a package with
+    a given checksum, so that identical packages in different OS major
+    directories can be hardlinked instead of being downloaded again.
+    Packages which are still being downloaded are found through claims,
+    so that concurrent syncs fetch each of them only once.
+    """
+
+    filename = '.checksums.json'
+
+    def __init__(self, basepath):
+        self.basepath = basepath
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.paths_by_checksum = {}
+        self.downloads = {}
+        try:
+            with open(os.path.join(basepath, self.filename), 'rb') as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            entries = {}
+        for key, entry in entries.iteritems():
+            self._add(key, tuple(entry))
+
+    def _add(self, key, entry):
+        old_entry = self.entries.get(key)
+        if old_entry is not None:
+            self.paths_by_checksum[old_entry[2:]].discard(key)
+        self.entries[key] = entry
+        self.paths_by_checksum.setdefault(entry[2:], set()).add(key)
+
+    def _is_current(self, key, entry):
+        try:
+            st = os.stat(os.path.join(self.basepath, key))
+        except OSError:
+            return False
+        return entry[:2] == (st.st_size, st.st_mtime)
+
+    def add(self, path, chksum_type, chksum):
+        st = os.stat(path)
+        key = os.path.relpath(path, self.basepath)
+        with self.lock:
+            self._add(key, (st.st_size, st.st_mtime, chksum_type, chksum))
+
+    def checksum(self, path, chksum_type, datasize=None):
+        key = os.path.relpath(path, self.basepath)
+        with self.lock:
+            entry = self.entries.get(key)
+        if (entry is not None and entry[2] == chksum_type
+                and self._is_current(key, entry)):
+            return entry[3]
+        chksum = dnf.yum.misc.checksum(chksum_type, path, datasize=datasize)
+        self.add(path, chksum_type, chksum)
+        return chksum
+
+    def find(self, chksum_type, chksum, exclude=None):
+        """
+        Returns the path of a local package with the given checksum, other
+        than *exclude*, or None.
+        """
+        exclude_key = exclude and os.path.relpath(exclude, self.basepath)
+        with self.lock:
+            candidates = [(key, self.entries[key]) for key in
+                    self.paths_by_checksum.get((chksum_type, chksum), ())
+                    if key != exclude_key]
+        for key, entry in candidates:
+            if self._is_current(key, entry):
+                return os.path.join(self.basepath, key)
+        return None
+
+    def claim(self, chksum_type, chksum):
+        """
+        Claims the download of the package with the given checksum. Returns
+        a future for the path of the downloaded package, and whether this is
+        the first claim. The first claimant must download the package and
+        resolve the future, the others wait for it.
+        """
+        with self.lock:
+            key = (chksum_type, chksum)
+            if key in self.downloads:
+                return self.downloads[key], False
+            future = concurrent.futures.Future()
+            self.downloads[key] = future
+            return future, True
+
+    def save(self):
+        with self.lock:
+            entries = dict((key, entry) for key, entry in self.entries.iteritems()
+                    if self._is_current(key, entry))
+        fd, temp_path = tempfile.mkstemp(dir=self.basepath, prefix=self.filename)
+        with os.fdopen(fd, 'wb') as f:
+            json.dump(entries, f)
+        os.rename(temp_path, os.path.join(self.basepath, self.filename))
+
+def link_package(source, dest):
+    """
+    Replaces *dest* with a hardlink to *source*, or with a copy of it if
+    they are on different filesystems.
+    """
+    temp_path = dest + '.tmp'
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(source, temp_path)
+    os.rename(temp_path, dest)
+
+def flag_new_files(output_dir):
+    flag_path = os.path.join(output_dir, '.new_files')
+    with open(flag_path, 'wb'):
+        os.utime(flag_path, None)
+
 # This is a cutdown version of reposync.
 class RepoSyncer(dnf.Base):
 
-    def __init__(self, repo_url, output_dir):
+    def __init__(self, repo_url):
         super(RepoSyncer, self).__init__()
         repo_id = repo_url.replace('/', '-')
         self.repos.add_new_repo(repo_id, self.conf, baseurl=[repo_url])
-        self.repo_url = repo_url
-        self.output_dir = output_dir
-
-    # Verify the remote package's checksum against the local copy
-    def verify_checksum(self, package, dest_path):
-        (chksum_type, chksum) = package.returnIdSum()
-        real_sum = dnf.yum.misc.checksum(chksum_type, dest_path,
-                                         datasize=package._size)
-        return real_sum == chksum
-
-    def sync(self):
-        # First check if the harness repo exists.
-        response = requests_session.head(urlparse.urljoin(self.repo_url, 'repodata/repomd.xml'))
-        if response.status_code != 200:
-            raise HarnessRepoNotFoundError()
-
-        log.info('Syncing packages from %s to %s', self.repo_url, self.output_dir)
         self.fill_sack(load_system_repo=False)
-        pkglist = self.sack.query().latest().filterm(arch__neq='src')
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
 
+    def remote_packages(self):
+        pkglist = self.sack.query().latest().filterm(arch__neq='src')
         remote_pkgs, _ = self._select_remote_pkgs(pkglist)
-        new_packages = []
-        for package in remote_pkgs:
-            dest = os.path.join(self.output_dir, os.path.basename(package.relativepath))
+        return remote_pkgs
+
+    def download(self, output_dir, filenames):
+        """
+        Fetches the packages with the given filenames into *output_dir*.
+        dnf verifies them against the repo metadata.
+        """
+        filenames = set(filenames)
+        packages = [package for package in self.remote_packages()
+                if os.path.basename(package.relativepath) in filenames]
+        progress = dnf.callback.NullDownloadProgress()
+        drpm = dnf.drpm.DeltaInfo(self.sack.query().latest(), progress, 0)
+        payloads = [RPMPayloadLocation(package, progress, os.path.join(output_dir, os.path.basename(package.relativepath)))
+                    for package in packages]
+        self._download_remote_payloads(payloads, drpm, progress, None)  # pylint: disable=no-member
+
+# Loading the repo metadata and downloading packages with dnf is CPU bound
+# and holds the GIL, so it is done in worker processes. These are module
+# level so that they can be run in a multiprocessing pool.
+
+def _list_remote_packages(repo_url):
+    """
+    Returns a list of (filename, checksum type, checksum) for every package
+    in the remote repo.
+    """
+    with RepoSyncer(repo_url) as syncer:
+        return [(os.path.basename(package.relativepath),) + tuple(package.returnIdSum())
+                for package in syncer.remote_packages()]
+
+def _download_remote_packages(repo_url, output_dir, filenames):
+    with RepoSyncer(repo_url) as syncer:
+        syncer.download(output_dir, filenames)
+
+def sync_repo(pool, repo_url, output_dir, checksum_cache):
+    """
+    Fetches any missing packages from the remote repo into *output_dir*,
+    using *pool* to run dnf, and returns a list of (filename, checksum type,
+    checksum) for every package in the repo.
+    """
+    log.info('Syncing packages from %s to %s', repo_url, output_dir)
+    packages = pool.apply(_list_remote_packages, (repo_url,))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    checksums = dict((filename, (chksum_type, chksum))
+            for filename, chksum_type, chksum in packages)
+    claimed = {}
+    waiting = []
+    new_files = False
+    try:
+        for filename, chksum_type, chksum in packages:
+            dest = os.path.join(output_dir, filename)
             if os.path.exists(dest):
-                if self.verify_checksum(package, dest):
+                if checksum_cache.checksum(dest, chksum_type) == chksum:
                     log.info('Skipping %s', dest)
+                    # An identical copy elsewhere can share the same inode
+                    existing = checksum_cache.find(chksum_type, chksum,
+                            exclude=dest)
+                    if existing and not os.path.samefile(existing, dest):
+                        link_package(existing, dest)
+                        checksum_cache.add(dest, chksum_type, chksum)
                     continue
                 else:
                     log.info('Unlinking bad package %s', dest)
                     os.unlink(dest)
-            new_packages.append(package)
-            log.info('Fetching %s', os.path.join(self.output_dir, package.relativepath))
-
-        if new_packages:
-            progress = dnf.callback.NullDownloadProgress()
-            drpm = dnf.drpm.DeltaInfo(self.sack.query().latest(), progress, 0)
-            payloads = [RPMPayloadLocation(package, progress, os.path.join(self.output_dir, os.path.basename(package.relativepath)))
-                        for package in new_packages]
-            self._download_remote_payloads(payloads, drpm, progress, None)  # pylint: disable=no-member
-            flag_path = os.path.join(self.output_dir, '.new_files')
-            with open(flag_path, 'wb'):
-                os.utime(flag_path, None)
-
-def update_repos(baseurl, basepath):
-    # We only sync repos for the OS majors that have existing trees in the lab controllers.
-    for osmajor in OSMajor.in_any_lab():
-        # urlgrabber < 3.9.1 doesn't handle unicode urls
-        osmajor = unicode(osmajor).encode('utf8')
-        dest = "%s/%s" % (basepath,osmajor)
-        if os.path.islink(dest):
-            continue # skip symlinks
-        syncer = RepoSyncer(urlparse.urljoin(baseurl, '%s/' % urllib.quote(osmajor)), dest)
+            existing = checksum_cache.find(chksum_type, chksum)
+            if existing:
+                log.info('Linking %s to identical package %s', dest, existing)
+                link_package(existing, dest)
+                checksum_cache.add(dest, chksum_type, chksum)
+                new_files = True
+                continue
+            future, first = checksum_cache.claim(chksum_type, chksum)
+            if first:
+                claimed[filename] = future
+                log.info('Fetching %s', dest)
+            else:
+                waiting.append((filename, future))
+
+        if claimed:
+            download_packages(pool, repo_url, output_dir, list(claimed),
+                    checksums, checksum_cache)
+            for filename, future in claimed.iteritems():
+                future.set_result(os.path.join(output_dir, filename))
+            new_files = True
+    except Exception as e:
+        # Don't leave other syncs waiting for packages we will not fetch
+        for future in claimed.itervalues():
+            if not future.done():
+                future.set_exception(e)
+        raise
+
+    # Our own claims are resolved before waiting on anyone else's, so these
+    # waits are always bounded.
+    failed_filenames = []
+    for filename, future in waiting:
+        dest = os.path.join(output_dir, filename)
         try:
-            syncer.sync()
-        except KeyboardInterrupt:
-            raise
+            existing = future.result()
+        except Exception:
+            log.warning('Fetching %s failed elsewhere, fetching it for %s',
+                    filename, output_dir)
+            failed_filenames.append(filename)
+            continue
+        log.info('Linking %s to identical package %s', dest, existing)
+        link_package(existing, dest)
+        checksum_cache.add(dest, *checksums[filename])
+        new_files = True
+    if failed_filenames:
+        download_packages(pool, repo_url, output_dir, failed_filenames,
+                checksums, checksum_cache)
+        new_files = True
+    if new_files:
+        flag_new_files(output_dir)
+    return packages
+
+def download_packages(pool, repo_url, output_dir, filenames, checksums,
+        checksum_cache):
+    """
+    Downloads the given packages from the remote repo into *output_dir*,
+    using *pool* to run dnf, and records them in the checksum cache.
+    """
+    pool.apply(_download_remote_packages, (repo_url, output_dir, filenames))
+    # dnf has verified the downloaded packages against the repo metadata
+    for filename in filenames:
+        checksum_cache.add(os.path.join(output_dir, filename),
+                *checksums[filename])
+
+def link_repo(source_dir, packages, output_dir, checksum_cache):
+    """
+    Populates *output_dir* with hardlinks to the packages which were already
+    synced into *source_dir* from an identical remote repo.
+    """
+    log.info('Linking packages from %s to %s', source_dir, output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    new_files = False
+    for filename, chksum_type, chksum in packages:
+        source = os.path.join(source_dir, filename)
+        dest = os.path.join(output_dir, filename)
+        if os.path.exists(dest):
+            if os.path.samefile(source, dest):
+                log.info('Skipping %s', dest)
+                continue
+            if checksum_cache.checksum(dest, chksum_type) != chksum:
+                log.info('Replacing bad package %s', dest)
+                new_files = True
+        else:
+            new_files = True
+        link_package(source, dest)
+        checksum_cache.add(dest, chksum_type, chksum)
+    if new_files:
+        flag_new_files(output_dir)
+
+def fetch_repomd(repo_url):
+    """
+    Returns a digest of the repomd.xml of the given remote repo, which
+    identifies the repo contents. Raises HarnessRepoNotFoundError if the
+    repo does not exist.
+    """
+    response = requests_session.get(urlparse.urljoin(repo_url, 'repodata/repomd.xml'))
+    if response.status_code != 200:
+        raise HarnessRepoNotFoundError()
+    return hashlib.sha256(response.content).hexdigest()
+
+class RepoUpdater(object):
+    """
+    Syncs the harness repos for several OS majors concurrently. Remote repos
+    with identical metadata (for example, the same harness packages
+    published under several OS major names) are only loaded and fetched
+    once, and the other OS major directories are populated with hardlinks.
+    Identical packages in repos which differ are also fetched only once.
+
+    Each OS major is handled by a thread, which runs dnf in the
+    multiprocessing *pool* and does the rest of the work itself.
+    """
+
+    def __init__(self, baseurl, basepath, pool):
+        self.baseurl = baseurl
+        self.basepath = basepath
+        self.pool = pool
+        self.checksum_cache = ChecksumCache(basepath)
+        self.lock = threading.Lock()
+        self.synced_repos = {}
+
+    def _claim(self, repomd_digest):
+        with self.lock:
+            if repomd_digest in self.synced_repos:
+                return self.synced_repos[repomd_digest], False
+            future = concurrent.futures.Future()
+            self.synced_repos[repomd_digest] = future
+            return future, True
+
+    def update_osmajor(self, osmajor):
+        dest = os.path.join(self.basepath, osmajor)
+        repo_url = urlparse.urljoin(self.baseurl, '%s/' % urllib.quote(osmajor))
+        try:
+            repomd_digest = fetch_repomd(repo_url)
         except HarnessRepoNotFoundError:
             log.warning('Harness packages not found for OS major %s, ignoring', osmajor)
-            continue
+            return
+        future, first = self._claim(repomd_digest)
+        if first:
+            try:
+                packages = sync_repo(self.pool, repo_url, dest,
+                        self.checksum_cache)
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            future.set_result((dest, packages))
+        else:
+            # The repo which claimed these metadata is being synced by
+            # a running worker, so this wait is always bounded.
+            try:
+                source_dir, packages = future.result()
+            except Exception:
+                log.warning('Syncing %s failed, fetching %s separately',
+                        repo_url, osmajor)
+                sync_repo(self.pool, repo_url, dest, self.checksum_cache)
+            else:
+                link_repo(source_dir, packages, dest, self.checksum_cache)
         flag_path = os.path.join(dest, '.new_files')
         if os.path.exists(flag_path):
             createrepo_results = run_createrepo(cwd=dest)
@@ -151,6 +445,35 @@ def update_repos(baseurl, basepath):
                         % (returncode, command, err))
             os.unlink(flag_path)
 
+def update_repos(baseurl, basepath, jobs=1):
+    osmajors = []
+    # We only sync repos for the OS majors that have existing trees in the lab controllers.
+    for osmajor in OSMajor.in_any_lab():
+        # urlgrabber < 3.9.1 doesn't handle unicode urls
+        osmajor = unicode(osmajor).encode('utf8')
+        if os.path.islink(os.path.join(basepath, osmajor)):
+            continue # skip symlinks
+        osmajors.append(osmajor)
+    if not os.path.exists(basepath):
+        os.makedirs(basepath)
+    # The pool is started first so that its processes are not forked while
+    # the threads are running.
+    pool = multiprocessing.Pool(jobs)
+    updater = RepoUpdater(baseurl, basepath, pool)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = [executor.submit(updater.update_osmajor, osmajor)
+                for osmajor in osmajors]
+        # Wait for every OS major, then report the first failure (if any)
+        concurrent.futures.wait(futures)
+    finally:
+        executor.shutdown(wait=True)
+        pool.close()
+        pool.join()
+        updater.checksum_cache.save()
+    for future in futures:
+        future.result()
+
 
 def main():
     parser = get_parser()
@@ -166,7 +489,9 @@ def main():
         basepath = opts.basepath
     else:
         basepath = get("basepath.harness")
-    sys.exit(update_repos(baseurl=baseurl, basepath=basepath))
+    if opts.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    sys.exit(update_repos(baseurl=baseurl, basepath=basepath, jobs=opts.jobs))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,104 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+__description__ = ('Loads finished days into the reporting fact tables and the '
+        'system utilisation rollup')
+
+# pkg_resources.requires() does not work if multiple versions are installed in
+# parallel. This semi-supported hack using __requires__ is the workaround.
+# http://bugs.python.org/setuptools/issue139
+# (Fedora/EPEL has python-cherrypy2 = 2.3 and python-cherrypy = 3)
+__requires__ = ['TurboGears']
+
+import sys
+import logging
+import datetime
+import optparse
+from bkr.common import __version__
+from bkr.log import log_to_stream
+from bkr.server.util import load_config_or_exit
+from bkr.server.model import session, ReportingFactDay
+from bkr.server import utilisation
+
+log = logging.getLogger(__name__)
+
+def update_reporting_facts(until, since=None, max_days=None):
+    """
+    Loads each day from the high-water mark (or from *since*, if that is
+    later) up to but not including *until*, committing after each day.
+    Returns the number of days loaded.
+    """
+    loaded = 0
+    while max_days is None or loaded < max_days:
+        with session.begin():
+            day = ReportingFactDay.next_day()
+            if day is None:
+                break
+            if since is not None and day < since:
+                day = since
+            if day >= until:
+                break
+            log.debug('Loading reporting facts for %s', day)
+            ReportingFactDay.load(day)
+        loaded += 1
+    return loaded
+
+def update_utilisation_rollup(until, since=None, max_days=None):
+    """
+    Rolls up system utilisation for each day from the high-water mark (or
+    from *since*, if that is later) up to but not including *until*,
+    committing after each day. Returns the number of days rolled up.
+    """
+    rolled_up = 0
+    while max_days is None or rolled_up < max_days:
+        with session.begin():
+            day = utilisation.next_rollup_day()
+            if day is None:
+                break
+            if since is not None and day < since:
+                day = since
+            if day >= until:
+                break
+            log.debug('Rolling up system utilisation for %s', day)
+            utilisation.rollup_utilisation_day(day)
+        rolled_up += 1
+    return rolled_up
+
+def _parse_date(option, opt_str, value, parser):
+    try:
+        date = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise optparse.OptionValueError('%s must be a date in YYYY-MM-DD format' % opt_str)
+    setattr(parser.values, option.dest, date)
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]',
+            description=__description__,
+            version=__version__)
+    parser.add_option('-c', '--config', metavar='FILENAME',
+            help='Read configuration from FILENAME')
+    parser.add_option('--since', metavar='DATE', type='string',
+            action='callback', callback=_parse_date,
+            help='Do not load days before DATE (YYYY-MM-DD), for example to '
+                 'avoid loading the entire history on the first run')
+    parser.add_option('--max-days', metavar='N', type='int',
+            help='Load at most N days into each table')
+    parser.add_option('--debug', action='store_true',
+            help='Print debugging messages to stderr')
+    parser.set_defaults(since=None, max_days=None, debug=False)
+    options, args = parser.parse_args()
+    load_config_or_exit(options.config)
+    log_to_stream(sys.stderr, level=logging.DEBUG if options.debug else logging.WARNING)
+
+    if options.max_days is not None and options.max_days < 1:
+        parser.error('--max-days must be positive')
+    # Only days which have finished (in UTC) are loaded
+    until = datetime.datetime.utcnow().date()
+    update_reporting_facts(until, since=options.since, max_days=options.max_days)
+    update_utilisation_rollup(until, since=options.since, max_days=options.max_days)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,10 +9,14 @@
 import pwd
 import os
 import sys
+import shutil
+import tempfile
 import xmlrpclib
 import lxml.etree as ET
 import logging
+import multiprocessing
 import urllib2
+import concurrent.futures
 from optparse import OptionParser
 
 import turbogears.config
@@ -36,6 +40,8 @@ class TaskLibrarySync:
 
 
     batch_size = 100
+    download_threads = 8
+    download_attempts = 3
 
     def __init__(self, remote=None):
 
@@ -104,44 +110,117 @@ def _get_task_xml(self, server, task):
             self.logger.error('Error message: %s' % e)
             return None
 
+    def _download_rpm(self, task_url, staging_dir):
+        """
+        Downloads a task RPM into the staging directory and checks that it
+        arrived intact, retrying a few times if not. Returns the path of the
+        downloaded RPM.
+        """
+        rpm_path = os.path.join(staging_dir, os.path.split(task_url)[1])
+        for attempt in range(1, self.download_attempts + 1):
+            try:
+                response = urllib2.urlopen(task_url)
+                with open(rpm_path, 'wb') as f:
+                    siphon(response, f)
+                expected_size = response.info().getheader('Content-Length')
+                size = os.path.getsize(rpm_path)
+                if expected_size is not None and int(expected_size) != size:
+                    raise ValueError('Expected %s bytes but received %s'
+                            % (expected_size, size))
+                # Raises if the RPM headers are truncated or corrupted
+                with open(rpm_path, 'rb') as f:
+                    self.tasklib.get_rpm_info(f)
+                self.logger.debug('Downloaded %s' % task_url)
+                return rpm_path
+            except Exception, e:
+                if attempt == self.download_attempts:
+                    raise
+                self.logger.warning('Failed to download %s (attempt %s of %s): %s'
+                        % (task_url, attempt, self.download_attempts, e))
+
     def sync_tasks(self, urls_to_sync):
         """Syncs remote tasks to the local task library.
 
         sync_local_tasks() downloads tasks in batches and syncs
         them to the local task library. If the operation fails at some point
         any batches that have already been processed will be preserved.
+
+        RPMs are downloaded concurrently into a staging directory, one batch
+        ahead of the batch which is being synced, so that the task library is
+        only locked while the downloaded RPMs are moved into place. Each
+        batch's staged RPMs are deleted once it has been processed, so at
+        most two batches are ever staged on disk.
         """
-        def write_data_from_url(task_url):
+        def write_data_from_file(rpm_path):
 
-            def _write_data_from_url(f):
-                siphon(urllib2.urlopen(task_url), f)
+            def _write_data_from_file(f):
+                with open(rpm_path, 'rb') as rpm_file:
+                    shutil.copyfileobj(rpm_file, f)
                 f.flush()
 
-            return _write_data_from_url
+            return _write_data_from_file
         urls_to_sync.sort()
-        tasks_and_writes = []
-        for task_url in urls_to_sync:
-            task_rpm_name = os.path.split(task_url)[1]
-            tasks_and_writes.append((task_rpm_name, write_data_from_url(task_url),))
         # We section the batch processing up to allow other processes
         # that may be queueing for the flock to have access, and to limit
         # wastage of time if an error occurs
-        total_number_of_rpms = len(tasks_and_writes)
-        rpms_synced = 0
-        while rpms_synced < total_number_of_rpms:
-            session.begin()
-            try:
-                tasks_and_writes_current_batch = \
-                    tasks_and_writes[rpms_synced:rpms_synced+self.batch_size]
-                self.tasklib.update_tasks(tasks_and_writes_current_batch)
-            except Exception, e:
-                session.rollback()
-                session.close()
-                self.logger.exception('Error syncing tasks. Got error %s' % (unicode(e)))
-                break
-            session.commit()
-            self.logger.debug('Synced %s tasks' % len(tasks_and_writes_current_batch))
-            rpms_synced += self.batch_size
+        batches = [urls_to_sync[i:i + self.batch_size]
+                for i in range(0, len(urls_to_sync), self.batch_size)]
+        # The task details are read from each batch of RPMs in parallel.
+        # The pool is started first so that its processes are not forked
+        # while download threads are running.
+        pool = multiprocessing.Pool()
+        staging_dir = tempfile.mkdtemp(prefix='beaker-sync-tasks-')
+        executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.download_threads)
+        def download_batch(batch):
+            return [(task_url, executor.submit(self._download_rpm, task_url,
+                    staging_dir)) for task_url in batch]
+        next_downloads = download_batch(batches[0]) if batches else []
+        try:
+            for batch_number in range(len(batches)):
+                downloads = next_downloads
+                # Start downloading the next batch while this one is synced
+                if batch_number + 1 < len(batches):
+                    next_downloads = download_batch(batches[batch_number + 1])
+                else:
+                    next_downloads = []
+                tasks_and_writes_current_batch = []
+                rpm_paths = []
+                for task_url, download in downloads:
+                    try:
+                        rpm_path = download.result()
+                    except Exception, e:
+                        self.logger.error('Could not download %s, skipping it. '
+                                'Got error %s' % (task_url, unicode(e)))
+                        continue
+                    rpm_paths.append(rpm_path)
+                    tasks_and_writes_current_batch.append(
+                            (os.path.split(task_url)[1],
+                             write_data_from_file(rpm_path)))
+                try:
+                    if not tasks_and_writes_current_batch:
+                        continue
+                    session.begin()
+                    try:
+                        self.tasklib.update_tasks(tasks_and_writes_current_batch,
+                                pool=pool)
+                    except Exception, e:
+                        session.rollback()
+                        session.close()
+                        self.logger.exception('Error syncing tasks. Got error %s' % (unicode(e)))
+                        break
+                    session.commit()
+                    self.logger.debug('Synced %s tasks' % len(tasks_and_writes_current_batch))
+                finally:
+                    for rpm_path in rpm_paths:
+                        os.unlink(rpm_path)
+        finally:
+            for __, download in next_downloads:
+                download.cancel()
+            executor.shutdown(wait=True)
+            pool.close()
+            pool.join()
+            shutil.rmtree(staging_dir, ignore_errors=True)
         session.close()
 
     def tasks_add(self, new_tasks, old_tasks):
@@ -208,6 +287,10 @@ def get_parser():
     parser.add_option('--debug', action='store_true',dest='debug',default=False,
                       help='Display all messages')
 
+    parser.add_option('--download-threads', type='int', dest='download_threads',
+                      default=TaskLibrarySync.download_threads, metavar='N',
+                      help='Download up to N task RPMs at once [default: %default]')
+
     return parser
 
 def main():
@@ -220,7 +303,11 @@ def main():
         parser.print_help()
         sys.exit(1)
 
+    if options.download_threads < 1:
+        parser.error('--download-threads must be at least 1')
+
     task_sync = TaskLibrarySync(options.remote)
+    task_sync.download_threads = options.download_threads
     task_sync.check_perms()
 
     if options.debug:
@@ -0,0 +1,68 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+__description__ = 'Rebuilds or checks the system search facet index'
+
+# pkg_resources.requires() does not work if multiple versions are installed in 
+# parallel. This semi-supported hack using __requires__ is the workaround.
+# http://bugs.python.org/setuptools/issue139
+# (Fedora/EPEL has python-cherrypy2 = 2.3 and python-cherrypy = 3)
+__requires__ = ['TurboGears']
+
+import sys
+import logging
+import optparse
+from bkr.common import __version__
+from bkr.log import log_to_stream
+from bkr.server.util import load_config_or_exit
+from bkr.server.model import session, SystemFacet
+
+def _format_row(row):
+    system_id, facet, key_id, value, int_value = row
+    if int_value is not None:
+        value = int_value
+    if key_id is not None:
+        return 'system %s: %s %s = %s' % (system_id, facet, key_id, value)
+    return 'system %s: %s = %s' % (system_id, facet, value)
+
+def check_system_facets():
+    """
+    Prints any differences between the system facet index and the current
+    inventory. Returns True if the index is consistent.
+    """
+    with session.begin():
+        missing, unexpected = SystemFacet.check_consistency()
+    for row in missing:
+        print 'Missing: %s' % _format_row(row)
+    for row in unexpected:
+        print 'Unexpected: %s' % _format_row(row)
+    return not missing and not unexpected
+
+def rebuild_system_facets():
+    with session.begin():
+        SystemFacet.rebuild()
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]',
+            description=__description__,
+            version=__version__)
+    parser.add_option('-c', '--config', metavar='FILENAME',
+            help='Read configuration from FILENAME')
+    parser.add_option('--check', action='store_true',
+            help='Report inconsistencies instead of rebuilding the index')
+    parser.add_option('--debug', action='store_true',
+            help='Print debugging messages to stderr')
+    parser.set_defaults(check=False, debug=False)
+    options, args = parser.parse_args()
+    load_config_or_exit(options.config)
+    log_to_stream(sys.stderr, level=logging.DEBUG if options.debug else logging.WARNING)
+
+    if options.check:
+        return 0 if check_system_facets() else 1
+    rebuild_system_facets()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
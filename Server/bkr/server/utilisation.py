@@ -8,21 +8,50 @@
 from collections import defaultdict
 from sqlalchemy.sql import and_, or_, func, literal_column
 from turbogears.database import session
-from bkr.server.model import System, SystemStatusDuration, Reservation
+from bkr.server.model import System, SystemStatusDuration, Reservation, \
+        SystemUtilisationDay
+from bkr.server.model.gauges import idle_state
+
+utilisation_states = ['recipe', 'manual', 'idle_automated', 'idle_manual',
+        'idle_broken', 'idle_removed']
 
 def update_status_durations_in_period(tally, status_durations, start, end):
-    for sd in status_durations:
-        if sd.start_time < end and (sd.finish_time or end) > start:
-            duration = min(sd.finish_time or end, end) - max(sd.start_time, start)
+    # status_durations are (start_time, finish_time, state) tuples
+    for sd_start, sd_finish, state in status_durations:
+        if sd_start < end and (sd_finish or end) > start:
+            duration = min(sd_finish or end, end) - max(sd_start, start)
             assert duration >= datetime.timedelta(0)
-            tally['idle_%s' % sd.status.value.lower()] += duration
+            tally[state] += duration
+
+def _utilisation_in_period(status_durations, reservations, start, end):
+    """
+    Returns the time spent in each utilisation state between *start* and
+    *end*, given the status durations as (start_time, finish_time, state)
+    and the reservations as (start_time, finish_time, type), both overlapping
+    the period and ordered by start time.
+    """
+    retval = dict((k, datetime.timedelta(0)) for k in utilisation_states)
+    prev_finish = start
+    for res_start, res_finish, res_type in reservations:
+        # clamp reservation start and finish to be within the period
+        clamped_res_start = max(res_start, start)
+        clamped_res_finish = min(res_finish or end, end)
+        # first, do the gap from the end of the previous reservation to the 
+        # start of this one
+        update_status_durations_in_period(retval, status_durations,
+                prev_finish, clamped_res_start)
+        # now do this actual reservation
+        retval[res_type] += clamped_res_finish - clamped_res_start
+        prev_finish = clamped_res_finish
+    # lastly, do the gap from the end of the last reservation to the end of the 
+    # reporting period
+    update_status_durations_in_period(retval, status_durations,
+            prev_finish, end)
+    return retval
 
 def system_utilisation(system, start, end):
-    retval = dict((k, datetime.timedelta(0)) for k in
-            ['recipe', 'manual', 'idle_automated', 'idle_manual',
-             'idle_broken', 'idle_removed'])
     if end <= system.date_added:
-        return retval
+        return dict((k, datetime.timedelta(0)) for k in utilisation_states)
     if start <= system.date_added:
         start = system.date_added
     status_durations = system.dyn_status_durations\
@@ -35,22 +64,109 @@ def system_utilisation(system, start, end):
                 or_(Reservation.finish_time >= start,
                     Reservation.finish_time == None)))\
             .order_by(Reservation.start_time).all()
-    prev_finish = start
-    for reservation in reservations:
-        # clamp reservation start and finish to be within the period
-        clamped_res_start = max(reservation.start_time, start)
-        clamped_res_finish = min(reservation.finish_time or end, end)
-        # first, do the gap from the end of the previous reservation to the 
-        # start of this one
-        update_status_durations_in_period(retval, status_durations,
-                prev_finish, clamped_res_start)
-        # now do this actual reservation
-        retval[reservation.type] += clamped_res_finish - clamped_res_start
-        prev_finish = clamped_res_finish
-    # lastly, do the gap from the end of the last reservation to the end of the 
-    # reporting period
-    update_status_durations_in_period(retval, status_durations,
-            prev_finish, end)
+    return _utilisation_in_period(
+            [(sd.start_time, sd.finish_time, idle_state(sd.status))
+             for sd in status_durations],
+            [(r.start_time, r.finish_time, r.type) for r in reservations],
+            start, end)
+
+def fleet_utilisation(start, end, systems=None):
+    """
+    Returns a dict of (system id -> utilisation between *start* and *end*)
+    for each system in the *systems* query (defaults to all systems) which
+    was added before *end*. The results are the same as calling
+    system_utilisation() for each system, but the status durations and
+    reservations of all the systems are loaded with one query each.
+    """
+    if systems is None:
+        systems = System.query
+    systems = systems.filter(System.date_added < end)
+    date_added = dict(systems.with_entities(System.id, System.date_added))
+    system_ids = systems.with_entities(System.id).subquery()
+    status_durations = defaultdict(list)
+    for system_id, status, sd_start, sd_finish in session.query(
+            SystemStatusDuration.system_id, SystemStatusDuration.status,
+            SystemStatusDuration.start_time, SystemStatusDuration.finish_time)\
+            .filter(SystemStatusDuration.system_id.in_(system_ids))\
+            .filter(and_(SystemStatusDuration.start_time < end,
+                or_(SystemStatusDuration.finish_time >= start,
+                    SystemStatusDuration.finish_time == None)))\
+            .order_by(SystemStatusDuration.system_id,
+                SystemStatusDuration.start_time):
+        status_durations[system_id].append((sd_start, sd_finish, idle_state(status)))
+    reservations = defaultdict(list)
+    for system_id, res_start, res_finish, res_type in session.query(
+            Reservation.system_id, Reservation.start_time,
+            Reservation.finish_time, Reservation.type)\
+            .filter(Reservation.system_id.in_(system_ids))\
+            .filter(and_(Reservation.start_time < end,
+                or_(Reservation.finish_time >= start,
+                    Reservation.finish_time == None)))\
+            .order_by(Reservation.system_id, Reservation.start_time):
+        reservations[system_id].append((res_start, res_finish, res_type))
+    retval = {}
+    for system_id, added in date_added.iteritems():
+        system_start = max(start, added)
+        # the queries above are for the whole period, drop anything which
+        # finished before this system was added
+        retval[system_id] = _utilisation_in_period(
+                [sd for sd in status_durations[system_id]
+                 if sd[1] is None or sd[1] >= system_start],
+                [r for r in reservations[system_id]
+                 if r[1] is None or r[1] >= system_start],
+                system_start, end)
+    return retval
+
+def rollup_utilisation_day(day, systems=None):
+    """
+    Appends rows to the daily utilisation rollup for *day*, for each system
+    in the *systems* query (defaults to all systems) which existed that day.
+    """
+    start = datetime.datetime.combine(day, datetime.time())
+    end = start + datetime.timedelta(days=1)
+    rows = []
+    for system_id, tally in fleet_utilisation(start, end, systems).iteritems():
+        row = dict((state, int(duration.total_seconds()))
+                for state, duration in tally.iteritems())
+        row.update(system_id=system_id, day=day)
+        rows.append(row)
+    if rows:
+        session.connection(SystemUtilisationDay).execute(
+                SystemUtilisationDay.__table__.insert(), rows)
+
+def next_rollup_day():
+    """
+    Returns the day after the last day which was rolled up or, if nothing has
+    been rolled up yet, the day the first system was added. Returns None if
+    there are no systems.
+    """
+    last_day = session.query(func.max(SystemUtilisationDay.day)).scalar()
+    if last_day is not None:
+        return last_day + datetime.timedelta(days=1)
+    first_added = session.query(func.min(System.date_added)).scalar()
+    if first_added is None:
+        return None
+    return first_added.date()
+
+def daily_utilisation(start_day, end_day, systems=None):
+    """
+    Returns a dict of (system id -> utilisation) summed from the daily rollup,
+    for the days from *start_day* up to but not including *end_day*. Days
+    which have not been rolled up yet do not contribute.
+    """
+    query = session.query(SystemUtilisationDay.system_id,
+            *[func.sum(getattr(SystemUtilisationDay, state))
+              for state in utilisation_states])\
+            .filter(SystemUtilisationDay.day >= start_day)\
+            .filter(SystemUtilisationDay.day < end_day)\
+            .group_by(SystemUtilisationDay.system_id)
+    if systems is not None:
+        query = query.filter(SystemUtilisationDay.system_id.in_(
+                systems.with_entities(System.id).subquery()))
+    retval = {}
+    for row in query:
+        retval[row[0]] = dict((state, datetime.timedelta(seconds=int(seconds or 0)))
+                for state, seconds in zip(utilisation_states, row[1:]))
     return retval
 
 def system_utilisation_counts(systems):
@@ -58,9 +174,7 @@ def system_utilisation_counts(systems):
     Similar to the above except returns counts of systems based on the current 
     state, rather than historical data about particular systems.
     """
-    retval = dict((k, 0) for k in
-            ['recipe', 'manual', 'idle_automated', 'idle_manual',
-             'idle_broken', 'idle_removed'])
+    retval = dict((k, 0) for k in utilisation_states)
     query = systems.outerjoin(System.open_reservation)\
             .with_entities(func.coalesce(Reservation.type,
                 func.concat('idle_', func.lower(System.status))),
@@ -71,9 +185,7 @@ def system_utilisation_counts(systems):
     return retval
 
 def system_utilisation_counts_by_group(grouping, systems):
-    retval = defaultdict(lambda: dict((k, 0) for k in
-            ['recipe', 'manual', 'idle_automated', 'idle_manual',
-             'idle_broken', 'idle_removed']))
+    retval = defaultdict(lambda: dict((k, 0) for k in utilisation_states))
     query = systems.outerjoin(System.open_reservation)\
             .with_entities(grouping,
                 func.coalesce(Reservation.type,
@@ -32,9 +32,9 @@
 import cherrypy
 import cherrypy._cpwsgi
 from cherrypy.filters.basefilter import BaseFilter
-from flask import Flask
+from flask import Flask, request
 from bkr.common import __version__
-from bkr.server import identity, assets
+from bkr.server import identity, assets, sqlprofile
 from bkr.server.app import app
 
 log = logging.getLogger(__name__)
@@ -44,6 +44,7 @@
 from bkr.server.util import load_config
 load_config()
 log_to_stream(sys.stderr, level=logging.DEBUG)
+sqlprofile.install_hooks()
 
 # Keep the code before the imports, otherwise we'll end up with function names
 # not marked as executed (see: Coverage.py FAQ)
@@ -135,6 +136,19 @@ def restart_transaction_patched(args):
 # NOTE: order of before_request/after_request functions is important!
 # Flask runs them in the reverse of the order in which they were added.
 
+@app.before_request
+def start_sql_profile():
+    sqlprofile.start('%s %s' % (request.method, request.path))
+
+@app.after_request
+def set_sql_profile_headers(response):
+    # Registered first so that it runs last, after the transaction is committed
+    profile = sqlprofile.current()
+    if profile is not None and config.get('beaker.sql_profile_headers', False):
+        response.headers.add('X-Beaker-SQL-Statements', str(profile.statement_count))
+        response.headers.add('X-Beaker-SQL-Time', '%.3f' % profile.total_time)
+    return response
+
 @app.before_request
 def begin_session():
     session.begin()
@@ -159,6 +173,10 @@ def set_extra_headers(response):
     response.headers.add('Vary', 'Accept')
     return response
 
+@app.teardown_appcontext
+def finish_sql_profile(exception=None):
+    sqlprofile.finish(budget=config.get('beaker.sql_query_budget'))
+
 @app.teardown_appcontext
 def close_session(exception=None):
     try:
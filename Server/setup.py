@@ -246,6 +246,10 @@ def find_data_recursive(dest_dir, src_dir, exclude=frozenset()):
             'beaker-refresh-ldap = bkr.server.tools.refresh_ldap:main',
             'beaker-repo-update = bkr.server.tools.repo_update:main',
             'beaker-sync-tasks = bkr.server.tools.sync_tasks:main',
+            'beaker-rebuild-system-access = bkr.server.tools.system_access:main',
+            'beaker-rebuild-system-facets = bkr.server.tools.system_facets:main',
+            'beaker-archive-activity = bkr.server.tools.archive_activity:main',
+            'beaker-update-reporting-facts = bkr.server.tools.reporting_facts:main',
             'beaker-create-kickstart = bkr.server.tools.create_kickstart:main'
         ),
     }
@@ -180,6 +180,7 @@ Requires:       python-webassets
 Requires:       python-passlib
 Requires:       python-alembic
 Requires:       python-futures
+Requires:       python-backports-lzma
 BuildRequires:  systemd
 BuildRequires:  pkgconfig(systemd)
 Requires:       systemd-units
@@ -452,12 +453,20 @@ chmod go-w %{_localstatedir}/log/%{name}/*.log >/dev/null 2>&1 || :
 %{_bindir}/beaker-repo-update
 %{_bindir}/beaker-sync-tasks
 %{_bindir}/beaker-refresh-ldap
+%{_bindir}/beaker-rebuild-system-access
+%{_bindir}/beaker-rebuild-system-facets
+%{_bindir}/beaker-archive-activity
 %{_bindir}/beaker-create-kickstart
 %{_bindir}/beaker-create-ipxe-image
+%{_bindir}/beaker-update-reporting-facts
+%{_mandir}/man8/beaker-archive-activity.8.gz
 %{_mandir}/man8/beaker-create-ipxe-image.8.gz
 %{_mandir}/man8/beaker-create-kickstart.8.gz
 %{_mandir}/man8/beaker-init.8.gz
+%{_mandir}/man8/beaker-rebuild-system-access.8.gz
+%{_mandir}/man8/beaker-rebuild-system-facets.8.gz
 %{_mandir}/man8/beaker-repo-update.8.gz
+%{_mandir}/man8/beaker-update-reporting-facts.8.gz
 %{_mandir}/man8/beaker-usage-reminder.8.gz
 
 %{_unitdir}/beakerd.service
@@ -34,6 +34,9 @@
      [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
 ]
 man_server_pages = [
+    ('admin-guide/man/beaker-archive-activity', 'beaker-archive-activity',
+     'Archive old activity records',
+     [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
     ('admin-guide/man/beaker-create-kickstart',
      'beaker-create-kickstart', 'Generate Anaconda kickstarts',
      [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
@@ -43,9 +46,20 @@
     ('admin-guide/man/beaker-init', 'beaker-init',
      'Initialize and populate the Beaker database',
      [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
+    ('admin-guide/man/beaker-rebuild-system-access',
+     'beaker-rebuild-system-access',
+     'Rebuild or check the materialised system access table',
+     [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
+    ('admin-guide/man/beaker-rebuild-system-facets',
+     'beaker-rebuild-system-facets',
+     'Rebuild or check the system search facet index',
+     [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
     ('admin-guide/man/beaker-repo-update', 'beaker-repo-update',
      'Update cached harness packages',
      [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
+    ('admin-guide/man/beaker-update-reporting-facts',
+     'beaker-update-reporting-facts', 'Load the reporting fact tables',
+     [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
     ('admin-guide/man/beaker-usage-reminder', 'beaker-usage-reminder',
      'Send Beaker usage reminder',
      [u'The Beaker team <beaker-devel@lists.fedorahosted.org>'], 8),
@@ -94,6 +108,7 @@ def strip_decorator_args(app, what, name, obj, options, signature, return_annota
 
 def find_client_subcommands():
     from bkr.client.main import BeakerCommandContainer
+    BeakerCommandContainer.register_all()
     command_container = BeakerCommandContainer({})
     for cmd_name in command_container:
         if cmd_name in ['help', 'help-admin']: